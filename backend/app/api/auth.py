@@ -1,9 +1,17 @@
 # backend/app/api/auth.py
 
-from fastapi import APIRouter, HTTPException, Request, Response, Depends
+import asyncio
+import time
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, Response, Depends
 from pymongo.errors import DuplicateKeyError
+from bson.objectid import ObjectId
 from datetime import datetime, timezone
-from ..core.security import hash_password
+from ..core.security import (
+    HashingBusyError,
+    hash_password_async,
+    verify_password_async,
+    password_needs_rehash,
+)
 from ..schemas.auth import (
     SignupRequest,
     LoginRequest,
@@ -12,17 +20,21 @@ from ..schemas.auth import (
     ConsentAgreementRequest,
     ConsentDeclineRequest,
 )
-from ..schemas.user import UserPublic, SurveyStage, AssignedVar
+from ..schemas.user import UserPublic, SessionUser, SurveyStage, AssignedVar
 from ..services.users import (
     get_users_collection,
     ensure_indexes,
     create_user,
     find_user_by_email,
-    check_user_password,
+    find_user_by_email_cached,
     maybe_touch_last_active,
+    get_session_version,
+    bump_session_version,
+    update_password_hash,
 )
 from ..core.security import create_access_token, decode_token
 from ..core.config import get_settings
+from ..services.user_cache import user_cache
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -81,7 +93,51 @@ def build_user_public(doc: dict) -> UserPublic:
     )
 
 
-def get_current_user(request: Request) -> UserPublic:
+def create_session_token(user: UserPublic | SessionUser, session_version: int = 0) -> str:
+    """Issue the session JWT. With SESSION_CLAIMS_ENABLED the token also carries
+    the stable claims get_session_user authorizes from; otherwise it holds only
+    the email, as before.
+    """
+    if not get_settings().SESSION_CLAIMS_ENABLED:
+        return create_access_token(user.email)
+    claims = {
+        "uid": user.id,
+        "adm": bool(user.is_admin),
+        "var": AssignedVar(user.assigned_var).value,
+        "sv": session_version,
+    }
+    return create_access_token(user.email, claims=claims)
+
+
+def _renewal_due(payload: dict) -> bool:
+    """Whether a valid token has used SESSION_RENEW_AFTER_FRACTION of its lifetime."""
+    fraction = get_settings().SESSION_RENEW_AFTER_FRACTION
+    iat, exp = payload.get("iat"), payload.get("exp")
+    if fraction <= 0 or iat is None or exp is None or exp <= iat:
+        return False
+    return (time.time() - iat) / (exp - iat) >= fraction
+
+
+def _renew_if_due(request: Request, payload: dict, user: UserPublic | SessionUser, session_version: int) -> None:
+    """Sliding renewal: once the token is due (_renewal_due), stash a fresh one
+    on request.state for SessionRenewalMiddleware (core/middleware.py) to set
+    as the cookie on whatever response this request produces."""
+    if _renewal_due(payload):
+        request.state.renewed_session_token = create_session_token(user, session_version)
+
+
+def get_current_user_doc(request: Request) -> dict:
+    """The signed-in user's raw users document, read once per request.
+
+    The document is kept on request.state, so routes that need fields
+    UserPublic doesn't carry (password_hash, session_version) can depend on
+    this instead of looking the user up again, and get_current_user reuses it
+    when both run in the same request.
+    """
+    doc = getattr(request.state, "user_doc", None)
+    if doc is not None:
+        return doc
+
     s = get_settings()
     token = request.cookies.get(s.COOKIE_NAME)
     if not token:
@@ -97,52 +153,166 @@ def get_current_user(request: Request) -> UserPublic:
         raise HTTPException(status_code=401, detail="Invalid token (no subject)")
 
     users = get_users_collection(request.app.state.db)
-    doc = find_user_by_email(users, email)
+    doc = find_user_by_email_cached(users, email)
     if not doc:
         raise HTTPException(status_code=401, detail="User not found")
 
     maybe_touch_last_active(users, doc)
+    _renew_if_due(request, payload, build_user_public(doc), doc.get("session_version", 0))
+
+    request.state.user_doc = doc
+    return doc
+
+
+def get_current_user(request: Request) -> UserPublic:
+    return build_user_public(get_current_user_doc(request))
 
-    return build_user_public(doc)
 
+def get_session_user(request: Request) -> SessionUser:
+    """Lightweight auth for hot endpoints (quiz answers, chat streams).
+
+    A claims-bearing token is trusted as-is once its session_version matches
+    the user's current one; that check is served from an in-process cache and
+    only hits Mongo when the cached version has gone stale. When the token is
+    due for renewal the user document is re-read, so the renewed token (and
+    this request) carry the current is_admin/assigned_var rather than the old
+    token's copies. Email-only tokens (issued before claims were enabled)
+    fall back to get_current_user.
+    """
+    s = get_settings()
+    token = request.cookies.get(s.COOKIE_NAME)
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    try:
+        payload = decode_token(token)
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    user_id = payload.get("uid")
+    if not user_id:
+        user = get_current_user(request)
+        return SessionUser(
+            id=user.id,
+            email=user.email,
+            is_admin=user.is_admin,
+            assigned_var=user.assigned_var,
+        )
+
+    users = get_users_collection(request.app.state.db)
+    current_version = get_session_version(users, user_id)
+    if current_version is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    if current_version != payload.get("sv", 0):
+        raise HTTPException(status_code=401, detail="Session expired")
+
+    # Heartbeats are buffered in memory (see services/heartbeats.py), so the
+    # claims path can keep last_active_at current without touching Mongo.
+    maybe_touch_last_active(users, {"_id": ObjectId(user_id)})
+
+    try:
+        assigned_var = AssignedVar(payload.get("var"))
+    except ValueError:
+        assigned_var = AssignedVar.followup
+
+    user = SessionUser(
+        id=user_id,
+        email=payload["sub"],
+        is_admin=bool(payload.get("adm", False)),
+        assigned_var=assigned_var,
+        session_version=current_version,
+    )
+    if _renewal_due(payload):
+        doc = find_user_by_email(users, payload["sub"])
+        # A version bump the cache hasn't seen yet means this session is
+        # about to end; don't extend it.
+        if doc is not None and int(doc.get("session_version", 0)) == current_version:
+            fresh = build_user_public(doc)
+            user = user.model_copy(update={"is_admin": fresh.is_admin, "assigned_var": fresh.assigned_var})
+            request.state.renewed_session_token = create_session_token(user, current_version)
+    return user
+
+
+def _hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Server busy, please retry shortly",
+        headers={"Retry-After": str(get_settings().HASH_RETRY_AFTER_SECONDS)},
+    )
 
+
+# signup/login/change-password are async so argon2 runs on the bounded hashing
+# pool (core.security) instead of tying up the threadpool shared by every sync
+# route; Mongo calls go through asyncio.to_thread as in api/chat.py.
 @router.post("/signup", response_model=AuthResponse)
-def signup(data: SignupRequest, request: Request, response: Response):
+async def signup(data: SignupRequest, request: Request, response: Response):
     users = get_users_collection(request.app.state.db)
-    ensure_indexes(users)
+    await asyncio.to_thread(ensure_indexes, users)
 
     if data.consent is not True:
         raise HTTPException(status_code=400, detail="Consent is required")
 
     try:
-        user_pub = create_user(
+        password_hash = await hash_password_async(data.password)
+    except HashingBusyError:
+        raise _hashing_busy()
+
+    try:
+        user_pub = await asyncio.to_thread(
+            create_user,
             users,
             email=data.email,
             password=data.password,
             first_name=data.first_name,
             last_name=data.last_name,
             consent=data.consent,
+            password_hash=password_hash,
         )
     except DuplicateKeyError:
         raise HTTPException(status_code=400, detail="Email already registered")
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    token = create_access_token(user_pub.email)
+    token = create_session_token(user_pub)
     set_session_cookie(response, token)
     return AuthResponse(user=user_pub)
 
 
+async def _rehash_password(users, doc: dict, password: str) -> None:
+    """Upgrade a hash made with outdated argon2 costs. Runs after the login
+    response is sent; if the hashing pool is busy we simply try again on the
+    user's next login."""
+    try:
+        new_hash = await hash_password_async(password)
+    except HashingBusyError:
+        return
+    await asyncio.to_thread(update_password_hash, users, doc, new_hash)
+
+
 @router.post("/login", response_model=AuthResponse)
-def login(data: LoginRequest, request: Request, response: Response):
+async def login(
+    data: LoginRequest,
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+):
     users = get_users_collection(request.app.state.db)
-    doc = find_user_by_email(users, data.email)
-    if not doc or not check_user_password(doc, data.password):
+    doc = await asyncio.to_thread(find_user_by_email, users, data.email)
+    if not doc:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    try:
+        valid = await verify_password_async(data.password, doc["password_hash"])
+    except HashingBusyError:
+        raise _hashing_busy()
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+    if password_needs_rehash(doc["password_hash"]):
+        background_tasks.add_task(_rehash_password, users, doc, data.password)
+
     user_pub = build_user_public(doc)
 
-    token = create_access_token(user_pub.email)
+    token = create_session_token(user_pub, doc.get("session_version", 0))
     set_session_cookie(response, token)
     return AuthResponse(user=user_pub)
 
@@ -162,13 +332,9 @@ def logout(response: Response):
 def record_consent_agreement(
     data: ConsentAgreementRequest,
     request: Request,
-    user: UserPublic = Depends(get_current_user),
+    doc: dict = Depends(get_current_user_doc),
 ):
     users = get_users_collection(request.app.state.db)
-    doc = find_user_by_email(users, user.email)
-    if not doc:
-        raise HTTPException(status_code=404, detail="User not found")
-
     now = datetime.now(timezone.utc)
     users.update_one(
         {"_id": doc["_id"]},
@@ -180,6 +346,7 @@ def record_consent_agreement(
             }
         },
     )
+    user_cache.invalidate(doc["email"])
 
     return {"ok": True}
 
@@ -188,13 +355,9 @@ def record_consent_agreement(
 def record_consent_decline(
     data: ConsentDeclineRequest,
     request: Request,
-    user: UserPublic = Depends(get_current_user),
+    doc: dict = Depends(get_current_user_doc),
 ):
     users = get_users_collection(request.app.state.db)
-    doc = find_user_by_email(users, user.email)
-    if not doc:
-        raise HTTPException(status_code=404, detail="User not found")
-
     now = datetime.now(timezone.utc)
     users.update_one(
         {"_id": doc["_id"]},
@@ -206,33 +369,42 @@ def record_consent_decline(
             }
         },
     )
+    user_cache.invalidate(doc["email"])
 
     return {"ok": True}
 
 
 @router.post("/change-password")
-def change_password(
+async def change_password(
     data: ChangePasswordRequest,
     request: Request,
-    user: UserPublic = Depends(get_current_user),
+    response: Response,
+    doc: dict = Depends(get_current_user_doc),
 ):
     users = get_users_collection(request.app.state.db)
-    doc = find_user_by_email(users, user.email)
-    if not doc:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    if not check_user_password(doc, data.current_password):
-        raise HTTPException(status_code=400, detail="Current password is incorrect")
-
-    new_hash = hash_password(data.new_password)
-    users.update_one(
-        {"_id": doc["_id"]},
-        {
-            "$set": {
-                "password_hash": new_hash,
-                "updated_at": datetime.now(timezone.utc),
-            }
+    try:
+        if not await verify_password_async(data.current_password, doc["password_hash"]):
+            raise HTTPException(status_code=400, detail="Current password is incorrect")
+        new_hash = await hash_password_async(data.new_password)
+    except HashingBusyError:
+        raise _hashing_busy()
+
+    # Bumping session_version ends every other claims-bearing session; the
+    # current one is kept alive with a freshly issued cookie. doc may come from
+    # the user cache, so the write only applies if the hash we verified against
+    # is still the stored one.
+    new_version = await asyncio.to_thread(
+        bump_session_version,
+        users,
+        doc,
+        extra_set={
+            "password_hash": new_hash,
+            "updated_at": datetime.now(timezone.utc),
         },
+        match={"password_hash": doc["password_hash"]},
     )
+    if new_version is None:
+        raise HTTPException(status_code=409, detail="Password was changed elsewhere, please retry")
+    set_session_cookie(response, create_session_token(build_user_public(doc), new_version))
 
-    return {"ok": True}
\ No newline at end of file
+    return {"ok": True}
@@ -1,15 +1,19 @@
 import os
+import re
 import uuid
 import json
+import hashlib
 import asyncio
+import functools
 import time
 from typing import AsyncGenerator, Callable, Optional
+import anyio
 from openai import AsyncOpenAI
 from datetime import datetime
 from fastapi import APIRouter, Request, HTTPException, Depends
 from fastapi.responses import StreamingResponse
 
-from ..schemas.user import UserPublic
+from ..schemas.user import AssignedVar, SessionUser
 from ..schemas.message import AIMessageMetadata
 from ..schemas.question import QuestionChoice
 from ..schemas.chat import (
@@ -17,28 +21,39 @@ from ..schemas.chat import (
     UserMessageData, UserConversationHistoryResponse,
     ConversationMessageData, ConversationHistoryResponse,
 )
-from .auth import get_current_user
+from .auth import get_session_user
+from ..core.config import get_settings
 from ..services.chat import (
     get_last_exchange,
+    latest_user_message_at,
     get_conversation_history as fetch_conversation_history,
     detect_stated_choice,
+    agent_tags,
 )
 from ..services.search import _build_search_context, _inject_citation_links
 # from ..services.search import _run_search, _filter_valid_urls  # external search disabled
 from ..services.followup import generate_followup_questions
+from ..services.llm_cache import llm_cache, cache_key as llm_cache_key, get_llm_cache_collection
+from ..services.pregen import question_prompt
+from ..services.speculation import speculation, SpeculationBusyError
+from ..services.history_cache import history_cache
+from ..services.message_writer import message_writer
+from ..services.llm_gate import llm_gate, LLMQueueFullError, LLMTicket
+from ..services.upstream_stats import upstream_stats
+from ..services.reply_metrics import ReplyMeter, combined_metadata, reply_latency
+from ..services.stream_replay import parse_event_id, stream_replay
+from ..services.idempotency import (
+    idempotency, get_idempotency_collection, IdempotencyKeyReusedError, MAX_KEY_LENGTH,
+)
+from ..services.single_flight import single_flight
+from ..services.upstream_deadlines import upstream_deadlines, UpstreamTimeoutError
+from ..services.model_routes import model_router, ModelRoute
 
 router = APIRouter()
 
 
-
-# Max tokens the AI may generate per response. 0 = no limit. Valid range: 1–4096 (model-dependent).
-MAX_TOKENS: int = 1000
-
-# Controls response randomness. 0.0 = fully deterministic, 2.0 = very random. Valid range: 0.0–2.0. Recommended: 0.0–1.0.
-TEMPERATURE: float = 0.5
-# Lower temperature for double-agent mode so stochastic answer divergence is minimised
-# and the style difference (intuitive vs. formal) is the dominant signal between agents.
-DOUBLE_TEMPERATURE: float = 0.1
+# Model, temperature and max_tokens for each call below come from the routing
+# table in services/model_routes.py (LLM_ROUTES).
 
 
 # Initialize OpenAI client with UF proxy settings (from env)
@@ -72,32 +87,366 @@ def _sse(data: dict) -> str:
     return f"data: {json.dumps(data)}\n\n"
 
 
-async def _stream_ai(messages: list[dict], temperature: float = TEMPERATURE) -> AsyncGenerator[str, None]:
-    """Streams text delta tokens from the AI. Raises on failure."""
+# Token events are by far the most frequent frame, so they're built from a
+# fixed template around the C string encoder instead of a json.dumps of a
+# dict. The output is byte-identical to _sse({"type": "token", ...}).
+_TOKEN_FRAME_HEAD = 'data: {"type": "token", "content": '
+_encode_json_str = json.encoder.encode_basestring_ascii
+
+
+def _token_frame(delta: str, agent_tag: Optional[str] = None) -> str:
+    if agent_tag:
+        return f'{_TOKEN_FRAME_HEAD}{_encode_json_str(delta)}, "agent": {_encode_json_str(agent_tag)}}}\n\n'
+    return f"{_TOKEN_FRAME_HEAD}{_encode_json_str(delta)}}}\n\n"
+
+
+async def _coalesce(deltas: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+    """Merge deltas into one chunk per SSE_COALESCE_MS window or per
+    SSE_COALESCE_BYTES of text, whichever comes first (0 disables either).
+
+    A reader task drains upstream into a buffer; the window starts at the
+    first buffered delta and is flushed by a timer even if upstream has gone
+    quiet. Once a chunk reaches the byte limit the reader waits for it to be
+    sent, so a slow client still holds back upstream. Buffered text is
+    flushed before an upstream error is re-raised.
+    """
+    settings = get_settings()
+    window = settings.SSE_COALESCE_MS / 1000
+    max_bytes = settings.SSE_COALESCE_BYTES
+    if window <= 0 and max_bytes <= 0:
+        async for delta in deltas:
+            yield delta
+        return
+
+    loop = asyncio.get_running_loop()
+    buf: list[str] = []
+    size = 0
+    ended = False
+    error: Optional[Exception] = None
+    wake = loop.create_future()
+    taken: Optional[asyncio.Future] = None
+    timer: Optional[asyncio.TimerHandle] = None
+
+    def flush() -> None:
+        if not wake.done():
+            wake.set_result(None)
+
+    async def read() -> None:
+        nonlocal size, ended, error, taken, timer
+        try:
+            async for delta in deltas:
+                buf.append(delta)
+                size += len(delta.encode())
+                if max_bytes > 0 and size >= max_bytes:
+                    taken = loop.create_future()
+                    flush()
+                    await taken
+                elif timer is None and window > 0:
+                    timer = loop.call_later(window, flush)
+        except Exception as e:
+            error = e
+        finally:
+            ended = True
+            flush()
+
+    reader = asyncio.create_task(read())
+    try:
+        while True:
+            await wake
+            finished = ended
+            wake = loop.create_future()
+            if timer is not None:
+                timer.cancel()
+                timer = None
+            chunk = "".join(buf)
+            buf.clear()
+            size = 0
+            if taken is not None:
+                taken.set_result(None)
+                taken = None
+            if chunk:
+                yield chunk
+            if finished:
+                if error is not None:
+                    raise error
+                return
+    finally:
+        reader.cancel()
+        if timer is not None:
+            timer.cancel()
+        # Let the reader unwind (closing deltas, and the upstream response
+        # behind it) before the caller releases its llm_gate ticket.
+        try:
+            await reader
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+
+
+async def _upstream_deltas(
+    messages: list[dict], route: ModelRoute, meter: Optional[ReplyMeter], attempt: Optional["_Attempt"] = None,
+) -> AsyncGenerator[str, None]:
+    """One upstream completion's text deltas. Raises on failure.
+
+    If the consumer stops early (aclose, cancellation) the upstream response
+    is closed right away rather than left to finish generating. meter, if
+    given, receives the usage block upstream sends after the last delta.
+    attempt is set when this is one request of a hedged race (_open_stream);
+    closing the one that lost isn't counted as a cancellation.
+    """
+    model_router.record(route)
     stream = await _client.chat.completions.create(
-        model=os.getenv("UF_OPENAI_API_MODEL"),
+        model=route.model,
         messages=messages,
         stream=True,
-        temperature=temperature,
-        **({"max_tokens": MAX_TOKENS} if MAX_TOKENS > 0 else {}),
+        temperature=route.temperature,
+        **({"max_tokens": route.max_tokens} if route.max_tokens > 0 else {}),
+        **({"stream_options": {"include_usage": True}} if get_settings().LLM_STREAM_USAGE else {}),
     )
-    async for chunk in stream:
-        delta = chunk.choices[0].delta.content or ""
-        if delta:
+    generated = 0
+    reported: Optional[int] = None
+    try:
+        async for chunk in stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                reported = getattr(usage, "completion_tokens", None)
+                if meter is not None:
+                    meter.usage(usage, getattr(chunk, "model", None))
+            if not chunk.choices:
+                continue  # the trailing usage-only chunk
+            delta = chunk.choices[0].delta.content or ""
+            if delta:
+                generated += len(delta)
+                yield delta
+    except BaseException as e:
+        if not isinstance(e, Exception) and not (attempt is not None and attempt.lost):
+            # Closed or cancelled by the consumer (client went away).
+            upstream_stats.record_cancelled(generated, route.max_tokens)
+        # Stop the generation and give the connection back to the pool.
+        with anyio.CancelScope(shield=True):
+            try:
+                await stream.close()
+            except Exception:
+                pass
+        raise
+    upstream_stats.record_completed(generated, reported)
+
+
+async def _first_delta(deltas: AsyncGenerator[str, None]) -> Optional[str]:
+    return await anext(deltas, None)
+
+
+class _Attempt:
+    """One upstream request racing in _open_stream: its deltas and the task
+    waiting for the first of them."""
+
+    def __init__(self, messages: list[dict], route: ModelRoute, meter: Optional[ReplyMeter]):
+        # The slower request of a hedged pair; upstream_stats doesn't count
+        # closing it as a cancellation, since nobody was reading it.
+        self.lost = False
+        self.deltas = _upstream_deltas(messages, route, meter, self)
+        self.task = asyncio.create_task(_first_delta(self.deltas))
+
+    async def drop(self, lost: bool = False) -> None:
+        """Stop the request, possibly still waiting for its first delta."""
+        self.lost = self.lost or lost
+        self.task.cancel()
+        with anyio.CancelScope(shield=True):
+            await asyncio.wait({self.task})
+            await self.deltas.aclose()
+
+
+# Overtaken first requests being watched (see _watch_overtaken); held here so
+# the tasks aren't garbage collected while they run.
+_overtaken: set[asyncio.Task] = set()
+
+
+def _watch_overtaken(attempt: _Attempt, started: float, ttft_ms: float, ticket: Optional[LLMTicket]) -> None:
+    """Give the first request of a stream its hedge won until its own first
+    delta (or the TTFT deadline), record how long that took, then close it.
+    ticket is the hedge's llm_gate slot, held until then."""
+    async def watch() -> None:
+        loop = asyncio.get_running_loop()
+        ttft = upstream_deadlines.ttft_seconds
+        remaining = max(0.0, started + ttft - loop.time()) if ttft > 0 else None
+        task = attempt.task
+        try:
+            # With no TTFT deadline, the client's own timeout bounds this.
+            await asyncio.wait({task}, timeout=remaining)
+            if not task.done() or task.exception() is None:
+                upstream_deadlines.record_overtaken((loop.time() - started) * 1000, ttft_ms)
+        finally:
+            await attempt.drop(lost=True)
+            if ticket is not None:
+                ticket.release()
+
+    watcher = asyncio.create_task(watch())
+    _overtaken.add(watcher)
+    watcher.add_done_callback(_overtaken.discard)
+
+
+async def _open_stream(
+    messages: list[dict], route: ModelRoute, meter: Optional[ReplyMeter], user_id: Optional[str], hedge: bool,
+) -> tuple[AsyncGenerator[str, None], Optional[str]]:
+    """(deltas, first delta) from whichever upstream request produces a
+    delta first; the first delta is None for an empty reply. With hedge, a
+    second request is sent once the first has waited upstream_deadlines'
+    hedge delay, if user_id can get an llm_gate slot without queueing.
+    Raises UpstreamTimeoutError past the TTFT deadline."""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    ttft = upstream_deadlines.ttft_seconds
+    deadline = started + ttft if ttft > 0 else None
+    delay = upstream_deadlines.hedge_delay() if hedge else None
+    hedge_at = started + delay if delay is not None and (deadline is None or delay < ttft) else None
+    upstream_deadlines.started += 1
+
+    primary = _Attempt(messages, route, meter)
+    attempts = {primary.task: primary}
+    hedge_ticket: Optional[LLMTicket] = None
+    decided = False
+    try:
+        while True:
+            wake = min((t for t in (deadline, hedge_at) if t is not None), default=None)
+            done, _ = await asyncio.wait(
+                attempts, timeout=max(0.0, wake - loop.time()) if wake is not None else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            winner = next((t for t in done if t.exception() is None), None)
+            for task in done:
+                if task is not winner:
+                    await attempts.pop(task).deltas.aclose()
+            if winner is not None:
+                decided = True
+                ttft_ms = (loop.time() - started) * 1000
+                hedge_won = winner is not primary.task
+                upstream_deadlines.record_first_token(ttft_ms, hedge_won)
+                if hedge_won and primary.task in attempts:
+                    _watch_overtaken(attempts.pop(primary.task), started, ttft_ms, hedge_ticket)
+                    hedge_ticket = None
+                return attempts.pop(winner).deltas, winner.result()
+            if done:
+                if not attempts:
+                    raise next(iter(done)).exception()
+                continue  # the other request may still answer
+            if hedge_at is not None and loop.time() >= hedge_at and (deadline is None or loop.time() < deadline):
+                hedge_at = None
+                hedge_ticket = llm_gate.try_acquire(user_id)
+                if hedge_ticket is None:
+                    upstream_deadlines.hedge_skipped += 1
+                else:
+                    upstream_deadlines.hedged += 1
+                    second = _Attempt(messages, route, meter)
+                    attempts[second.task] = second
+                continue
+            upstream_deadlines.ttft_timeouts += 1
+            raise UpstreamTimeoutError("first token", ttft)
+    finally:
+        # Left over once a winner is picked: the hedge the first request beat.
+        for attempt in attempts.values():
+            await attempt.drop(lost=decided)
+        if hedge_ticket is not None:
+            hedge_ticket.release()
+
+
+async def _stream_ai(
+    messages: list[dict],
+    route: Optional[ModelRoute] = None,
+    meter: Optional[ReplyMeter] = None,
+    user_id: Optional[str] = None,
+    hedge: bool = False,
+) -> AsyncGenerator[str, None]:
+    """Streams text delta tokens from the AI. Raises on failure, including
+    UpstreamTimeoutError when upstream misses its first-token or inter-token
+    deadline (upstream_deadlines).
+
+    hedge: race a second request against a first one that is slow to its
+    first token (see _open_stream); user_id is whose llm_gate slot it takes.
+    Meant for replies a participant is waiting on. route defaults to the
+    "answer" route. meter, if given, receives the usage block upstream sends
+    after the last delta.
+    """
+    route = route or model_router.route("answer")
+    deltas, first = await _open_stream(messages, route, meter, user_id, hedge)
+    idle = upstream_deadlines.idle_seconds
+    try:
+        delta = first
+        while delta is not None:
+            yield delta
+            try:
+                async with asyncio.timeout(idle if idle > 0 else None):
+                    delta = await anext(deltas, None)
+            except TimeoutError:
+                upstream_deadlines.idle_timeouts += 1
+                raise UpstreamTimeoutError("token", idle) from None
+    finally:
+        await deltas.aclose()
+
+
+async def _gated_stream_ai(
+    messages: list[dict], route: Optional[ModelRoute] = None, user_id: Optional[str] = None,
+) -> AsyncGenerator[str, None]:
+    """_stream_ai behind llm_gate, waiting for a slot without reporting the
+    queue position. Raises LLMQueueFullError if the wait queue is full."""
+    ticket = llm_gate.enqueue(user_id)
+    try:
+        async for _ in ticket.wait():
+            pass
+        async for delta in _stream_ai(messages, route=route):
             yield delta
+    finally:
+        ticket.release()
+
 
+async def _speculative_stream_ai(messages: list[dict], route: ModelRoute, user_id: str) -> AsyncGenerator[str, None]:
+    """_stream_ai for a speculation, only on a slot nobody is waiting for."""
+    ticket = llm_gate.try_acquire(user_id)
+    if ticket is None:
+        raise SpeculationBusyError()
+    try:
+        async for delta in _stream_ai(messages, route=route):
+            yield delta
+    finally:
+        ticket.release()
+
+
+def _require_upstream_room(streams: int = 1) -> None:
+    """429 before streaming starts if llm_gate's wait queue can't take streams more.
+    Called from _event_stream, once resumes and idempotent repeats are ruled out."""
+    try:
+        llm_gate.check(streams)
+    except LLMQueueFullError:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many chat requests right now, please retry shortly",
+            headers={"Retry-After": str(get_settings().LLM_RETRY_AFTER_SECONDS)},
+        )
 
 
 def _save_message(
     col,
     role: str,
-    user: UserPublic,
+    user: SessionUser,
     conv_id: str,
     content,
     metadata=None,
     extra_fields: dict | None = None,
-) -> None:
-    """Insert one message document. Raises on failure — callers must handle/log."""
+) -> datetime:
+    """Insert one message document and return its created_at. Raises on
+    failure — callers must handle/log."""
+    doc = _message_doc(role, user, conv_id, content, metadata, extra_fields)
+    col.insert_one(doc)
+    return doc["created_at"]
+
+
+def _message_doc(
+    role: str,
+    user: SessionUser,
+    conv_id: str,
+    content,
+    metadata=None,
+    extra_fields: dict | None = None,
+) -> dict:
     doc = {
         "conversation_id": conv_id,
         "role": role,
@@ -111,12 +460,12 @@ def _save_message(
         doc["metadata"] = metadata
     if extra_fields:
         doc.update(extra_fields)
-    col.insert_one(doc)
+    return doc
 
 
 async def _save_exchange(
     col,
-    user: UserPublic,
+    user: SessionUser,
     conv_id: str,
     user_message: str,
     assistant_reply: list,
@@ -124,8 +473,15 @@ async def _save_exchange(
     question_id: Optional[str] = None,
     trigger: Optional[str] = None,
 ) -> None:
-    """Persist the user message then the assistant reply, awaited before the
-    caller reports success to the client.
+    """Persist the user message then the assistant reply.
+
+    When the background writer is running (services/message_writer.py, started
+    at app startup) the pair is only queued, so done goes out before it is in
+    Mongo; the writer inserts it, or spools it to disk if Mongo is down. The
+    queue itself is in memory: exchanges still queued when the process is
+    killed or crashes are lost (the spool only covers Mongo outages and a
+    graceful shutdown). Otherwise both are inserted here, awaited, before the
+    caller reports success.
 
     Saves user message first so its timestamp is strictly earlier than the
     assistant message. Called only after streaming completes successfully, so a
@@ -135,26 +491,64 @@ async def _save_exchange(
     over a persistence error, but it must never vanish without a trace.
 
     question_id/trigger are stored as top-level fields (not nested in metadata)
-    since they identify the message itself, analogous to conversation_id.
+    since they identify the message itself, analogous to conversation_id, as
+    are turn (the exchange's index in the conversation) and, for double-mode
+    replies, agents (the tags present, e.g. ["A", "B"]).
     trigger only applies to the user message — an assistant reply has no "trigger".
     """
+    if message_writer.running:
+        user_extra = {"question_id": question_id, "trigger": trigger}
+        assistant_extra = {"question_id": question_id, "agents": agent_tags(assistant_reply) or None}
+        user_doc = _message_doc("user", user, conv_id, user_message,
+                                extra_fields={k: v for k, v in user_extra.items() if v is not None})
+        message_writer.enqueue(
+            user_doc,
+            _message_doc("assistant", user, conv_id, assistant_reply, assistant_metadata,
+                         extra_fields={k: v for k, v in assistant_extra.items() if v is not None}),
+        )
+        history_cache.record(conv_id, user_message, assistant_reply, user_doc["created_at"])
+        return
+
     def _save() -> None:
-        user_extra = {}
+        # Both halves of the exchange share a turn index, so history assembly
+        # pairs them without comparing timestamps.
+        try:
+            turn = col.count_documents({"conversation_id": conv_id, "role": "user"})
+        except Exception as e:
+            turn = None
+            print(f"[chat] turn count failed conv={conv_id}: {type(e).__name__}: {e}")
+        user_extra = {} if turn is None else {"turn": turn}
         if question_id is not None:
             user_extra["question_id"] = question_id
         if trigger is not None:
             user_extra["trigger"] = trigger
+        saved = True
+        created_at = None
         try:
-            _save_message(col, "user", user, conv_id, user_message, extra_fields=user_extra or None)
+            created_at = _save_message(col, "user", user, conv_id, user_message, extra_fields=user_extra or None)
         except Exception as e:
+            saved = False
             print(f"[chat] FAILED to save USER message conv={conv_id} user={user.id}: {type(e).__name__}: {e}")
 
-        assistant_extra = {"question_id": question_id} if question_id is not None else None
+        assistant_extra = {} if turn is None else {"turn": turn}
+        tags = agent_tags(assistant_reply)
+        if tags:
+            assistant_extra["agents"] = tags
+        if question_id is not None:
+            assistant_extra["question_id"] = question_id
         try:
-            _save_message(col, "assistant", user, conv_id, assistant_reply, assistant_metadata, extra_fields=assistant_extra)
+            _save_message(col, "assistant", user, conv_id, assistant_reply, assistant_metadata, extra_fields=assistant_extra or None)
         except Exception as e:
+            saved = False
             print(f"[chat] FAILED to save ASSISTANT message conv={conv_id} user={user.id}: {type(e).__name__}: {e}")
 
+        # Keep the history window cache in step with what Mongo now holds; a
+        # partial save is left for the next turn to re-read.
+        if saved:
+            history_cache.record(conv_id, user_message, assistant_reply, created_at)
+        else:
+            history_cache.invalidate(conv_id)
+
     await asyncio.to_thread(_save)
 
 def _build_system_instruction(answer_incorrectly: bool, has_choices: bool) -> str:
@@ -196,6 +590,151 @@ def _build_system_instruction(answer_incorrectly: bool, has_choices: bool) -> st
 _SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
 
+class _ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that closes its generator as soon as the response
+    ends, however it ends.
+
+    Starlette cancels the stream when it sees the client disconnect, but a
+    generator that was suspended at a yield at that moment (mid send) is only
+    closed once it's garbage collected. Closing it here runs the finally
+    blocks that stop upstream work — _stream_ai's response, the llm_gate
+    ticket, double_chat's agent task — straight away.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
+
+
+# Prefix of the frame _sse({"type": "done", ...}) produces.
+_DONE_FRAME_HEAD = 'data: {"type": "done"'
+
+
+def _idempotency_key(request: Request, req: ChatRequest) -> Optional[str]:
+    key = request.headers.get("idempotency-key") or req.client_message_id
+    if not key or not idempotency.enabled:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency key longer than {MAX_KEY_LENGTH} characters")
+    return key
+
+
+def _request_fingerprint(request: Request, req: ChatRequest) -> str:
+    """What an idempotency key is bound to: the endpoint and the request body
+    (message, conversation_id, ...) apart from the key itself."""
+    body = req.model_dump_json(exclude={"client_message_id"})
+    return hashlib.sha256(f"{request.url.path}\n{body}".encode()).hexdigest()
+
+
+def _idempotency_col(request: Request):
+    db = getattr(request.app.state, "db", None)
+    return get_idempotency_collection(db) if db is not None else None
+
+
+async def _recording(
+    frames: AsyncGenerator[str, None], col, user_id: str, key: str, stream_id: str, fingerprint: str,
+) -> AsyncGenerator[str, None]:
+    """Pass frames through, storing them under the idempotency key once the
+    done event went out. A reply that fails or is abandoned before that
+    releases the key, so a retry starts over."""
+    sent: list[str] = []
+    try:
+        async for frame in frames:
+            sent.append(frame)
+            yield frame
+    finally:
+        with anyio.CancelScope(shield=True):
+            if any(frame.startswith(_DONE_FRAME_HEAD) for frame in sent):
+                await asyncio.to_thread(idempotency.complete, col, user_id, key, stream_id, fingerprint, sent)
+            else:
+                await asyncio.to_thread(idempotency.release, col, user_id, key, stream_id)
+
+
+async def _stored_frames(stream_id: str, frames: list[str], after: int) -> AsyncGenerator[str, None]:
+    """A stored reply's frames after seq `after`, with the ids the original
+    response carried (when stream_replay is on) so it can be resumed again."""
+    for seq, frame in enumerate(frames, start=1):
+        if seq > after:
+            yield f"id: {stream_id}:{seq}\n{frame}" if stream_replay.enabled else frame
+
+
+def _duplicate_stream(existing: dict, request: Request, user: SessionUser) -> StreamingResponse:
+    """Response for a repeat of an idempotency key: the stored reply, or the
+    one still generating in this process. 409 if it is generating elsewhere.
+    A reconnect whose Last-Event-ID names that reply gets only the frames
+    after it, so the client doesn't append text it already has."""
+    after = 0
+    parsed = parse_event_id(request.headers.get("last-event-id"))
+    if parsed is not None and parsed[0] == existing["stream_id"]:
+        after = parsed[1]
+    if existing["frames"] is not None:
+        body = _stored_frames(existing["stream_id"], existing["frames"], after)
+    else:
+        stream = stream_replay.get(existing["stream_id"], user.id)
+        if stream is None or not stream.has(after):
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this idempotency key is still in progress",
+                headers={"Retry-After": str(get_settings().LLM_RETRY_AFTER_SECONDS)},
+            )
+        body = stream.follow(after)
+    return _ClosingStreamingResponse(body, media_type="text/event-stream", headers=_SSE_HEADERS)
+
+
+async def _event_stream(
+    frames: AsyncGenerator[str, None], request: Request, req: ChatRequest, user: SessionUser,
+    upstream_streams: int = 1,
+) -> StreamingResponse:
+    """SSE response for a chat reply. With stream_replay enabled the frames
+    are produced in the background and carry ids, so a dropped connection
+    can be resumed (see _resumed_stream) without a second upstream call.
+    A request repeating an idempotency key gets the original reply instead
+    (frames is closed unstarted). Otherwise 429 if llm_gate can't take the
+    upstream_streams the reply needs (see _upstream_streams_needed)."""
+    stream_id = uuid.uuid4().hex
+    key = _idempotency_key(request, req)
+    col = None
+    if key is not None:
+        col = _idempotency_col(request)
+        fingerprint = _request_fingerprint(request, req)
+        try:
+            existing = await asyncio.to_thread(idempotency.claim, col, user.id, key, stream_id, fingerprint)
+        except IdempotencyKeyReusedError:
+            await frames.aclose()
+            raise HTTPException(
+                status_code=422, detail="This idempotency key was already used for a different message",
+            )
+        if existing is not None:
+            await frames.aclose()
+            return _duplicate_stream(existing, request, user)
+    try:
+        _require_upstream_room(upstream_streams)
+    except HTTPException:
+        await frames.aclose()
+        if key is not None:
+            await asyncio.to_thread(idempotency.release, col, user.id, key, stream_id)
+        raise
+    if key is not None:
+        frames = _recording(frames, col, user.id, key, stream_id, fingerprint)
+    if stream_replay.enabled:
+        frames = stream_replay.start(user.id, frames, stream_id).follow()
+    return _ClosingStreamingResponse(frames, media_type="text/event-stream", headers=_SSE_HEADERS)
+
+
+def _resumed_stream(request: Request, user: SessionUser) -> Optional[StreamingResponse]:
+    """The rest of an earlier reply when request is a reconnect carrying
+    Last-Event-ID for a stream still buffered in this process; None means
+    handle it as a new message."""
+    resumed = stream_replay.resume(request.headers.get("last-event-id"), user.id)
+    if resumed is None:
+        return None
+    stream, after = resumed
+    return _ClosingStreamingResponse(stream.follow(after), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+
 # Not currently used — all endpoints stream tokens via _stream_ai / _standard_stream.
 # Restore this if any endpoint switches back to a single blocking AI call that needs
 # metadata (latency, token counts, model version) attached to the stored message.
@@ -236,31 +775,376 @@ def _build_standard_messages(
     ]
 
 
+_REPLAY_PIECES = re.compile(r"\S+\s*|^\s+")
+
+
+async def _replay_reply(reply: str) -> AsyncGenerator[str, None]:
+    """Re-emit a cached reply word by word, paced like a live stream."""
+    delay = get_settings().LLM_REPLAY_DELAY_MS / 1000
+    for i, piece in enumerate(_REPLAY_PIECES.findall(reply)):
+        if i and delay:
+            await asyncio.sleep(delay)
+        yield piece
+
+
+def _cache_target(
+    request: Request,
+    variant: str,
+    messages: list[dict],
+    route: ModelRoute,
+    answer_incorrectly: bool,
+) -> tuple[Optional[str], object]:
+    """(key, collection) for the LLM response cache, or (None, None) if this
+    turn isn't cacheable: the variant opted out, or the conversation already
+    has history (only first turns repeat across participants)."""
+    if not llm_cache.enabled_for(variant) or len(messages) != 2:
+        return None, None
+    db = getattr(request.app.state, "db", None)
+    col = get_llm_cache_collection(db) if db is not None else None
+    key = llm_cache_key(messages, route.temperature, answer_incorrectly, route.model)
+    return key, col
+
+
+async def _upstream_streams_needed(
+    user_id: str,
+    answer_incorrectly: bool,
+    targets: list[tuple[list[dict], ModelRoute, tuple[Optional[str], object], Optional[str]]],
+) -> int:
+    """How many of the replies (messages, route, _cache_target, _flight_key)
+    will open an upstream stream: not those _stream_agent_tokens serves from
+    a waiting speculation, the LLM cache or another request's single flight."""
+    needed = 0
+    for messages, route, (cache_key, cache_col), flight_key in targets:
+        if single_flight.busy(flight_key):
+            continue
+        if speculation.enabled and len(messages) == 2:
+            key = cache_key or llm_cache_key(messages, route.temperature, answer_incorrectly, route.model)
+            if speculation.pending(user_id, key):
+                continue
+        if cache_key is not None and await asyncio.to_thread(llm_cache.has, cache_col, cache_key):
+            continue
+        needed += 1
+    return needed
+
+
+def _flight_key(
+    variant: str,
+    messages: list[dict],
+    route: ModelRoute,
+    answer_incorrectly: bool,
+) -> Optional[str]:
+    """Key under which identical concurrent prompts share one upstream stream,
+    or None if the variant needs independent samples."""
+    if not single_flight.enabled_for(variant):
+        return None
+    return llm_cache_key(messages, route.temperature, answer_incorrectly, route.model)
+
+
+def _double_system_prompt(system_instruction: str, tag: str) -> str:
+    style = _AGENT_A_STYLE if tag == "A" else _AGENT_B_STYLE
+    return f"{system_instruction}\nYou are Agent {tag}.\n{style}"
+
+
+def _links_system_instruction(answer_incorrectly: bool, has_choices: bool) -> str:
+    return (
+        _build_system_instruction(answer_incorrectly=answer_incorrectly, has_choices=has_choices) +
+        " Use web searches to gather information and cite sources inline."
+        #" Prioritize academic and institutional sources; avoid blog posts, news articles, or unverifiable sources."
+        #" Prefer sources with stable, long-lived URLs."
+    )
+
+
+def _curated_links(knowledge_links: list[dict]) -> list[dict]:
+    return [
+        {"title": l.get("title", ""), "url": l.get("url", ""), "snippet": l.get("description", "")}
+        for l in knowledge_links
+        if l.get("url")
+    ]
+
+
+# Chat modes with a first turn worth caching/pre-generating, and the
+# LLM_CACHE_DISABLED_VARIANTS name each one is opted out by.
+FIRST_TURN_MODES = {
+    "default": "default",
+    "followup": "followup",
+    "links": "links",
+    "double_a": "double",
+    "double_b": "double",
+}
+
+
+def first_turn_messages(
+    mode: str,
+    message: str,
+    answer_incorrectly: bool,
+    has_choices: bool,
+    knowledge_links: list[dict],
+) -> tuple[list[dict], ModelRoute]:
+    """(messages, route) the given mode sends upstream for a turn with no
+    history. The endpoints and scripts/pregenerate_replies.py both build first
+    turns through here, so pre-generated replies land on the same cache key."""
+    if mode in ("double_a", "double_b"):
+        system = _build_system_instruction(answer_incorrectly=answer_incorrectly, has_choices=has_choices)
+        tag = "A" if mode == "double_a" else "B"
+        return [
+            {"role": "system", "content": _double_system_prompt(system, tag)},
+            {"role": "user", "content": message},
+        ], model_router.route(mode)
+    if mode == "links":
+        messages, _ = _build_search_context(
+            _build_standard_messages([], message, system_prompt=_links_system_instruction(answer_incorrectly, has_choices)),
+            _curated_links(knowledge_links),
+        )
+        return messages, model_router.route("answer")
+    system = _build_system_instruction(answer_incorrectly=answer_incorrectly, has_choices=has_choices)
+    return _build_standard_messages([], message, system_prompt=system), model_router.route("answer")
+
+
+async def _history_for(req: ChatRequest, variant: str, col, conv_id: str, agent_prefix: Optional[str] = None) -> list[dict]:
+    """Prior turns to send upstream, from the history window cache when the
+    conversation is loaded there (and, with HISTORY_CACHE_CHECK_LATEST,
+    nothing newer is in Mongo); from Mongo otherwise. Variants opted in with
+    LLM_CACHE_FRESH_QUESTION_VARIANTS send the automatic first message for a
+    question without history, so it matches the pre-generated/cached first
+    turn for that question; every other turn keeps its history."""
+    if req.trigger == "auto_question" and llm_cache.starts_fresh(variant):
+        return []
+    # With several workers, another one may have saved turns this process's
+    # cache hasn't seen.
+    latest = None
+    if history_cache.enabled and history_cache.check_latest:
+        latest = await asyncio.to_thread(latest_user_message_at, col, conv_id)
+    cached, version = history_cache.lookup(conv_id, agent_prefix, latest)
+    if cached is not None:
+        return cached
+
+    def _read() -> list[dict]:
+        # The previous turn may still be queued in the background writer.
+        message_writer.wait_written(conv_id)
+        if agent_prefix:
+            return get_last_exchange(col, conv_id, agent_prefix)
+        return get_last_exchange(col, conv_id)
+
+    history = await asyncio.to_thread(_read)
+    history_cache.fill(conv_id, agent_prefix, history, version, latest)
+    return history
+
+
+# Chat endpoint(s) each quiz posts to (frontend: /api/chat/{quiz_id}), as
+# FIRST_TURN_MODES entries.
+QUIZ_CHAT_MODES = {
+    "base": ["default"],
+    "followup": ["followup"],
+    "links": ["links"],
+    "double": ["double_a", "double_b"],
+}
+
+
+async def speculate_first_turn(
+    app,
+    user_id: str,
+    quiz_id: str,
+    question: dict,
+    answer_incorrectly: bool,
+    fresh_context: bool,
+) -> None:
+    """Background task for GET /quiz/{quiz_id}/state: start generating the
+    reply to the participant's "ask about this question" message while they
+    are still reading it (see services/speculation.py).
+
+    Variants whose first turn is already in the LLM cache are skipped. A
+    variant that keeps history across questions (the default, see
+    _history_for) is only speculated while the conversation is still empty
+    (fresh_context), since otherwise the real request's messages won't match.
+    """
+    if not speculation.enabled or not _UF_API_KEY:
+        return
+    db = getattr(app.state, "db", None)
+    col = get_llm_cache_collection(db) if db is not None else None
+    knowledge_links = getattr(app.state, "knowledge_links", [])
+    message = question_prompt(question)
+
+    jobs = []
+    for mode in QUIZ_CHAT_MODES.get(quiz_id, []):
+        variant = FIRST_TURN_MODES[mode]
+        cached_variant = llm_cache.enabled_for(variant)
+        if not (llm_cache.starts_fresh(variant) or fresh_context):
+            continue
+        messages, route = first_turn_messages(
+            mode, message, answer_incorrectly, bool(question.get("choices")), knowledge_links,
+        )
+        key = llm_cache_key(messages, route.temperature, answer_incorrectly, route.model)
+        jobs.append((key, messages, route, cached_variant))
+
+    speculation.retain(user_id, [key for key, *_ in jobs])
+    for key, messages, route, cached_variant in jobs:
+        if cached_variant and await asyncio.to_thread(llm_cache.has, col, key):
+            speculation.record_cached_skip()
+            continue
+        if not llm_gate.idle(user_id):
+            speculation.record_busy_skip()
+            continue
+        speculation.start(
+            user_id, key, lambda m=messages, r=route: _speculative_stream_ai(m, r, user_id),
+        )
+
+
 async def _stream_agent_tokens(
     messages: list[dict],
     agent_tag: Optional[str] = None,
-    temperature: float = TEMPERATURE,
+    route: Optional[ModelRoute] = None,
+    cache_key: Optional[str] = None,
+    cache_col=None,
+    user_id: Optional[str] = None,
+    answer_incorrectly: bool = False,
+    meter: Optional[ReplyMeter] = None,
+    flight_key: Optional[str] = None,
 ) -> AsyncGenerator[tuple[bool, str, str], None]:
     """Core token-streaming helper. Yields (is_error, delta, sse_str) tuples.
 
     On success: is_error=False, delta=token text, sse_str=token SSE event.
+    Upstream deltas are coalesced (see _coalesce), so one delta may carry
+    several upstream chunks.
     On failure: is_error=True, delta='', sse_str=error SSE event (then stops).
     Callers accumulate delta to reconstruct the full reply.
+
+    route: model_routes entry to generate under ("answer" if omitted); cache
+    and speculation keys must have been computed with the same route.
+    cache_key/cache_col (see _cache_target): a cached reply is replayed as
+    token events instead of calling upstream; a completed live reply is stored.
+    user_id/answer_incorrectly: a first turn speculated for this user when the
+    question was shown (speculate_first_turn) is streamed from that generation.
+    A live request takes an llm_gate slot for user_id first; while it waits,
+    queued events (is_error=False, delta='') report its position.
+    meter: a ReplyMeter started by the caller, finished on success.
+    flight_key (see _flight_key): a live request whose prompt is already
+    streaming for another request shares that upstream stream (single_flight).
     """
+    route = route or model_router.route("answer")
+    meter = meter or ReplyMeter()
+    meter.model = route.model
+    meter.route = route.name
+    full_reply = ""
+    if user_id is not None and speculation.enabled and len(messages) == 2:
+        key = cache_key or llm_cache_key(messages, route.temperature, answer_incorrectly, route.model)
+        spec = speculation.claim(user_id, key)
+        if spec is not None:
+            meter.source = "speculation"
+            pieces = _replay_reply(spec.text) if spec.done else spec.follow()
+            try:
+                async for delta in _coalesce(pieces):
+                    full_reply += delta
+                    meter.token(delta)
+                    yield False, delta, _token_frame(delta, agent_tag)
+            except (GeneratorExit, asyncio.CancelledError):
+                # Claimed, so nobody else will read the rest of it.
+                if spec.task is not None and not spec.done:
+                    spec.task.cancel()
+                raise
+            if spec.failed and full_reply:
+                yield True, "", _sse({"type": "error", "detail": "Upstream AI request failed"})
+                return
+            if not spec.failed:
+                meter.finish()
+                if cache_key is not None:
+                    await asyncio.to_thread(
+                        llm_cache.put, cache_col, cache_key, full_reply, route.model, meter.output_tokens,
+                    )
+                return
+            # Failed before producing anything: fall through to a live request.
+            meter.source = "upstream"
+
+    if cache_key is not None:
+        cached = await asyncio.to_thread(llm_cache.get, cache_col, cache_key)
+        if cached is not None:
+            meter.source = "cache"
+            async for delta in _coalesce(_replay_reply(cached)):
+                meter.token(delta)
+                yield False, delta, _token_frame(delta, agent_tag)
+            meter.finish()
+            return
+
+    # The same prompt already streaming for someone else (or about to, once
+    # the request queued ahead of this one gets a slot): share it, no slot needed.
+    flight = single_flight.join(flight_key)
+    if flight is None and single_flight.busy(flight_key):
+        flight = await single_flight.join_queued(flight_key)
+    ticket = None
+    queued_lead = False
+    if flight is None:
+        try:
+            ticket = llm_gate.enqueue(user_id)
+        except LLMQueueFullError:
+            yield True, "", _sse({"type": "error", "detail": "Too many chat requests right now, please retry shortly"})
+            return
+        queued_lead = flight_key is not None and single_flight.queue_lead(flight_key)
     try:
-        async for delta in _stream_ai(messages, temperature=temperature):
-            event: dict = {"type": "token", "content": delta}
-            if agent_tag:
-                event["agent"] = agent_tag
-            yield False, delta, _sse(event)
+        if ticket is not None:
+            async for position in ticket.wait():
+                event: dict = {"type": "queued", "position": position}
+                if agent_tag:
+                    event["agent"] = agent_tag
+                yield False, "", _sse(event)
+            flight = single_flight.join(flight_key)  # started while this one queued
+            if flight is None and flight_key is not None:
+                # The flight holds the slot until upstream is done, even if
+                # this request leaves first.
+                flight = single_flight.lead(
+                    flight_key,
+                    _stream_ai(messages, route=route, meter=meter, user_id=user_id, hedge=True),
+                    on_done=ticket.release,
+                )
+                ticket = None
+            if queued_lead:
+                single_flight.unqueue(flight_key)
+                queued_lead = False
+        if flight is not None and not flight.leader:
+            meter.source = "single_flight"
+        deltas = flight.deltas() if flight is not None else _stream_ai(
+            messages, route=route, meter=meter, user_id=user_id, hedge=True,
+        )
+        async for delta in _coalesce(deltas):
+            full_reply += delta
+            meter.token(delta)
+            yield False, delta, _token_frame(delta, agent_tag)
     except Exception:
         yield True, "", _sse({"type": "error", "detail": "Upstream AI request failed"})
+        return
+    finally:
+        if queued_lead:
+            single_flight.unqueue(flight_key)
+        if ticket is not None:
+            ticket.release()
+        if flight is not None:
+            flight.leave()
+    meter.finish()
+
+    if cache_key is not None and full_reply:
+        await asyncio.to_thread(
+            llm_cache.put, cache_col, cache_key, full_reply, route.model, meter.output_tokens,
+        )
+
+
+def _reply_metadata(
+    endpoint: str,
+    user: SessionUser,
+    answer_incorrectly: bool,
+    stated_choice_id: Optional[dict],
+    timing: dict,
+) -> dict:
+    """Stored metadata for a completed reply (timing from ReplyMeter.metadata
+    or combined_metadata). Also feeds the per endpoint/variant latency stats."""
+    metadata = AIMessageMetadata(
+        answer_incorrectly=answer_incorrectly, stated_choice_id=stated_choice_id, **timing,
+    ).model_dump(exclude_none=True)
+    reply_latency.record(endpoint, AssignedVar(user.assigned_var).value, metadata)
+    return metadata
 
 
 async def _standard_stream(
     messages: list[dict],
     col,
-    user: UserPublic,
+    user: SessionUser,
     conv_id: str,
     user_message: str,
     after_done: Optional[Callable[[str], AsyncGenerator[str, None]]] = None,
@@ -268,10 +1152,14 @@ async def _standard_stream(
     agent_tag: Optional[str] = None,
     reply_prefix: str = "",
     answer_incorrectly: bool = False,
-    temperature: float = TEMPERATURE,
+    route: Optional[ModelRoute] = None,
     question_id: Optional[str] = None,
     trigger: Optional[str] = None,
     answer_choices: Optional[list[QuestionChoice]] = None,
+    cache_key: Optional[str] = None,
+    cache_col=None,
+    endpoint: str = "default",
+    flight_key: Optional[str] = None,
 ) -> AsyncGenerator[str, None]:
     """Stream tokens, await the save, emit done, then optionally yield from after_done.
 
@@ -279,9 +1167,16 @@ async def _standard_stream(
     reply_prefix: prepended to the stored reply (e.g. "[AGENT A] " for double quiz).
     answer_choices: if provided, the leading text of the reply is scanned to detect
     which choice the AI named, recorded in metadata.stated_choice_id["default"].
+    route/cache_key/cache_col/flight_key: passed through to _stream_agent_tokens, along
+    with user.id/answer_incorrectly for claiming a speculated first turn.
+    endpoint: label the reply's timing is aggregated under (see _reply_metadata).
     """
     full_reply = ""
-    async for is_error, delta, sse in _stream_agent_tokens(messages, agent_tag=agent_tag, temperature=temperature):
+    meter = ReplyMeter()
+    async for is_error, delta, sse in _stream_agent_tokens(
+        messages, agent_tag=agent_tag, route=route, cache_key=cache_key, cache_col=cache_col,
+        user_id=user.id, answer_incorrectly=answer_incorrectly, meter=meter, flight_key=flight_key,
+    ):
         yield sse
         if is_error:
             return
@@ -290,7 +1185,7 @@ async def _standard_stream(
     stored_reply = f"{reply_prefix}{full_reply}" if reply_prefix else full_reply
     choices = answer_choices or []
     stated = {"default": detect_stated_choice(full_reply, choices)} if choices else None
-    metadata = AIMessageMetadata(answer_incorrectly=answer_incorrectly, stated_choice_id=stated).model_dump(exclude_none=True)
+    metadata = _reply_metadata(endpoint, user, answer_incorrectly, stated, meter.metadata())
     await _save_exchange(col, user, conv_id, user_message, [stored_reply], metadata, question_id=question_id, trigger=trigger)
     yield _sse({"type": "done", "conversation_id": conv_id})
 
@@ -303,11 +1198,20 @@ async def _stream_into_queue(
     messages: list[dict],
     tag: str,
     queue: asyncio.Queue,
-    temperature: float = TEMPERATURE,
+    route: Optional[ModelRoute] = None,
+    cache_key: Optional[str] = None,
+    cache_col=None,
+    user_id: Optional[str] = None,
+    answer_incorrectly: bool = False,
+    meter: Optional[ReplyMeter] = None,
+    flight_key: Optional[str] = None,
 ) -> None:
     """Stream one agent's tokens into a shared queue for concurrent multi-agent rendering."""
     try:
-        async for is_error, delta, sse in _stream_agent_tokens(messages, agent_tag=tag, temperature=temperature):
+        async for is_error, delta, sse in _stream_agent_tokens(
+            messages, agent_tag=tag, route=route, cache_key=cache_key, cache_col=cache_col,
+            user_id=user_id, answer_incorrectly=answer_incorrectly, meter=meter, flight_key=flight_key,
+        ):
             await queue.put((is_error, delta, tag, sse))
             if is_error:
                 return
@@ -320,10 +1224,13 @@ async def _stream_into_queue(
 async def double_chat(
     req: ChatRequest,
     request: Request,
-    user: UserPublic = Depends(get_current_user),
+    user: SessionUser = Depends(get_session_user),
 ):
     if not _UF_API_KEY:
         raise HTTPException(status_code=500, detail="Backend missing UF_OPENAI_API_KEY")
+    resumed = _resumed_stream(request, user)
+    if resumed is not None:
+        return resumed
 
     conv_id = req.conversation_id or str(uuid.uuid4())
 
@@ -339,72 +1246,89 @@ async def double_chat(
     # Each agent gets only its own last reply as history — no cross-agent context.
     # This simplifies @mention routing: each agent's memory is isolated to its own turns.
     history_a, history_b = await asyncio.gather(
-        asyncio.to_thread(get_last_exchange, col, conv_id, "[AGENT A]"),
-        asyncio.to_thread(get_last_exchange, col, conv_id, "[AGENT B]"),
+        _history_for(req, "double", col, conv_id, "[AGENT A]"),
+        _history_for(req, "double", col, conv_id, "[AGENT B]"),
     )
-    
+
     prompt_content = req.message
 
-    system_instruction_a = _build_system_instruction(
-        answer_incorrectly=req.answer_incorrectly,
-        has_choices=len(req.answer_choices) > 0,
-    )
-    system_instruction_b = _build_system_instruction(
+    system_instruction = _build_system_instruction(
         answer_incorrectly=req.answer_incorrectly,
         has_choices=len(req.answer_choices) > 0,
     )
 
     messages_a = [
-        {"role": "system", "content": f"{system_instruction_a}\nYou are Agent A.\n{_AGENT_A_STYLE}"},
+        {"role": "system", "content": _double_system_prompt(system_instruction, "A")},
         *history_a,
         {"role": "user", "content": prompt_content},
     ]
 
     messages_b = [
-        {"role": "system", "content": f"{system_instruction_b}\nYou are Agent B.\n{_AGENT_B_STYLE}"},
+        {"role": "system", "content": _double_system_prompt(system_instruction, "B")},
         *history_b,
         {"role": "user", "content": prompt_content},
     ]
+    route_a, route_b = model_router.route("double_a"), model_router.route("double_b")
+    cache_a = _cache_target(request, "double", messages_a, route_a, req.answer_incorrectly)
+    cache_b = _cache_target(request, "double", messages_b, route_b, req.answer_incorrectly)
+    flight_a = _flight_key("double", messages_a, route_a, req.answer_incorrectly)
+    flight_b = _flight_key("double", messages_b, route_b, req.answer_incorrectly)
+    streams = await _upstream_streams_needed(user.id, req.answer_incorrectly, [
+        target for target, run in (
+            ((messages_a, route_a, cache_a, flight_a), run_agent_a),
+            ((messages_b, route_b, cache_b, flight_b), run_agent_b),
+        ) if run
+    ])
 
     # Single agent selected via @mention — reuse _standard_stream directly.
     if not (run_agent_a and run_agent_b):
         tag = "A" if run_agent_a else "B"
         msgs = messages_a if run_agent_a else messages_b
-        return StreamingResponse(
+        cache_key, cache_col = cache_a if run_agent_a else cache_b
+        return await _event_stream(
             _standard_stream(msgs, col, user, conv_id, req.message,
                              agent_tag=tag, reply_prefix=f"[AGENT {tag}] ",
                              answer_incorrectly=req.answer_incorrectly,
-                             temperature=DOUBLE_TEMPERATURE,
+                             route=route_a if run_agent_a else route_b,
                              question_id=req.question_id, trigger=req.trigger,
-                             answer_choices=req.answer_choices),
-            media_type="text/event-stream",
-            headers=_SSE_HEADERS,
+                             answer_choices=req.answer_choices,
+                             cache_key=cache_key, cache_col=cache_col, endpoint="double",
+                             flight_key=flight_a if run_agent_a else flight_b),
+            request, req, user, streams,
         )
 
     # Both agents — run concurrently via shared queue.
     async def generate() -> AsyncGenerator[str, None]:
         queue: asyncio.Queue = asyncio.Queue()
         replies = {"A": "", "B": ""}
+        meters = {"A": ReplyMeter(), "B": ReplyMeter()}
 
         async def _run_both() -> None:
             await asyncio.gather(
-                _stream_into_queue(messages_a, "A", queue, temperature=DOUBLE_TEMPERATURE),
-                _stream_into_queue(messages_b, "B", queue, temperature=DOUBLE_TEMPERATURE),
+                _stream_into_queue(messages_a, "A", queue, route=route_a,
+                                   cache_key=cache_a[0], cache_col=cache_a[1], flight_key=flight_a,
+                                   user_id=user.id, answer_incorrectly=req.answer_incorrectly, meter=meters["A"]),
+                _stream_into_queue(messages_b, "B", queue, route=route_b,
+                                   cache_key=cache_b[0], cache_col=cache_b[1], flight_key=flight_b,
+                                   user_id=user.id, answer_incorrectly=req.answer_incorrectly, meter=meters["B"]),
             )
 
         task = asyncio.create_task(_run_both())
         task.add_done_callback(lambda _: queue.put_nowait(None))
 
-        while True:
-            item = await queue.get()
-            if item is None:
-                break
-            is_error, delta, tag, sse = item
-            yield sse
-            if is_error:
-                task.cancel()
-                return
-            replies[tag] += delta
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                is_error, delta, tag, sse = item
+                yield sse
+                if is_error:
+                    return
+                replies[tag] += delta
+        finally:
+            # Client gone or an agent failed: stop the other agent's stream too.
+            task.cancel()
 
         replies_to_store = [f"[AGENT A] {replies['A']}", f"[AGENT B] {replies['B']}"]
         stated = (
@@ -414,42 +1338,55 @@ async def double_chat(
             }
             if req.answer_choices else None
         )
-        metadata = AIMessageMetadata(answer_incorrectly=req.answer_incorrectly, stated_choice_id=stated).model_dump(exclude_none=True)
+        metadata = _reply_metadata("double", user, req.answer_incorrectly, stated, combined_metadata(meters))
         await _save_exchange(col, user, conv_id, req.message, replies_to_store, assistant_metadata=metadata,
                               question_id=req.question_id, trigger=req.trigger)
         yield _sse({"type": "done", "conversation_id": conv_id})
 
-    return StreamingResponse(generate(), media_type="text/event-stream", headers=_SSE_HEADERS)
+    return await _event_stream(generate(), request, req, user, streams)
 
 
 @router.post("/chat/followup")
 async def followup_quiz_chat(
     req: ChatRequest,
     request: Request,
-    user: UserPublic = Depends(get_current_user),
+    user: SessionUser = Depends(get_session_user),
 ):
     if not _UF_API_KEY:
         raise HTTPException(status_code=500, detail="Backend missing UF_OPENAI_API_KEY")
+    resumed = _resumed_stream(request, user)
+    if resumed is not None:
+        return resumed
 
     conv_id = req.conversation_id or str(uuid.uuid4())
-    history = await asyncio.to_thread(get_last_exchange, request.app.state.messages, conv_id)
     col = request.app.state.messages
+    history = await _history_for(req, "followup", col, conv_id)
     system_instruction = _build_system_instruction(
         answer_incorrectly=req.answer_incorrectly,
         has_choices=len(req.answer_choices) > 0,
     )
     messages = _build_standard_messages(history, req.message, system_prompt=system_instruction)
+    route = model_router.route("answer")
+    cache_key, cache_col = _cache_target(request, "followup", messages, route, req.answer_incorrectly)
+    flight_key = _flight_key("followup", messages, route, req.answer_incorrectly)
+    streams = await _upstream_streams_needed(
+        user.id, req.answer_incorrectly, [(messages, route, (cache_key, cache_col), flight_key)],
+    )
 
     async def after_done(full_reply: str) -> AsyncGenerator[str, None]:
-        async for delta in generate_followup_questions(full_reply, _stream_ai):
-            yield _sse({"type": "followup", "token": delta})
+        stream = functools.partial(_gated_stream_ai, route=model_router.route("followup_suggestions"), user_id=user.id)
+        try:
+            async for delta in _coalesce(generate_followup_questions(full_reply, stream)):
+                yield _sse({"type": "followup", "token": delta})
+        except LLMQueueFullError:
+            pass  # suggestions are optional; skip them rather than queue
 
-    return StreamingResponse(
+    return await _event_stream(
         _standard_stream(messages, col, user, conv_id, req.message, after_done=after_done, request=request,
-                         answer_incorrectly=req.answer_incorrectly,
-                         question_id=req.question_id, trigger=req.trigger, answer_choices=req.answer_choices),
-        media_type="text/event-stream",
-        headers=_SSE_HEADERS,
+                         answer_incorrectly=req.answer_incorrectly, route=route,
+                         question_id=req.question_id, trigger=req.trigger, answer_choices=req.answer_choices,
+                         cache_key=cache_key, cache_col=cache_col, endpoint="followup", flight_key=flight_key),
+        request, req, user, streams,
     )
 
 
@@ -459,50 +1396,52 @@ async def followup_quiz_chat(
 async def chat_with_embedded_links(
     req: ChatRequest,
     request: Request,
-    user: UserPublic = Depends(get_current_user),
+    user: SessionUser = Depends(get_session_user),
 ):
     if not _UF_API_KEY:
         raise HTTPException(status_code=500, detail="Backend missing UF_OPENAI_API_KEY")
+    resumed = _resumed_stream(request, user)
+    if resumed is not None:
+        return resumed
 
     conv_id = req.conversation_id or str(uuid.uuid4())
-    history = await asyncio.to_thread(get_last_exchange, request.app.state.messages, conv_id)
-
-    system_instruction = (
-        _build_system_instruction(
-            answer_incorrectly=req.answer_incorrectly,
-            has_choices=len(req.answer_choices) > 0,
-        ) +
-        " Use web searches to gather information and cite sources inline."
-        #" Prioritize academic and institutional sources; avoid blog posts, news articles, or unverifiable sources."
-        #" Prefer sources with stable, long-lived URLs."
+    history = await _history_for(req, "links", request.app.state.messages, conv_id)
+
+    system_instruction = _links_system_instruction(req.answer_incorrectly, len(req.answer_choices) > 0)
+
+    # External web search disabled — citations come from DB links only.
+    # To re-enable: uncomment _run_search/_filter_valid_urls imports and restore
+    # the lines below (inside generate(), so a search failure is an error event).
+    # try:
+    #     raw_web = await _run_search(req.message)
+    # except Exception as e:
+    #     yield _sse({"type": "error", "detail": f"Search failed: {e}"})
+    #     return
+
+    curated = _curated_links(getattr(request.app.state, "knowledge_links", []))
+    augmented_messages, citations = _build_search_context(
+        _build_standard_messages(history, req.message, system_prompt=system_instruction),
+        curated,  # was: curated + raw_web
+    )
+    route = model_router.route("answer")
+    cache_key, cache_col = _cache_target(request, "links", augmented_messages, route, req.answer_incorrectly)
+    flight_key = _flight_key("links", augmented_messages, route, req.answer_incorrectly)
+    streams = await _upstream_streams_needed(
+        user.id, req.answer_incorrectly, [(augmented_messages, route, (cache_key, cache_col), flight_key)],
     )
 
     async def generate() -> AsyncGenerator[str, None]:
-        # External web search disabled — citations come from DB links only.
-        # To re-enable: uncomment _run_search/_filter_valid_urls imports and restore lines below.
-        # try:
-        #     raw_web = await _run_search(req.message)
-        # except Exception as e:
-        #     yield _sse({"type": "error", "detail": f"Search failed: {e}"})
-        #     return
-
-        curated = [
-            {"title": l.get("title", ""), "url": l.get("url", ""), "snippet": l.get("description", "")}
-            for l in getattr(request.app.state, "knowledge_links", [])
-            if l.get("url")
-        ]
-        augmented_messages, citations = _build_search_context(
-            _build_standard_messages(history, req.message, system_prompt=system_instruction),
-            curated,  # was: curated + raw_web
-        )
-
         # validation_task = asyncio.create_task(_filter_valid_urls(raw_web))  # disabled with search
 
         if citations:
             yield _sse({"type": "citations", "citations": citations})
 
         full_reply = ""
-        async for is_error, delta, sse in _stream_agent_tokens(augmented_messages):
+        meter = ReplyMeter()
+        async for is_error, delta, sse in _stream_agent_tokens(
+            augmented_messages, route=route, cache_key=cache_key, cache_col=cache_col, flight_key=flight_key,
+            user_id=user.id, answer_incorrectly=req.answer_incorrectly, meter=meter,
+        ):
             yield sse
             if is_error:
                 # validation_task.cancel()  # disabled with search
@@ -515,13 +1454,13 @@ async def chat_with_embedded_links(
 
         stored_reply = _inject_citation_links(full_reply, citations) if citations else full_reply
         stated = {"default": detect_stated_choice(full_reply, req.answer_choices)} if req.answer_choices else None
-        metadata = AIMessageMetadata(answer_incorrectly=req.answer_incorrectly, stated_choice_id=stated).model_dump(exclude_none=True)
+        metadata = _reply_metadata("links", user, req.answer_incorrectly, stated, meter.metadata())
         await _save_exchange(request.app.state.messages, user, conv_id, req.message, [stored_reply], assistant_metadata=metadata,
                               question_id=req.question_id, trigger=req.trigger)
 
         yield _sse({"type": "done", "conversation_id": conv_id, "reply": stored_reply})
 
-    return StreamingResponse(generate(), media_type="text/event-stream", headers=_SSE_HEADERS)
+    return await _event_stream(generate(), request, req, user, streams)
 
 
 # Default behavior
@@ -530,37 +1469,51 @@ async def chat(
     quiz_id: str,
     req: ChatRequest,
     request: Request,
-    user: UserPublic = Depends(get_current_user),
+    user: SessionUser = Depends(get_session_user),
 ):
     if not _UF_API_KEY:
         raise HTTPException(status_code=500, detail="Backend missing UF_OPENAI_API_KEY")
+    resumed = _resumed_stream(request, user)
+    if resumed is not None:
+        return resumed
 
     conv_id = req.conversation_id or str(uuid.uuid4())
-    history = await asyncio.to_thread(get_last_exchange, request.app.state.messages, conv_id)
     col = request.app.state.messages
+    history = await _history_for(req, "default", col, conv_id)
     system_instruction = _build_system_instruction(
         answer_incorrectly=req.answer_incorrectly,
         has_choices=len(req.answer_choices) > 0,
     )
     messages = _build_standard_messages(history, req.message, system_prompt=system_instruction)
+    route = model_router.route("answer")
+    cache_key, cache_col = _cache_target(request, "default", messages, route, req.answer_incorrectly)
+    flight_key = _flight_key("default", messages, route, req.answer_incorrectly)
+    streams = await _upstream_streams_needed(
+        user.id, req.answer_incorrectly, [(messages, route, (cache_key, cache_col), flight_key)],
+    )
 
-    return StreamingResponse(
-        _standard_stream(messages, col, user, conv_id, req.message, answer_incorrectly=req.answer_incorrectly,
-                         question_id=req.question_id, trigger=req.trigger, answer_choices=req.answer_choices),
-        media_type="text/event-stream",
-        headers=_SSE_HEADERS,
+    return await _event_stream(
+        _standard_stream(messages, col, user, conv_id, req.message, answer_incorrectly=req.answer_incorrectly, route=route,
+                         question_id=req.question_id, trigger=req.trigger, answer_choices=req.answer_choices,
+                         cache_key=cache_key, cache_col=cache_col, flight_key=flight_key),
+        request, req, user, streams,
     )
 
 
+def _read_conversation(col, conversation_id: str) -> list[dict]:
+    message_writer.wait_written(conversation_id)
+    return fetch_conversation_history(col, conversation_id)
+
+
 @router.get("/chat/get_history/{conversation_id}", response_model=ConversationHistoryResponse)
 async def get_conversation_history(
     conversation_id: str,
     request: Request,
-    user: UserPublic = Depends(get_current_user),
+    user: SessionUser = Depends(get_session_user),
 ):
     try:
         # OPTIMIZATION: Non-blocking DB read
-        docs = await asyncio.to_thread(fetch_conversation_history, request.app.state.messages, conversation_id)
+        docs = await asyncio.to_thread(_read_conversation, request.app.state.messages, conversation_id)
 
         if not docs:
             return ConversationHistoryResponse(conversation_id=conversation_id, messages=[])
@@ -606,10 +1559,10 @@ async def get_conversation_history(
 async def load_user_history(
     conversation_id: str,
     request: Request,
-    user: UserPublic = Depends(get_current_user),
+    user: SessionUser = Depends(get_session_user),
 ):
     # OPTIMIZATION: Non-blocking DB read
-    all_docs = await asyncio.to_thread(fetch_conversation_history, request.app.state.messages, conversation_id)
+    all_docs = await asyncio.to_thread(_read_conversation, request.app.state.messages, conversation_id)
     
     if not all_docs:
         return UserConversationHistoryResponse(conversation_id=conversation_id, messages=[])
@@ -6,6 +6,7 @@ from typing import Optional, List
 from datetime import datetime
 from ..schemas.user import UserPublic
 from .auth import get_current_user
+from ..services.user_cache import user_cache
 
 router = APIRouter(prefix="/demographics", tags=["demographics"])
 
@@ -43,6 +44,8 @@ def save_my_demographics(
         },
     )
 
+    user_cache.invalidate_id(user.id)
+
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -0,0 +1,99 @@
+# backend/app/api/enrollment.py
+import asyncio
+import json
+from collections import Counter
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+
+from ..core.security import hash_passwords_async
+from ..schemas.enrollment import RosterRequest
+from ..schemas.user import UserPublic
+from ..api.auth import get_current_user
+from ..services.users import get_users_collection, ensure_indexes
+from ..services.enrollment import (
+    parse_roster_csv,
+    validate_roster,
+    find_existing_emails,
+    insert_roster,
+)
+
+router = APIRouter(prefix="/enrollment", tags=["enrollment"])
+
+MAX_ROSTER_ROWS = 2000
+
+
+def require_admin(user: UserPublic = Depends(get_current_user)) -> UserPublic:
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
+
+
+async def _read_roster(request: Request) -> list[dict]:
+    content_type = request.headers.get("content-type", "")
+    body = await request.body()
+    if "csv" in content_type or content_type.startswith("text/plain"):
+        try:
+            return parse_roster_csv(body.decode("utf-8"))
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="Roster CSV must be UTF-8")
+    try:
+        return RosterRequest(**json.loads(body)).rows
+    except (ValueError, TypeError, ValidationError):
+        raise HTTPException(
+            status_code=400,
+            detail='Expected a JSON body {"rows": [...]} or a text/csv roster',
+        )
+
+
+def _line(record: dict) -> str:
+    return json.dumps(record) + "\n"
+
+
+async def _enroll(users, rows: list[dict], enrolled_by: str):
+    counts: Counter = Counter()
+
+    valid, rejected = validate_roster(rows)
+    for record in rejected:
+        counts[record["status"]] += 1
+        yield _line(record)
+
+    existing = await asyncio.to_thread(
+        find_existing_emails, users, [row.email for _, row in valid]
+    )
+    pending = []
+    for n, row in valid:
+        if row.email.lower() in existing:
+            counts["exists"] += 1
+            yield _line({"row": n, "email": row.email.lower(), "status": "exists"})
+        else:
+            pending.append((n, row))
+
+    hashes = await hash_passwords_async([row.password for _, row in pending])
+    for record in await asyncio.to_thread(insert_roster, users, pending, hashes, enrolled_by):
+        counts[record["status"]] += 1
+        yield _line(record)
+
+    yield _line({"summary": {"total": len(rows), **counts}})
+
+
+# Accepts {"rows": [{first_name, last_name, email, password}, ...]} as JSON or
+# the same columns as text/csv with a header line. Streams one NDJSON result
+# per row (created / exists / duplicate_in_roster / invalid / error) and a
+# final {"summary": {...}} line.
+@router.post("/roster")
+async def enroll_roster(request: Request, user: UserPublic = Depends(require_admin)):
+    rows = await _read_roster(request)
+    if not rows:
+        raise HTTPException(status_code=400, detail="Roster is empty")
+    if len(rows) > MAX_ROSTER_ROWS:
+        raise HTTPException(
+            status_code=413, detail=f"Roster exceeds {MAX_ROSTER_ROWS} rows; split it up"
+        )
+
+    users = get_users_collection(request.app.state.db)
+    await asyncio.to_thread(ensure_indexes, users)
+    return StreamingResponse(
+        _enroll(users, rows, user.email), media_type="application/x-ndjson"
+    )
@@ -0,0 +1,51 @@
+# backend/app/api/metrics.py
+from fastapi import APIRouter, Depends, HTTPException
+
+from ..schemas.user import UserPublic
+from .auth import get_current_user
+from ..core.security import token_memo
+from ..services.user_cache import user_cache, session_versions
+from ..services.heartbeats import heartbeats
+from ..services.llm_cache import llm_cache
+from ..services.speculation import speculation
+from ..services.history_cache import history_cache
+from ..services.message_writer import message_writer
+from ..services.llm_gate import llm_gate
+from ..services.upstream_stats import upstream_stats
+from ..services.reply_metrics import reply_latency
+from ..services.stream_replay import stream_replay
+from ..services.idempotency import idempotency
+from ..services.single_flight import single_flight
+from ..services.upstream_deadlines import upstream_deadlines
+from ..services.model_routes import model_router
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+def require_admin(user: UserPublic = Depends(get_current_user)) -> UserPublic:
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
+
+
+# In-process counters only — each uvicorn worker reports its own numbers.
+@router.get("")
+def get_metrics(user: UserPublic = Depends(require_admin)):
+    return {
+        "user_cache": user_cache.stats(),
+        "session_versions": session_versions.stats(),
+        "heartbeats": heartbeats.stats(),
+        "token_memo": token_memo.stats(),
+        "llm_cache": llm_cache.stats(),
+        "speculation": speculation.stats(),
+        "history_cache": history_cache.stats(),
+        "message_writer": message_writer.stats(),
+        "llm_gate": llm_gate.stats(),
+        "upstream": upstream_stats.stats(),
+        "reply_latency": reply_latency.stats(),
+        "stream_replay": stream_replay.stats(),
+        "idempotency": idempotency.stats(),
+        "single_flight": single_flight.stats(),
+        "upstream_deadlines": upstream_deadlines.stats(),
+        "model_routes": model_router.stats(),
+    }
@@ -1,7 +1,7 @@
 # backend/app/api/quiz.py
-from fastapi import APIRouter, Depends, Request, HTTPException
-from ..schemas.user import UserPublic
-from .auth import get_current_user
+from fastapi import APIRouter, BackgroundTasks, Depends, Request, HTTPException
+from ..schemas.user import UserPublic, SessionUser
+from .auth import get_current_user, get_session_user
 from ..schemas.quiz import QuizStateResponse, SubmitAnswerRequest, QuizResultsResponse
 from ..services.quiz import (
     _load_or_create_attempt,
@@ -11,6 +11,8 @@ from ..services.quiz import (
     reset_quiz_attempt,
     get_quiz_results,
 )
+from ..services.speculation import speculation
+from .chat import speculate_first_turn
 
 #TODO: ensure quiz_id is valid - either in this file before querying responses or in services/quiz.py functions
 # Doing in this file is a bit more organized but doing it from services avoids doing an additional mongoDB request
@@ -23,7 +25,11 @@ def require_admin(user: UserPublic = Depends(get_current_user)) -> UserPublic:
     return user
 
 @router.get("/state", response_model=QuizStateResponse)
-def get_quiz_state(request: Request, user: UserPublic = Depends(get_current_user)):
+def get_quiz_state(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    user: SessionUser = Depends(get_session_user),
+):
     db = request.app.state.db
     quiz_id = request.path_params["quiz_id"]
     attempt_doc = _load_or_create_attempt(db, user.id, user.email, quiz_id)
@@ -41,13 +47,25 @@ def get_quiz_state(request: Request, user: UserPublic = Depends(get_current_user
         # rebuild state from updated doc
         state = build_quiz_state_response(db, attempt_doc)
 
+    question = state.current_question
+    if speculation.enabled and question is not None:
+        background_tasks.add_task(
+            speculate_first_turn,
+            request.app,
+            user.id,
+            quiz_id,
+            question.model_dump(),
+            question.id in state.attempt.incorrect_question_ids,
+            not any(a.get("answered_at") for a in attempt_doc.get("answers", [])),
+        )
+
     return state
 
 @router.post("/answer", response_model=QuizStateResponse)
 def submit_quiz_answer(
     data: SubmitAnswerRequest,
     request: Request,
-    user: UserPublic = Depends(get_current_user),
+    user: SessionUser = Depends(get_session_user),
 ):
     db = request.app.state.db
     quiz_id = request.path_params["quiz_id"]
@@ -11,11 +11,169 @@ class Settings:
     JWT_ALG: str = os.getenv("JWT_ALG", "HS256")
     JWT_EXPIRES_MIN: int = int(os.getenv("JWT_EXPIRES_MIN", "180"))  # 3 hours
 
+    # Embed id/is_admin/assigned_var/session_version in the JWT so hot endpoints
+    # can skip the users lookup. session_version is re-checked against Mongo at
+    # most once per SESSION_VERSION_CHECK_SECONDS per user per process.
+    SESSION_CLAIMS_ENABLED: bool = os.getenv("SESSION_CLAIMS_ENABLED", "").lower() in {"1","true","yes"}
+    SESSION_VERSION_CHECK_SECONDS: int = int(os.getenv("SESSION_VERSION_CHECK_SECONDS", "60"))
+
+    # Sliding sessions: once a token has used this fraction of its lifetime the
+    # next authenticated request reissues the cookie, so only real inactivity
+    # (longer than JWT_EXPIRES_MIN) forces a fresh login. 0 disables.
+    SESSION_RENEW_AFTER_FRACTION: float = float(os.getenv("SESSION_RENEW_AFTER_FRACTION", "0.5"))
+
+    # Per-process LRU of already-verified session tokens (see decode_token). 0 disables.
+    JWT_MEMO_MAX_ENTRIES: int = int(os.getenv("JWT_MEMO_MAX_ENTRIES", "4096"))
+
     COOKIE_NAME: str = os.getenv("COOKIE_NAME", "session")
     COOKIE_SECURE: bool = os.getenv("COOKIE_SECURE", "").lower() in {"1","true","yes"}  # True in prod
     COOKIE_DOMAIN: str | None = os.getenv("COOKIE_DOMAIN") or None  # optional
     SAMESITE: str = os.getenv("COOKIE_SAMESITE", "Lax")  # "None" for cross-site in prod if needed
 
+    # argon2 cost parameters; 0 keeps passlib's default. Size them for the host
+    # with `python -m scripts.calibrate_argon2`. Existing hashes are upgraded
+    # transparently on the user's next successful login.
+    ARGON2_TIME_COST: int = int(os.getenv("ARGON2_TIME_COST", "0"))
+    ARGON2_MEMORY_COST: int = int(os.getenv("ARGON2_MEMORY_COST", "0"))  # KiB
+    ARGON2_PARALLELISM: int = int(os.getenv("ARGON2_PARALLELISM", "0"))
+
+    # Dedicated argon2 pool for login/signup/change-password. 0 = min(4, cpu count).
+    # Requests beyond workers + queue limit get 503 with Retry-After.
+    HASH_WORKERS: int = int(os.getenv("HASH_WORKERS", "0"))
+    HASH_QUEUE_LIMIT: int = int(os.getenv("HASH_QUEUE_LIMIT", "32"))
+    HASH_RETRY_AFTER_SECONDS: int = int(os.getenv("HASH_RETRY_AFTER_SECONDS", "2"))
+
+    # Per-process cache of user documents used by get_current_user. 0 disables.
+    USER_CACHE_TTL_SECONDS: int = int(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+    USER_CACHE_MAX_ENTRIES: int = int(os.getenv("USER_CACHE_MAX_ENTRIES", "2000"))
+
+    # How often buffered last_active_at heartbeats are written as one bulk_write.
+    HEARTBEAT_FLUSH_SECONDS: int = int(os.getenv("HEARTBEAT_FLUSH_SECONDS", "15"))
+
+    # Signup round-robin numbers reserved per counters $inc (rounded up to a
+    # multiple of the number of variants so each block stays balanced).
+    SIGNUP_SEQ_BLOCK_SIZE: int = int(os.getenv("SIGNUP_SEQ_BLOCK_SIZE", "48"))
+
+    # Per-conversation cache of the prompt history window (first exchange +
+    # last 3), written through on every saved exchange. Bounded by the bytes
+    # of message text held. Per-process: with HISTORY_CACHE_CHECK_LATEST each
+    # turn first reads the conversation's newest message time from Mongo (one
+    # indexed query) so turns saved by other workers aren't missed. Only needed
+    # with more than one worker or instance, so it defaults to on when
+    # WEB_CONCURRENCY (uvicorn's worker count) is above 1; without it a cached
+    # window is trusted until HISTORY_CACHE_TTL_SECONDS.
+    HISTORY_CACHE_MAX_BYTES: int = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+    HISTORY_CACHE_TTL_SECONDS: int = int(os.getenv("HISTORY_CACHE_TTL_SECONDS", "1800"))
+    HISTORY_CACHE_CHECK_LATEST: bool = os.getenv(
+        "HISTORY_CACHE_CHECK_LATEST", "true" if int(os.getenv("WEB_CONCURRENCY", "1")) > 1 else "",
+    ).lower() in {"1","true","yes"}
+
+    # Chat exchanges are written by a background thread (batched insert_many)
+    # so the done event doesn't wait on Mongo. Batches that can't be written
+    # are appended to MESSAGE_SPOOL_PATH and replayed on the next startup.
+    MESSAGE_WRITE_BEHIND: bool = os.getenv("MESSAGE_WRITE_BEHIND", "true").lower() in {"1","true","yes"}
+    MESSAGE_WRITE_BATCH: int = int(os.getenv("MESSAGE_WRITE_BATCH", "200"))  # exchanges per insert_many
+    MESSAGE_SPOOL_PATH: str = os.getenv("MESSAGE_SPOOL_PATH", "message_spool.jsonl")
+
+    # Admission control for upstream chat completions (per process): at most
+    # LLM_MAX_CONCURRENT streams, LLM_MAX_PER_USER of them for one user, and
+    # LLM_QUEUE_LIMIT waiting (served round-robin across users) before chat
+    # requests get 429 with Retry-After. LLM_MAX_CONCURRENT=0 disables the gate.
+    LLM_MAX_CONCURRENT: int = int(os.getenv("LLM_MAX_CONCURRENT", "32"))
+    LLM_MAX_PER_USER: int = int(os.getenv("LLM_MAX_PER_USER", "2"))
+    LLM_QUEUE_LIMIT: int = int(os.getenv("LLM_QUEUE_LIMIT", "64"))
+    LLM_RETRY_AFTER_SECONDS: int = int(os.getenv("LLM_RETRY_AFTER_SECONDS", "5"))
+
+    # Per-phase deadlines for upstream chat streams, tighter than the client's
+    # 60s timeout: LLM_TTFT_TIMEOUT_SECONDS for the first token,
+    # LLM_IDLE_TIMEOUT_SECONDS between later ones (0 disables either). With
+    # LLM_HEDGE_ENABLED, a stream with no token by the p95 upstream TTFT (at
+    # least LLM_HEDGE_MIN_MS) gets a second request if an llm_gate slot is
+    # free, and whichever answers first is kept. Off by default since hedges
+    # cost upstream tokens; see hedge_rate under /metrics.
+    LLM_TTFT_TIMEOUT_SECONDS: float = float(os.getenv("LLM_TTFT_TIMEOUT_SECONDS", "20"))
+    LLM_IDLE_TIMEOUT_SECONDS: float = float(os.getenv("LLM_IDLE_TIMEOUT_SECONDS", "15"))
+    LLM_HEDGE_ENABLED: bool = os.getenv("LLM_HEDGE_ENABLED", "").lower() in {"1","true","yes"}
+    LLM_HEDGE_MIN_MS: int = int(os.getenv("LLM_HEDGE_MIN_MS", "1000"))
+
+    # Token deltas are merged into one SSE frame per SSE_COALESCE_MS window or
+    # SSE_COALESCE_BYTES of text, whichever fills first. 0 disables either limit;
+    # both 0 sends one frame per upstream delta.
+    SSE_COALESCE_MS: int = int(os.getenv("SSE_COALESCE_MS", "30"))
+    SSE_COALESCE_BYTES: int = int(os.getenv("SSE_COALESCE_BYTES", "256"))
+
+    # Ask upstream for a usage block at the end of each streamed reply
+    # (stream_options.include_usage) so assistant messages record real token
+    # counts. Turn off for proxies that reject stream_options.
+    LLM_STREAM_USAGE: bool = os.getenv("LLM_STREAM_USAGE", "true").lower() in {"1","true","yes"}
+
+    # Chat SSE events carry ids so a client that reconnects with Last-Event-ID
+    # reattaches to the reply still generating, or replays a finished one for
+    # STREAM_REPLAY_TTL_SECONDS, instead of starting a new upstream call. Up to
+    # STREAM_REPLAY_MAX_EVENTS frames are buffered per reply. A reply nobody is
+    # reading is cancelled after STREAM_RESUME_GRACE_SECONDS (0 = on disconnect).
+    # STREAM_REPLAY_MAX_STREAMS=0 disables resuming.
+    STREAM_REPLAY_MAX_STREAMS: int = int(os.getenv("STREAM_REPLAY_MAX_STREAMS", "1000"))
+    STREAM_REPLAY_MAX_EVENTS: int = int(os.getenv("STREAM_REPLAY_MAX_EVENTS", "2000"))
+    STREAM_REPLAY_TTL_SECONDS: int = int(os.getenv("STREAM_REPLAY_TTL_SECONDS", "60"))
+    STREAM_RESUME_GRACE_SECONDS: float = float(os.getenv("STREAM_RESUME_GRACE_SECONDS", "10"))
+
+    # Chat POSTs carrying an Idempotency-Key header (or client_message_id) are
+    # deduplicated: a repeat attaches to the reply in flight or replays the
+    # stored one. Keys live in the idempotency_keys collection for
+    # IDEMPOTENCY_TTL_SECONDS once the reply is done, IDEMPOTENCY_PENDING_SECONDS
+    # while it is still generating; IDEMPOTENCY_MAX_ENTRIES are kept in memory.
+    IDEMPOTENCY_ENABLED: bool = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() in {"1","true","yes"}
+    IDEMPOTENCY_TTL_SECONDS: int = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+    IDEMPOTENCY_PENDING_SECONDS: int = int(os.getenv("IDEMPOTENCY_PENDING_SECONDS", "120"))
+    IDEMPOTENCY_MAX_ENTRIES: int = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "1000"))
+
+    # Identical prompts streaming at the same time share one upstream call,
+    # fanned out to each request (each still saves its own exchange).
+    # SINGLE_FLIGHT_DISABLED_VARIANTS is a comma list of chat variants
+    # (default, followup, links, double) that need independent samples. Off by
+    # default: a joiner gets the same reply as another participant, so enabling
+    # it is a study-design decision, like the reply cache.
+    SINGLE_FLIGHT_ENABLED: bool = os.getenv("SINGLE_FLIGHT_ENABLED", "").lower() in {"1","true","yes"}
+    SINGLE_FLIGHT_DISABLED_VARIANTS: set[str] = {
+        v.strip().lower() for v in os.getenv("SINGLE_FLIGHT_DISABLED_VARIANTS", "").split(",") if v.strip()
+    }
+
+    # Exact-match cache of first-turn chat replies (memory LRU in front of the
+    # llm_cache collection). Hits are replayed as paced token events, one word
+    # every LLM_REPLAY_DELAY_MS. LLM_CACHE_DISABLED_VARIANTS is a comma list of
+    # chat variants (default, followup, links) that must always get a fresh sample.
+    # LLM_CACHE_FRESH_QUESTION_VARIANTS (off by default) lists cached variants whose
+    # automatic per-question message is sent without the earlier conversation, so it
+    # matches the pre-generated first turn for that question.
+    # Off by default: a hit replays a reply generated for another participant, so
+    # turning it on changes what a study condition sees. Set LLM_CACHE_ENABLED=true
+    # (listing any variants that must stay independent) to opt in.
+    LLM_CACHE_ENABLED: bool = os.getenv("LLM_CACHE_ENABLED", "").lower() in {"1","true","yes"}
+    LLM_CACHE_TTL_HOURS: int = int(os.getenv("LLM_CACHE_TTL_HOURS", "168"))
+    LLM_CACHE_MAX_ENTRIES: int = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "500"))
+    LLM_CACHE_DISABLED_VARIANTS: set[str] = {
+        v.strip().lower() for v in os.getenv("LLM_CACHE_DISABLED_VARIANTS", "").split(",") if v.strip()
+    }
+    LLM_CACHE_FRESH_QUESTION_VARIANTS: set[str] = {
+        v.strip().lower() for v in os.getenv("LLM_CACHE_FRESH_QUESTION_VARIANTS", "").split(",") if v.strip()
+    }
+    LLM_REPLAY_DELAY_MS: int = int(os.getenv("LLM_REPLAY_DELAY_MS", "15"))
+
+    # Per call site model routing (services/model_routes.py): a JSON object of
+    # route -> {"model", "temperature", "max_tokens"} overriding the defaults,
+    # e.g. {"followup_suggestions": {"model": "gpt-4o-mini"}}. Routes are answer,
+    # followup_suggestions, double_a, double_b, relevance_judge, page_summary.
+    LLM_ROUTES: str = os.getenv("LLM_ROUTES", "")
+
+    # Speculative first turns: showing a quiz question starts generating the
+    # reply to the participant's likely first chat message about it, kept for
+    # SPECULATION_TTL_SECONDS. Off by default since unclaimed speculations
+    # still cost upstream tokens; see payoff_rate under /metrics.
+    SPECULATION_ENABLED: bool = os.getenv("SPECULATION_ENABLED", "").lower() in {"1","true","yes"}
+    SPECULATION_MAX_IN_FLIGHT: int = int(os.getenv("SPECULATION_MAX_IN_FLIGHT", "8"))
+    SPECULATION_TTL_SECONDS: int = int(os.getenv("SPECULATION_TTL_SECONDS", "300"))
+
     # CORS / Frontend
     ALLOW_ORIGINS: list[str] = list(filter(None, [
         "http://localhost:3000",
@@ -0,0 +1,47 @@
+# backend/app/core/middleware.py
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import get_settings
+from ..api.auth import set_session_cookie
+
+
+class SessionRenewalMiddleware:
+    """Sets the session cookie that api.auth._renew_if_due left on
+    request.state.renewed_session_token.
+
+    Written as a plain ASGI middleware because the chat endpoints return
+    StreamingResponse: cookies set on an injected Response are dropped there,
+    and BaseHTTPMiddleware would buffer/wrap the stream. We only add a
+    Set-Cookie header to the response start message. If the endpoint already
+    set the session cookie itself (login, logout, change-password), it wins.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                token = scope.get("state", {}).get("renewed_session_token")
+                if token:
+                    message = _with_session_cookie(message, token)
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+def _with_session_cookie(message: Message, token: str) -> Message:
+    headers = list(message.get("headers", []))
+    prefix = get_settings().COOKIE_NAME.encode("latin-1") + b"="
+    if any(k.lower() == b"set-cookie" and v.startswith(prefix) for k, v in headers):
+        return message
+
+    carrier = Response()
+    set_session_cookie(carrier, token)
+    headers.extend((k, v) for k, v in carrier.raw_headers if k == b"set-cookie")
+    return {**message, "headers": headers}
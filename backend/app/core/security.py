@@ -1,9 +1,42 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 from .config import get_settings
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+
+
+def _argon2_options(settings) -> dict:
+    """CryptContext options for the ARGON2_* costs that are set (non-zero)."""
+    costs = {
+        "argon2__time_cost": settings.ARGON2_TIME_COST,
+        "argon2__memory_cost": settings.ARGON2_MEMORY_COST,
+        "argon2__parallelism": settings.ARGON2_PARALLELISM,
+    }
+    return {k: v for k, v in costs.items() if v}
+
+
+pwd_context = CryptContext(schemes=["argon2"], deprecated="auto", **_argon2_options(get_settings()))
+
+
+class HashingBusyError(Exception):
+    """The password-hashing queue is full. Endpoints map this to 503 + Retry-After."""
+
+
+# argon2 runs on its own small pool so a login burst can't occupy the
+# threadpool every other sync route shares. argon2-cffi releases the GIL while
+# hashing, so threads parallelise fine. _hash_slots caps in-flight + queued
+# jobs; anything beyond that is rejected up front rather than left waiting.
+_settings = get_settings()
+_HASH_WORKERS = _settings.HASH_WORKERS or min(4, os.cpu_count() or 1)
+_hash_executor = ThreadPoolExecutor(max_workers=_HASH_WORKERS, thread_name_prefix="argon2")
+_hash_slots = threading.BoundedSemaphore(_HASH_WORKERS + _settings.HASH_QUEUE_LIMIT)
 
 def hash_password(password: str) -> str:
     if not isinstance(password, str):
@@ -17,14 +50,133 @@ def verify_password(password: str, hashed: str) -> bool:
     password = password.strip()
     return pwd_context.verify(password, hashed)
 
-def create_access_token(subject: str) -> str:
-    """Create a short-lived JWT for the given subject (user id or email)."""
+def password_needs_rehash(hashed: str) -> bool:
+    """True if hashed was made with different argon2 costs than configured."""
+    return pwd_context.needs_update(hashed)
+
+
+async def _run_hashing(fn, *args):
+    if not _hash_slots.acquire(blocking=False):
+        raise HashingBusyError()
+    try:
+        future = _hash_executor.submit(fn, *args)
+    except BaseException:
+        _hash_slots.release()
+        raise
+    # Release on completion, not when the awaiting request goes away, so a
+    # cancelled request can't free a slot its hash is still occupying.
+    future.add_done_callback(lambda _: _hash_slots.release())
+    return await asyncio.wrap_future(future)
+
+
+async def hash_password_async(password: str) -> str:
+    """hash_password on the bounded hashing pool. Raises HashingBusyError."""
+    return await _run_hashing(hash_password, password)
+
+
+async def hash_passwords_async(passwords: list[str]) -> list[str]:
+    """Hash a batch (roster enrollment) on the hashing pool.
+
+    At most _HASH_WORKERS jobs are in flight at once, so a class roster never
+    takes every queue slot away from interactive logins; instead of failing
+    with HashingBusyError the batch waits for a slot to free up.
+    """
+    gate = asyncio.Semaphore(_HASH_WORKERS)
+
+    async def one(password: str) -> str:
+        async with gate:
+            while True:
+                try:
+                    return await _run_hashing(hash_password, password)
+                except HashingBusyError:
+                    await asyncio.sleep(0.05)
+
+    return list(await asyncio.gather(*(one(p) for p in passwords)))
+
+
+async def verify_password_async(password: str, hashed: str) -> bool:
+    """verify_password on the bounded hashing pool. Raises HashingBusyError."""
+    return await _run_hashing(verify_password, password, hashed)
+
+
+def create_access_token(subject: str, claims: dict | None = None) -> str:
+    """Create a short-lived JWT for the given subject (user id or email).
+
+    claims: extra private claims merged into the payload (see
+    api.auth.create_session_token). They cannot override sub/iat/exp.
+    """
     settings = get_settings()
     now = datetime.now(tz=timezone.utc)
     expire = now + timedelta(minutes=settings.JWT_EXPIRES_MIN)
-    payload = {"sub": subject, "iat": int(now.timestamp()), "exp": int(expire.timestamp())}
+    payload = dict(claims or {})
+    payload.update({"sub": subject, "iat": int(now.timestamp()), "exp": int(expire.timestamp())})
     return jwt.encode(payload, settings.JWT_SECRET, algorithm=settings.JWT_ALG)
 
+class _VerifiedTokenMemo:
+    """LRU of tokens that already passed signature/expiry checks, keyed by the
+    sha256 of the token string and dropped once the token's exp passes.
+
+    A browser resends the same session cookie on every request, so after the
+    first verification we hand back the stored payload instead of re-running
+    the HMAC and JSON parsing in python-jose. Only successful decodes are
+    stored; anything invalid is re-checked (and rejected) every time.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: bytes) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, key: bytes, payload: dict) -> None:
+        exp = payload.get("exp")
+        if self.max_entries <= 0 or not isinstance(exp, (int, float)):
+            return
+        with self._lock:
+            self._entries[key] = (float(exp), dict(payload))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else None,
+            }
+
+
+token_memo = _VerifiedTokenMemo(_settings.JWT_MEMO_MAX_ENTRIES)
+
+
 def decode_token(token: str) -> dict:
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_memo.get(key)
+    if payload is not None:
+        return payload
     settings = get_settings()
-    return jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALG])
+    payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALG])
+    token_memo.put(key, payload)
+    return payload
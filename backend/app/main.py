@@ -10,16 +10,20 @@ from .api.allowlist import router as allowlist_router
 from .api.reports import router as reports_router
 from .api.link_clicks import router as link_clicks_router
 from .api.copy_events import router as copy_events_router
+from .api.metrics import router as metrics_router
+from .api.enrollment import router as enrollment_router
 from .api import questions as questions_router
 from .api import quiz as quiz_router
 from .api import demographics as demographics_router
 from .api import surveys as surveys_router
 
 from .core.config import get_settings
+from .core.middleware import SessionRenewalMiddleware
 
 app = FastAPI()
 settings = get_settings()
 
+app.add_middleware(SessionRenewalMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.ALLOW_ORIGINS,
@@ -45,9 +49,19 @@ def _startup():
 
         db = client[MONGO_DB]
         messages = db["messages"]
-        messages.create_index([("conversation_id", ASCENDING)])
+        # Serves history assembly (services.chat.get_last_exchange) and the
+        # per-save turn count; its conversation_id prefix covers the lookups
+        # the old single-field index was for.
+        messages.create_index([("conversation_id", ASCENDING), ("role", ASCENDING), ("created_at", ASCENDING)])
         messages.create_index([("created_at", ASCENDING)])
 
+        # Put back exchanges spooled while Mongo was unreachable, then start
+        # the background writer _save_exchange queues into.
+        from .services.message_writer import message_writer
+        message_writer.replay_spool(messages)
+        if settings.MESSAGE_WRITE_BEHIND:
+            message_writer.start(messages)
+
         from .services.users import get_users_collection, ensure_indexes
         ensure_indexes(get_users_collection(db))
 
@@ -107,6 +121,12 @@ def _startup():
         from .services.copy_events import get_copy_events_collection, ensure_indexes as ensure_copy_events_indexes
         ensure_copy_events_indexes(get_copy_events_collection(db))
 
+        from .services.llm_cache import get_llm_cache_collection, ensure_indexes as ensure_llm_cache_indexes
+        ensure_llm_cache_indexes(get_llm_cache_collection(db))
+
+        from .services.idempotency import get_idempotency_collection, ensure_indexes as ensure_idempotency_indexes
+        ensure_idempotency_indexes(get_idempotency_collection(db))
+
         # Start background scheduler (last, after all caches are ready)
         from .scheduler import start_scheduler
         start_scheduler(app)
@@ -121,6 +141,17 @@ def _shutdown():
     from .scheduler import stop_scheduler
     stop_scheduler()
 
+    # Drain queued chat exchanges before the client goes away.
+    from .services.message_writer import message_writer
+    message_writer.stop()
+
+    # Final heartbeat flush — the scheduler that normally does it is gone.
+    db = getattr(app.state, "db", None)
+    if db is not None:
+        from .services.heartbeats import heartbeats
+        from .services.users import get_users_collection
+        heartbeats.flush(get_users_collection(db))
+
     client = getattr(app.state, "mongo_client", None)
     if client:
         client.close()
@@ -147,3 +178,5 @@ app.include_router(surveys_router.router)
 app.include_router(reports_router)
 app.include_router(link_clicks_router)
 app.include_router(copy_events_router)
+app.include_router(metrics_router)
+app.include_router(enrollment_router)
@@ -41,6 +41,14 @@ def run_jobs_now(app) -> None:
     print(f"[scheduler] cache reloaded: {len(app.state.knowledge_links)} READY links")
 
 
+def flush_heartbeats(app) -> None:
+    """Write buffered last_active_at heartbeats in one bulk_write."""
+    from .services.heartbeats import heartbeats
+    from .services.users import get_users_collection
+
+    heartbeats.flush(get_users_collection(app.state.db))
+
+
 def start_scheduler(app) -> None:
     global _scheduler
 
@@ -66,6 +74,16 @@ def start_scheduler(app) -> None:
             max_instances=1,
             coalesce=True,
         )
+        sched.add_job(
+            func=flush_heartbeats,
+            args=[app],
+            trigger="interval",
+            seconds=app.state.settings.HEARTBEAT_FLUSH_SECONDS,
+            id="flush_heartbeats",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
         sched.start()
         _scheduler = sched
         print(f"[scheduler] started — first run in {INITIAL_DELAY_HOURS}h, then every {interval_hours}h")
@@ -15,6 +15,7 @@ class ChatRequest(BaseModel):
     answer_choices: list[QuestionChoice] = Field(default_factory=list)
     question_id: str | None = None
     trigger: str | None = None  # "manual" | "followup_chip" | "auto_question"
+    client_message_id: str | None = None  # idempotency key when the client can't send the header
 
 
 # Returned by non-streaming chat endpoints (e.g. legacy or search-based).
@@ -0,0 +1,17 @@
+# backend/app/schemas/enrollment.py
+from typing import List
+from pydantic import BaseModel, EmailStr, Field
+
+
+# One student on a class roster. Mirrors SignupRequest minus the consent
+# checkbox — students record consent themselves on first login.
+class RosterRow(BaseModel):
+    first_name: str = Field(min_length=1)
+    last_name: str = Field(min_length=1)
+    email: EmailStr
+    password: str = Field(min_length=6)
+
+
+# JSON form of a roster upload. The same columns are accepted as text/csv.
+class RosterRequest(BaseModel):
+    rows: List[dict]
@@ -5,7 +5,8 @@ Metadata fields support future analysis and UI rendering:
 - sources: References or sources used in the response
 - confidence_score: Confidence level (0-1) of the response
 - model_version: Version of the model that generated the response
-- processing_time: Time taken to generate the response
+- processing_time_ms: Time taken to generate the response
+- ttft_ms / tokens_per_second: Streaming latency and throughput of the reply
 - tokens_used: Number of tokens used in generation
 - custom_metadata: Flexible field for any additional analysis data
 """
@@ -49,6 +50,26 @@ class AIMessageMetadata(BaseModel):
         default=None,
         description="Tokens generated in the response"
     )
+    ttft_ms: Optional[int] = Field(
+        default=None,
+        description="Time from the start of the reply (including any wait for an upstream slot) to its first token"
+    )
+    tokens_per_second: Optional[float] = Field(
+        default=None,
+        description="Output tokens per second from first token to last"
+    )
+    reply_source: Optional[str] = Field(
+        default=None,
+        description="How the reply was served: 'upstream', 'cache', 'speculation', 'single_flight' (or 'mixed' across agents)"
+    )
+    model_route: Optional[str] = Field(
+        default=None,
+        description="Routing table entry the reply was generated under, e.g. 'answer' or 'double_a' (see services/model_routes.py)"
+    )
+    agent_metrics: Optional[dict[str, dict[str, Any]]] = Field(
+        default=None,
+        description="Per-agent timing and usage for dual-agent replies, keyed 'A'/'B'"
+    )
     answer_incorrectly: Optional[bool] = Field(
         default=None,
         description="Whether the AI was instructed to answer incorrectly"
@@ -69,6 +69,17 @@ class UserPublic(BaseModel):
     survey_stage: SurveyStage = SurveyStage.pre_base
 
 
+# Identity carried in a claims-bearing session token (see create_session_token).
+# Hot endpoints authorize from this without reading the users collection, so it
+# only holds fields that are stable for the life of a session.
+class SessionUser(BaseModel):
+    id: str
+    email: EmailStr
+    is_admin: bool = False
+    assigned_var: AssignedVar = AssignedVar.followup
+    session_version: int = 0
+
+
 # Full document shape as stored in MongoDB, including all study-progress flags.
 # Used internally when reading from the users collection.
 class UserDBDoc(BaseModel):
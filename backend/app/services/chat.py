@@ -1,5 +1,6 @@
 # backend/app/services/chat.py
 import re
+from datetime import datetime
 from typing import Optional
 from pymongo.collection import Collection
 
@@ -28,6 +29,30 @@ def _format_assistant(content) -> str:
     return content
 
 
+_AGENT_TAG = re.compile(r"^\[AGENT ([A-Z])\]")
+
+
+def agent_tags(content) -> list[str]:
+    """Agent tags ('A', 'B') of a double-mode reply, read from the '[AGENT X]'
+    prefix of each item. Stored on assistant messages as "agents" so per-agent
+    history doesn't have to regex the content."""
+    if not isinstance(content, list):
+        return []
+    return [m.group(1) for m in (_AGENT_TAG.match(c) for c in content) if m]
+
+
+def latest_user_message_at(messages_col: Collection, conv_id: str) -> Optional[datetime]:
+    """created_at of the conversation's newest user message, or None. Served
+    from the (conversation_id, role, created_at) index; the history window
+    cache compares it with what it holds."""
+    doc = messages_col.find_one(
+        {"conversation_id": conv_id, "role": "user"},
+        {"_id": 0, "created_at": 1},
+        sort=[("created_at", -1)],
+    )
+    return doc.get("created_at") if doc else None
+
+
 def get_last_exchange(
     messages_col: Collection,
     conv_id: str,
@@ -42,20 +67,26 @@ def get_last_exchange(
 
     agent_prefix: if provided (e.g. '[AGENT A]'), filters and strips per-agent
     replies so each agent only sees its own history.
+
+    One projected query over the (conversation_id, role, created_at) index;
+    each reply is paired with the user message of the same turn, or for
+    messages saved before turns were recorded, the latest user message before it.
     """
-    if agent_prefix:
-        asst_query = {
-            "conversation_id": conv_id,
-            "role": "assistant",
-            "content": {"$elemMatch": {"$regex": f"^{re.escape(agent_prefix)}"}},
-        }
-    else:
-        asst_query = {"conversation_id": conv_id, "role": "assistant"}
-
-    # Fetch all assistant docs in chronological order.
-    all_asst = list(messages_col.find(asst_query, sort=[("created_at", 1)]))
-    if not all_asst:
-        return []
+    docs = list(messages_col.find(
+        {"conversation_id": conv_id, "role": {"$in": ["user", "assistant"]}},
+        {"_id": 0, "role": 1, "content": 1, "turn": 1, "agents": 1},
+        sort=[("created_at", 1)],
+    ))
+    tag_match = _AGENT_TAG.match(agent_prefix) if agent_prefix else None
+    tag = tag_match.group(1) if tag_match else None
+
+    def _in_view(doc: dict) -> bool:
+        if not agent_prefix:
+            return True
+        if tag and "agents" in doc:
+            return tag in doc["agents"]
+        content = doc["content"]
+        return isinstance(content, list) and any(c.startswith(agent_prefix) for c in content)
 
     def _extract_content(doc: dict) -> str:
         content = doc["content"]
@@ -64,41 +95,49 @@ def get_last_exchange(
             return matches[0][len(agent_prefix):].strip() if matches else _format_assistant(content)
         return _format_assistant(content)
 
-    def _user_before(asst_doc: dict) -> Optional[dict]:
-        return messages_col.find_one(
-            {
-                "conversation_id": conv_id,
-                "role": "user",
-                "created_at": {"$lt": asst_doc["created_at"]},
-            },
-            sort=[("created_at", -1)],
-        )
-
-    # Build the first exchange (contains the original quiz question).
-    first_asst = all_asst[0]
-    first_user = _user_before(first_asst)
-    if not first_user:
-        return []
-
-    first_pair = [
-        {"role": "user", "content": first_user["content"]},
-        {"role": "assistant", "content": _extract_content(first_asst)},
-    ]
+    users_by_turn = {d["turn"]: d for d in docs if d["role"] == "user" and "turn" in d}
+    exchanges: list[tuple[Optional[dict], dict]] = []
+    last_user = None
+    for doc in docs:
+        if doc["role"] == "user":
+            last_user = doc
+        elif _in_view(doc):
+            exchanges.append((users_by_turn.get(doc["turn"]) if "turn" in doc else last_user, doc))
 
-    # Build recent exchanges (skip the first one to avoid duplication).
-    recent_asst_docs = all_asst[-(recent_turns):]
-    if recent_asst_docs and recent_asst_docs[0]["_id"] == first_asst["_id"]:
-        recent_asst_docs = recent_asst_docs[1:]
+    if not exchanges or exchanges[0][0] is None:
+        return []
 
-    recent_pairs: list[dict] = []
-    for asst_doc in recent_asst_docs:
-        user_doc = _user_before(asst_doc)
-        if not user_doc:
+    # The first exchange (contains the original quiz question), then the
+    # latest recent_turns after it.
+    window = [exchanges[0], *exchanges[max(1, len(exchanges) - recent_turns):]]
+    history: list[dict] = []
+    for user_doc, asst_doc in window:
+        if user_doc is None:
             continue
-        recent_pairs.append({"role": "user", "content": user_doc["content"]})
-        recent_pairs.append({"role": "assistant", "content": _extract_content(asst_doc)})
-
-    return first_pair + recent_pairs
+        history.append({"role": "user", "content": user_doc["content"]})
+        history.append({"role": "assistant", "content": _extract_content(asst_doc)})
+    return history
+
+
+def message_field_backfill(docs: list[dict]) -> list[tuple[object, dict]]:
+    """(_id, fields) updates giving one conversation's older messages the turn
+    and agents fields _save_exchange now writes. docs: the conversation's
+    user/assistant messages sorted by created_at. A user message starts a new
+    turn; replies take the turn of the latest user message before them."""
+    updates = []
+    turn = -1
+    for doc in docs:
+        if doc["role"] == "user":
+            turn += 1
+            fields = {"turn": turn}
+        else:
+            fields = {"turn": max(turn, 0)}
+            tags = agent_tags(doc["content"])
+            if tags:
+                fields["agents"] = tags
+        if any(doc.get(k) != v for k, v in fields.items()):
+            updates.append((doc["_id"], fields))
+    return updates
 
 
 def get_conversation_history(messages_col: Collection, conv_id: str) -> list[dict]:
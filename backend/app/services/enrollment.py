@@ -0,0 +1,131 @@
+# backend/app/services/enrollment.py
+import csv
+import io
+from datetime import datetime, timezone
+from typing import Iterable
+
+from pydantic import ValidationError
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+from ..schemas.enrollment import RosterRow
+from .user_cache import user_cache
+from .users import new_user_doc, signup_sequence, assigned_var_for
+
+_DUPLICATE_KEY = 11000
+
+
+def parse_roster_csv(text: str) -> list[dict]:
+    """Rows of a CSV roster with a header line (first_name,last_name,email,password).
+    Header names are matched case-insensitively; blank lines are skipped."""
+    reader = csv.DictReader(io.StringIO(text.lstrip("\ufeff")))
+    if reader.fieldnames:
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    return [
+        {k: (v or "").strip() for k, v in row.items() if k}
+        for row in reader
+        if any((v or "").strip() for v in row.values() if isinstance(v, str))
+    ]
+
+
+def validate_roster(rows: Iterable[dict]) -> tuple[list[tuple[int, RosterRow]], list[dict]]:
+    """Split raw rows into valid (row number, RosterRow) pairs and result
+    records for rows that can't be enrolled (invalid, or an email repeated
+    earlier in the same roster). Row numbers are 1-based."""
+    valid: list[tuple[int, RosterRow]] = []
+    rejected: list[dict] = []
+    seen: set[str] = set()
+    for i, raw in enumerate(rows, start=1):
+        try:
+            row = RosterRow(**raw)
+        except (ValidationError, TypeError) as e:
+            errors = e.errors() if isinstance(e, ValidationError) else [{"msg": str(e)}]
+            rejected.append({
+                "row": i,
+                "email": raw.get("email") if isinstance(raw, dict) else None,
+                "status": "invalid",
+                "error": "; ".join(err["msg"] for err in errors),
+            })
+            continue
+        email = row.email.lower()
+        if email in seen:
+            rejected.append({"row": i, "email": email, "status": "duplicate_in_roster"})
+            continue
+        seen.add(email)
+        valid.append((i, row))
+    return valid, rejected
+
+
+def find_existing_emails(users: Collection, emails: list[str]) -> set[str]:
+    """Which of emails already have an account — one indexed $in query."""
+    if not emails:
+        return set()
+    cursor = users.find({"email": {"$in": [e.lower() for e in emails]}}, {"email": 1})
+    return {doc["email"] for doc in cursor}
+
+
+def insert_roster(
+    users: Collection,
+    rows: list[tuple[int, RosterRow]],
+    password_hashes: list[str],
+    enrolled_by: str,
+) -> list[dict]:
+    """Create accounts for rows (already hashed, in the same order) with one
+    counter reservation and one ordered insert_many.
+
+    If an email was registered between the pre-check and the insert, the
+    ordered insert stops at that row; it is reported as "exists" and the
+    remainder is re-sent, so the results still cover every row.
+    """
+    if not rows:
+        return []
+
+    now = datetime.now(timezone.utc)
+    seqs = signup_sequence.take_many(users, len(rows))
+    docs = []
+    for (_, row), password_hash, seq in zip(rows, password_hashes, seqs):
+        doc = new_user_doc(
+            row.email, password_hash, row.first_name, row.last_name, assigned_var_for(seq), now,
+        )
+        # The admin enrolled them; the student still consents on first login.
+        doc.update({"consent": False, "consent_given_at": None, "enrolled_by": enrolled_by})
+        docs.append(doc)
+
+    results: list[dict] = []
+    start = 0
+    while start < len(docs):
+        batch = docs[start:]
+        try:
+            users.insert_many(batch, ordered=True)
+            done, failed = len(batch), None
+        except BulkWriteError as e:
+            failed = e.details["writeErrors"][0]
+            done = failed["index"]
+
+        for offset in range(done):
+            i = start + offset
+            user_cache.invalidate(docs[i]["email"])
+            results.append({
+                "row": rows[i][0],
+                "email": docs[i]["email"],
+                "status": "created",
+                "id": str(docs[i]["_id"]),
+                "assigned_var": docs[i]["assigned_var"],
+            })
+
+        if failed is None:
+            break
+        i = start + done
+        signup_sequence.give_back(seqs[i])
+        if failed.get("code") == _DUPLICATE_KEY:
+            results.append({"row": rows[i][0], "email": docs[i]["email"], "status": "exists"})
+        else:
+            results.append({
+                "row": rows[i][0],
+                "email": docs[i]["email"],
+                "status": "error",
+                "error": failed.get("errmsg", "insert failed"),
+            })
+        start = i + 1
+
+    return results
@@ -0,0 +1,108 @@
+# backend/app/services/heartbeats.py
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any
+
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+
+
+class HeartbeatBuffer:
+    """Coalesces last_active_at heartbeats in memory and writes them out as one
+    unordered bulk_write per flush, instead of an inline update_one on the
+    request path.
+
+    Only the newest timestamp per user is kept, and the flush uses $max so an
+    out-of-order flush from another worker can never move last_active_at
+    backwards. A failed flush puts its batch back to be retried next time.
+
+    The newest recorded time per user is also remembered across flushes (for
+    up to max_remembered users, least recently recorded dropped first), so
+    last_recorded() still answers the caller's debounce once the pending
+    entry has been written.
+    """
+
+    def __init__(self, max_remembered: int = 10_000):
+        self.max_remembered = max_remembered
+        self._pending: dict[Any, datetime] = {}
+        self._last: OrderedDict[Any, datetime] = OrderedDict()
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.writes = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    def record(self, user_id, at: datetime) -> None:
+        with self._lock:
+            prev = self._pending.get(user_id)
+            if prev is None or at > prev:
+                self._pending[user_id] = at
+            last = self._last.get(user_id)
+            if last is None or at > last:
+                self._last[user_id] = at
+            self._last.move_to_end(user_id)
+            while len(self._last) > self.max_remembered:
+                self._last.popitem(last=False)
+            self.recorded += 1
+
+    def pending_for(self, user_id):
+        with self._lock:
+            return self._pending.get(user_id)
+
+    def last_recorded(self, user_id):
+        """Newest heartbeat recorded for user_id by this process, flushed or
+        not, or None."""
+        with self._lock:
+            return self._pending.get(user_id) or self._last.get(user_id)
+
+    def flush(self, users: Collection) -> int:
+        """Write all pending heartbeats in one round trip. Returns ops written."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+
+        ops = [
+            UpdateOne({"_id": user_id}, {"$max": {"last_active_at": at}})
+            for user_id, at in batch.items()
+        ]
+        try:
+            users.bulk_write(ops, ordered=False)
+        except PyMongoError as e:
+            print(f"[heartbeats] flush of {len(ops)} heartbeat(s) failed, will retry: {type(e).__name__}: {e}")
+            with self._lock:
+                self.failed_flushes += 1
+                for user_id, at in batch.items():
+                    prev = self._pending.get(user_id)
+                    if prev is None or at > prev:
+                        self._pending[user_id] = at
+            return 0
+
+        with self._lock:
+            self.writes += len(ops)
+            self.flushes += 1
+        return len(ops)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pending.clear()
+            self._last.clear()
+            self.recorded = self.writes = self.flushes = self.failed_flushes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+            return {
+                "recorded": self.recorded,
+                "pending": pending,
+                "writes": self.writes,
+                "flushes": self.flushes,
+                "failed_flushes": self.failed_flushes,
+                # Each recorded heartbeat used to be its own update_one.
+                "writes_saved": self.recorded - self.writes - pending,
+            }
+
+
+heartbeats = HeartbeatBuffer()
@@ -0,0 +1,232 @@
+# backend/app/services/history_cache.py
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Optional
+
+from ..core.config import get_settings
+from .chat import _format_assistant
+
+# Rough fixed cost charged per conversation on top of its message text, so
+# entries that hold only a write counter still count against max_bytes.
+_ENTRY_OVERHEAD = 256
+
+
+class _Window:
+    """First exchange plus the latest recent_turns exchanges after it — the
+    same shape get_last_exchange builds from Mongo."""
+
+    def __init__(self, recent_turns: int, history: list[dict]):
+        self.first: Optional[list[dict]] = history[:2] or None
+        self.recent: deque = deque(
+            (history[i:i + 2] for i in range(2, len(history), 2)), maxlen=recent_turns,
+        )
+
+    def append(self, pair: list[dict]) -> None:
+        if self.first is None:
+            self.first = pair
+        else:
+            self.recent.append(pair)
+
+    def messages(self) -> list[dict]:
+        if self.first is None:
+            return []
+        return [m for pair in (self.first, *self.recent) for m in pair]
+
+    def size(self) -> int:
+        return sum(len(m["content"]) for m in self.messages())
+
+
+class _Conversation:
+    def __init__(self):
+        self.views: dict[Optional[str], _Window] = {}
+        self.writes = 0
+        self.size = 0  # accounted in HistoryWindowCache._resize
+        self.expires_at = 0.0
+        # created_at of the newest user message the views include, to compare
+        # against Mongo's (see HistoryWindowCache.lookup).
+        self.latest: Optional[datetime] = None
+
+
+class HistoryWindowCache:
+    """Per-conversation LRU of the prompt history get_last_exchange would
+    return, so steady-state chat turns skip the history queries entirely.
+
+    Each conversation keeps one window per view: None for the plain history
+    and one per agent prefix ('[AGENT A]', '[AGENT B]') for /chat/double. A
+    view is only created by fill() after a Mongo read, and _save_exchange
+    writes every completed exchange through with record(); a view that was
+    never read stays absent rather than being built from partial history.
+
+    Bounded by max_bytes of stored message text (LRU eviction). It is
+    per-process, so with several workers another one may have saved turns
+    this cache never saw. With check_latest, callers pass lookup() the
+    created_at of the conversation's newest user message in Mongo (see
+    latest_user_message_at); a conversation holding anything older is
+    dropped and re-read. That costs one indexed read per turn, so it is off
+    for a single worker, where every write goes through record(); without
+    it (latest=None) only the TTL bounds staleness. Two workers saving
+    turns in the same millisecond can still slip past the check until the
+    next write or the TTL.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float, recent_turns: int = 3, check_latest: bool = False):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.check_latest = check_latest
+        self.recent_turns = recent_turns
+        self._entries: "OrderedDict[str, _Conversation]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.ttl_seconds > 0
+
+    def lookup(
+        self, conv_id: str, agent_prefix: Optional[str] = None, latest: Optional[datetime] = None,
+    ) -> tuple[Optional[list[dict]], int]:
+        """(history, version). history is None on a miss; pass version back to
+        fill() so a write that lands during the Mongo read isn't lost. latest
+        is Mongo's newest user message time for the conversation, if read."""
+        with self._lock:
+            entry = self._live(conv_id)
+            if entry is not None and latest is not None and (entry.latest is None or latest > entry.latest):
+                # Another worker saved a turn since this window was built.
+                del self._entries[conv_id]
+                self._bytes -= entry.size
+                self.stale += 1
+                entry = None
+            view = entry.views.get(agent_prefix) if entry is not None else None
+            if view is None:
+                self.misses += 1
+                return None, entry.writes if entry is not None else 0
+            self._entries.move_to_end(conv_id)
+            self.hits += 1
+            return view.messages(), entry.writes
+
+    def fill(
+        self,
+        conv_id: str,
+        agent_prefix: Optional[str],
+        history: list[dict],
+        version: int,
+        latest: Optional[datetime] = None,
+    ) -> None:
+        """Install history read from Mongo. latest is the newest user message
+        time read before it (so a turn saved in between is seen as newer)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._live(conv_id)
+            if entry is None:
+                if version:
+                    return
+                entry = self._entries[conv_id] = _Conversation()
+                entry.expires_at = time.monotonic() + self.ttl_seconds
+            if entry.writes != version or agent_prefix in entry.views:
+                return
+            entry.views[agent_prefix] = _Window(self.recent_turns, history)
+            entry.latest = _newest(entry.latest, latest)
+            self._resize(conv_id, entry)
+
+    def record(
+        self, conv_id: str, user_message: str, assistant_reply: list, created_at: Optional[datetime] = None,
+    ) -> None:
+        """Write a saved exchange through to every loaded view it belongs to.
+        created_at is the user message's, as stored."""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._live(conv_id)
+            if entry is None:
+                # Remember the write so an in-flight fill() for this
+                # conversation doesn't install history that misses it.
+                entry = self._entries[conv_id] = _Conversation()
+            entry.writes += 1
+            entry.expires_at = time.monotonic() + self.ttl_seconds
+            entry.latest = _newest(entry.latest, created_at)
+            for prefix, view in entry.views.items():
+                content = _view_content(assistant_reply, prefix)
+                if content is not None:
+                    view.append([
+                        {"role": "user", "content": user_message},
+                        {"role": "assistant", "content": content},
+                    ])
+            self._resize(conv_id, entry)
+
+    def invalidate(self, conv_id: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(conv_id, None)
+            if entry is not None:
+                self._bytes -= entry.size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = self.stale = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "check_latest": self.check_latest,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else None,
+                "evictions": self.evictions,
+                "stale": self.stale,
+            }
+
+    def _live(self, conv_id: str) -> Optional[_Conversation]:
+        # Caller must hold self._lock.
+        entry = self._entries.get(conv_id)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            del self._entries[conv_id]
+            self._bytes -= entry.size
+            return None
+        return entry
+
+    def _resize(self, conv_id: str, entry: _Conversation) -> None:
+        # Caller must hold self._lock.
+        size = _ENTRY_OVERHEAD + sum(v.size() for v in entry.views.values())
+        self._bytes += size - entry.size
+        entry.size = size
+        self._entries.move_to_end(conv_id)
+        while self._bytes > self.max_bytes and self._entries:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old.size
+            self.evictions += 1
+
+
+def _newest(a: Optional[datetime], b: Optional[datetime]) -> Optional[datetime]:
+    if a is None or b is None:
+        return a or b
+    return max(a, b)
+
+
+def _view_content(assistant_reply: list, agent_prefix: Optional[str]) -> Optional[str]:
+    """The assistant text a view sees, mirroring get_last_exchange: agent views
+    only include replies carrying their prefix, stripped of it."""
+    if agent_prefix is None:
+        return _format_assistant(assistant_reply)
+    matches = [c for c in assistant_reply if c.startswith(agent_prefix)]
+    return matches[0][len(agent_prefix):].strip() if matches else None
+
+
+_settings = get_settings()
+history_cache = HistoryWindowCache(
+    max_bytes=_settings.HISTORY_CACHE_MAX_BYTES,
+    ttl_seconds=_settings.HISTORY_CACHE_TTL_SECONDS,
+    check_latest=_settings.HISTORY_CACHE_CHECK_LATEST,
+)
@@ -0,0 +1,199 @@
+# backend/app/services/idempotency.py
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from ..core.config import get_settings
+
+MAX_KEY_LENGTH = 200
+
+
+def get_idempotency_collection(db) -> Collection:
+    return db["idempotency_keys"]
+
+
+def ensure_indexes(col: Collection) -> None:
+    # Mongo's TTL monitor drops keys once expires_at has passed.
+    col.create_index("expires_at", expireAfterSeconds=0)
+
+
+class IdempotencyKeyReusedError(Exception):
+    """A key was sent again with a different request than the one it was
+    first used for."""
+
+
+class IdempotencyStore:
+    """Idempotency keys for chat POSTs, so a double click or a client retry
+    gets the reply that is already being generated instead of a second one.
+
+    claim() records a key as in flight, tied to the reply's stream id and a
+    fingerprint of the request; a later claim of the same key gets that
+    record back instead, or IdempotencyKeyReusedError if its fingerprint
+    differs (the key can't be used to fetch another message's reply). complete()
+    stores the reply's SSE frames once its done event went out, and
+    release() forgets a key whose reply failed so a retry can start over.
+    In-flight claims expire after pending_seconds (a worker that died
+    mid-reply doesn't block the key for long), completed ones after
+    ttl_seconds. An in-process LRU sits in front of the idempotency_keys
+    collection; without a collection (col=None) keys are per-process.
+    """
+
+    def __init__(self, enabled: bool, ttl_seconds: float, pending_seconds: float, max_entries: int):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.pending_seconds = pending_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+    def _reset_counters(self) -> None:
+        self.claimed = 0
+        self.duplicates = 0
+        self.completed = 0
+        self.released = 0
+        self.reused = 0
+
+    def claim(
+        self, col: Optional[Collection], user_id: str, key: str, stream_id: str, fingerprint: str,
+    ) -> Optional[dict]:
+        """None if the key was free and is now claimed for stream_id, else the
+        existing record: {"stream_id", "frames", "fingerprint"}; frames is
+        None while the first reply is still in flight."""
+        doc_id = f"{user_id}:{key}"
+        record = {"stream_id": stream_id, "frames": None, "fingerprint": fingerprint}
+        with self._lock:
+            existing = self._lookup(doc_id)
+            if existing is not None:
+                return self._duplicate(existing, fingerprint)
+            # Claimed in memory first so a duplicate racing us in this
+            # process sees it without waiting on Mongo.
+            self._remember(doc_id, record, self.pending_seconds)
+
+        if col is not None:
+            now = datetime.now(timezone.utc)
+            doc = {
+                "_id": doc_id, "user_id": user_id, "stream_id": stream_id, "frames": None,
+                "fingerprint": fingerprint, "created_at": now, "expires_at": now + timedelta(seconds=self.pending_seconds),
+            }
+            try:
+                existing = self._claim_stored(col, doc, now)
+            except PyMongoError as e:
+                print(f"[idempotency] claim failed, key is per-process only: {type(e).__name__}: {e}")
+            if existing is not None:
+                # Another worker has it; its record is the one to follow.
+                with self._lock:
+                    self._entries.pop(doc_id, None)
+                    return self._duplicate(existing, fingerprint)
+
+        with self._lock:
+            self.claimed += 1
+        return None
+
+    def complete(
+        self, col: Optional[Collection], user_id: str, key: str, stream_id: str, fingerprint: str, frames: list[str],
+    ) -> None:
+        doc_id = f"{user_id}:{key}"
+        record = {"stream_id": stream_id, "frames": frames, "fingerprint": fingerprint}
+        with self._lock:
+            self._remember(doc_id, record, self.ttl_seconds)
+            self.completed += 1
+        if col is None:
+            return
+        now = datetime.now(timezone.utc)
+        try:
+            col.update_one(
+                {"_id": doc_id, "stream_id": stream_id},
+                {"$set": {"frames": frames, "expires_at": now + timedelta(seconds=self.ttl_seconds)}},
+            )
+        except PyMongoError as e:
+            print(f"[idempotency] store failed: {type(e).__name__}: {e}")
+
+    def release(self, col: Optional[Collection], user_id: str, key: str, stream_id: str) -> None:
+        doc_id = f"{user_id}:{key}"
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is not None and entry[1]["stream_id"] == stream_id:
+                del self._entries[doc_id]
+            self.released += 1
+        if col is None:
+            return
+        try:
+            col.delete_one({"_id": doc_id, "stream_id": stream_id, "frames": None})
+        except PyMongoError as e:
+            print(f"[idempotency] release failed: {type(e).__name__}: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._reset_counters()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "claimed": self.claimed,
+                "duplicates": self.duplicates,
+                "completed": self.completed,
+                "released": self.released,
+                "reused": self.reused,
+            }
+
+    @staticmethod
+    def _claim_stored(col: Collection, doc: dict, now: datetime) -> Optional[dict]:
+        try:
+            col.insert_one(doc)
+            return None
+        except DuplicateKeyError:
+            pass
+        found = col.find_one({"_id": doc["_id"], "expires_at": {"$gt": now}})
+        if found is not None:
+            return {
+                "stream_id": found.get("stream_id"),
+                "frames": found.get("frames"),
+                "fingerprint": found.get("fingerprint"),
+            }
+        # Expired but not yet swept by the TTL monitor: take it over.
+        col.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+        return None
+
+    def _duplicate(self, existing: dict, fingerprint: str) -> dict:
+        # Caller must hold self._lock.
+        if existing.get("fingerprint") != fingerprint:
+            self.reused += 1
+            raise IdempotencyKeyReusedError()
+        self.duplicates += 1
+        return existing
+
+    def _lookup(self, doc_id: str) -> Optional[dict]:
+        # Caller must hold self._lock.
+        entry = self._entries.get(doc_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[doc_id]
+            return None
+        self._entries.move_to_end(doc_id)
+        return entry[1]
+
+    def _remember(self, doc_id: str, record: dict, ttl: float) -> None:
+        # Caller must hold self._lock.
+        self._entries[doc_id] = (time.monotonic() + ttl, record)
+        self._entries.move_to_end(doc_id)
+        while len(self._entries) > max(self.max_entries, 1):
+            self._entries.popitem(last=False)
+
+
+_settings = get_settings()
+idempotency = IdempotencyStore(
+    enabled=_settings.IDEMPOTENCY_ENABLED,
+    ttl_seconds=_settings.IDEMPOTENCY_TTL_SECONDS,
+    pending_seconds=_settings.IDEMPOTENCY_PENDING_SECONDS,
+    max_entries=_settings.IDEMPOTENCY_MAX_ENTRIES,
+)
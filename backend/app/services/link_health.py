@@ -1,6 +1,5 @@
 # backend/app/services/link_health.py
 import asyncio
-import os
 import re
 import time
 from datetime import datetime, timezone
@@ -11,6 +10,7 @@ import httpx
 from openai import OpenAI
 
 from .allowlist import domain_is_allowed, load_allowlist_cache
+from .model_routes import model_router
 
 PREDEFINED_TAGS = [
     "Statistical Inference & Descriptive Statistics",
@@ -214,12 +214,13 @@ def summarize_page_content(content: str, title: str, openai_client) -> str:
             "as an educational resource summary. Focus on the specific topic covered, not "
             f"the website itself. Page title: '{title}'.\n\nPage content:\n{content[:3000]}"
         )
-        model = os.getenv("UF_OPENAI_API_MODEL", "gpt-4o-mini")
+        route = model_router.route("page_summary")
+        model_router.record(route)
         resp = openai_client.chat.completions.create(
-            model=model,
+            model=route.model or "gpt-4o-mini",
             messages=[{"role": "user", "content": prompt}],
-            max_tokens=120,
-            temperature=0.3,
+            temperature=route.temperature,
+            **({"max_tokens": route.max_tokens} if route.max_tokens > 0 else {}),
         )
         return (resp.choices[0].message.content or "").strip()
     except Exception as e:
@@ -294,12 +295,13 @@ def llm_judges_relevant(
             f"Resource title: '{title}'. Description: '{description}'. "
             "Reply with only YES or NO."
         )
-        model = os.getenv("UF_OPENAI_API_MODEL", "gpt-4o-mini")
+        route = model_router.route("relevance_judge")
+        model_router.record(route)
         resp = openai_client.chat.completions.create(
-            model=model,
+            model=route.model or "gpt-4o-mini",
             messages=[{"role": "user", "content": prompt}],
-            max_tokens=5,
-            temperature=0,
+            temperature=route.temperature,
+            **({"max_tokens": route.max_tokens} if route.max_tokens > 0 else {}),
         )
         answer = (resp.choices[0].message.content or "").strip().upper()
         return answer.startswith("YES")
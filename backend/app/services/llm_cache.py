@@ -0,0 +1,223 @@
+# backend/app/services/llm_cache.py
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+
+from ..core.config import get_settings
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def get_llm_cache_collection(db) -> Collection:
+    return db["llm_cache"]
+
+
+def ensure_indexes(col: Collection) -> None:
+    # Mongo's TTL monitor drops entries once expires_at has passed.
+    col.create_index("expires_at", expireAfterSeconds=0)
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def cache_key(
+    messages: list[dict],
+    temperature: float,
+    answer_incorrectly: bool,
+    model: Optional[str],
+) -> str:
+    """Digest of everything that determines the upstream reply.
+
+    messages[0] is the system instruction, so it is covered by the messages
+    themselves; whitespace is collapsed so trivially different copies of the
+    same quiz question share an entry.
+    """
+    raw = json.dumps(
+        {
+            "messages": [{"role": m["role"], "content": _normalize(m["content"])} for m in messages],
+            "temperature": temperature,
+            "answer_incorrectly": answer_incorrectly,
+            "model": model,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    # For replies without a reported completion_tokens (LLM_STREAM_USAGE off,
+    # or served without an upstream call of their own), the usual ~4
+    # characters per token rule of thumb.
+    return max(1, len(text) // 4)
+
+
+class LLMResponseCache:
+    """Exact-match cache of completed chat replies.
+
+    An in-process LRU sits in front of the llm_cache collection, so replies
+    are shared across workers and survive restarts, while repeat hits within
+    a worker don't touch Mongo at all. Only complete, successful replies are
+    stored. Variants listed in disabled_variants (study conditions that need a
+    fresh sample per participant) never read or write the cache. Variants
+    listed in fresh_question_variants send the automatic per-question message
+    without earlier history (see starts_fresh); none do by default.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        max_entries: int,
+        ttl_seconds: float,
+        disabled_variants: set[str],
+        fresh_question_variants: Optional[set[str]] = None,
+    ):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disabled_variants = disabled_variants
+        self.fresh_question_variants = fresh_question_variants or set()
+        self._entries: "OrderedDict[str, tuple[float, str, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.saved_tokens = 0
+
+    def enabled_for(self, variant: str) -> bool:
+        return self.enabled and variant not in self.disabled_variants
+
+    def starts_fresh(self, variant: str) -> bool:
+        """Whether the automatic first message for a question is sent without
+        the earlier conversation, so it can hit the cached/pre-generated first
+        turn. Opt-in per variant, since it changes what the model sees."""
+        return self.enabled_for(variant) and variant in self.fresh_question_variants
+
+    def get(self, col: Optional[Collection], key: str) -> Optional[str]:
+        """Return the cached reply for key, or None. col may be None (memory only)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                self.saved_tokens += entry[2]
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+
+        doc = None
+        if col is not None:
+            try:
+                # Pre-generated entries (services/pregen.py) have no expires_at.
+                doc = col.find_one({
+                    "_id": key,
+                    "$or": [{"expires_at": {"$gt": datetime.now(timezone.utc)}}, {"expires_at": None}],
+                })
+            except PyMongoError as e:
+                print(f"[llm_cache] lookup failed: {type(e).__name__}: {e}")
+
+        with self._lock:
+            if doc is None:
+                self.misses += 1
+                return None
+            tokens = int(doc.get("output_tokens") or estimate_tokens(doc["reply"]))
+            self.store_hits += 1
+            self.saved_tokens += tokens
+            self._remember(key, doc["reply"], tokens)
+            return doc["reply"]
+
+    def has(self, col: Optional[Collection], key: str) -> bool:
+        """Whether get() would hit, without touching the hit/miss counters."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return True
+        if col is None:
+            return False
+        try:
+            return col.find_one({
+                "_id": key,
+                "$or": [{"expires_at": {"$gt": datetime.now(timezone.utc)}}, {"expires_at": None}],
+            }, {"_id": 1}) is not None
+        except PyMongoError as e:
+            print(f"[llm_cache] lookup failed: {type(e).__name__}: {e}")
+            return False
+
+    def put(
+        self, col: Optional[Collection], key: str, reply: str, model: Optional[str],
+        output_tokens: Optional[int] = None,
+    ) -> None:
+        """Store a completed reply. output_tokens is upstream's reported
+        completion_tokens, if any; hits count it as saved."""
+        tokens = output_tokens or estimate_tokens(reply)
+        with self._lock:
+            self._remember(key, reply, tokens)
+            self.stores += 1
+        if col is None:
+            return
+        now = datetime.now(timezone.utc)
+        try:
+            col.update_one(
+                {"_id": key},
+                {"$setOnInsert": {
+                    "reply": reply,
+                    "model": model,
+                    "output_tokens": tokens,
+                    "created_at": now,
+                    "expires_at": now + timedelta(seconds=self.ttl_seconds),
+                }},
+                upsert=True,
+            )
+        except PyMongoError as e:
+            print(f"[llm_cache] store failed: {type(e).__name__}: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.memory_hits = self.store_hits = self.misses = self.stores = self.saved_tokens = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.store_hits
+            lookups = hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "disabled_variants": sorted(self.disabled_variants),
+                "fresh_question_variants": sorted(self.fresh_question_variants),
+                "size": len(self._entries),
+                "memory_hits": self.memory_hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "hit_rate": (hits / lookups) if lookups else None,
+                "stores": self.stores,
+                "saved_tokens": self.saved_tokens,
+            }
+
+    def _remember(self, key: str, reply: str, tokens: int) -> None:
+        # Caller must hold self._lock.
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, reply, tokens)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+_settings = get_settings()
+llm_cache = LLMResponseCache(
+    enabled=_settings.LLM_CACHE_ENABLED,
+    max_entries=_settings.LLM_CACHE_MAX_ENTRIES,
+    ttl_seconds=_settings.LLM_CACHE_TTL_HOURS * 3600,
+    disabled_variants=_settings.LLM_CACHE_DISABLED_VARIANTS,
+    fresh_question_variants=_settings.LLM_CACHE_FRESH_QUESTION_VARIANTS,
+)
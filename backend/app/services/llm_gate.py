@@ -0,0 +1,250 @@
+# backend/app/services/llm_gate.py
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Optional
+
+from ..core.config import get_settings
+
+
+class LLMQueueFullError(Exception):
+    """The upstream wait queue is full. Endpoints map this to 429 + Retry-After."""
+
+
+class LLMTicket:
+    """One upstream stream's place in LLMGate: waiting, then holding a slot
+    until release(). Safe to release more than once."""
+
+    def __init__(self, gate: "LLMGate", user_key: str):
+        self.gate = gate
+        self.user_key = user_key
+        self.granted = False
+        self.released = False
+        self.enqueued_at = time.monotonic()
+        self._changed: Optional[asyncio.Future] = None
+
+    async def wait(self) -> AsyncIterator[int]:
+        """Yield this ticket's queue position whenever it changes; returns
+        once a slot is granted (immediately if it already was)."""
+        last = None
+        while not self.granted:
+            position = self.gate.position(self)
+            if position != last:
+                yield position
+                last = position
+                if self.granted:
+                    return
+            self._changed = asyncio.get_running_loop().create_future()
+            await self._changed
+
+    def release(self) -> None:
+        self.gate._release(self)
+
+    def _notify(self) -> None:
+        if self._changed is not None and not self._changed.done():
+            self._changed.set_result(None)
+
+
+class LLMGate:
+    """Admission control for upstream chat completions.
+
+    At most max_concurrent streams run against the proxy at once (per
+    process), and no user holds more than max_per_user of them — /chat/double
+    needs two. Streams beyond that wait in per-user queues that are served
+    round-robin, so one participant's burst of requests waits behind
+    everyone else's next request instead of in front of it. At most
+    max_queue streams wait in total; enqueue() raises LLMQueueFullError past
+    that. max_concurrent <= 0 disables the gate.
+
+    Only touched from the event loop, so no locking.
+    """
+
+    def __init__(self, max_concurrent: int, max_per_user: int, max_queue: int):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.active = 0
+        self._active_by_user: dict[str, int] = {}
+        self._waiting: dict[str, deque[LLMTicket]] = {}
+        self._rotation: deque[str] = deque()
+        self._reset_counters()
+
+    def _reset_counters(self) -> None:
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.abandoned = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent > 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._waiting.values())
+
+    def check(self, streams: int = 1) -> None:
+        """Raise LLMQueueFullError unless streams more tickets would be
+        admitted or queued right now. Lets an endpoint answer 429 before it
+        starts streaming; enqueue() still enforces the limit itself."""
+        if not self.enabled:
+            return
+        free = max(0, self.max_concurrent - self.active)
+        if self.waiting + max(0, streams - free) > self.max_queue:
+            self.rejected += 1
+            raise LLMQueueFullError()
+
+    def enqueue(self, user_id: Optional[str]) -> LLMTicket:
+        """A ticket for one upstream stream, granted now if a slot is free.
+        Raises LLMQueueFullError if it would have to wait and the queue is full."""
+        ticket = LLMTicket(self, user_id or "")
+        if not self.enabled:
+            ticket.granted = True
+            return ticket
+        # Waiting streams are granted as soon as a slot frees up, so a free slot
+        # with streams still waiting means those users are at max_per_user.
+        if self._can_run(ticket.user_key):
+            self._grant(ticket)
+            return ticket
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise LLMQueueFullError()
+        queue = self._waiting.get(ticket.user_key)
+        if queue is None:
+            queue = self._waiting[ticket.user_key] = deque()
+            self._rotation.append(ticket.user_key)
+        queue.append(ticket)
+        self.queued += 1
+        self._notify_waiting()
+        return ticket
+
+    def idle(self, user_id: Optional[str]) -> bool:
+        """Whether user_id could start a stream now without anyone waiting."""
+        return not self.enabled or (not self._rotation and self._can_run(user_id or ""))
+
+    def try_acquire(self, user_id: Optional[str]) -> Optional[LLMTicket]:
+        """A granted ticket if idle(user_id), else None. For background work
+        (speculation) that isn't worth queueing."""
+        if not self.idle(user_id):
+            return None
+        ticket = LLMTicket(self, user_id or "")
+        if self.enabled:
+            self._grant(ticket)
+        else:
+            ticket.granted = True
+        return ticket
+
+    def position(self, ticket: LLMTicket) -> int:
+        """1-based estimate of how many grants away ticket is, assuming the
+        queues stay as they are (round-robin, ignoring per-user caps)."""
+        queue = self._waiting.get(ticket.user_key)
+        if not queue or ticket not in queue:
+            return 0
+        index = queue.index(ticket)
+        ahead = 0
+        before = True
+        for key in self._rotation:
+            if key == ticket.user_key:
+                before = False
+                continue
+            ahead += min(len(self._waiting[key]), index + (1 if before else 0))
+        return ahead + index + 1
+
+    def clear(self) -> None:
+        self._waiting.clear()
+        self._rotation.clear()
+        self._active_by_user.clear()
+        self.active = 0
+        self._reset_counters()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "max_concurrent": self.max_concurrent,
+            "max_per_user": self.max_per_user,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "waiting_users": len(self._rotation),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "abandoned": self.abandoned,
+            "avg_wait_ms": (self.wait_seconds * 1000 / self.queued) if self.queued else None,
+            "max_wait_ms": self.max_wait_seconds * 1000,
+        }
+
+    def _can_run(self, user_key: str) -> bool:
+        return (
+            self.active < self.max_concurrent
+            and (self.max_per_user <= 0 or self._active_by_user.get(user_key, 0) < self.max_per_user)
+        )
+
+    def _grant(self, ticket: LLMTicket) -> None:
+        ticket.granted = True
+        self.active += 1
+        self._active_by_user[ticket.user_key] = self._active_by_user.get(ticket.user_key, 0) + 1
+        self.admitted += 1
+
+    def _release(self, ticket: LLMTicket) -> None:
+        if ticket.released or not self.enabled:
+            ticket.released = True
+            return
+        ticket.released = True
+        if not ticket.granted:
+            # Gave up while waiting (client disconnected).
+            queue = self._waiting.get(ticket.user_key)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                self.abandoned += 1
+                if not queue:
+                    del self._waiting[ticket.user_key]
+                    self._rotation.remove(ticket.user_key)
+            self._notify_waiting()
+            return
+        self.active = max(0, self.active - 1)
+        held = self._active_by_user.get(ticket.user_key, 0) - 1
+        if held > 0:
+            self._active_by_user[ticket.user_key] = held
+        else:
+            self._active_by_user.pop(ticket.user_key, None)
+        self._grant_waiting()
+
+    def _grant_waiting(self) -> None:
+        granted = False
+        while self._rotation and self.active < self.max_concurrent:
+            for _ in range(len(self._rotation)):
+                key = self._rotation[0]
+                self._rotation.rotate(-1)
+                if self._can_run(key):
+                    break
+            else:
+                break  # every waiting user is at max_per_user
+            queue = self._waiting[key]
+            ticket = queue.popleft()
+            if not queue:
+                del self._waiting[key]
+                self._rotation.remove(key)
+            waited = time.monotonic() - ticket.enqueued_at
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self._grant(ticket)
+            ticket._notify()
+            granted = True
+        if granted:
+            self._notify_waiting()
+
+    def _notify_waiting(self) -> None:
+        for queue in self._waiting.values():
+            for ticket in queue:
+                ticket._notify()
+
+
+_settings = get_settings()
+llm_gate = LLMGate(
+    max_concurrent=_settings.LLM_MAX_CONCURRENT,
+    max_per_user=_settings.LLM_MAX_PER_USER,
+    max_queue=_settings.LLM_QUEUE_LIMIT,
+)
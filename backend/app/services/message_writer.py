@@ -0,0 +1,332 @@
+# backend/app/services/message_writer.py
+import os
+import threading
+from collections import Counter
+from typing import Optional
+
+from bson import ObjectId, json_util
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from ..core.config import get_settings
+
+_DUPLICATE_KEY = 11000
+_REPLAY_CHUNK = 1000
+
+
+class MessageWriteBehind:
+    """Background writer for chat exchanges, so a reply's done event doesn't
+    wait on Mongo.
+
+    _save_exchange enqueues the (user, assistant) document pair and returns;
+    a single writer thread drains everything queued by all in-flight streams
+    into one ordered insert_many, so the user message of an exchange is
+    always inserted before its reply. Both documents get their _id at enqueue
+    time, which makes retries and spool replays idempotent (duplicate keys
+    are skipped). The turn index is assigned per batch from one $group count.
+
+    If Mongo is unreachable the batch is appended to spool_path (one extended
+    JSON document per line) instead of being lost; replay_spool() re-inserts
+    it on startup, and the writer retries it after its next batch that
+    doesn't fail. Spooled exchanges carry no turn: replay_spool() assigns it
+    when they go back in, and until then later exchanges of the same
+    conversations are spooled behind them, so turns stay unique and in order.
+    The queue itself is only in memory: stop() drains it on a graceful
+    shutdown, but whatever is queued when the process is killed is lost.
+    Readers that need their own writes (history assembly) call wait_written().
+    """
+
+    def __init__(self, spool_path: str, max_batch: int):
+        self.spool_path = spool_path
+        self.max_batch = max_batch
+        self._pending: list[tuple[dict, dict]] = []
+        self._unwritten: Counter = Counter()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._col: Optional[Collection] = None
+        self._stopping = False
+        self._spool_lock = threading.Lock()
+        self._held: set[str] = set()  # conversations with spooled exchanges
+        self._reset_counters()
+
+    def _reset_counters(self) -> None:
+        self.enqueued = 0
+        self.inserted = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.spooled = 0
+        self.replayed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, col: Collection) -> None:
+        with self._cond:
+            if self.running:
+                return
+            self._col = col
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Write out everything still queued, then stop the thread."""
+        with self._cond:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def enqueue(self, user_doc: dict, assistant_doc: dict) -> None:
+        user_doc.setdefault("_id", ObjectId())
+        assistant_doc.setdefault("_id", ObjectId())
+        with self._cond:
+            self._pending.append((user_doc, assistant_doc))
+            self._unwritten[user_doc["conversation_id"]] += 1
+            self.enqueued += 1
+            self._cond.notify_all()
+
+    def wait_written(self, conv_id: str, timeout: float = 5.0) -> bool:
+        """Block until nothing for conv_id is waiting to be written (inserted
+        or spooled). Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._unwritten.get(conv_id), timeout)
+
+    def flush(self) -> int:
+        """Write up to max_batch queued exchanges. Returns documents inserted."""
+        with self._cond:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if not batch:
+            return 0
+        inserted = self._write(batch)
+        with self._cond:
+            for user_doc, _ in batch:
+                conv_id = user_doc["conversation_id"]
+                self._unwritten[conv_id] -= 1
+                if self._unwritten[conv_id] <= 0:
+                    del self._unwritten[conv_id]
+            self._cond.notify_all()
+        return inserted
+
+    def replay_spool(self, col: Collection) -> int:
+        """Insert spooled documents back into col. Returns documents replayed.
+        Left in place (to retry later) if Mongo fails again."""
+        replay_path = f"{self.spool_path}.replay"
+        with self._spool_lock:
+            if not os.path.exists(replay_path):
+                try:
+                    os.replace(self.spool_path, replay_path)
+                except FileNotFoundError:
+                    self._held.clear()
+                    return 0
+        with open(replay_path, encoding="utf-8") as f:
+            docs = [json_util.loads(line) for line in f if line.strip()]
+
+        units = self._exchanges(docs)
+        step = _REPLAY_CHUNK // 2
+        replayed = 0
+        for i in range(0, len(units), step):
+            chunk = [doc for unit in units[i:i + step] for doc in unit]
+            try:
+                self._restore_turns(col, [unit for unit in units[i:i + step] if len(unit) == 2])
+                col.insert_many(chunk, ordered=False)
+                replayed += len(chunk)
+            except BulkWriteError as e:
+                rejected = [chunk[err["index"]] for err in e.details.get("writeErrors", []) if err.get("code") != _DUPLICATE_KEY]
+                replayed += e.details.get("nInserted", 0)
+                if rejected:
+                    print(f"[message_writer] {len(rejected)} spooled message(s) rejected, kept in {self.spool_path}.rejected")
+                    self._append(f"{self.spool_path}.rejected", rejected)
+            except PyMongoError as e:
+                print(f"[message_writer] spool replay failed, will retry: {type(e).__name__}: {e}")
+                rest = self._without_turns([doc for unit in units[i:] for doc in unit])
+                with open(replay_path, "w", encoding="utf-8") as f:
+                    f.writelines(json_util.dumps(d) + "\n" for d in rest)
+                self.replayed += replayed
+                self._refresh_held()
+                return replayed
+        os.remove(replay_path)
+        self._refresh_held()
+        self.replayed += replayed
+        if replayed:
+            print(f"[message_writer] replayed {replayed} spooled message(s)")
+        return replayed
+
+    def clear(self) -> None:
+        with self._cond:
+            self._pending.clear()
+            self._unwritten.clear()
+            self._reset_counters()
+        with self._spool_lock:
+            self._held.clear()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "running": self.running,
+                "queued": len(self._pending),
+                "enqueued": self.enqueued,
+                "inserted": self.inserted,
+                "batches": self.batches,
+                "avg_batch_docs": (self.inserted / self.batches) if self.batches else None,
+                "failed_batches": self.failed_batches,
+                "spooled": self.spooled,
+                "replayed": self.replayed,
+            }
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopping)
+                if self._stopping and not self._pending:
+                    return
+            failed = self.failed_batches
+            self.flush()
+            if self.failed_batches == failed and os.path.exists(self.spool_path):
+                # Mongo is reachable again — put back what was spooled meanwhile.
+                try:
+                    self.replay_spool(self._col)
+                except Exception as e:
+                    print(f"[message_writer] spool replay failed: {type(e).__name__}: {e}")
+
+    def _write(self, batch: list[tuple[dict, dict]]) -> int:
+        with self._spool_lock:
+            held = [pair for pair in batch if pair[0]["conversation_id"] in self._held]
+            batch = [pair for pair in batch if pair[0]["conversation_id"] not in self._held]
+        if held:
+            # Behind spooled exchanges of the same conversation: no turn yet.
+            self._spool([doc for pair in held for doc in pair])
+        if not batch:
+            return 0
+        col = self._col
+        docs = [doc for pair in batch for doc in pair]
+        try:
+            self._assign_turns(col, batch)
+            remaining = docs
+            inserted = 0
+            while remaining:
+                try:
+                    col.insert_many(remaining, ordered=True)
+                    inserted += len(remaining)
+                    break
+                except BulkWriteError as e:
+                    n = e.details.get("nInserted", 0)
+                    inserted += n
+                    err = e.details["writeErrors"][0]
+                    if err.get("code") != _DUPLICATE_KEY:
+                        print(f"[message_writer] insert rejected: {err.get('errmsg')}")
+                        self._spool(remaining[n:])
+                        break
+                    # Already stored by an earlier attempt.
+                    remaining = remaining[n + 1:]
+        except PyMongoError as e:
+            print(f"[message_writer] batch of {len(docs)} message(s) failed, spooling: {type(e).__name__}: {e}")
+            with self._cond:
+                self.failed_batches += 1
+            self._spool(docs)
+            return 0
+        with self._cond:
+            self.inserted += inserted
+            self.batches += 1
+        return inserted
+
+    @staticmethod
+    def _assign_turns(col: Collection, batch: list[tuple[dict, dict]]) -> None:
+        todo = [pair for pair in batch if "turn" not in pair[0]]
+        if not todo:
+            return
+        conv_ids = list({user_doc["conversation_id"] for user_doc, _ in todo})
+        counts = {
+            row["_id"]: row["n"]
+            for row in col.aggregate([
+                {"$match": {"conversation_id": {"$in": conv_ids}, "role": "user"}},
+                {"$group": {"_id": "$conversation_id", "n": {"$sum": 1}}},
+            ])
+        }
+        for user_doc, assistant_doc in todo:
+            turn = counts.get(user_doc["conversation_id"], 0)
+            counts[user_doc["conversation_id"]] = turn + 1
+            user_doc["turn"] = assistant_doc["turn"] = turn
+
+    def _restore_turns(self, col: Collection, pairs: list[tuple[dict, dict]]) -> None:
+        """Give spooled exchanges their turn: the stored one if the user
+        message already made it into Mongo, else the next free one."""
+        todo = [pair for pair in pairs if "turn" not in pair[0]]
+        if not todo:
+            return
+        stored = {
+            doc["_id"]: doc["turn"]
+            for doc in col.find({"_id": {"$in": [user_doc["_id"] for user_doc, _ in todo]}}, {"turn": 1})
+            if "turn" in doc
+        }
+        for user_doc, assistant_doc in todo:
+            if user_doc["_id"] in stored:
+                user_doc["turn"] = assistant_doc["turn"] = stored[user_doc["_id"]]
+        self._assign_turns(col, todo)
+
+    @staticmethod
+    def _exchanges(docs: list[dict]) -> list[tuple[dict, ...]]:
+        """Spooled documents regrouped into (user, assistant) pairs; a reply
+        whose user message was stored before the batch failed stays alone."""
+        units: list[tuple[dict, ...]] = []
+        i = 0
+        while i < len(docs):
+            doc = docs[i]
+            following = docs[i + 1] if i + 1 < len(docs) else None
+            if (doc.get("role") == "user" and following is not None and following.get("role") == "assistant"
+                    and following.get("conversation_id") == doc.get("conversation_id")):
+                units.append((doc, following))
+                i += 2
+            else:
+                units.append((doc,))
+                i += 1
+        return units
+
+    @classmethod
+    def _without_turns(cls, docs: list[dict]) -> list[dict]:
+        out = []
+        for unit in cls._exchanges(docs):
+            if len(unit) == 2 or unit[0].get("role") == "user":
+                unit = tuple({k: v for k, v in doc.items() if k != "turn"} for doc in unit)
+            out.extend(unit)
+        return out
+
+    def _refresh_held(self) -> None:
+        held = set()
+        for path in (self.spool_path, f"{self.spool_path}.replay"):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    held.update(json_util.loads(line).get("conversation_id") for line in f if line.strip())
+            except FileNotFoundError:
+                pass
+        with self._spool_lock:
+            self._held = held
+
+    def _spool(self, docs: list[dict]) -> None:
+        self._append(self.spool_path, self._without_turns(docs))
+        with self._spool_lock:
+            self._held.update(doc["conversation_id"] for doc in docs)
+        with self._cond:
+            self.spooled += len(docs)
+
+    def _append(self, path: str, docs: list[dict]) -> None:
+        data = "".join(json_util.dumps(d) + "\n" for d in docs)
+        with self._spool_lock:
+            try:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                # Nowhere left to put them: log the documents so they can be recovered.
+                print(f"[message_writer] FAILED to spool {len(docs)} message(s) to {path}: {e}\n{data}")
+
+
+_settings = get_settings()
+message_writer = MessageWriteBehind(
+    spool_path=_settings.MESSAGE_SPOOL_PATH,
+    max_batch=_settings.MESSAGE_WRITE_BATCH,
+)
@@ -0,0 +1,129 @@
+# backend/app/services/model_routes.py
+import json
+import os
+import threading
+from typing import Optional
+
+from ..core.config import get_settings
+
+# Every upstream call site and what it sends by default. A model of None means
+# UF_OPENAI_API_MODEL; max_tokens 0 means no limit (otherwise 1–4096, model-
+# dependent). LLM_ROUTES overrides any of the three per route.
+DEFAULT_ROUTES: dict[str, dict] = {
+    # The reply to the participant's message (default, followup and links chats).
+    # temperature: 0.0 = fully deterministic, 2.0 = very random; 0.0–1.0 recommended.
+    "answer": {"model": None, "temperature": 0.5, "max_tokens": 1000},
+    # The three short questions suggested after a /chat/followup reply.
+    "followup_suggestions": {"model": None, "temperature": 0.5, "max_tokens": 200},
+    # Double-agent mode runs at a lower temperature so stochastic answer divergence
+    # is minimised and the style difference (intuitive vs. formal) is the dominant
+    # signal between agents.
+    "double_a": {"model": None, "temperature": 0.1, "max_tokens": 1000},
+    "double_b": {"model": None, "temperature": 0.1, "max_tokens": 1000},
+    # Knowledge link maintenance (services/link_health.py): a YES/NO relevance
+    # verdict and a 1-2 sentence description of a fetched page.
+    "relevance_judge": {"model": None, "temperature": 0.0, "max_tokens": 5},
+    "page_summary": {"model": None, "temperature": 0.3, "max_tokens": 120},
+}
+
+
+class ModelRoute:
+    """Which model, temperature and max_tokens one call site uses."""
+
+    def __init__(self, name: str, model: Optional[str], temperature: float, max_tokens: int):
+        self.name = name
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+
+    def __repr__(self) -> str:
+        return (
+            f"ModelRoute({self.name!r}, model={self.model!r}, "
+            f"temperature={self.temperature}, max_tokens={self.max_tokens})"
+        )
+
+
+def parse_routes(raw: str) -> dict[str, dict]:
+    """LLM_ROUTES, a JSON object of route name -> {"model", "temperature",
+    "max_tokens"} (any subset). Unknown routes and fields are ignored with a
+    warning rather than failing startup."""
+    if not raw.strip():
+        return {}
+    try:
+        table = json.loads(raw)
+    except ValueError as e:
+        print(f"[model_routes] LLM_ROUTES is not valid JSON, using defaults: {e}")
+        return {}
+    if not isinstance(table, dict):
+        print("[model_routes] LLM_ROUTES must be a JSON object, using defaults")
+        return {}
+    overrides: dict[str, dict] = {}
+    for name, spec in table.items():
+        if name not in DEFAULT_ROUTES or not isinstance(spec, dict):
+            print(f"[model_routes] ignoring LLM_ROUTES entry {name!r}")
+            continue
+        fields = {}
+        for field, value in spec.items():
+            try:
+                if field == "model":
+                    fields[field] = str(value) if value else None
+                elif field == "temperature":
+                    fields[field] = float(value)
+                elif field == "max_tokens":
+                    fields[field] = int(value)
+                else:
+                    raise ValueError("unknown field")
+            except (TypeError, ValueError):
+                print(f"[model_routes] ignoring LLM_ROUTES {name}.{field}={value!r}")
+        overrides[name] = fields
+    return overrides
+
+
+class ModelRouter:
+    """Routing table from upstream call site to ModelRoute: DEFAULT_ROUTES
+    with the LLM_ROUTES overrides on top, so auxiliary calls (follow-up
+    suggestions, link maintenance) can go to a cheaper or faster model than
+    the replies participants read.
+
+    route() is looked up per request, since a route without its own model
+    follows UF_OPENAI_API_MODEL. record() counts upstream calls per route and
+    model for /metrics. Called from link maintenance threads as well as the
+    event loop, hence the lock.
+    """
+
+    def __init__(self, overrides: dict[str, dict]):
+        self.overrides = overrides
+        self._calls: dict[tuple[str, Optional[str]], int] = {}
+        self._lock = threading.Lock()
+
+    def route(self, name: str) -> ModelRoute:
+        spec = {**DEFAULT_ROUTES[name], **self.overrides.get(name, {})}
+        return ModelRoute(
+            name, spec["model"] or os.getenv("UF_OPENAI_API_MODEL"), spec["temperature"], spec["max_tokens"],
+        )
+
+    def record(self, route: ModelRoute) -> None:
+        with self._lock:
+            key = (route.name, route.model)
+            self._calls[key] = self._calls.get(key, 0) + 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._calls.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = dict(self._calls)
+        routes = {}
+        for name in DEFAULT_ROUTES:
+            route = self.route(name)
+            routes[name] = {
+                "model": route.model,
+                "temperature": route.temperature,
+                "max_tokens": route.max_tokens,
+                "calls": {model or "": n for (r, model), n in calls.items() if r == name},
+            }
+        return routes
+
+
+model_router = ModelRouter(parse_routes(get_settings().LLM_ROUTES))
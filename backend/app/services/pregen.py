@@ -0,0 +1,170 @@
+# backend/app/services/pregen.py
+"""Offline pre-generation of first-turn chat replies.
+
+For every active question, chat mode and answer_incorrectly setting, the
+first turn is generated once and stored in the llm_cache collection under the
+same key the endpoint computes (api.chat.first_turn_messages + cache_key), so
+a participant's first message about a question replays it immediately.
+
+The job is incremental by construction: the key is a digest of the exact
+prompt, so an entry is only (re)generated when its question text or the
+prompt template changed. Entries superseded by such a change are pruned.
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import AsyncGenerator, Callable, Optional
+
+from pymongo.collection import Collection
+
+from ..schemas.question import QuestionChoice
+from .chat import detect_stated_choice
+from .llm_cache import cache_key, estimate_tokens
+from .model_routes import ModelRoute
+from .reply_metrics import ReplyMeter
+
+
+def question_prompt(question: dict) -> str:
+    """The message the quiz page sends when a participant asks the assistant
+    about a question (onAskAssistantAboutQuestion in pages/quiz/[quiz_id].tsx).
+    Must stay in sync with the frontend or pre-generated replies never hit."""
+    choices_text = "\n".join(f"{c['id'].upper()}. {c['label']}" for c in question.get("choices", []))
+    parts = [question["stem"]]
+    if question.get("subtitle"):
+        parts.append(question["subtitle"])
+    parts.append(f"Answer choices:\n{choices_text}")
+    return "\n\n".join(parts)
+
+
+def plan_jobs(
+    questions: list[dict],
+    modes: list[str],
+    build_messages: Callable[[str, str, bool, bool], tuple[list[dict], ModelRoute]],
+) -> list[dict]:
+    """One job per (question, mode, answer_incorrectly), minus modes whose first
+    turn is identical to an earlier one (default and followup send the same
+    prompt, so they share an entry).
+
+    build_messages(mode, message, answer_incorrectly, has_choices) returns the
+    (messages, route) the endpoint would send for that first turn; the route's
+    model and temperature are part of the key.
+    """
+    jobs = []
+    seen: set[str] = set()
+    for q in questions:
+        message = question_prompt(q)
+        choices = q.get("choices", [])
+        for mode in modes:
+            for answer_incorrectly in (False, True):
+                messages, route = build_messages(mode, message, answer_incorrectly, bool(choices))
+                key = cache_key(messages, route.temperature, answer_incorrectly, route.model)
+                if key in seen:
+                    continue
+                seen.add(key)
+                jobs.append({
+                    "key": key,
+                    "question_id": str(q["_id"]),
+                    "mode": mode,
+                    "answer_incorrectly": answer_incorrectly,
+                    "messages": messages,
+                    "route": route,
+                    "choices": choices,
+                })
+    return jobs
+
+
+def pending_jobs(col: Collection, jobs: list[dict]) -> list[dict]:
+    """Jobs without a pre-generated entry yet — one $in query for the whole
+    plan. A live-cached reply under the same key doesn't count: it expires."""
+    if not jobs:
+        return []
+    existing = {
+        doc["_id"]
+        for doc in col.find({"_id": {"$in": [j["key"] for j in jobs]}, "pregenerated": True}, {"_id": 1})
+    }
+    return [j for j in jobs if j["key"] not in existing]
+
+
+def store_pregenerated(col: Collection, job: dict, reply: str, output_tokens: Optional[int] = None) -> None:
+    choices = [QuestionChoice(**c) for c in job["choices"]]
+    col.update_one(
+        {"_id": job["key"]},
+        {
+            "$set": {
+                "reply": reply,
+                "model": job["route"].model,
+                "output_tokens": output_tokens or estimate_tokens(reply),
+                "pregenerated": True,
+                "question_id": job["question_id"],
+                "mode": job["mode"],
+                "answer_incorrectly": job["answer_incorrectly"],
+                "stated_choice_id": detect_stated_choice(reply, choices) if choices else None,
+                "created_at": datetime.now(timezone.utc),
+            },
+            # Never expires; superseded entries are removed by prune_stale.
+            "$unset": {"expires_at": ""},
+        },
+        upsert=True,
+    )
+
+
+def prune_stale(col: Collection, jobs: list[dict]) -> int:
+    """Delete pre-generated entries that no current job maps to (edited or
+    removed questions, changed prompt templates). Returns how many."""
+    current = [j["key"] for j in jobs]
+    result = col.delete_many({"pregenerated": True, "_id": {"$nin": current}})
+    return result.deleted_count
+
+
+class _RateLimiter:
+    """At most per_minute starts per minute, spaced evenly."""
+
+    def __init__(self, per_minute: int):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def run_pregeneration(
+    col: Collection,
+    jobs: list[dict],
+    get_stream: Callable[..., AsyncGenerator[str, None]],
+    concurrency: int = 4,
+    per_minute: int = 60,
+) -> dict:
+    """Generate and store every job. get_stream(messages, route=..., meter=...)
+    is the same streaming call the endpoints use (api.chat._stream_ai); the
+    meter picks up the reported token usage. A failed job is reported and
+    left for the next run."""
+    gate = asyncio.Semaphore(max(1, concurrency))
+    limiter = _RateLimiter(per_minute)
+    counts = {"generated": 0, "failed": 0}
+
+    async def one(job: dict) -> None:
+        async with gate:
+            await limiter.wait()
+            meter = ReplyMeter()
+            try:
+                reply = "".join([d async for d in get_stream(job["messages"], route=job["route"], meter=meter)])
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"[pregen] {job['question_id']} {job['mode']} ai={job['answer_incorrectly']} failed: {type(e).__name__}: {e}")
+                return
+            if not reply:
+                counts["failed"] += 1
+                return
+            await asyncio.to_thread(store_pregenerated, col, job, reply, meter.output_tokens)
+            counts["generated"] += 1
+
+    await asyncio.gather(*(one(j) for j in jobs))
+    return counts
@@ -7,6 +7,7 @@ from pymongo.collection import Collection
 from fastapi import HTTPException
 
 from .questions import get_questions_collection
+from .user_cache import user_cache
 from ..schemas.quiz import QuizStateResponse, QuizAttemptPublic, QuizQuestionPayload, QuizResultItem, QuizResultsResponse
 from ..schemas.user import SurveyStage, AssignedVar
 
@@ -94,6 +95,7 @@ def _mark_quiz_completed(db, doc: dict) -> None:
         {"_id": ObjectId(doc["user_id"])},
         {"$set": user_set_doc},
     )
+    user_cache.invalidate_id(doc["user_id"])
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -145,6 +147,7 @@ def reset_quiz_attempt(db, user_id: str, quiz_id: str) -> None:
 
     users = get_users_collection(db)
     users.update_one({"_id": ObjectId(user_id)}, {"$set": revert})
+    user_cache.invalidate_id(user_id)
 
 
 def build_quiz_state_response(db, doc: dict) -> QuizStateResponse:
@@ -0,0 +1,188 @@
+# backend/app/services/reply_metrics.py
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+# Percentiles are computed over the most recent replies per endpoint/variant.
+_SAMPLE_WINDOW = 500
+
+
+class ReplyMeter:
+    """Timing and token usage of one streamed reply, as the participant saw it.
+
+    Created when the reply starts (before any wait for an upstream slot), fed
+    every token event, and given the usage block when the upstream stream
+    reports one. source is how the reply was served: "upstream", "cache",
+    "speculation" or "single_flight"; route is the model_routes entry it was
+    generated under.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.output_chars = 0
+        self.input_tokens: Optional[int] = None
+        self.output_tokens: Optional[int] = None
+        self.model: Optional[str] = None
+        self.source = "upstream"
+        self.route: Optional[str] = None
+
+    def token(self, delta: str) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.output_chars += len(delta)
+
+    def usage(self, usage, model: Optional[str] = None) -> None:
+        """Record an OpenAI usage block (prompt_tokens / completion_tokens)."""
+        self.input_tokens = getattr(usage, "prompt_tokens", None)
+        self.output_tokens = getattr(usage, "completion_tokens", None)
+        if model:
+            self.model = model
+
+    def finish(self) -> None:
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+
+    @property
+    def ttft_ms(self) -> Optional[int]:
+        if self.first_token_at is None:
+            return None
+        return int((self.first_token_at - self.started_at) * 1000)
+
+    @property
+    def total_ms(self) -> Optional[int]:
+        if self.finished_at is None:
+            return None
+        return int((self.finished_at - self.started_at) * 1000)
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """Output tokens over the time from first token to the end. Estimated
+        at ~4 characters per token when upstream didn't report usage."""
+        if self.first_token_at is None or self.finished_at is None:
+            return None
+        elapsed = self.finished_at - self.first_token_at
+        tokens = self.output_tokens if self.output_tokens is not None else self.output_chars // 4
+        return round(tokens / elapsed, 1) if elapsed > 0 and tokens else None
+
+    def metadata(self) -> dict:
+        """AIMessageMetadata fields for this reply (None values dropped)."""
+        tokens_used = (
+            self.input_tokens + self.output_tokens
+            if self.input_tokens is not None and self.output_tokens is not None else None
+        )
+        fields = {
+            "model_version": self.model,
+            "processing_time_ms": self.total_ms,
+            "ttft_ms": self.ttft_ms,
+            "tokens_per_second": self.tokens_per_second,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "tokens_used": tokens_used,
+            "reply_source": self.source,
+            "model_route": self.route,
+        }
+        return {k: v for k, v in fields.items() if v is not None}
+
+
+def combined_metadata(meters: dict[str, ReplyMeter]) -> dict:
+    """Metadata for a reply made of several agents' streams (/chat/double):
+    the participant's first token, the last agent to finish, summed usage,
+    and each agent's own numbers under agent_metrics."""
+    started = min(m.started_at for m in meters.values())
+    firsts = [m.first_token_at for m in meters.values() if m.first_token_at is not None]
+    finishes = [m.finished_at for m in meters.values() if m.finished_at is not None]
+    fields: dict = {"agent_metrics": {tag: m.metadata() for tag, m in meters.items()}}
+    if firsts:
+        fields["ttft_ms"] = int((min(firsts) - started) * 1000)
+    if finishes:
+        fields["processing_time_ms"] = int((max(finishes) - started) * 1000)
+    for name in ("input_tokens", "output_tokens"):
+        values = [getattr(m, name) for m in meters.values()]
+        if all(v is not None for v in values):
+            fields[name] = sum(values)
+    if "input_tokens" in fields and "output_tokens" in fields:
+        fields["tokens_used"] = fields["input_tokens"] + fields["output_tokens"]
+    models = {m.model for m in meters.values() if m.model}
+    if len(models) == 1:
+        fields["model_version"] = models.pop()
+    routes = {m.route for m in meters.values() if m.route}
+    if len(routes) == 1:
+        fields["model_route"] = routes.pop()
+    sources = {m.source for m in meters.values()}
+    fields["reply_source"] = sources.pop() if len(sources) == 1 else "mixed"
+    return fields
+
+
+def _percentile(values: list, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _Series:
+    def __init__(self):
+        self.replies = 0
+        self.by_source: dict[str, int] = {}
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.ttft_ms: deque = deque(maxlen=_SAMPLE_WINDOW)
+        self.total_ms: deque = deque(maxlen=_SAMPLE_WINDOW)
+        self.tokens_per_second: deque = deque(maxlen=_SAMPLE_WINDOW)
+
+
+class ReplyLatencyStats:
+    """Per endpoint/variant aggregate of ReplyMeter.metadata() for completed
+    replies: counts by source, token totals, and p50/p95 TTFT and total
+    latency over the last _SAMPLE_WINDOW replies. Per-process, like the
+    other /metrics counters.
+    """
+
+    def __init__(self):
+        self._series: dict[str, _Series] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, variant: Optional[str], metadata: dict) -> None:
+        key = f"{endpoint}/{variant}" if variant else endpoint
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series()
+            series.replies += 1
+            source = metadata.get("reply_source", "upstream")
+            series.by_source[source] = series.by_source.get(source, 0) + 1
+            series.input_tokens += metadata.get("input_tokens") or 0
+            series.output_tokens += metadata.get("output_tokens") or 0
+            for name in ("ttft_ms", "total_ms", "tokens_per_second"):
+                value = metadata.get("processing_time_ms" if name == "total_ms" else name)
+                if value is not None:
+                    getattr(series, name).append(value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                key: {
+                    "replies": s.replies,
+                    "by_source": dict(s.by_source),
+                    "input_tokens": s.input_tokens,
+                    "output_tokens": s.output_tokens,
+                    "ttft_ms_p50": _percentile(list(s.ttft_ms), 0.5),
+                    "ttft_ms_p95": _percentile(list(s.ttft_ms), 0.95),
+                    "total_ms_p50": _percentile(list(s.total_ms), 0.5),
+                    "total_ms_p95": _percentile(list(s.total_ms), 0.95),
+                    "tokens_per_second_avg": (
+                        sum(s.tokens_per_second) / len(s.tokens_per_second) if s.tokens_per_second else None
+                    ),
+                }
+                for key, s in self._series.items()
+            }
+
+
+reply_latency = ReplyLatencyStats()
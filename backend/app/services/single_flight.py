@@ -0,0 +1,208 @@
+# backend/app/services/single_flight.py
+import asyncio
+from typing import AsyncGenerator, Callable, Optional
+
+from ..core.config import get_settings
+
+# Queue sentinel: the upstream stream ended normally.
+_END = object()
+
+
+class FlightSubscription:
+    """One request's view of a shared upstream stream: its own queue,
+    pre-filled with whatever had already streamed when it joined."""
+
+    def __init__(self, flight: "Flight", leader: bool):
+        self.flight = flight
+        self.leader = leader
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def deltas(self) -> AsyncGenerator[str, None]:
+        """The reply's deltas from the start. Raises what upstream raised."""
+        try:
+            while True:
+                item = await self.queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                if not self.leader:
+                    self.flight.registry.shared_chars += len(item)
+                yield item
+        finally:
+            self.leave()
+
+    def leave(self) -> None:
+        """Stop receiving. Safe to call more than once, and needed when
+        deltas() may never have been started."""
+        self.flight.unsubscribe(self)
+
+
+class Flight:
+    """A single upstream stream fanned out to every subscriber's queue."""
+
+    def __init__(self, registry: "SingleFlight", key: str):
+        self.registry = registry
+        self.key = key
+        self.deltas: list[str] = []
+        self.subscribers: set[FlightSubscription] = set()
+        self.task: Optional[asyncio.Task] = None
+        self.outcome = None  # _END or the upstream exception, once finished
+
+    def subscribe(self, leader: bool = False) -> FlightSubscription:
+        sub = FlightSubscription(self, leader)
+        for delta in self.deltas:
+            sub.queue.put_nowait(delta)
+        if self.outcome is not None:
+            sub.queue.put_nowait(self.outcome)
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: FlightSubscription) -> None:
+        self.subscribers.discard(sub)
+        if not self.subscribers and self.task is not None and not self.task.done():
+            # Nobody is reading any more: stop upstream (see _stream_ai).
+            self.registry._land(self)
+            self.task.cancel()
+
+    def _publish(self, item) -> None:
+        for sub in self.subscribers:
+            sub.queue.put_nowait(item)
+
+    async def _pump(self, upstream: AsyncGenerator[str, None]) -> None:
+        try:
+            async for delta in upstream:
+                self.deltas.append(delta)
+                self._publish(delta)
+            self.outcome = _END
+        except Exception as e:
+            self.outcome = e
+        finally:
+            if self.outcome is not None:
+                self.registry._land(self)
+                self._publish(self.outcome)
+            await upstream.aclose()
+
+
+class SingleFlight:
+    """Coalesces identical prompts that are streaming upstream at the same
+    time (a lab full of students asking the same question in the same
+    second) into one upstream call.
+
+    lead() starts the upstream stream for a key and fans it out; join()
+    attaches to one still running, replaying what already streamed, or
+    returns None. Each request still saves its own exchange. Unlike the
+    llm_cache this only covers concurrent misses, and it is skipped for the
+    variants in disabled_variants (conditions that need independent
+    samples per participant). The upstream stream is cancelled once every
+    subscriber has gone.
+
+    A request that has to wait for an llm_gate slot before it can lead
+    marks the key with queue_lead(); identical requests arriving meanwhile
+    wait on it with join_queued() instead of queueing for slots of their
+    own, and busy() lets admission control leave them out of its count.
+
+    Only touched from the event loop, so no locking.
+    """
+
+    def __init__(self, enabled: bool, disabled_variants: set[str]):
+        self.enabled = enabled
+        self.disabled_variants = disabled_variants
+        self._flights: dict[str, Flight] = {}
+        self._queued: dict[str, asyncio.Future] = {}
+        self._reset_counters()
+
+    def _reset_counters(self) -> None:
+        self.led = 0
+        self.joined = 0
+        self.shared_chars = 0
+
+    def enabled_for(self, variant: str) -> bool:
+        return self.enabled and variant not in self.disabled_variants
+
+    def busy(self, key: Optional[str]) -> bool:
+        """Whether a request for key would share an upstream stream rather
+        than open one: it is streaming, or queued to be led."""
+        return key is not None and (key in self._flights or key in self._queued)
+
+    def queue_lead(self, key: str) -> bool:
+        """Mark key as about to be led by a request now waiting for a slot.
+        False if another request already has."""
+        if key in self._queued:
+            return False
+        self._queued[key] = asyncio.get_running_loop().create_future()
+        return True
+
+    def unqueue(self, key: str) -> None:
+        """The request queued to lead key has led it, or given up."""
+        waiter = self._queued.pop(key, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def join_queued(self, key: str) -> Optional[FlightSubscription]:
+        """Wait for the request queued to lead key, then join its flight.
+        None if it gave up without leading."""
+        waiter = self._queued.get(key)
+        if waiter is not None:
+            await asyncio.shield(waiter)
+        return self.join(key)
+
+    def join(self, key: Optional[str]) -> Optional[FlightSubscription]:
+        flight = self._flights.get(key) if key is not None else None
+        if flight is None:
+            return None
+        self.joined += 1
+        return flight.subscribe()
+
+    def lead(
+        self,
+        key: str,
+        upstream: AsyncGenerator[str, None],
+        on_done: Optional[Callable[[], None]] = None,
+    ) -> FlightSubscription:
+        """Start streaming upstream under key. on_done runs once upstream is
+        finished with (e.g. releasing the llm_gate slot it was started under),
+        which may be after the leader itself has stopped reading."""
+        flight = Flight(self, key)
+        sub = flight.subscribe(leader=True)
+        self._flights[key] = flight
+        flight.task = asyncio.create_task(flight._pump(upstream))
+
+        # A done callback rather than a finally in _pump: it also runs when
+        # the task is cancelled before it ever started.
+        def landed(_task: asyncio.Task) -> None:
+            self._land(flight)
+            if on_done is not None:
+                on_done()
+
+        flight.task.add_done_callback(landed)
+        self.led += 1
+        return sub
+
+    def clear(self) -> None:
+        self._flights.clear()
+        self._queued.clear()
+        self._reset_counters()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "disabled_variants": sorted(self.disabled_variants),
+            "in_flight": len(self._flights),
+            "queued_to_lead": len(self._queued),
+            "led": self.led,
+            "joined": self.joined,
+            # ~4 characters per token, as in llm_cache.estimate_tokens.
+            "estimated_saved_tokens": self.shared_chars // 4,
+        }
+
+    def _land(self, flight: Flight) -> None:
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+
+_settings = get_settings()
+single_flight = SingleFlight(
+    enabled=_settings.SINGLE_FLIGHT_ENABLED,
+    disabled_variants=_settings.SINGLE_FLIGHT_DISABLED_VARIANTS,
+)
@@ -0,0 +1,217 @@
+# backend/app/services/speculation.py
+import asyncio
+import time
+from typing import AsyncIterator, Callable, Optional
+
+from ..core.config import get_settings
+
+
+class SpeculationBusyError(Exception):
+    """Raised by a speculation's stream when it finds no free upstream slot
+    after all. Counted as skipped_busy rather than failed."""
+
+
+class SpeculativeReply:
+    """One upstream generation started ahead of the chat request it answers.
+
+    Chunks are appended as they stream in, so a chat request that arrives
+    mid-generation can follow() the rest instead of starting over.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks: list[str] = []
+        self.done = False
+        self.failed = False
+        self.started_at = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def append(self, delta: str) -> None:
+        self.chunks.append(delta)
+        self._notify()
+
+    def finish(self, failed: bool = False) -> None:
+        self.done = True
+        self.failed = failed
+        self._notify()
+
+    async def follow(self) -> AsyncIterator[str]:
+        """Yield the chunks received so far, then new ones until generation
+        ends. Check .failed afterwards: a failed reply just stops early."""
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done:
+                return
+            await self._changed.wait()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+
+class SpeculationStore:
+    """Replies generated while the participant is still reading the question.
+
+    GET /quiz/{quiz_id}/state starts a generation for the first turn the
+    participant's chat variant would send about the question just shown, and
+    the chat endpoints claim it (once) when the exact same messages arrive.
+    Entries are per user: showing the next question drops the previous
+    question's entries, and anything unclaimed after ttl_seconds is dropped
+    as wasted. At most max_in_flight generations run at once per process;
+    extra ones (and any while real requests wait on the upstream gate) are
+    skipped rather than queued, since a late speculation is worth nothing.
+
+    Only touched from the event loop, so no locking.
+    """
+
+    def __init__(self, enabled: bool, max_in_flight: int, ttl_seconds: float):
+        self.enabled = enabled
+        self.max_in_flight = max_in_flight
+        self.ttl_seconds = ttl_seconds
+        self._by_user: dict[str, dict[str, SpeculativeReply]] = {}
+        self.in_flight = 0
+        self._reset_counters()
+
+    def _reset_counters(self) -> None:
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.skipped_busy = 0
+        self.skipped_cached = 0
+        self.skipped_duplicate = 0
+        self.claimed_ready = 0
+        self.claimed_in_flight = 0
+        self.wasted = 0
+        self.head_start_seconds = 0.0
+
+    def retain(self, user_id: str, keys: list[str]) -> None:
+        """Drop the user's entries other than keys (the participant moved on)."""
+        entries = self._by_user.get(user_id, {})
+        for key in [k for k in entries if k not in keys]:
+            self._discard(entries.pop(key))
+        if not entries:
+            self._by_user.pop(user_id, None)
+
+    def record_cached_skip(self) -> None:
+        self.skipped_cached += 1
+
+    def record_busy_skip(self) -> None:
+        self.skipped_busy += 1
+
+    def start(self, user_id: str, key: str, stream: Callable[[], AsyncIterator[str]]) -> bool:
+        """Begin generating stream() for (user_id, key) in a background task.
+        Returns False if it was skipped (already pending, or at the cap)."""
+        self._sweep()
+        entries = self._by_user.setdefault(user_id, {})
+        if key in entries:
+            self.skipped_duplicate += 1
+            return False
+        if self.in_flight >= self.max_in_flight:
+            self.skipped_busy += 1
+            return False
+        reply = SpeculativeReply(key)
+        entries[key] = reply
+        self.in_flight += 1
+        self.started += 1
+        reply.task = asyncio.create_task(self._run(reply, stream))
+        return True
+
+    def pending(self, user_id: str, key: str) -> bool:
+        """Whether claim(user_id, key) would hand over a reply right now."""
+        self._sweep()
+        reply = self._by_user.get(user_id, {}).get(key)
+        return reply is not None and not reply.failed
+
+    def claim(self, user_id: str, key: str) -> Optional[SpeculativeReply]:
+        """Hand the pending reply for (user_id, key) to a chat request, or None."""
+        self._sweep()
+        entries = self._by_user.get(user_id)
+        reply = entries.pop(key, None) if entries else None
+        if entries is not None and not entries:
+            self._by_user.pop(user_id, None)
+        if reply is None or reply.failed:
+            return None
+        if reply.done:
+            self.claimed_ready += 1
+        else:
+            self.claimed_in_flight += 1
+        self.head_start_seconds += time.monotonic() - reply.started_at
+        return reply
+
+    def clear(self) -> None:
+        self._by_user.clear()
+        self.in_flight = 0
+        self._reset_counters()
+
+    def stats(self) -> dict:
+        claimed = self.claimed_ready + self.claimed_in_flight
+        resolved = claimed + self.wasted
+        return {
+            "enabled": self.enabled,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "pending": sum(len(e) for e in self._by_user.values()),
+            "started": self.started,
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped_busy": self.skipped_busy,
+            "skipped_cached": self.skipped_cached,
+            "skipped_duplicate": self.skipped_duplicate,
+            "claimed_ready": self.claimed_ready,
+            "claimed_in_flight": self.claimed_in_flight,
+            "wasted": self.wasted,
+            "payoff_rate": (claimed / resolved) if resolved else None,
+            "avg_head_start_ms": (self.head_start_seconds * 1000 / claimed) if claimed else None,
+        }
+
+    async def _run(self, reply: SpeculativeReply, stream: Callable[[], AsyncIterator[str]]) -> None:
+        try:
+            async for delta in stream():
+                reply.append(delta)
+        except asyncio.CancelledError:
+            reply.finish(failed=True)
+            raise
+        except SpeculationBusyError:
+            self.skipped_busy += 1
+            reply.finish(failed=True)
+        except Exception as e:
+            self.failed += 1
+            reply.finish(failed=True)
+            print(f"[speculation] generation failed: {type(e).__name__}: {e}")
+        else:
+            self.completed += 1
+            reply.finish()
+        finally:
+            self.in_flight -= 1
+
+    def _sweep(self) -> None:
+        cutoff = time.monotonic() - self.ttl_seconds
+        for user_id in list(self._by_user):
+            entries = self._by_user[user_id]
+            for key in [k for k, r in entries.items() if r.started_at <= cutoff or r.failed]:
+                self._discard(entries.pop(key))
+            if not entries:
+                del self._by_user[user_id]
+
+    def _discard(self, reply: SpeculativeReply) -> None:
+        if reply.failed:
+            return
+        self.wasted += 1
+        if reply.task is not None and not reply.task.done():
+            reply.task.cancel()
+
+
+_settings = get_settings()
+speculation = SpeculationStore(
+    enabled=_settings.SPECULATION_ENABLED,
+    max_in_flight=_settings.SPECULATION_MAX_IN_FLIGHT,
+    ttl_seconds=_settings.SPECULATION_TTL_SECONDS,
+)
@@ -0,0 +1,221 @@
+# backend/app/services/stream_replay.py
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import AsyncGenerator, Optional
+
+from ..core.config import get_settings
+
+
+def parse_event_id(last_event_id: Optional[str]) -> Optional[tuple[str, int]]:
+    """(stream id, seq) from an event id "<stream id>:<seq>", or None."""
+    if not last_event_id:
+        return None
+    stream_id, _, seq = last_event_id.strip().partition(":")
+    if not stream_id or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
+
+
+class ReplayStream:
+    """One chat reply's SSE frames, produced by a background task and kept
+    in a bounded buffer so readers can attach, leave and come back.
+
+    Each frame gets an id line "<stream id>:<seq>" (seq from 1). A reader
+    that has seen seq n resumes with follow(n). When the last reader leaves
+    before the reply is finished, the producer is cancelled after grace
+    seconds unless someone reattaches (immediately if grace <= 0).
+    """
+
+    def __init__(self, stream_id: str, user_id: str, max_events: int, grace: float):
+        self.id = stream_id
+        self.user_id = user_id
+        self.grace = grace
+        self.events: deque[tuple[int, str]] = deque(maxlen=max_events)
+        self.last_seq = 0
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.readers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed: Optional[asyncio.Future] = None
+        self._abandon: Optional[asyncio.TimerHandle] = None
+
+    def append(self, frame: str) -> None:
+        self.last_seq += 1
+        self.events.append((self.last_seq, f"id: {self.id}:{self.last_seq}\n{frame}"))
+        self._notify()
+
+    def finish(self) -> None:
+        self.done = True
+        self.finished_at = time.monotonic()
+        if self._abandon is not None:
+            self._abandon.cancel()
+            self._abandon = None
+        self._notify()
+
+    def has(self, after: int) -> bool:
+        """Whether every frame after seq `after` is still buffered."""
+        if after < 0 or after > self.last_seq:
+            return False
+        return not self.events or self.events[0][0] <= after + 1
+
+    async def follow(self, after: int = 0) -> AsyncGenerator[str, None]:
+        """Frames after seq `after`, live until the reply is finished. Ends
+        early if the reader falls so far behind that frames were dropped."""
+        self._attach()
+        try:
+            while True:
+                if not self.has(after):
+                    print(f"[stream_replay] stream {self.id} reader fell behind the replay buffer")
+                    return
+                if after < self.last_seq:
+                    first = self.events[0][0]
+                    for seq, frame in list(self.events)[after + 1 - first:]:
+                        yield frame
+                        after = seq
+                    continue
+                if self.done:
+                    return
+                if self._changed is None:
+                    self._changed = asyncio.get_running_loop().create_future()
+                # Shielded: one reader being cancelled mustn't cancel the
+                # future the other readers are waiting on.
+                await asyncio.shield(self._changed)
+        finally:
+            self._detach()
+
+    def cancel(self) -> None:
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    def _attach(self) -> None:
+        self.readers += 1
+        if self._abandon is not None:
+            self._abandon.cancel()
+            self._abandon = None
+
+    def _detach(self) -> None:
+        self.readers -= 1
+        if self.readers > 0 or self.done:
+            return
+        if self.grace <= 0:
+            self.cancel()
+        else:
+            self._abandon = asyncio.get_running_loop().call_later(self.grace, self.cancel)
+
+    def _notify(self) -> None:
+        if self._changed is not None and not self._changed.done():
+            self._changed.set_result(None)
+        self._changed = None
+
+
+class StreamReplayRegistry:
+    """Chat SSE streams that can be resumed with Last-Event-ID.
+
+    start() runs a frame generator in a background task so the reply keeps
+    generating (and gets saved) through a brief client disconnect; the
+    reconnecting request resumes from the last id it saw instead of paying
+    for a second upstream call. Finished streams stay replayable for
+    ttl_seconds. Per-process, so a reconnect that lands on another worker
+    falls back to a fresh request. max_streams <= 0 disables resuming.
+
+    Only touched from the event loop, so no locking.
+    """
+
+    def __init__(self, max_streams: int, max_events: int, ttl_seconds: int):
+        self.max_streams = max_streams
+        self.max_events = max_events
+        self.ttl_seconds = ttl_seconds
+        self._streams: OrderedDict[str, ReplayStream] = OrderedDict()
+        self._reset_counters()
+
+    def _reset_counters(self) -> None:
+        self.started = 0
+        self.resumed = 0
+        self.resume_misses = 0
+        self.abandoned = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_streams > 0
+
+    def start(
+        self, user_id: Optional[str], frames: AsyncGenerator[str, None], stream_id: Optional[str] = None,
+    ) -> ReplayStream:
+        """Start producing frames into a new ReplayStream; read it with follow()."""
+        self._prune()
+        stream = ReplayStream(
+            stream_id or uuid.uuid4().hex, user_id or "", self.max_events,
+            get_settings().STREAM_RESUME_GRACE_SECONDS,
+        )
+        self._streams[stream.id] = stream
+        stream.task = asyncio.create_task(self._produce(stream, frames))
+        self.started += 1
+        return stream
+
+    def resume(self, last_event_id: Optional[str], user_id: Optional[str]) -> Optional[tuple[ReplayStream, int]]:
+        """(stream, seq) to resume from for a Last-Event-ID header, or None
+        if it doesn't name a buffered stream of this user's."""
+        if not last_event_id or not self.enabled:
+            return None
+        parsed = parse_event_id(last_event_id)
+        stream = self.get(parsed[0], user_id) if parsed is not None else None
+        if stream is None or not stream.has(parsed[1]):
+            self.resume_misses += 1
+            return None
+        self.resumed += 1
+        return stream, parsed[1]
+
+    def get(self, stream_id: str, user_id: Optional[str]) -> Optional[ReplayStream]:
+        """The buffered stream stream_id if it belongs to user_id."""
+        stream = self._streams.get(stream_id)
+        return stream if stream is not None and stream.user_id == (user_id or "") else None
+
+    def clear(self) -> None:
+        self._streams.clear()
+        self._reset_counters()
+
+    def stats(self) -> dict:
+        in_flight = sum(1 for s in self._streams.values() if not s.done)
+        return {
+            "enabled": self.enabled,
+            "streams": len(self._streams),
+            "in_flight": in_flight,
+            "started": self.started,
+            "resumed": self.resumed,
+            "resume_misses": self.resume_misses,
+            "abandoned": self.abandoned,
+        }
+
+    async def _produce(self, stream: ReplayStream, frames: AsyncGenerator[str, None]) -> None:
+        try:
+            async for frame in frames:
+                stream.append(frame)
+        except asyncio.CancelledError:
+            self.abandoned += 1
+            raise
+        except Exception as e:
+            print(f"[stream_replay] chat stream {stream.id} failed: {type(e).__name__}: {e}")
+        finally:
+            await frames.aclose()
+            stream.finish()
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for stream_id, stream in list(self._streams.items()):
+            if stream.done and now - stream.finished_at > self.ttl_seconds:
+                del self._streams[stream_id]
+        # Make room for one more, oldest finished first; in-flight streams
+        # are bounded by llm_gate.
+        excess = len(self._streams) + 1 - max(self.max_streams, 0)
+        for stream_id in [k for k, s in self._streams.items() if s.done][:max(0, excess)]:
+            del self._streams[stream_id]
+
+
+_settings = get_settings()
+stream_replay = StreamReplayRegistry(
+    max_streams=_settings.STREAM_REPLAY_MAX_STREAMS,
+    max_events=_settings.STREAM_REPLAY_MAX_EVENTS,
+    ttl_seconds=_settings.STREAM_REPLAY_TTL_SECONDS,
+)
@@ -18,6 +18,7 @@ from ..schemas.survey import (
 )
 
 from ..schemas.user import SurveyStage
+from .user_cache import user_cache
 
 def get_survey_items_collection(db) -> Collection:
     return db["survey_items"]
@@ -344,6 +345,7 @@ def submit_survey(db, user_id: str, user_email: str, stage: str, req: SurveySubm
             {"_id": ObjectId(user_id)},
             {"$set": set_doc},
         )
+        user_cache.invalidate_id(user_id)
 
         if user_result.matched_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
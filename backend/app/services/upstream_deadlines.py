@@ -0,0 +1,121 @@
+# backend/app/services/upstream_deadlines.py
+from collections import deque
+from typing import Optional
+
+from ..core.config import get_settings
+
+# The hedge delay is the p95 of the most recent upstream TTFTs, once there
+# are enough of them to mean anything.
+_SAMPLE_WINDOW = 500
+_MIN_SAMPLES = 20
+
+
+class UpstreamTimeoutError(Exception):
+    """An upstream stream missed its first-token or inter-token deadline.
+    Endpoints report it like any other upstream failure."""
+
+    def __init__(self, phase: str, seconds: float):
+        super().__init__(f"no {phase} from upstream within {seconds:g}s")
+        self.phase = phase
+
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class UpstreamDeadlines:
+    """Per-phase deadlines and hedging for upstream chat streams.
+
+    ttft_seconds bounds the wait for a stream's first text delta (including
+    the create call), idle_seconds the gap between later deltas; 0 disables
+    either. With hedging on, a stream that has no token by the p95 upstream
+    TTFT (at least hedge_min_ms) gets a second, identical request; whichever
+    produces a token first is kept. The losing first request is watched
+    until its own first token so stats() can report the tail latency the
+    hedge saved, then closed.
+
+    TTFT here is upstream only (create call to first delta), unlike
+    reply_latency's, which includes waiting for an llm_gate slot.
+
+    Only touched from the event loop, so no locking.
+    """
+
+    def __init__(self, ttft_seconds: float, idle_seconds: float, hedge_enabled: bool, hedge_min_ms: int):
+        self.ttft_seconds = ttft_seconds
+        self.idle_seconds = idle_seconds
+        self.hedge_enabled = hedge_enabled
+        self.hedge_min_ms = hedge_min_ms
+        self._reset_counters()
+
+    def _reset_counters(self) -> None:
+        self.started = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.hedge_skipped = 0  # no free llm_gate slot for the hedge
+        self.ttft_timeouts = 0
+        self.idle_timeouts = 0
+        # TTFT of the first request alone, as if nothing had been hedged...
+        self._unhedged_ms: deque = deque(maxlen=_SAMPLE_WINDOW)
+        # ...and of whichever request the reply was actually streamed from.
+        self._ttft_ms: deque = deque(maxlen=_SAMPLE_WINDOW)
+        self._saved_ms: deque = deque(maxlen=_SAMPLE_WINDOW)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds after which to hedge a stream still waiting for its first
+        token, or None if hedging is off or there is no p95 yet."""
+        if not self.hedge_enabled or len(self._unhedged_ms) < _MIN_SAMPLES:
+            return None
+        return max(_percentile(self._unhedged_ms, 0.95), self.hedge_min_ms) / 1000
+
+    def record_first_token(self, ttft_ms: float, hedge_won: bool = False) -> None:
+        """A stream produced its first token (or ended empty) after ttft_ms."""
+        self._ttft_ms.append(ttft_ms)
+        if hedge_won:
+            self.hedge_wins += 1
+        else:
+            self._unhedged_ms.append(ttft_ms)
+
+    def record_overtaken(self, unhedged_ms: float, ttft_ms: float) -> None:
+        """The first request of a stream the hedge won got its own first
+        token (or gave up) after unhedged_ms; the reply had one at ttft_ms."""
+        self._unhedged_ms.append(unhedged_ms)
+        self._saved_ms.append(max(0.0, unhedged_ms - ttft_ms))
+
+    def clear(self) -> None:
+        self._reset_counters()
+
+    def stats(self) -> dict:
+        unhedged_p95 = _percentile(self._unhedged_ms, 0.95)
+        ttft_p95 = _percentile(self._ttft_ms, 0.95)
+        return {
+            "ttft_seconds": self.ttft_seconds,
+            "idle_seconds": self.idle_seconds,
+            "hedge_enabled": self.hedge_enabled,
+            "hedge_delay_ms": int(self.hedge_delay() * 1000) if self.hedge_delay() is not None else None,
+            "streams": self.started,
+            "hedged": self.hedged,
+            "hedge_rate": (self.hedged / self.started) if self.started else None,
+            "hedge_wins": self.hedge_wins,
+            "hedge_skipped": self.hedge_skipped,
+            "ttft_timeouts": self.ttft_timeouts,
+            "idle_timeouts": self.idle_timeouts,
+            "ttft_ms_p50": _percentile(self._ttft_ms, 0.5),
+            "ttft_ms_p95": ttft_p95,
+            "unhedged_ttft_ms_p95": unhedged_p95,
+            "p95_improvement_ms": (
+                unhedged_p95 - ttft_p95 if unhedged_p95 is not None and ttft_p95 is not None else None
+            ),
+            "hedge_saved_ms_avg": (sum(self._saved_ms) / len(self._saved_ms)) if self._saved_ms else None,
+        }
+
+
+_settings = get_settings()
+upstream_deadlines = UpstreamDeadlines(
+    ttft_seconds=_settings.LLM_TTFT_TIMEOUT_SECONDS,
+    idle_seconds=_settings.LLM_IDLE_TIMEOUT_SECONDS,
+    hedge_enabled=_settings.LLM_HEDGE_ENABLED,
+    hedge_min_ms=_settings.LLM_HEDGE_MIN_MS,
+)
@@ -0,0 +1,52 @@
+# backend/app/services/upstream_stats.py
+from typing import Optional
+
+
+class UpstreamStreamStats:
+    """How upstream completions ended: run to completion, or cut off because
+    nobody was reading any more (client disconnected, speculation dropped).
+
+    A completed stream counts the completion_tokens upstream reported in its
+    usage block (LLM_STREAM_USAGE); without one, and for cut-off streams,
+    which end before the usage block, tokens are estimated at ~4 characters
+    each (llm_cache.estimate_tokens). A cut-off stream is assumed to have
+    saved the rest of an average completed reply, capped at the request's
+    max_tokens when it had one.
+
+    Only touched from the event loop, so no locking.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def record_completed(self, chars: int, tokens: Optional[int] = None) -> None:
+        self.completed += 1
+        self.completed_tokens += tokens if tokens is not None else chars // 4
+
+    def record_cancelled(self, chars: int, max_tokens: int = 0) -> None:
+        tokens = chars // 4
+        expected = self.completed_tokens // self.completed if self.completed else 0
+        if max_tokens > 0:
+            expected = min(expected, max_tokens)
+        self.cancelled += 1
+        self.cancelled_tokens += tokens
+        self.saved_tokens += max(0, expected - tokens)
+
+    def clear(self) -> None:
+        self.completed = 0
+        self.completed_tokens = 0
+        self.cancelled = 0
+        self.cancelled_tokens = 0
+        self.saved_tokens = 0
+
+    def stats(self) -> dict:
+        return {
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "avg_reply_tokens": (self.completed_tokens / self.completed) if self.completed else None,
+            "tokens_before_cancel": self.cancelled_tokens,
+            "estimated_saved_tokens": self.saved_tokens,
+        }
+
+
+upstream_stats = UpstreamStreamStats()
@@ -0,0 +1,170 @@
+# backend/app/services/user_cache.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from ..core.config import get_settings
+
+
+class UserDocCache:
+    """Bounded LRU of raw user documents keyed by lowercased email, with a TTL.
+
+    get_current_user runs on every authenticated request, so the users lookup
+    dominates Mongo load when a whole class works through the quiz at once.
+    Every code path that writes to a user document must call invalidate() or
+    invalidate_id() afterwards so the next request re-reads it.
+
+    The cache is per-process: each uvicorn worker keeps its own copy and only
+    sees its own invalidations. The TTL bounds how long another worker (or an
+    edit made directly in Mongo, e.g. flipping is_admin) can serve stale data.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self._emails_by_id: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def get(self, email: str) -> Optional[dict]:
+        """Return a copy of the cached document, or None on a miss/expiry."""
+        key = email.lower()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, doc = entry
+            if expires_at <= time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(doc)
+
+    def put(self, doc: dict) -> None:
+        if not self.enabled:
+            return
+        key = doc["email"].lower()
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, dict(doc))
+            self._entries.move_to_end(key)
+            self._emails_by_id[str(doc["_id"])] = key
+            while len(self._entries) > self.max_entries:
+                _, (_, old_doc) = self._entries.popitem(last=False)
+                self._emails_by_id.pop(str(old_doc["_id"]), None)
+                self.evictions += 1
+
+    def update_fields(self, user_id: str, fields: dict) -> None:
+        """Patch a cached document in place after a write the caller knows the
+        exact effect of (e.g. the last_active_at heartbeat), instead of evicting."""
+        with self._lock:
+            key = self._emails_by_id.get(str(user_id))
+            entry = self._entries.get(key) if key else None
+            if entry is not None:
+                entry[1].update(fields)
+
+    def invalidate(self, email: str) -> None:
+        with self._lock:
+            if self._drop(email.lower()):
+                self.invalidations += 1
+
+    def invalidate_id(self, user_id: str) -> None:
+        """Evict by user id — the quiz/survey services only know the id."""
+        with self._lock:
+            key = self._emails_by_id.get(str(user_id))
+            if key and self._drop(key):
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._emails_by_id.clear()
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _drop(self, key: str) -> bool:
+        # Caller must hold self._lock.
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._emails_by_id.pop(str(entry[1]["_id"]), None)
+        return True
+
+
+class SessionVersionCache:
+    """Last known session_version per user id, trusted for ttl_seconds.
+
+    Backs the claims-token path in get_session_user: the token carries the
+    version it was issued at, and only when the cached value has aged out do
+    we pay for a (projected, _id-indexed) read to confirm it still matches.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple[float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.checks = 0
+
+    def get(self, user_id: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id: str, version: int) -> None:
+        with self._lock:
+            self.checks += 1
+            self._entries[user_id] = (time.monotonic() + self.ttl_seconds, version)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.checks = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "checks": self.checks}
+
+
+_settings = get_settings()
+user_cache = UserDocCache(
+    max_entries=_settings.USER_CACHE_MAX_ENTRIES,
+    ttl_seconds=_settings.USER_CACHE_TTL_SECONDS,
+)
+session_versions = SessionVersionCache(
+    max_entries=_settings.USER_CACHE_MAX_ENTRIES,
+    ttl_seconds=_settings.SESSION_VERSION_CHECK_SECONDS,
+)
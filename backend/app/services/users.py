@@ -1,11 +1,18 @@
 # backend/app/services/users.py
+import threading
 from typing import Optional
 from datetime import datetime, timezone, timedelta
 from pymongo.collection import Collection
 from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
 
 from ..schemas.user import UserPublic, SurveyStage, AssignedVar
+from ..core.config import get_settings
 from ..core.security import hash_password, verify_password
+from .user_cache import user_cache, session_versions
+from .heartbeats import heartbeats
 
 _HEARTBEAT_DEBOUNCE = timedelta(minutes=2)
 
@@ -59,21 +66,93 @@ def ensure_indexes(users: Collection) -> None:
     users.create_index("email", unique=True)
 
 
+_ASSIGNED_VARS = [
+    AssignedVar.followup.value,
+    AssignedVar.double.value,
+    AssignedVar.links.value,
+]
+
+
+class _SignupSequence:
+    """Round-robin sequence numbers reserved from the counters document in blocks.
+
+    Reserving block_size numbers per $inc means a signup burst only touches
+    the shared counter once every block_size signups per worker, and the
+    variant is known before the user document is inserted. block_size is
+    rounded up to a multiple of len(_ASSIGNED_VARS) so every block spreads
+    evenly across the variants; a worker restarting mid-block leaves at most
+    one unused block behind, which skews the split by a few users at worst.
+    Numbers handed out to a signup that then fails on a duplicate email are
+    returned and reused, as the old insert-then-increment flow never spent one.
+    """
+
+    def __init__(self, block_size: int):
+        n = len(_ASSIGNED_VARS)
+        self.block_size = max(n, -(-block_size // n) * n)
+        self._next = 0
+        self._end = 0  # exclusive
+        self._returned: list[int] = []
+        self._lock = threading.Lock()
+
+    def take(self, users: Collection) -> int:
+        with self._lock:
+            if self._returned:
+                return self._returned.pop()
+            if self._next >= self._end:
+                counter_doc = users.database["counters"].find_one_and_update(
+                    {"_id": "user_signup_round_robin"},
+                    {"$inc": {"seq": self.block_size}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+                last = int(counter_doc.get("seq", self.block_size))
+                self._next, self._end = last - self.block_size + 1, last + 1
+            seq = self._next
+            self._next += 1
+            return seq
+
+    def take_many(self, users: Collection, n: int) -> list[int]:
+        """n sequence numbers for a bulk enrollment, reserving at most one new
+        block (sized to cover whatever the current block can't)."""
+        with self._lock:
+            seqs = [self._returned.pop() for _ in range(min(n, len(self._returned)))]
+            from_current = min(n - len(seqs), self._end - self._next)
+            seqs.extend(range(self._next, self._next + from_current))
+            self._next += from_current
+            need = n - len(seqs)
+            if need:
+                size = max(self.block_size, -(-need // self.block_size) * self.block_size)
+                counter_doc = users.database["counters"].find_one_and_update(
+                    {"_id": "user_signup_round_robin"},
+                    {"$inc": {"seq": size}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+                last = int(counter_doc.get("seq", size))
+                start = last - size + 1
+                seqs.extend(range(start, start + need))
+                self._next, self._end = start + need, last + 1
+            return seqs
+
+    def give_back(self, seq: int) -> None:
+        with self._lock:
+            self._returned.append(seq)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._next = self._end = 0
+            self._returned.clear()
+
+
+signup_sequence = _SignupSequence(get_settings().SIGNUP_SEQ_BLOCK_SIZE)
+
+
+def assigned_var_for(seq: int) -> str:
+    return _ASSIGNED_VARS[(seq - 1) % len(_ASSIGNED_VARS)]
+
+
 def _next_assigned_var(users: Collection) -> str:
-    assigned_vars = [
-        AssignedVar.followup.value,
-        AssignedVar.double.value,
-        AssignedVar.links.value,
-    ]
-    counters = users.database["counters"]
-    counter_doc = counters.find_one_and_update(
-        {"_id": "user_signup_round_robin"},
-        {"$inc": {"seq": 1}},
-        upsert=True,
-        return_document=ReturnDocument.AFTER,
-    )
-    seq = int(counter_doc.get("seq", 1))
-    return assigned_vars[(seq - 1) % len(assigned_vars)]
+    return assigned_var_for(signup_sequence.take(users))
 
 
 def create_user(
@@ -83,15 +162,49 @@ def create_user(
     first_name: str,
     last_name: str,
     consent: bool,
+    password_hash: Optional[str] = None,
 ) -> UserPublic:
+    """Insert a new user. password_hash lets async callers hash on the bounded
+    hashing pool (core.security.hash_password_async) first; otherwise the
+    password is hashed inline."""
     if consent is not True:
         raise ValueError("Consent is required")
 
     now = datetime.now(timezone.utc)
+    seq = signup_sequence.take(users)
+    doc = new_user_doc(
+        email,
+        password_hash or hash_password(password),
+        first_name,
+        last_name,
+        assigned_var_for(seq),
+        now,
+    )
+
+    try:
+        res = users.insert_one(doc)
+    except DuplicateKeyError:
+        signup_sequence.give_back(seq)
+        raise
+    doc["_id"] = res.inserted_id
+    user_cache.invalidate(doc["email"])
 
-    doc = {
+    return _to_public(doc)
+
+
+def new_user_doc(
+    email: str,
+    password_hash: str,
+    first_name: str,
+    last_name: str,
+    assigned_var: str,
+    now: datetime,
+) -> dict:
+    """The users document for a fresh account, shared by signup and roster
+    enrollment (services/enrollment.py)."""
+    return {
         "email": email.strip().lower(),
-        "password_hash": hash_password(password),
+        "password_hash": password_hash,
         "first_name": first_name.strip(),
         "last_name": last_name.strip(),
         "consent": True,
@@ -106,26 +219,22 @@ def create_user(
         "quiz_variant_completed": False,
         "survey_post_variant_completed": False,
         "survey_stage": SurveyStage.pre_base.value,
+        "assigned_var": assigned_var,
         "demographics": {},
     }
 
-    res = users.insert_one(doc)
-    doc["_id"] = res.inserted_id
-
-    assigned_var = _next_assigned_var(users)
-    users.update_one({"_id": doc["_id"]}, {"$set": {"assigned_var": assigned_var}})
-    doc["assigned_var"] = assigned_var
-
-    return _to_public(doc)
-
 
 def maybe_touch_last_active(users: Collection, user_doc: dict) -> None:
-    """Update last_active_at only if more than _HEARTBEAT_DEBOUNCE has passed
-    since the last recorded value, to avoid a write on every single
+    """Record a last_active_at heartbeat only if more than _HEARTBEAT_DEBOUNCE
+    has passed since the last recorded value, to avoid one on every single
     authenticated request (get_current_user runs on every one).
+
+    The heartbeat is buffered, not written: the scheduler flushes the buffer
+    as a single bulk_write (see services/heartbeats.py), so no request pays
+    for a Mongo write. users is kept for the call signature only.
     """
     now = datetime.now(timezone.utc)
-    last = user_doc.get("last_active_at")
+    last = heartbeats.last_recorded(user_doc["_id"]) or user_doc.get("last_active_at")
     if last is not None:
         # pymongo returns stored datetimes as naive UTC by default (no tz_aware
         # codec option on this client) — attach tzinfo before subtracting, or a
@@ -135,12 +244,98 @@ def maybe_touch_last_active(users: Collection, user_doc: dict) -> None:
             last = last.replace(tzinfo=timezone.utc)
         if (now - last) < _HEARTBEAT_DEBOUNCE:
             return
-    users.update_one({"_id": user_doc["_id"]}, {"$set": {"last_active_at": now}})
+    heartbeats.record(user_doc["_id"], now)
+    # Patch rather than evict: the heartbeat is the only field that changed,
+    # and evicting would turn every debounced heartbeat into an extra read.
+    user_cache.update_fields(str(user_doc["_id"]), {"last_active_at": now})
 
 
 def find_user_by_email(users: Collection, email: str) -> Optional[dict]:
     return users.find_one({"email": email.lower()})
 
 
+def find_user_by_email_cached(users: Collection, email: str) -> Optional[dict]:
+    """find_user_by_email behind the per-process user cache. Only used on the
+    get_current_user hot path; writes elsewhere must invalidate the entry."""
+    doc = user_cache.get(email)
+    if doc is not None:
+        return doc
+    doc = find_user_by_email(users, email)
+    if doc:
+        user_cache.put(doc)
+    return doc
+
+
+def get_session_version(users: Collection, user_id: str) -> Optional[int]:
+    """Current session_version for a user, or None if the user no longer exists.
+
+    Served from session_versions while fresh; otherwise a projected read by
+    _id. Documents created before session_version existed count as version 0.
+    """
+    cached = session_versions.get(user_id)
+    if cached is not None:
+        return cached
+    try:
+        oid = ObjectId(user_id)
+    except (InvalidId, TypeError):
+        return None
+    doc = users.find_one({"_id": oid}, {"session_version": 1})
+    if not doc:
+        return None
+    version = int(doc.get("session_version", 0))
+    session_versions.put(user_id, version)
+    return version
+
+
+def bump_session_version(
+    users: Collection,
+    user_doc: dict,
+    extra_set: Optional[dict] = None,
+    match: Optional[dict] = None,
+) -> Optional[int]:
+    """Invalidate every claims-bearing token issued for this user so far.
+
+    Use for any write that changes a claim (is_admin, assigned_var) or that
+    should end other sessions (password change); extra_set is applied in the
+    same update. match adds conditions to the filter; if the document no
+    longer satisfies them (or is gone) nothing is written and None is
+    returned. Otherwise returns the new version so the caller can reissue
+    the current session's cookie.
+
+    The version is incremented in Mongo, not computed from user_doc, which
+    may be a stale cached copy: a bump racing another worker's still moves
+    the version past every token issued before either.
+    """
+    update: dict = {"$inc": {"session_version": 1}}
+    if extra_set:
+        update["$set"] = extra_set
+    doc = users.find_one_and_update(
+        {**(match or {}), "_id": user_doc["_id"]},
+        update,
+        projection={"session_version": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    user_cache.invalidate(user_doc["email"])
+    if doc is None:
+        return None
+    version = int(doc["session_version"])
+    session_versions.put(str(user_doc["_id"]), version)
+    return version
+
+
+def update_password_hash(users: Collection, user_doc: dict, new_hash: str) -> bool:
+    """Swap in a rehashed password (same password, new argon2 costs).
+
+    Matches on the old hash too, so a rehash racing a password change can never
+    overwrite the new password. Returns whether the hash was replaced.
+    """
+    result = users.update_one(
+        {"_id": user_doc["_id"], "password_hash": user_doc["password_hash"]},
+        {"$set": {"password_hash": new_hash}},
+    )
+    user_cache.invalidate(user_doc["email"])
+    return result.modified_count == 1
+
+
 def check_user_password(user_doc: dict, password: str) -> bool:
     return verify_password(password, user_doc["password_hash"])
@@ -0,0 +1,125 @@
+# backend/scripts/bench_history_assembly.py
+"""Benchmark prompt-history assembly on conversations of 5, 50 and 500 turns.
+
+Compares get_last_exchange (one projected query on the
+(conversation_id, role, created_at) index) against the previous per-turn
+lookup: one find for the assistant messages, then one find_one per
+exchange in the window. Needs a reachable MongoDB; the synthetic
+conversations go into a scratch collection that is dropped afterwards.
+Run from backend/:
+
+    python -m scripts.bench_history_assembly --repeat 200
+    python -m scripts.bench_history_assembly --turns 5 50 500 --agent
+
+--agent times the per-agent view /chat/double uses ('[AGENT A]').
+"""
+import argparse
+import re
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, MongoClient, monitoring
+
+from app.core.config import get_settings
+from app.services.chat import _format_assistant, get_last_exchange
+
+_COLLECTION = "bench_history_messages"
+
+
+class _CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name in ("find", "aggregate", "getMore"):
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _per_turn_lookup(col, conv_id, agent_prefix=None, recent_turns=3):
+    """The N+1 assembly get_last_exchange replaced, kept here for comparison."""
+    query = {"conversation_id": conv_id, "role": "assistant"}
+    if agent_prefix:
+        query["content"] = {"$elemMatch": {"$regex": f"^{re.escape(agent_prefix)}"}}
+    all_asst = list(col.find(query, sort=[("created_at", 1)]))
+    if not all_asst:
+        return []
+
+    def user_before(doc):
+        return col.find_one(
+            {"conversation_id": conv_id, "role": "user", "created_at": {"$lt": doc["created_at"]}},
+            sort=[("created_at", -1)],
+        )
+
+    window = [all_asst[0], *[d for d in all_asst[-recent_turns:] if d["_id"] != all_asst[0]["_id"]]]
+    history = []
+    for doc in window:
+        user = user_before(doc)
+        if user:
+            history += [{"role": "user", "content": user["content"]},
+                        {"role": "assistant", "content": _format_assistant(doc["content"])}]
+    return history
+
+
+def _seed(col, conv_id: str, turns: int) -> None:
+    t = datetime(2025, 1, 1)
+    docs = []
+    for turn in range(turns):
+        reply = [f"[AGENT A] answer {turn} " + "a" * 600, f"[AGENT B] answer {turn} " + "b" * 600]
+        docs.append({"conversation_id": conv_id, "role": "user", "content": f"question {turn} " + "q" * 200,
+                     "created_at": t + timedelta(seconds=2 * turn), "turn": turn})
+        docs.append({"conversation_id": conv_id, "role": "assistant", "content": reply, "agents": ["A", "B"],
+                     "created_at": t + timedelta(seconds=2 * turn + 1), "turn": turn})
+    col.insert_many(docs)
+
+
+def _measure(fn, counter, repeat):
+    times = []
+    counter.count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return counter.count / repeat, times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, nargs="+", default=[5, 50, 500])
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--agent", action="store_true", help="time the '[AGENT A]' view")
+    args = parser.parse_args()
+
+    settings = get_settings()
+    counter = _CommandCounter()
+    db = MongoClient(settings.MONGO_URL, event_listeners=[counter])[settings.MONGO_DB]
+    col = db[_COLLECTION]
+    col.drop()
+    col.create_index([("conversation_id", ASCENDING), ("role", ASCENDING), ("created_at", ASCENDING)])
+    prefix = "[AGENT A]" if args.agent else None
+
+    try:
+        print(f"{'turns':>6} {'assembly':<12} {'queries':>8} {'mean ms':>9} {'p95 ms':>8}")
+        for turns in args.turns:
+            conv_id = f"bench-{turns}"
+            _seed(col, conv_id, turns)
+            for name, fn in (
+                ("per-turn", lambda: _per_turn_lookup(col, conv_id, prefix)),
+                ("single", lambda: get_last_exchange(col, conv_id, prefix)),
+            ):
+                fn()  # warm up
+                queries, times = _measure(fn, counter, args.repeat)
+                p95 = sorted(times)[max(0, int(len(times) * 0.95) - 1)]
+                print(f"{turns:>6} {name:<12} {queries:>8.0f} {statistics.mean(times) * 1000:>9.2f} {p95 * 1000:>8.2f}")
+    finally:
+        col.drop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# backend/scripts/bench_login_burst.py
+"""Fire a burst of concurrent /auth/login requests at a running backend and
+report throughput and latency.
+
+The account must already exist. Run from backend/ against a dev server:
+
+    python -m scripts.bench_login_burst --base-url http://localhost:8000 \\
+        --email bench@test.edu --password bench-password --concurrency 200
+
+503 responses are the hashing pool's admission control shedding load (see
+HASH_WORKERS / HASH_QUEUE_LIMIT); they are counted separately from errors.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+async def _one_login(client: httpx.AsyncClient, email: str, password: str) -> tuple[int, float]:
+    start = time.perf_counter()
+    resp = await client.post("/auth/login", json={"email": email, "password": password})
+    return resp.status_code, time.perf_counter() - start
+
+
+async def run(base_url: str, email: str, password: str, concurrency: int) -> None:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120.0) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(_one_login(client, email, password) for _ in range(concurrency)),
+            return_exceptions=True,
+        )
+        elapsed = time.perf_counter() - start
+
+    ok = [lat for r in results if not isinstance(r, Exception) and r[0] == 200 for lat in [r[1]]]
+    shed = sum(1 for r in results if not isinstance(r, Exception) and r[0] == 503)
+    failed = len(results) - len(ok) - shed
+
+    print(f"requests:     {len(results)} in {elapsed:.2f}s")
+    print(f"succeeded:    {len(ok)}  shed (503): {shed}  failed: {failed}")
+    if ok:
+        print(f"logins/sec:   {len(ok) / elapsed:.1f}")
+        print(f"latency p50:  {statistics.median(ok) * 1000:.0f} ms")
+        print(f"latency p99:  {_percentile(ok, 99) * 1000:.0f} ms")
+        print(f"latency max:  {max(ok) * 1000:.0f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.base_url, args.email, args.password, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# backend/scripts/bench_sse_frames.py
+"""Benchmark SSE frames and server CPU per streamed chat reply.
+
+Starts a uvicorn server in a subprocess that streams synthetic replies
+through _stream_agent_tokens from a fake upstream (no network, no OpenAI
+key needed) emitting one small delta every --token-ms, and reads --streams
+of them concurrently over HTTP. Server CPU is the server process's own CPU
+time, so the client's work isn't counted. Compares:
+
+  per-delta/json   one json.dumps-encoded frame per upstream delta (the old path)
+  per-delta/tmpl   one templated frame per delta (coalescing disabled)
+  coalesced        deltas merged per --window-ms / --bytes, templated frames
+
+and, separately, raw encoder throughput (frames/sec with no pacing).
+Run from backend/:
+
+    python -m scripts.bench_sse_frames
+    python -m scripts.bench_sse_frames --streams 100 --tokens 600 --window-ms 50 --bytes 512
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("UF_OPENAI_API_KEY", "bench")
+
+import httpx  # noqa: E402
+
+from app.api import chat as chat_module  # noqa: E402
+from app.core.config import get_settings  # noqa: E402
+
+_WORDS = ("the ", "quiz ", "answer ", "is ", "B, ", "because ", "vectors ", "añadir ", "“x” ", "∑\n")
+_MODES = ("per-delta/json", "per-delta/tmpl", "coalesced")
+
+
+def _fake_create(tokens: int, token_ms: float):
+    async def create(**kwargs):
+        async def stream():
+            for i in range(tokens):
+                await asyncio.sleep(token_ms / 1000)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=_WORDS[i % len(_WORDS)]))])
+        return stream()
+    return create
+
+
+async def _json_per_delta():
+    # Frozen copy of the pre-coalescing token loop.
+    async for delta in chat_module._stream_ai([{"role": "user", "content": "hi"}]):
+        yield chat_module._sse({"type": "token", "content": delta, "agent": "A"})
+
+
+async def _current():
+    async for _, _, frame in chat_module._stream_agent_tokens([{"role": "user", "content": "hi"}], agent_tag="A"):
+        yield frame
+
+
+def _serve(args) -> None:
+    import uvicorn
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    settings = get_settings()
+    coalesce = args.mode == "coalesced"
+    settings.SSE_COALESCE_MS = args.window_ms if coalesce else 0
+    settings.SSE_COALESCE_BYTES = args.bytes if coalesce else 0
+    chat_module._client.chat.completions.create = _fake_create(args.tokens, args.token_ms)
+    frames = _json_per_delta if args.mode == "per-delta/json" else _current
+
+    app = FastAPI()
+
+    @app.get("/stream")
+    async def stream():
+        return StreamingResponse(frames(), media_type="text/event-stream")
+
+    @app.get("/cpu")
+    async def cpu():
+        return JSONResponse({"cpu": time.process_time()})
+
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+async def _load(port: int, streams: int) -> tuple[float, float, int, int]:
+    base = f"http://127.0.0.1:{port}"
+    async with httpx.AsyncClient(base_url=base, timeout=None, limits=httpx.Limits(max_connections=streams)) as client:
+        for _ in range(100):
+            try:
+                await client.get("/cpu")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+
+        async def one() -> tuple[int, int]:
+            frames = size = 0
+            async with client.stream("GET", "/stream") as resp:
+                async for chunk in resp.aiter_bytes():
+                    frames += chunk.count(b"\n\n")
+                    size += len(chunk)
+            return frames, size
+
+        cpu_before = (await client.get("/cpu")).json()["cpu"]
+        wall = time.perf_counter()
+        results = await asyncio.gather(*(one() for _ in range(streams)))
+        wall = time.perf_counter() - wall
+        cpu = (await client.get("/cpu")).json()["cpu"] - cpu_before
+    return cpu, wall, sum(f for f, _ in results), sum(b for _, b in results)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _encoder_rate(encode, deltas: list[str], seconds: float = 0.5) -> float:
+    n = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for d in deltas:
+            encode(d)
+        n += len(deltas)
+    return n / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=50, help="concurrent replies")
+    parser.add_argument("--tokens", type=int, default=400, help="upstream deltas per reply")
+    parser.add_argument("--token-ms", type=float, default=10.0, help="delay between upstream deltas")
+    parser.add_argument("--window-ms", type=int, default=30)
+    parser.add_argument("--bytes", type=int, default=256)
+    parser.add_argument("--mode", choices=_MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        _serve(args)
+        return
+
+    print(f"{args.streams} concurrent replies x {args.tokens} deltas, one every {args.token_ms:g} ms")
+    print(f"{'mode':<16} {'frames/reply':>12} {'bytes/reply':>12} {'frames/s':>10} {'server cpu ms/reply':>20}")
+    for mode in _MODES:
+        port = _free_port()
+        server = subprocess.Popen([
+            sys.executable, "-m", "scripts.bench_sse_frames", "--mode", mode, "--port", str(port),
+            "--tokens", str(args.tokens), "--token-ms", str(args.token_ms),
+            "--window-ms", str(args.window_ms), "--bytes", str(args.bytes),
+        ])
+        try:
+            cpu, wall, frames, size = asyncio.run(_load(port, args.streams))
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{mode:<16} {frames / args.streams:>12.1f} {size / args.streams:>12.0f} "
+              f"{frames / wall:>10.0f} {cpu * 1000 / args.streams:>20.2f}")
+
+    deltas = [_WORDS[i % len(_WORDS)] for i in range(1000)]
+    print("\nencoder throughput (frames/s, no pacing)")
+    for name, encode in (
+        ("json.dumps", lambda d: chat_module._sse({"type": "token", "content": d, "agent": "A"})),
+        ("template", lambda d: chat_module._token_frame(d, "A")),
+    ):
+        print(f"  {name:<12} {_encoder_rate(encode, deltas):>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
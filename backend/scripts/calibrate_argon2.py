@@ -0,0 +1,78 @@
+# backend/scripts/calibrate_argon2.py
+"""Measure argon2 hash time on this host and pick ARGON2_* costs that fit a
+per-hash latency budget.
+
+Run on the same dyno/container size the backend is deployed on:
+
+    python -m scripts.calibrate_argon2 --target-ms 250 --max-memory-mib 64
+
+Strategy: fix parallelism (each request hashes on one HASH_WORKERS thread, so
+lanes beyond a couple only add contention), start from the memory ceiling,
+and raise time_cost until the median hash reaches the target. If even
+time_cost=1 is over budget, memory is halved down to OWASP's 19 MiB floor.
+Prints the env lines to paste into .env; existing users are rehashed to the
+new costs on their next login.
+"""
+import argparse
+import statistics
+import time
+
+from argon2 import PasswordHasher
+
+# OWASP password storage cheat sheet minimum for argon2id.
+MIN_MEMORY_KIB = 19 * 1024
+MAX_TIME_COST = 10
+
+
+def measure_ms(time_cost: int, memory_cost: int, parallelism: int, samples: int) -> float:
+    hasher = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    hasher.hash("calibration-warmup")
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hasher.hash("calibration-password")
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate(target_ms: float, max_memory_kib: int, parallelism: int, samples: int) -> dict:
+    memory_cost = max_memory_kib
+    while True:
+        elapsed = measure_ms(1, memory_cost, parallelism, samples)
+        print(f"  t=1 m={memory_cost // 1024}MiB p={parallelism}: {elapsed:.0f} ms")
+        if elapsed <= target_ms or memory_cost // 2 < MIN_MEMORY_KIB:
+            break
+        memory_cost //= 2
+
+    time_cost = 1
+    while time_cost < MAX_TIME_COST:
+        elapsed = measure_ms(time_cost + 1, memory_cost, parallelism, samples)
+        print(f"  t={time_cost + 1} m={memory_cost // 1024}MiB p={parallelism}: {elapsed:.0f} ms")
+        if elapsed > target_ms:
+            break
+        time_cost += 1
+
+    return {
+        "ARGON2_TIME_COST": time_cost,
+        "ARGON2_MEMORY_COST": memory_cost,
+        "ARGON2_PARALLELISM": parallelism,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target-ms", type=float, default=250.0, help="per-hash latency budget")
+    parser.add_argument("--max-memory-mib", type=int, default=64, help="memory ceiling per hash")
+    parser.add_argument("--parallelism", type=int, default=1)
+    parser.add_argument("--samples", type=int, default=5, help="hashes timed per candidate")
+    args = parser.parse_args()
+
+    print(f"Calibrating argon2id for a {args.target_ms:.0f} ms budget...")
+    costs = calibrate(args.target_ms, args.max_memory_mib * 1024, args.parallelism, args.samples)
+    print("\nAdd to .env:")
+    for key, value in costs.items():
+        print(f"{key}={value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# backend/scripts/migrate_message_fields.py
+"""Backfill the turn/agents fields on chat messages saved before they existed.
+
+History assembly (services.chat.get_last_exchange) pairs a reply with the
+user message of the same turn and reads per-agent replies from "agents";
+older messages fall back to timestamp pairing and prefix matching until
+they are migrated. Also creates the (conversation_id, role, created_at)
+index the app builds at startup. Run from backend/ with the server's env
+(MONGO_URL, MONGO_DB):
+
+    python -m scripts.migrate_message_fields --dry-run
+    python -m scripts.migrate_message_fields
+
+Safe to re-run: only conversations that still have messages without a turn
+are rewritten.
+"""
+import argparse
+
+from pymongo import ASCENDING, MongoClient, UpdateOne
+
+from app.core.config import get_settings
+from app.services.chat import message_field_backfill
+
+_ROLES = {"$in": ["user", "assistant"]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="count the updates without writing them")
+    args = parser.parse_args()
+
+    settings = get_settings()
+    col = MongoClient(settings.MONGO_URL)[settings.MONGO_DB]["messages"]
+    if not args.dry_run:
+        col.create_index([("conversation_id", ASCENDING), ("role", ASCENDING), ("created_at", ASCENDING)])
+
+    conv_ids = col.distinct("conversation_id", {"role": _ROLES, "turn": {"$exists": False}})
+    print(f"{len(conv_ids)} conversations need migrating")
+
+    updated = 0
+    for i, conv_id in enumerate(conv_ids, 1):
+        # _id breaks created_at ties: the user message is always inserted first.
+        docs = list(col.find(
+            {"conversation_id": conv_id, "role": _ROLES},
+            {"role": 1, "content": 1, "turn": 1, "agents": 1},
+            sort=[("created_at", ASCENDING), ("_id", ASCENDING)],
+        ))
+        updates = message_field_backfill(docs)
+        if updates and not args.dry_run:
+            col.bulk_write([UpdateOne({"_id": _id}, {"$set": fields}) for _id, fields in updates], ordered=False)
+        updated += len(updates)
+        if i % 500 == 0:
+            print(f"  {i}/{len(conv_ids)} conversations, {updated} messages")
+
+    print(f"{'would update' if args.dry_run else 'updated'} {updated} messages")
+
+
+if __name__ == "__main__":
+    main()
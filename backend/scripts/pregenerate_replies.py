@@ -0,0 +1,68 @@
+# backend/scripts/pregenerate_replies.py
+"""Pre-generate first-turn chat replies for every active question.
+
+Covers each chat mode (default, followup, links, double agent A and B) with
+answer_incorrectly both false and true, and stores the replies in the
+llm_cache collection, where the chat endpoints replay them. Only entries
+whose question or prompt template changed since the last run are generated.
+Run from backend/ with the same env as the server (MONGO_URL, MONGO_DB,
+UF_OPENAI_*):
+
+    python -m scripts.pregenerate_replies --concurrency 4 --per-minute 60
+    python -m scripts.pregenerate_replies --dry-run
+
+Modes opted out through LLM_CACHE_DISABLED_VARIANTS are skipped, since the
+endpoints would never read them. Nothing is generated (or pruned) unless
+LLM_CACHE_ENABLED is set.
+"""
+import argparse
+import asyncio
+
+from pymongo import MongoClient
+
+from app.api.chat import FIRST_TURN_MODES, first_turn_messages, _stream_ai
+from app.core.config import get_settings
+from app.services.knowledge_links import get_knowledge_links_collection, reload_knowledge_links_cache
+from app.services.llm_cache import get_llm_cache_collection, ensure_indexes, llm_cache
+from app.services.pregen import plan_jobs, pending_jobs, prune_stale, run_pregeneration
+from app.services.questions import get_questions_collection
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--per-minute", type=int, default=60, help="upstream requests started per minute (0 = unlimited)")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be generated and pruned")
+    args = parser.parse_args()
+
+    if not llm_cache.enabled:
+        print("LLM_CACHE_ENABLED is off, the chat endpoints would never replay pre-generated replies")
+        return
+
+    settings = get_settings()
+    db = MongoClient(settings.MONGO_URL)[settings.MONGO_DB]
+    col = get_llm_cache_collection(db)
+    ensure_indexes(col)
+
+    questions = list(get_questions_collection(db).find({"active": {"$ne": False}}))
+    knowledge_links = reload_knowledge_links_cache(get_knowledge_links_collection(db))
+    modes = [m for m, variant in FIRST_TURN_MODES.items() if llm_cache.enabled_for(variant)]
+
+    def build(mode, message, answer_incorrectly, has_choices):
+        return first_turn_messages(mode, message, answer_incorrectly, has_choices, knowledge_links)
+
+    jobs = plan_jobs(questions, modes, build)
+    todo = pending_jobs(col, jobs)
+    print(f"{len(questions)} questions x {len(modes)} modes x 2 -> {len(jobs)} entries, {len(todo)} to generate")
+    if args.dry_run:
+        stale = col.count_documents({"pregenerated": True, "_id": {"$nin": [j["key"] for j in jobs]}})
+        print(f"{stale} stale entries would be pruned")
+        return
+
+    counts = asyncio.run(run_pregeneration(col, todo, _stream_ai, args.concurrency, args.per_minute))
+    pruned = prune_stale(col, jobs)
+    print(f"generated={counts['generated']} failed={counts['failed']} pruned={pruned}")
+
+
+if __name__ == "__main__":
+    main()
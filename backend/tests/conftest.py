@@ -15,6 +15,55 @@ from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
 from app.schemas.user import UserPublic, SurveyStage, AssignedVar
+from app.services.user_cache import user_cache, session_versions
+from app.services.heartbeats import heartbeats
+from app.core.security import token_memo
+from app.services.users import signup_sequence
+from app.services.llm_cache import llm_cache
+from app.services.speculation import speculation
+from app.services.history_cache import history_cache
+from app.services.message_writer import message_writer
+from app.services.llm_gate import llm_gate
+from app.services.upstream_stats import upstream_stats
+from app.services.reply_metrics import reply_latency
+from app.services.stream_replay import stream_replay
+from app.services.idempotency import idempotency
+from app.services.single_flight import single_flight
+from app.services.upstream_deadlines import upstream_deadlines
+from app.services.model_routes import model_router
+
+
+# ── In-process caches ────────────────────────────────────────────────────────
+
+def _clear_in_process_caches():
+    user_cache.clear()
+    session_versions.clear()
+    heartbeats.clear()
+    token_memo.clear()
+    signup_sequence.clear()
+    llm_cache.clear()
+    speculation.clear()
+    history_cache.clear()
+    llm_gate.clear()
+    upstream_stats.clear()
+    reply_latency.clear()
+    stream_replay.clear()
+    idempotency.clear()
+    single_flight.clear()
+    upstream_deadlines.clear()
+    model_router.clear()
+
+
+@pytest.fixture(autouse=True)
+def _reset_in_process_caches():
+    """Module-level caches outlive a single test; clear them so a document
+    cached by one test's mocked collection can't leak into the next."""
+    _clear_in_process_caches()
+    yield
+    # app.main's startup (test_main) starts the background message writer.
+    message_writer.stop()
+    message_writer.clear()
+    _clear_in_process_caches()
 
 
 # ── Shared user fixtures ─────────────────────────────────────────────────────
@@ -5,14 +5,23 @@ from unittest.mock import MagicMock
 
 import pytest
 from bson import ObjectId
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.testclient import TestClient
 from pymongo.errors import DuplicateKeyError
 
-from app.api.auth import router as auth_router, get_current_user
+from fastapi import HTTPException
+
+from app.api.auth import (
+    router as auth_router,
+    get_current_user,
+    get_current_user_doc,
+    get_session_user,
+    create_session_token,
+)
 from app.core.config import get_settings
-from app.core.security import create_access_token, hash_password
-from app.schemas.user import AssignedVar, SurveyStage, UserPublic
+from app.core.security import create_access_token, hash_password, verify_password
+from app.schemas.user import AssignedVar, SessionUser, SurveyStage, UserPublic
+from app.services.user_cache import user_cache
 
 
 # ── Local app/fixtures (do not touch conftest.py) ────────────────────────────
@@ -43,12 +52,22 @@ def auth_client(auth_app):
 
 
 @pytest.fixture
-def overridden_app(auth_mock_db, regular_user):
-    """Auth app with get_current_user overridden to a fixed regular_user."""
+def overridden_app(auth_mock_db, auth_mock_col, regular_user):
+    """Auth app with get_current_user overridden to a fixed regular_user, and
+    get_current_user_doc serving whatever document the test puts in
+    auth_mock_col.find_one (the one users read a request makes)."""
     app = FastAPI()
     app.include_router(auth_router)
     app.state.db = auth_mock_db
     app.dependency_overrides[get_current_user] = lambda: regular_user
+
+    def current_doc():
+        doc = auth_mock_col.find_one.return_value
+        if doc is None:
+            raise HTTPException(status_code=401, detail="User not found")
+        return doc
+
+    app.dependency_overrides[get_current_user_doc] = current_doc
     return app
 
 
@@ -148,6 +167,19 @@ class TestSignup:
         assert "consent" in resp.json()["detail"].lower()
         auth_mock_col.insert_one.assert_not_called()
 
+    def test_hashing_queue_full_returns_503(self, auth_client, auth_mock_col, monkeypatch):
+        import threading
+        from app.core import security
+
+        monkeypatch.setattr(security, "_hash_slots", threading.BoundedSemaphore(1))
+        security._hash_slots.acquire()
+
+        resp = auth_client.post("/auth/signup", json=VALID_SIGNUP_PAYLOAD)
+
+        assert resp.status_code == 503
+        assert "retry-after" in resp.headers
+        auth_mock_col.insert_one.assert_not_called()
+
     def test_duplicate_email_returns_400(self, auth_client, auth_mock_col):
         auth_mock_col.insert_one.side_effect = DuplicateKeyError("E11000 duplicate key error")
 
@@ -178,6 +210,35 @@ class TestLogin:
         settings = get_settings()
         assert settings.COOKIE_NAME in resp.cookies
 
+    def test_outdated_hash_is_rehashed_after_login(self, auth_client, auth_mock_col):
+        from argon2 import PasswordHasher
+
+        old_hash = PasswordHasher(time_cost=1, memory_cost=8 * 1024, parallelism=1).hash("correct-password")
+        doc = make_user_doc(email="student@test.edu", password_hash=old_hash)
+        auth_mock_col.find_one.return_value = doc
+
+        resp = auth_client.post("/auth/login", json={
+            "email": "student@test.edu",
+            "password": "correct-password",
+        })
+
+        assert resp.status_code == 200
+        query, update = auth_mock_col.update_one.call_args[0]
+        assert query == {"_id": doc["_id"], "password_hash": old_hash}
+        new_hash = update["$set"]["password_hash"]
+        assert new_hash != old_hash
+        assert verify_password("correct-password", new_hash)
+
+    def test_current_hash_is_not_rehashed(self, auth_client, auth_mock_col):
+        auth_mock_col.find_one.return_value = make_user_doc(email="student@test.edu")
+
+        auth_client.post("/auth/login", json={
+            "email": "student@test.edu",
+            "password": "correct-password",
+        })
+
+        auth_mock_col.update_one.assert_not_called()
+
     def test_wrong_password_returns_401(self, auth_client, auth_mock_col):
         doc = make_user_doc(email="student@test.edu", password="correct-password")
         auth_mock_col.find_one.return_value = doc
@@ -190,6 +251,22 @@ class TestLogin:
         assert resp.status_code == 401
         assert resp.json()["detail"] == "Invalid credentials"
 
+    def test_hashing_queue_full_returns_503_with_retry_after(self, auth_client, auth_mock_col, monkeypatch):
+        import threading
+        from app.core import security
+
+        monkeypatch.setattr(security, "_hash_slots", threading.BoundedSemaphore(1))
+        security._hash_slots.acquire()
+        auth_mock_col.find_one.return_value = make_user_doc(email="student@test.edu")
+
+        resp = auth_client.post("/auth/login", json={
+            "email": "student@test.edu",
+            "password": "correct-password",
+        })
+
+        assert resp.status_code == 503
+        assert resp.headers["retry-after"] == str(get_settings().HASH_RETRY_AFTER_SECONDS)
+
     def test_nonexistent_user_returns_401(self, auth_client, auth_mock_col):
         auth_mock_col.find_one.return_value = None
 
@@ -264,10 +341,22 @@ class TestMe:
 
         auth_client.get("/auth/me")
 
-        auth_mock_col.update_one.assert_called_once()
-        args = auth_mock_col.update_one.call_args[0]
-        assert args[0] == {"_id": doc["_id"]}
-        assert "last_active_at" in args[1]["$set"]
+        from app.services.heartbeats import heartbeats
+        assert heartbeats.pending_for(doc["_id"]) is not None
+        auth_mock_col.update_one.assert_not_called()
+
+
+    def test_second_request_served_from_user_cache(self, auth_client, auth_mock_col):
+        settings = get_settings()
+        doc = make_user_doc(email="student@test.edu")
+        auth_client.cookies.set(settings.COOKIE_NAME, create_access_token("student@test.edu"))
+        auth_mock_col.find_one.return_value = doc
+
+        assert auth_client.get("/auth/me").status_code == 200
+        assert auth_client.get("/auth/me").status_code == 200
+
+        auth_mock_col.find_one.assert_called_once()
+        assert user_cache.hits == 1
 
 
 # ═══════════════════════════════════════════════════════════════════════════
@@ -314,6 +403,15 @@ class TestRecordConsentAgreement:
         assert "consent_agreed_at" in set_doc
         assert "updated_at" in set_doc
 
+    def test_invalidates_cached_user(self, overridden_client, auth_mock_col, regular_user):
+        doc = make_user_doc(email=regular_user.email)
+        auth_mock_col.find_one.return_value = doc
+        user_cache.put(doc)
+
+        overridden_client.post("/auth/consent", json={"consent_text": "I agree"})
+
+        assert user_cache.get(regular_user.email) is None
+
     def test_empty_consent_text_returns_422(self, overridden_client):
         resp = overridden_client.post("/auth/consent", json={"consent_text": ""})
         assert resp.status_code == 422
@@ -322,14 +420,24 @@ class TestRecordConsentAgreement:
         resp = overridden_client.post("/auth/consent", json={})
         assert resp.status_code == 422
 
-    def test_user_not_found_returns_404(self, overridden_client, auth_mock_col):
+    def test_user_not_found_returns_401(self, overridden_client, auth_mock_col):
         auth_mock_col.find_one.return_value = None
 
         resp = overridden_client.post("/auth/consent", json={"consent_text": "Some text"})
 
-        assert resp.status_code == 404
+        assert resp.status_code == 401
         assert resp.json()["detail"] == "User not found"
 
+    def test_reads_user_once_per_request(self, auth_client, auth_mock_col):
+        doc = make_user_doc(email="student@test.edu")
+        auth_mock_col.find_one.return_value = doc
+        auth_client.cookies.set(get_settings().COOKIE_NAME, create_access_token(doc["email"]))
+
+        resp = auth_client.post("/auth/consent", json={"consent_text": "I agree"})
+
+        assert resp.status_code == 200
+        auth_mock_col.find_one.assert_called_once()
+
     def test_requires_authentication(self, auth_client):
         resp = auth_client.post("/auth/consent", json={"consent_text": "Some text"})
         assert resp.status_code == 401
@@ -375,6 +483,15 @@ class TestRecordConsentDecline:
         assert "consent_declined_at" in set_doc
         assert "updated_at" in set_doc
 
+    def test_invalidates_cached_user(self, overridden_client, auth_mock_col, regular_user):
+        doc = make_user_doc(email=regular_user.email)
+        auth_mock_col.find_one.return_value = doc
+        user_cache.put(doc)
+
+        overridden_client.post("/auth/decline", json={"consent_text": "I decline"})
+
+        assert user_cache.get(regular_user.email) is None
+
     def test_empty_consent_text_returns_422(self, overridden_client):
         resp = overridden_client.post("/auth/decline", json={"consent_text": ""})
         assert resp.status_code == 422
@@ -383,12 +500,12 @@ class TestRecordConsentDecline:
         resp = overridden_client.post("/auth/decline", json={})
         assert resp.status_code == 422
 
-    def test_user_not_found_returns_404(self, overridden_client, auth_mock_col):
+    def test_user_not_found_returns_401(self, overridden_client, auth_mock_col):
         auth_mock_col.find_one.return_value = None
 
         resp = overridden_client.post("/auth/decline", json={"consent_text": "Some text"})
 
-        assert resp.status_code == 404
+        assert resp.status_code == 401
         assert resp.json()["detail"] == "User not found"
 
     def test_requires_authentication(self, auth_client):
@@ -420,6 +537,7 @@ class TestChangePassword:
     def test_successful_change(self, overridden_client, auth_mock_col, regular_user):
         doc = make_user_doc(email=regular_user.email, password="old-password")
         auth_mock_col.find_one.return_value = doc
+        auth_mock_col.find_one_and_update.return_value = {"_id": doc["_id"], "session_version": 1}
 
         resp = overridden_client.post("/auth/change-password", json={
             "current_password": "old-password",
@@ -429,12 +547,24 @@ class TestChangePassword:
         assert resp.status_code == 200
         assert resp.json() == {"ok": True}
 
-        # update_one called with new password_hash set
-        args, _ = auth_mock_col.update_one.call_args
-        assert args[0] == {"_id": doc["_id"]}
+        # find_one_and_update called with new password_hash set, guarded on the old one
+        args, _ = auth_mock_col.find_one_and_update.call_args
+        assert args[0] == {"_id": doc["_id"], "password_hash": doc["password_hash"]}
         assert "password_hash" in args[1]["$set"]
         assert args[1]["$set"]["password_hash"] != doc["password_hash"]
 
+    def test_invalidates_cached_user(self, overridden_client, auth_mock_col, regular_user):
+        doc = make_user_doc(email=regular_user.email, password="old-password")
+        auth_mock_col.find_one.return_value = doc
+        user_cache.put(doc)
+
+        overridden_client.post("/auth/change-password", json={
+            "current_password": "old-password",
+            "new_password": "new-password-123",
+        })
+
+        assert user_cache.get(regular_user.email) is None
+
     def test_wrong_current_password_returns_400(self, overridden_client, auth_mock_col, regular_user):
         doc = make_user_doc(email=regular_user.email, password="old-password")
         auth_mock_col.find_one.return_value = doc
@@ -446,7 +576,7 @@ class TestChangePassword:
 
         assert resp.status_code == 400
         assert resp.json()["detail"] == "Current password is incorrect"
-        auth_mock_col.update_one.assert_not_called()
+        auth_mock_col.find_one_and_update.assert_not_called()
 
     def test_weak_new_password_returns_422(self, overridden_client, auth_mock_col, regular_user):
         doc = make_user_doc(email=regular_user.email, password="old-password")
@@ -459,7 +589,7 @@ class TestChangePassword:
 
         assert resp.status_code == 422
 
-    def test_user_not_found_returns_404(self, overridden_client, auth_mock_col):
+    def test_user_not_found_returns_401(self, overridden_client, auth_mock_col):
         auth_mock_col.find_one.return_value = None
 
         resp = overridden_client.post("/auth/change-password", json={
@@ -467,5 +597,169 @@ class TestChangePassword:
             "new_password": "new-password-123",
         })
 
-        assert resp.status_code == 404
+        assert resp.status_code == 401
         assert resp.json()["detail"] == "User not found"
+
+    def test_password_changed_elsewhere_returns_409(self, overridden_client, auth_mock_col, regular_user):
+        auth_mock_col.find_one.return_value = make_user_doc(email=regular_user.email, password="old-password")
+        auth_mock_col.find_one_and_update.return_value = None
+
+        resp = overridden_client.post("/auth/change-password", json={
+            "current_password": "old-password",
+            "new_password": "new-password-123",
+        })
+
+        assert resp.status_code == 409
+        assert get_settings().COOKIE_NAME not in resp.cookies
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Session claims: create_session_token / get_session_user
+# ═══════════════════════════════════════════════════════════════════════════
+
+@pytest.fixture
+def claims_enabled(monkeypatch):
+    monkeypatch.setattr(get_settings(), "SESSION_CLAIMS_ENABLED", True)
+
+
+@pytest.fixture
+def session_client(auth_mock_db):
+    """App with one route that authorizes through get_session_user."""
+    app = FastAPI()
+    app.include_router(auth_router)
+    app.state.db = auth_mock_db
+
+    @app.get("/whoami")
+    def whoami(user: SessionUser = Depends(get_session_user)):
+        return user.model_dump()
+
+    return TestClient(app)
+
+
+def _claims_token(doc, session_version=0):
+    return create_session_token(
+        UserPublic(id=str(doc["_id"]), email=doc["email"], assigned_var=doc["assigned_var"]),
+        session_version,
+    )
+
+
+class TestCreateSessionToken:
+    def test_email_only_when_claims_disabled(self):
+        from app.core.security import decode_token
+
+        token = create_session_token(UserPublic(id="u1", email="a@test.edu"))
+        assert "uid" not in decode_token(token)
+
+    def test_carries_claims_when_enabled(self, claims_enabled):
+        from app.core.security import decode_token
+
+        user = UserPublic(id="u1", email="a@test.edu", is_admin=True, assigned_var=AssignedVar.double)
+        payload = decode_token(create_session_token(user, 4))
+
+        assert payload["sub"] == "a@test.edu"
+        assert payload["uid"] == "u1"
+        assert payload["adm"] is True
+        assert payload["var"] == "double"
+        assert payload["sv"] == 4
+
+    def test_login_issues_claims_token(self, claims_enabled, auth_client, auth_mock_col):
+        from app.core.security import decode_token
+
+        doc = make_user_doc(session_version=3)
+        auth_mock_col.find_one.return_value = doc
+
+        resp = auth_client.post("/auth/login", json={"email": doc["email"], "password": "correct-password"})
+
+        payload = decode_token(resp.cookies[get_settings().COOKIE_NAME])
+        assert payload["uid"] == str(doc["_id"])
+        assert payload["sv"] == 3
+
+
+class TestGetSessionUser:
+    def test_claims_token_authorizes_from_claims(self, claims_enabled, session_client, auth_mock_col):
+        doc = make_user_doc(assigned_var=AssignedVar.links.value)
+        auth_mock_col.find_one.return_value = {"_id": doc["_id"], "session_version": 0}
+        session_client.cookies.set(get_settings().COOKIE_NAME, _claims_token(doc))
+
+        resp = session_client.get("/whoami")
+
+        assert resp.status_code == 200
+        assert resp.json()["id"] == str(doc["_id"])
+        assert resp.json()["assigned_var"] == "links"
+        # Only the projected version check touches Mongo.
+        auth_mock_col.find_one.assert_called_once_with({"_id": doc["_id"]}, {"session_version": 1})
+
+    def test_version_check_is_cached(self, claims_enabled, session_client, auth_mock_col):
+        doc = make_user_doc()
+        auth_mock_col.find_one.return_value = {"_id": doc["_id"], "session_version": 0}
+        session_client.cookies.set(get_settings().COOKIE_NAME, _claims_token(doc))
+
+        session_client.get("/whoami")
+        session_client.get("/whoami")
+
+        auth_mock_col.find_one.assert_called_once()
+
+    def test_heartbeat_debounce_survives_a_flush(self, claims_enabled, session_client, auth_mock_col):
+        from app.services.heartbeats import heartbeats
+
+        doc = make_user_doc()
+        auth_mock_col.find_one.return_value = {"_id": doc["_id"], "session_version": 0}
+        session_client.cookies.set(get_settings().COOKIE_NAME, _claims_token(doc))
+
+        session_client.get("/whoami")
+        heartbeats.flush(MagicMock())
+        session_client.get("/whoami")
+
+        assert heartbeats.stats()["recorded"] == 1
+
+    def test_stale_session_version_returns_401(self, claims_enabled, session_client, auth_mock_col):
+        doc = make_user_doc()
+        auth_mock_col.find_one.return_value = {"_id": doc["_id"], "session_version": 1}
+        session_client.cookies.set(get_settings().COOKIE_NAME, _claims_token(doc, session_version=0))
+
+        resp = session_client.get("/whoami")
+
+        assert resp.status_code == 401
+        assert resp.json()["detail"] == "Session expired"
+
+    def test_deleted_user_returns_401(self, claims_enabled, session_client, auth_mock_col):
+        doc = make_user_doc()
+        auth_mock_col.find_one.return_value = None
+        session_client.cookies.set(get_settings().COOKIE_NAME, _claims_token(doc))
+
+        resp = session_client.get("/whoami")
+
+        assert resp.status_code == 401
+
+    def test_email_only_token_falls_back_to_user_lookup(self, session_client, auth_mock_col):
+        doc = make_user_doc(assigned_var=AssignedVar.double.value)
+        auth_mock_col.find_one.return_value = doc
+        session_client.cookies.set(get_settings().COOKIE_NAME, create_access_token(doc["email"]))
+
+        resp = session_client.get("/whoami")
+
+        assert resp.status_code == 200
+        assert resp.json()["assigned_var"] == "double"
+        auth_mock_col.find_one.assert_called_once_with({"email": doc["email"]})
+
+    def test_no_cookie_returns_401(self, session_client):
+        assert session_client.get("/whoami").status_code == 401
+
+
+class TestChangePasswordSessionVersion:
+    def test_bumps_session_version_and_reissues_cookie(self, claims_enabled, overridden_client, auth_mock_col, regular_user):
+        from app.core.security import decode_token
+
+        doc = make_user_doc(email=regular_user.email, password="old-password", session_version=2)
+        auth_mock_col.find_one.return_value = doc
+        auth_mock_col.find_one_and_update.return_value = {"_id": doc["_id"], "session_version": 3}
+
+        resp = overridden_client.post("/auth/change-password", json={
+            "current_password": "old-password",
+            "new_password": "new-password-123",
+        })
+
+        update = auth_mock_col.find_one_and_update.call_args[0][1]
+        assert update["$inc"] == {"session_version": 1}
+        assert "password_hash" in update["$set"]
+        assert decode_token(resp.cookies[get_settings().COOKIE_NAME])["sv"] == 3
@@ -7,6 +7,7 @@ network calls are made. MongoDB collections are MagicMocks.
 """
 import asyncio
 import json
+import re
 from datetime import datetime, timezone
 from types import SimpleNamespace
 from unittest.mock import AsyncMock, MagicMock
@@ -17,9 +18,11 @@ from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
 from app.api import chat as chat_module
-from app.api.auth import get_current_user
+from app.api.auth import get_session_user
+from app.core.config import get_settings
 from app.schemas.user import UserPublic
 from app.schemas.question import QuestionChoice
+from app.services.reply_metrics import ReplyMeter
 
 
 # ── Fake OpenAI streaming helpers ────────────────────────────────────────────
@@ -36,8 +39,11 @@ class _FakeStream:
     iterated independently by concurrent consumers (e.g. /chat/double).
     """
 
-    def __init__(self, tokens):
+    def __init__(self, tokens, hang=False, usage=None):
         self._tokens = tokens
+        self._hang = hang
+        self._usage = usage
+        self.closed = False
 
     def __aiter__(self):
         return self._gen()
@@ -45,6 +51,15 @@ class _FakeStream:
     async def _gen(self):
         for t in self._tokens:
             yield _FakeChunk(t)
+        if self._usage is not None:
+            # stream_options.include_usage: a final chunk with no choices.
+            yield SimpleNamespace(choices=[], usage=self._usage, model="gpt-test")
+        if self._hang:
+            # A reply that is still being generated.
+            await asyncio.Event().wait()
+
+    async def close(self):
+        self.closed = True
 
 
 def _mock_create(tokens):
@@ -79,17 +94,55 @@ def _parse_sse(body: str) -> list[dict]:
         chunk = chunk.strip()
         if not chunk:
             continue
+        if chunk.startswith("id: "):
+            chunk = chunk.split("\n", 1)[1]
         assert chunk.startswith("data: ")
         events.append(json.loads(chunk[len("data: "):]))
     return events
 
 
+async def _post_until_disconnect(
+    app, path: str, body: dict, marker: bytes = b'"type": "token"', headers: tuple = (),
+) -> list[bytes]:
+    """Drive app over raw ASGI, disconnecting once a body chunk containing
+    marker has been sent. Returns the body chunks sent."""
+    sent: list[bytes] = []
+    gone = asyncio.Event()
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}
+        await gone.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            sent.append(message.get("body", b""))
+            if marker in message.get("body", b""):
+                gone.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), *headers], "client": ("test", 1), "server": ("test", 80),
+    }
+    await app(scope, receive, send)
+    for _ in range(5):
+        await asyncio.sleep(0)
+    return sent
+
+
 # ── App fixtures ──────────────────────────────────────────────────────────────
 
 @pytest.fixture
 def chat_col():
     col = MagicMock()
     col.find.return_value = []
+    col.find_one.return_value = None
+    col.count_documents.return_value = 0
     return col
 
 
@@ -99,7 +152,7 @@ def chat_app(regular_user, chat_col):
     app.include_router(chat_module.router)
     app.state.messages = chat_col
     app.state.knowledge_links = []
-    app.dependency_overrides[get_current_user] = lambda: regular_user
+    app.dependency_overrides[get_session_user] = lambda: regular_user
     return app
 
 
@@ -279,8 +332,40 @@ class TestSaveMessage:
 # ── _save_exchange ────────────────────────────────────────────────────────────
 
 class TestSaveExchange:
+    def test_queues_to_background_writer_when_running(self, monkeypatch):
+        from app.services.history_cache import history_cache
+
+        writer = MagicMock(running=True)
+        monkeypatch.setattr(chat_module, "message_writer", writer)
+        col = MagicMock()
+        user = UserPublic(id="u1", email="a@b.com", is_admin=False)
+        history_cache.fill("conv1", None, [], 0)
+
+        asyncio.run(chat_module._save_exchange(
+            col, user, "conv1", "hello", ["[AGENT A] hi"], {"answer_incorrectly": False}, question_id="q1", trigger="manual",
+        ))
+
+        col.insert_one.assert_not_called()
+        user_doc, assistant_doc = writer.enqueue.call_args.args
+        assert (user_doc["role"], user_doc["content"], user_doc["trigger"]) == ("user", "hello", "manual")
+        assert assistant_doc["agents"] == ["A"]
+        assert assistant_doc["question_id"] == "q1"
+        assert "trigger" not in assistant_doc
+        assert history_cache.lookup("conv1")[0][0] == {"role": "user", "content": "hello"}
+
+    def test_turn_count_failure_still_saves(self):
+        col = MagicMock()
+        col.count_documents.side_effect = RuntimeError("db down")
+        user = UserPublic(id="u1", email="a@b.com", is_admin=False)
+
+        asyncio.run(chat_module._save_exchange(col, user, "conv1", "hello", ["hi there"]))
+
+        user_doc, assistant_doc = (c.args[0] for c in col.insert_one.call_args_list)
+        assert "turn" not in user_doc and "turn" not in assistant_doc
+
     def test_saves_user_then_assistant(self):
         col = MagicMock()
+        col.count_documents.return_value = 2
         user = UserPublic(id="u1", email="a@b.com", is_admin=False)
 
         asyncio.run(
@@ -295,6 +380,8 @@ class TestSaveExchange:
         assert assistant_doc["role"] == "assistant"
         assert assistant_doc["content"] == ["hi there"]
         assert assistant_doc["metadata"] == {"answer_incorrectly": False}
+        assert user_doc["turn"] == assistant_doc["turn"] == 2
+        assert "agents" not in assistant_doc
         # regression: both docs must be BSON-encodable (real pymongo would raise otherwise)
         bson.encode(user_doc)
         bson.encode(assistant_doc)
@@ -370,6 +457,248 @@ class TestStreamAi:
 
         assert asyncio.run(collect()) == ["Hello", " world"]
 
+    def test_requests_usage_and_hands_it_to_meter(self, monkeypatch):
+        usage = SimpleNamespace(prompt_tokens=12, completion_tokens=3)
+        create_mock = AsyncMock(return_value=_FakeStream(["Hello"], usage=usage))
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+        meter = ReplyMeter()
+
+        async def collect():
+            return [d async for d in chat_module._stream_ai([{"role": "user", "content": "hi"}], meter=meter)]
+
+        assert asyncio.run(collect()) == ["Hello"]
+        assert create_mock.call_args.kwargs["stream_options"] == {"include_usage": True}
+        assert (meter.input_tokens, meter.output_tokens, meter.model) == (12, 3, "gpt-test")
+
+    def test_usage_request_can_be_turned_off(self, monkeypatch):
+        monkeypatch.setattr(get_settings(), "LLM_STREAM_USAGE", False)
+        create_mock = _mock_create(["Hello"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        async def collect():
+            return [d async for d in chat_module._stream_ai([{"role": "user", "content": "hi"}])]
+
+        asyncio.run(collect())
+        assert "stream_options" not in create_mock.call_args.kwargs
+
+
+class TestUpstreamDeadlines:
+    @staticmethod
+    def _timed_stream(tokens, first_delay=0.0, gap=0.0):
+        stream = _FakeStream(tokens)
+
+        async def gen():
+            await asyncio.sleep(first_delay)
+            for i, t in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(gap)
+                yield _FakeChunk(t)
+
+        stream._gen = gen
+        return stream
+
+    @staticmethod
+    def _hedging(monkeypatch, delay_ms=20):
+        from app.services.upstream_deadlines import upstream_deadlines
+
+        monkeypatch.setattr(upstream_deadlines, "hedge_enabled", True)
+        monkeypatch.setattr(upstream_deadlines, "hedge_min_ms", delay_ms)
+        for _ in range(20):
+            upstream_deadlines.record_first_token(1)
+        return upstream_deadlines
+
+    def test_first_token_deadline(self, monkeypatch):
+        from app.services.upstream_deadlines import upstream_deadlines, UpstreamTimeoutError
+
+        monkeypatch.setattr(upstream_deadlines, "ttft_seconds", 0.05)
+        stream = self._timed_stream(["Hello"], first_delay=5)
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", AsyncMock(return_value=stream))
+
+        async def collect():
+            return [d async for d in chat_module._stream_ai([{"role": "user", "content": "hi"}])]
+
+        with pytest.raises(UpstreamTimeoutError):
+            asyncio.run(collect())
+        assert stream.closed
+        assert upstream_deadlines.stats()["ttft_timeouts"] == 1
+
+    def test_inter_token_deadline(self, monkeypatch):
+        from app.services.upstream_deadlines import upstream_deadlines, UpstreamTimeoutError
+
+        monkeypatch.setattr(upstream_deadlines, "idle_seconds", 0.05)
+        stream = _FakeStream(["Hello"], hang=True)
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", AsyncMock(return_value=stream))
+        got = []
+
+        async def collect():
+            async for d in chat_module._stream_ai([{"role": "user", "content": "hi"}]):
+                got.append(d)
+
+        with pytest.raises(UpstreamTimeoutError):
+            asyncio.run(collect())
+        assert got == ["Hello"]
+        assert stream.closed
+        assert upstream_deadlines.stats()["idle_timeouts"] == 1
+
+    def test_hedge_overtakes_slow_first_request(self, monkeypatch):
+        deadlines = self._hedging(monkeypatch)
+        slow = self._timed_stream(["slow"], first_delay=0.3)
+        fast = self._timed_stream(["fast", " reply"])
+        create_mock = AsyncMock(side_effect=[slow, fast])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        async def run():
+            got = [d async for d in chat_module._stream_ai([{"role": "user", "content": "hi"}], hedge=True)]
+            await asyncio.gather(*chat_module._overtaken)  # until the slow request's own first token
+            return got
+
+        assert asyncio.run(run()) == ["fast", " reply"]
+        assert create_mock.call_count == 2
+        assert slow.closed
+        stats = deadlines.stats()
+        assert (stats["hedged"], stats["hedge_wins"]) == (1, 1)
+        assert stats["hedge_saved_ms_avg"] > 0
+        assert chat_module.llm_gate.active == 0
+        # Closing the losing request isn't a client cancellation.
+        assert chat_module.upstream_stats.stats()["cancelled"] == 0
+
+    def test_no_hedge_when_first_request_is_quick(self, monkeypatch):
+        deadlines = self._hedging(monkeypatch, delay_ms=500)
+        create_mock = _mock_create(["Hello"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        async def collect():
+            return [d async for d in chat_module._stream_ai([{"role": "user", "content": "hi"}], hedge=True)]
+
+        assert asyncio.run(collect()) == ["Hello"]
+        assert create_mock.call_count == 1
+        assert deadlines.stats()["hedged"] == 0
+
+    def test_no_hedge_without_free_slot(self, monkeypatch):
+        deadlines = self._hedging(monkeypatch)
+        monkeypatch.setattr(chat_module.llm_gate, "try_acquire", lambda user_id: None)
+        create_mock = AsyncMock(return_value=self._timed_stream(["Hello"], first_delay=0.1))
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        async def collect():
+            return [d async for d in chat_module._stream_ai([{"role": "user", "content": "hi"}], hedge=True)]
+
+        assert asyncio.run(collect()) == ["Hello"]
+        assert create_mock.call_count == 1
+        assert deadlines.stats()["hedge_skipped"] == 1
+
+    def test_missed_deadline_reported_as_upstream_error(self, monkeypatch, chat_client, chat_col):
+        from app.services.upstream_deadlines import upstream_deadlines
+
+        monkeypatch.setattr(upstream_deadlines, "ttft_seconds", 0.05)
+        create_mock = AsyncMock(return_value=self._timed_stream(["Hello"], first_delay=5))
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        events = _parse_sse(chat_client.post("/chat/quiz1", json={"message": "hi"}).text)
+
+        assert events[-1] == {"type": "error", "detail": "Upstream AI request failed"}
+        chat_col.insert_one.assert_not_called()
+
+
+# ── _token_frame / _coalesce ─────────────────────────────────────────────────────
+
+class TestTokenFrame:
+    @pytest.mark.parametrize("delta", ["foo", "", 'say "hi"\n', "back\\slash\t", "naïve — ∑ 😀", "</script>"])
+    def test_matches_generic_encoder(self, delta):
+        assert chat_module._token_frame(delta) == chat_module._sse({"type": "token", "content": delta})
+        assert chat_module._token_frame(delta, "B") == chat_module._sse({"type": "token", "content": delta, "agent": "B"})
+
+
+async def _paced(*items):
+    """Yield strings; a float item sleeps that many seconds, an exception is raised."""
+    for item in items:
+        if isinstance(item, float):
+            await asyncio.sleep(item)
+        elif isinstance(item, Exception):
+            raise item
+        else:
+            yield item
+
+
+class TestCoalesce:
+    def _collect(self, monkeypatch, window_ms, max_bytes, *items):
+        monkeypatch.setattr(get_settings(), "SSE_COALESCE_MS", window_ms)
+        monkeypatch.setattr(get_settings(), "SSE_COALESCE_BYTES", max_bytes)
+
+        async def collect():
+            return [d async for d in chat_module._coalesce(_paced(*items))]
+
+        return asyncio.run(collect())
+
+    def test_merges_deltas_within_window(self, monkeypatch):
+        assert self._collect(monkeypatch, 1000, 0, "a", "b", "c") == ["abc"]
+
+    def test_flushes_when_window_elapses_while_upstream_is_quiet(self, monkeypatch):
+        assert self._collect(monkeypatch, 20, 0, "a", "b", 0.2, "c") == ["ab", "c"]
+
+    def test_flushes_at_byte_limit(self, monkeypatch):
+        assert self._collect(monkeypatch, 1000, 4, "ab", "cd", "e", "fgh", "i") == ["abcd", "efgh", "i"]
+
+    def test_byte_limit_counts_utf8_bytes(self, monkeypatch):
+        assert self._collect(monkeypatch, 1000, 4, "éé", "x") == ["éé", "x"]
+
+    def test_disabled_passes_deltas_through(self, monkeypatch):
+        assert self._collect(monkeypatch, 0, 0, "a", "b") == ["a", "b"]
+
+    def test_flushes_buffer_before_upstream_error(self, monkeypatch):
+        monkeypatch.setattr(get_settings(), "SSE_COALESCE_MS", 1000)
+        monkeypatch.setattr(get_settings(), "SSE_COALESCE_BYTES", 0)
+
+        async def collect():
+            out = []
+            with pytest.raises(RuntimeError):
+                async for d in chat_module._coalesce(_paced("a", "b", RuntimeError("boom"))):
+                    out.append(d)
+            return out
+
+        assert asyncio.run(collect()) == ["ab"]
+
+    def test_upstream_error_after_coalesced_tokens_yields_error_event(self, monkeypatch):
+        async def create(**kwargs):
+            async def gen():
+                yield _FakeChunk("foo")
+                raise RuntimeError("connection reset")
+            return gen()
+
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create)
+
+        async def collect():
+            return [item async for item in chat_module._stream_agent_tokens([{"role": "user", "content": "hi"}])]
+
+        results = asyncio.run(collect())
+        assert results == [
+            (False, "foo", chat_module._sse({"type": "token", "content": "foo"})),
+            (True, "", chat_module._sse({"type": "error", "detail": "Upstream AI request failed"})),
+        ]
+
+    def test_closing_early_cancels_pending_read(self, monkeypatch):
+        monkeypatch.setattr(get_settings(), "SSE_COALESCE_MS", 10)
+        monkeypatch.setattr(get_settings(), "SSE_COALESCE_BYTES", 0)
+        closed = []
+
+        async def upstream():
+            try:
+                yield "a"
+                await asyncio.sleep(10)
+                yield "b"
+            finally:
+                closed.append(True)
+
+        async def run():
+            gen = chat_module._coalesce(upstream())
+            first = await gen.__anext__()
+            await gen.aclose()
+            # Upstream is closed by the time aclose() returns.
+            assert closed == [True]
+            return first
+
+        assert asyncio.run(run()) == "a"
+
 
 # ── _stream_agent_tokens ────────────────────────────────────────────────────────
 
@@ -377,6 +706,18 @@ class TestStreamAgentTokens:
     def test_success_without_agent_tag(self, monkeypatch):
         monkeypatch.setattr(chat_module._client.chat.completions, "create", _mock_create(["foo", "bar"]))
 
+        async def collect():
+            return [item async for item in chat_module._stream_agent_tokens([{"role": "user", "content": "hi"}])]
+
+        results = asyncio.run(collect())
+        # Both deltas arrive within one coalescing window.
+        assert results == [(False, "foobar", chat_module._sse({"type": "token", "content": "foobar"}))]
+
+    def test_one_event_per_delta_when_coalescing_disabled(self, monkeypatch):
+        monkeypatch.setattr(get_settings(), "SSE_COALESCE_MS", 0)
+        monkeypatch.setattr(get_settings(), "SSE_COALESCE_BYTES", 0)
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", _mock_create(["foo", "bar"]))
+
         async def collect():
             return [item async for item in chat_module._stream_agent_tokens([{"role": "user", "content": "hi"}])]
 
@@ -415,6 +756,7 @@ class TestStandardStream:
     def test_success_no_after_done(self, monkeypatch):
         monkeypatch.setattr(chat_module._client.chat.completions, "create", _mock_create(["foo", "bar"]))
         col = MagicMock()
+        col.count_documents.return_value = 0
         user = UserPublic(id="u1", email="a@b.com", is_admin=False)
 
         async def run():
@@ -426,13 +768,15 @@ class TestStandardStream:
 
         events = asyncio.run(run())
         assert events == [
-            chat_module._sse({"type": "token", "content": "foo"}),
-            chat_module._sse({"type": "token", "content": "bar"}),
+            chat_module._sse({"type": "token", "content": "foobar"}),
             chat_module._sse({"type": "done", "conversation_id": "conv1"}),
         ]
         assistant_doc = col.insert_one.call_args_list[1].args[0]
         assert assistant_doc["content"] == ["foobar"]
-        assert assistant_doc["metadata"] == {"answer_incorrectly": False}
+        metadata = assistant_doc["metadata"]
+        assert metadata["answer_incorrectly"] is False
+        assert metadata["reply_source"] == "upstream"
+        assert metadata["ttft_ms"] <= metadata["processing_time_ms"]
         bson.encode(assistant_doc)
 
     def test_reply_prefix_prepended_to_stored_reply(self, monkeypatch):
@@ -454,7 +798,7 @@ class TestStandardStream:
         assert events[0] == chat_module._sse({"type": "token", "content": "foo", "agent": "A"})
         assistant_doc = col.insert_one.call_args_list[1].args[0]
         assert assistant_doc["content"] == ["[AGENT A] foo"]
-        assert assistant_doc["metadata"] == {"answer_incorrectly": True}
+        assert assistant_doc["metadata"]["answer_incorrectly"] is True
 
     def test_error_mid_stream_no_save(self, monkeypatch):
         monkeypatch.setattr(chat_module._client.chat.completions, "create", AsyncMock(side_effect=RuntimeError("boom")))
@@ -587,8 +931,7 @@ class TestStreamIntoQueue:
 
         items = asyncio.run(run())
         assert items == [
-            (False, "foo", "A", chat_module._sse({"type": "token", "content": "foo", "agent": "A"})),
-            (False, "bar", "A", chat_module._sse({"type": "token", "content": "bar", "agent": "A"})),
+            (False, "foobar", "A", chat_module._sse({"type": "token", "content": "foobar", "agent": "A"})),
         ]
 
     def test_error_puts_single_error_item(self, monkeypatch):
@@ -638,9 +981,8 @@ class TestDefaultChatEndpoint:
 
         assert resp.status_code == 200
         events = _parse_sse(resp.text)
-        assert events[0] == {"type": "token", "content": "Hello"}
-        assert events[1] == {"type": "token", "content": " world"}
-        assert events[2] == {"type": "done", "conversation_id": "conv1"}
+        assert events[0] == {"type": "token", "content": "Hello world"}
+        assert events[1] == {"type": "done", "conversation_id": "conv1"}
 
     def test_generates_conversation_id_when_absent(self, monkeypatch, chat_client):
         monkeypatch.setattr(chat_module._client.chat.completions, "create", _mock_create(["hi"]))
@@ -692,9 +1034,785 @@ class TestDefaultChatEndpoint:
         assistant_doc = chat_col.insert_one.call_args_list[1].args[0]
         assert assistant_doc["metadata"]["stated_choice_id"] == {"default": "b"}
 
+    def test_reply_timing_and_usage_stored_and_aggregated(self, monkeypatch, chat_client, chat_col):
+        from app.services.reply_metrics import reply_latency
+
+        usage = SimpleNamespace(prompt_tokens=40, completion_tokens=2)
+        monkeypatch.setattr(
+            chat_module._client.chat.completions, "create",
+            AsyncMock(return_value=_FakeStream(["Hello", " world"], usage=usage)),
+        )
+
+        resp = chat_client.post("/chat/quiz1", json={"message": "hi", "conversation_id": "conv1"})
+
+        assert resp.status_code == 200
+        metadata = chat_col.insert_one.call_args_list[1].args[0]["metadata"]
+        assert metadata["input_tokens"] == 40
+        assert metadata["output_tokens"] == 2
+        assert metadata["tokens_used"] == 42
+        assert metadata["model_version"] == "gpt-test"
+        assert metadata["reply_source"] == "upstream"
+        assert metadata["ttft_ms"] is not None
+        stats = reply_latency.stats()
+        assert list(stats) == ["default/followup"]
+        assert stats["default/followup"]["replies"] == 1
+        assert stats["default/followup"]["input_tokens"] == 40
+
+    def test_cache_replay_tagged_as_cache(self, monkeypatch, chat_client, chat_col):
+        from app.services.llm_cache import llm_cache
+        from app.services.reply_metrics import reply_latency
+
+        monkeypatch.setattr(llm_cache, "enabled", True)
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", _mock_create(["Hello"]))
+
+        chat_client.post("/chat/quiz1", json={"message": "What is 2+2?"})
+        chat_client.post("/chat/quiz1", json={"message": "What is 2+2?"})
+
+        assert chat_col.insert_one.call_args_list[-1].args[0]["metadata"]["reply_source"] == "cache"
+        assert reply_latency.stats()["default/followup"]["by_source"] == {"upstream": 1, "cache": 1}
+
+
+class TestLLMResponseCache:
+    @pytest.fixture(autouse=True)
+    def cache_enabled(self, monkeypatch):
+        from app.services.llm_cache import llm_cache
+
+        monkeypatch.setattr(llm_cache, "enabled", True)
+
+    def test_repeat_first_turn_is_replayed_without_upstream(self, monkeypatch, chat_client, chat_col):
+        from app.services.llm_cache import llm_cache
+
+        create_mock = _mock_create(["Hello", " world"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        first = _parse_sse(chat_client.post("/chat/quiz1", json={"message": "What is 2+2?"}).text)
+        second = _parse_sse(chat_client.post("/chat/quiz1", json={"message": "What is  2+2? "}).text)
+
+        assert create_mock.call_count == 1
+        replayed = "".join(e["content"] for e in second if e["type"] == "token")
+        assert replayed == "Hello world"
+        assert second[-1]["type"] == "done"
+        assert first[-1]["type"] == "done"
+        # The replayed exchange is still saved like a live one.
+        assert chat_col.insert_one.call_args_list[-1].args[0]["content"] == ["Hello world"]
+        assert llm_cache.stats()["memory_hits"] == 1
+
+    def test_variant_opt_out_always_calls_upstream(self, monkeypatch, chat_client):
+        from app.services.llm_cache import llm_cache
+
+        monkeypatch.setattr(llm_cache, "disabled_variants", {"default"})
+        create_mock = _mock_create_sequence([["a"], ["b"]])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        chat_client.post("/chat/quiz1", json={"message": "hi"})
+        chat_client.post("/chat/quiz1", json={"message": "hi"})
+
+        assert create_mock.call_count == 2
+
+    def test_turns_with_history_are_not_cached(self, monkeypatch, chat_client):
+        monkeypatch.setattr(
+            chat_module, "get_last_exchange",
+            lambda *a, **k: [{"role": "user", "content": "q"}, {"role": "assistant", "content": "a"}],
+        )
+        create_mock = _mock_create_sequence([["a"], ["b"]])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        chat_client.post("/chat/quiz1", json={"message": "hi", "conversation_id": "c1"})
+        chat_client.post("/chat/quiz1", json={"message": "hi", "conversation_id": "c1"})
+
+        assert create_mock.call_count == 2
+
+    def test_auto_question_keeps_history_by_default(self, monkeypatch, chat_client):
+        history = MagicMock(return_value=[{"role": "user", "content": "q"}, {"role": "assistant", "content": "a"}])
+        monkeypatch.setattr(chat_module, "get_last_exchange", history)
+        create_mock = _mock_create(["live"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        chat_client.post("/chat/followup", json={
+            "message": "What is 2+2?", "conversation_id": "c1", "trigger": "auto_question",
+        })
+
+        history.assert_called_once()
+        sent = create_mock.call_args_list[0].kwargs["messages"]
+        assert {"role": "assistant", "content": "a"} in sent
+
+    def test_auto_question_starts_clean_and_hits_pregenerated_key(self, monkeypatch, chat_client):
+        from app.services.llm_cache import llm_cache, cache_key
+
+        monkeypatch.setattr(llm_cache, "fresh_question_variants", {"followup"})
+        history = MagicMock(return_value=[{"role": "user", "content": "q"}, {"role": "assistant", "content": "a"}])
+        monkeypatch.setattr(chat_module, "get_last_exchange", history)
+        create_mock = _mock_create(["live"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+        message = "What is 2+2?\n\nAnswer choices:\nA. 3\nB. 4"
+        choices = [{"id": "a", "label": "3"}, {"id": "b", "label": "4"}]
+        messages, route = chat_module.first_turn_messages("followup", message, False, True, [])
+        llm_cache.put(None, cache_key(messages, route.temperature, False, route.model), "The answer is 4.", None)
+        monkeypatch.delenv("UF_OPENAI_API_MODEL", raising=False)
+
+        resp = chat_client.post("/chat/followup", json={
+            "message": message, "conversation_id": "c1", "trigger": "auto_question", "answer_choices": choices,
+        })
+
+        tokens = "".join(e["content"] for e in _parse_sse(resp.text) if e["type"] == "token")
+        assert tokens == "The answer is 4."
+        history.assert_not_called()
+
+    def test_double_agents_are_cached_separately(self, monkeypatch, chat_client):
+        create_mock = _agent_aware_create(["A reply"], ["B reply"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        chat_client.post("/chat/double", json={"message": "hi"})
+        second = _parse_sse(chat_client.post("/chat/double", json={"message": "hi"}).text)
+
+        assert create_mock.call_count == 2
+        by_agent = {}
+        for e in second:
+            if e["type"] == "token":
+                by_agent[e["agent"]] = by_agent.get(e["agent"], "") + e["content"]
+        assert by_agent == {"A": "A reply", "B": "B reply"}
+
+    def test_failed_stream_is_not_cached(self, monkeypatch, chat_client):
+        from app.services.llm_cache import llm_cache
+
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", AsyncMock(side_effect=RuntimeError("boom")))
+        chat_client.post("/chat/quiz1", json={"message": "hi"})
+
+        assert llm_cache.stats()["stores"] == 0
+
+
+class TestHistoryWindowCache:
+    def test_second_turn_reads_history_from_cache(self, monkeypatch, chat_client, chat_col):
+        history = MagicMock(return_value=[])
+        monkeypatch.setattr(chat_module, "get_last_exchange", history)
+        create_mock = _mock_create_sequence([["first"], ["second"]])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        chat_client.post("/chat/quiz1", json={"message": "q1", "conversation_id": "c1"})
+        chat_client.post("/chat/quiz1", json={"message": "q2", "conversation_id": "c1"})
+
+        history.assert_called_once()
+        chat_col.find_one.assert_not_called()
+        sent = create_mock.call_args_list[1].kwargs["messages"]
+        assert sent[1:] == [
+            {"role": "user", "content": "q1"},
+            {"role": "assistant", "content": "first"},
+            {"role": "user", "content": "q2"},
+        ]
+
+    def test_turn_saved_by_another_worker_is_reread(self, monkeypatch, chat_client, chat_col):
+        from app.services.history_cache import history_cache
+
+        monkeypatch.setattr(history_cache, "check_latest", True)
+        history = MagicMock(return_value=[])
+        monkeypatch.setattr(chat_module, "get_last_exchange", history)
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", _mock_create_sequence([["a"], ["b"]]))
+
+        chat_client.post("/chat/quiz1", json={"message": "q1", "conversation_id": "c1"})
+        chat_col.find_one.return_value = {"created_at": datetime(2100, 1, 1)}
+        chat_client.post("/chat/quiz1", json={"message": "q2", "conversation_id": "c1"})
+
+        assert history.call_count == 2
+
+    def test_failed_save_drops_the_cached_window(self, monkeypatch, chat_client, chat_col):
+        from app.services.history_cache import history_cache
+
+        monkeypatch.setattr(chat_module, "get_last_exchange", MagicMock(return_value=[]))
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", _mock_create(["reply"]))
+        chat_col.insert_one.side_effect = [None, RuntimeError("write failed")]
+
+        chat_client.post("/chat/quiz1", json={"message": "q1", "conversation_id": "c1"})
+
+        assert history_cache.lookup("c1")[0] is None
+
+
+class TestSpeculativeFirstTurn:
+    QUESTION = {"id": "q1", "stem": "What is 2+2?", "subtitle": None,
+                "choices": [{"id": "a", "label": "3"}, {"id": "b", "label": "4"}]}
+    MESSAGE = "What is 2+2?\n\nAnswer choices:\nA. 3\nB. 4"
+
+    @pytest.fixture(autouse=True)
+    def _enabled(self, monkeypatch):
+        from app.services.speculation import speculation
+
+        monkeypatch.setattr(speculation, "enabled", True)
+        monkeypatch.delenv("UF_OPENAI_API_MODEL", raising=False)
+
+    def _speculate(self, client, app, quiz_id="base", fresh_context=True):
+        async def run():
+            await chat_module.speculate_first_turn(app, "userid1", quiz_id, self.QUESTION, False, fresh_context)
+            for _ in range(5):
+                await asyncio.sleep(0)
+        client.portal.call(run)
+
+    def _ask(self, client, path="/chat/base"):
+        return client.post(path, json={
+            "message": self.MESSAGE, "trigger": "auto_question", "answer_choices": self.QUESTION["choices"],
+        })
+
+    def test_chat_streams_the_speculated_reply(self, monkeypatch, chat_client, chat_app):
+        from app.services.speculation import speculation
+
+        create_mock = _mock_create(["The answer", " is 4."])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        self._speculate(chat_client, chat_app)
+        events = _parse_sse(self._ask(chat_client).text)
+
+        assert create_mock.call_count == 1
+        assert "".join(e["content"] for e in events if e["type"] == "token") == "The answer is 4."
+        assert events[-1]["type"] == "done"
+        assert speculation.stats()["claimed_ready"] == 1
+
+    def test_double_speculates_both_agents(self, monkeypatch, chat_client, chat_app):
+        create_mock = _agent_aware_create(["A reply"], ["B reply"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        self._speculate(chat_client, chat_app, quiz_id="double")
+        events = _parse_sse(self._ask(chat_client, "/chat/double").text)
+
+        assert create_mock.call_count == 2
+        by_agent = {}
+        for e in events:
+            if e["type"] == "token":
+                by_agent[e["agent"]] = by_agent.get(e["agent"], "") + e["content"]
+        assert by_agent == {"A": "A reply", "B": "B reply"}
+
+    def test_skipped_when_first_turn_is_cached(self, monkeypatch, chat_client, chat_app):
+        from app.services.llm_cache import llm_cache, cache_key
+        from app.services.speculation import speculation
+
+        monkeypatch.setattr(llm_cache, "enabled", True)
+        messages, route = chat_module.first_turn_messages("default", self.MESSAGE, False, True, [])
+        llm_cache.put(None, cache_key(messages, route.temperature, False, route.model), "cached", None)
+        create_mock = _mock_create(["live"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        self._speculate(chat_client, chat_app)
+
+        create_mock.assert_not_called()
+        assert speculation.stats()["skipped_cached"] == 1
+
+    def test_opted_out_variant_only_speculates_fresh_conversations(self, monkeypatch, chat_client, chat_app):
+        from app.services.llm_cache import llm_cache
+        from app.services.speculation import speculation
+
+        monkeypatch.setattr(llm_cache, "disabled_variants", {"default"})
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", _mock_create(["x"]))
+
+        self._speculate(chat_client, chat_app, fresh_context=False)
+
+        assert speculation.stats()["started"] == 0
+
+    def test_failed_speculation_falls_back_to_live_request(self, monkeypatch, chat_client, chat_app):
+        create_mock = AsyncMock(side_effect=[RuntimeError("boom"), _FakeStream(["live"])])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        self._speculate(chat_client, chat_app)
+        events = _parse_sse(self._ask(chat_client).text)
+
+        assert create_mock.call_count == 2
+        assert "".join(e["content"] for e in events if e["type"] == "token") == "live"
+
 
 # ── POST /chat/double ──────────────────────────────────────────────────────────
 
+class TestUpstreamGate:
+    @pytest.fixture
+    def gate(self, monkeypatch):
+        from app.services.llm_gate import LLMGate
+
+        gate = LLMGate(max_concurrent=1, max_per_user=0, max_queue=1)
+        monkeypatch.setattr(chat_module, "llm_gate", gate)
+        return gate
+
+    def test_full_queue_returns_429(self, monkeypatch, chat_client, gate):
+        create_mock = _mock_create(["hi"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+        gate.enqueue("someone")
+        gate.enqueue("someone-else")
+
+        resp = chat_client.post("/chat/quiz1", json={"message": "hi"})
+
+        assert resp.status_code == 429
+        assert resp.headers["Retry-After"] == str(get_settings().LLM_RETRY_AFTER_SECONDS)
+        create_mock.assert_not_called()
+
+    def test_double_needs_room_for_both_agents(self, monkeypatch, chat_client, gate):
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", _agent_aware_create(["a"], ["b"]))
+        gate.max_concurrent = 2
+        gate.enqueue("someone")  # one slot left, empty queue: room for 2 streams
+
+        assert chat_client.post("/chat/double", json={"message": "hi"}).status_code == 200
+        gate.enqueue("someone")
+        gate.enqueue("someone")  # now full and one waiting
+        assert chat_client.post("/chat/double", json={"message": "hello"}).status_code == 429
+
+    def test_cached_reply_is_served_while_full(self, monkeypatch, chat_client, gate):
+        from app.services.llm_cache import llm_cache, cache_key
+
+        monkeypatch.setattr(llm_cache, "enabled", True)
+        messages, route = chat_module.first_turn_messages("default", "hi", False, False, [])
+        llm_cache.put(None, cache_key(messages, route.temperature, False, route.model), "cached", None)
+        create_mock = _mock_create(["live"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+        gate.enqueue("someone")
+        gate.enqueue("someone-else")
+
+        resp = chat_client.post("/chat/quiz1", json={"message": "hi"})
+
+        assert resp.status_code == 200
+        assert "".join(e["content"] for e in _parse_sse(resp.text) if e["type"] == "token") == "cached"
+        create_mock.assert_not_called()
+
+    def test_waiting_stream_reports_position_then_streams(self, monkeypatch, gate):
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", _mock_create(["foo"]))
+
+        async def run():
+            holder = gate.enqueue("someone")
+            stream = chat_module._stream_agent_tokens([{"role": "user", "content": "hi"}], agent_tag="A", user_id="u1")
+            first = await stream.__anext__()
+            holder.release()
+            rest = [item async for item in stream]
+            return first, rest
+
+        first, rest = asyncio.run(run())
+        assert first == (False, "", chat_module._sse({"type": "queued", "position": 1, "agent": "A"}))
+        assert rest == [(False, "foo", chat_module._sse({"type": "token", "content": "foo", "agent": "A"}))]
+        assert gate.active == 0
+
+    def test_slot_released_on_upstream_error(self, monkeypatch, gate):
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", AsyncMock(side_effect=RuntimeError("boom")))
+
+        async def collect():
+            return [item async for item in chat_module._stream_agent_tokens([{"role": "user", "content": "hi"}])]
+
+        assert asyncio.run(collect())[-1][0] is True
+        assert gate.active == 0
+
+    def test_speculation_skipped_while_requests_wait(self, monkeypatch, chat_client, chat_app, gate):
+        from app.services.speculation import speculation
+
+        monkeypatch.setattr(speculation, "enabled", True)
+        create_mock = _mock_create(["x"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+        gate.enqueue("someone")
+        gate.enqueue("someone-else")
+
+        chat_client.portal.call(
+            chat_module.speculate_first_turn, chat_app, "userid1", "base", TestSpeculativeFirstTurn.QUESTION, False, True,
+        )
+
+        create_mock.assert_not_called()
+        assert speculation.stats()["skipped_busy"] == 1
+
+
+class TestDisconnectCancellation:
+    @pytest.fixture(autouse=True)
+    def _no_resume_grace(self, monkeypatch):
+        # Stop as soon as the client leaves rather than waiting for a reconnect.
+        monkeypatch.setattr(get_settings(), "STREAM_RESUME_GRACE_SECONDS", 0)
+
+    def test_stream_ai_closes_upstream_when_consumer_stops(self, monkeypatch):
+        from app.services.upstream_stats import upstream_stats
+
+        stream = _FakeStream(["a" * 40, "b" * 40], hang=True)
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", AsyncMock(return_value=stream))
+
+        async def run():
+            gen = chat_module._stream_ai([{"role": "user", "content": "hi"}])
+            await gen.__anext__()
+            await gen.aclose()
+
+        asyncio.run(run())
+        assert stream.closed
+        stats = upstream_stats.stats()
+        assert stats["cancelled"] == 1 and stats["tokens_before_cancel"] == 10
+
+    def test_stream_ai_records_completed_reply(self, monkeypatch):
+        from app.services.upstream_stats import upstream_stats
+
+        stream = _FakeStream(["a" * 40, "b" * 40])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", AsyncMock(return_value=stream))
+
+        async def run():
+            return [d async for d in chat_module._stream_ai([{"role": "user", "content": "hi"}])]
+
+        asyncio.run(run())
+        assert not stream.closed
+        assert upstream_stats.stats()["completed"] == 1
+        assert upstream_stats.stats()["avg_reply_tokens"] == 20
+
+    def test_response_closes_generator_disconnected_mid_send(self):
+        closed = []
+
+        async def body():
+            try:
+                yield "a"
+                yield "b"
+            finally:
+                closed.append(True)
+
+        async def run():
+            gone = asyncio.Event()
+            response = chat_module._ClosingStreamingResponse(body(), media_type="text/event-stream")
+
+            async def receive():
+                await gone.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                if message.get("body") == b"a":
+                    gone.set()
+                    await asyncio.sleep(1)  # cancelled here, with body() parked at its yield
+
+            await response({"type": "http"}, receive, send)
+            return list(closed)
+
+        assert asyncio.run(run()) == [True]
+
+    def test_double_chat_disconnect_cancels_both_agents(self, monkeypatch, chat_app, chat_col):
+        from app.services.upstream_stats import upstream_stats
+
+        streams = []
+
+        async def create(**kwargs):
+            streams.append(_FakeStream(["partial"], hang=True))
+            return streams[-1]
+
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create)
+
+        async def run():
+            await _post_until_disconnect(chat_app, "/chat/double", {"message": "hi"})
+            # Checked before asyncio.run's teardown cancels leftover tasks.
+            return [s.closed for s in streams], upstream_stats.stats()["cancelled"]
+
+        closed, cancelled = asyncio.run(run())
+        assert closed == [True, True]
+        assert cancelled == 2
+        assert chat_module.llm_gate.active == 0
+        chat_col.insert_one.assert_not_called()
+
+    def test_followup_disconnect_stops_suggestion_stream(self, monkeypatch, chat_app):
+        reply, suggestions = _FakeStream(["The answer."]), _FakeStream(["1. Why?"], hang=True)
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", AsyncMock(side_effect=[reply, suggestions]))
+
+        async def run():
+            sent = await _post_until_disconnect(chat_app, "/chat/followup", {"message": "hi"}, marker=b'"followup"')
+            return sent, suggestions.closed
+
+        sent, closed = asyncio.run(run())
+        assert any(b'"done"' in chunk for chunk in sent)
+        assert closed
+
+    def test_claimed_speculation_cancelled_when_client_leaves(self, monkeypatch, chat_app):
+        from app.services.speculation import speculation
+
+        monkeypatch.setattr(speculation, "enabled", True)
+        monkeypatch.delenv("UF_OPENAI_API_MODEL", raising=False)
+        stream = _FakeStream(["The answer"], hang=True)
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", AsyncMock(return_value=stream))
+        question = TestSpeculativeFirstTurn.QUESTION
+
+        async def run():
+            await chat_module.speculate_first_turn(chat_app, "userid1", "base", question, False, True)
+            await asyncio.sleep(0)
+            await _post_until_disconnect(chat_app, "/chat/base", {
+                "message": TestSpeculativeFirstTurn.MESSAGE, "answer_choices": question["choices"],
+            })
+            return stream.closed
+
+        assert asyncio.run(run())
+        assert speculation.stats()["claimed_in_flight"] == 1
+
+
+class TestResumableStream:
+    @staticmethod
+    def _last_id(chunks: list[bytes]) -> str:
+        return re.findall(r"^id: (\S+)$", b"".join(chunks).decode(), re.M)[-1]
+
+    def test_events_carry_increasing_ids(self, monkeypatch, chat_client):
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", _mock_create(["Hello"]))
+
+        resp = chat_client.post("/chat/quiz1", json={"message": "hi"})
+
+        ids = re.findall(r"^id: (\S+)$", resp.text, re.M)
+        assert len(ids) == len(_parse_sse(resp.text)) == 2
+        stream_ids = {i.split(":")[0] for i in ids}
+        assert len(stream_ids) == 1
+        assert [int(i.split(":")[1]) for i in ids] == [1, 2]
+
+    def test_reconnect_reattaches_to_running_reply(self, monkeypatch, chat_app, chat_col):
+        calls = []
+
+        async def create(**kwargs):
+            calls.append(kwargs)
+
+            async def chunks():
+                yield _FakeChunk("Hello")
+                await finish.wait()
+                yield _FakeChunk(" world")
+            return chunks()
+
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create)
+        body = {"message": "hi", "conversation_id": "conv1"}
+
+        async def run():
+            nonlocal finish
+            finish = asyncio.Event()
+            first = await _post_until_disconnect(chat_app, "/chat/quiz1", body)
+            finish.set()
+            rest = await _post_until_disconnect(
+                chat_app, "/chat/quiz1", body, marker=b"never",
+                headers=((b"last-event-id", self._last_id(first).encode()),),
+            )
+            return first, rest
+
+        finish = None
+        first, rest = asyncio.run(run())
+        assert _parse_sse(b"".join(first).decode()) == [{"type": "token", "content": "Hello"}]
+        assert _parse_sse(b"".join(rest).decode()) == [
+            {"type": "token", "content": " world"},
+            {"type": "done", "conversation_id": "conv1"},
+        ]
+        assert len(calls) == 1
+        assert chat_col.insert_one.call_count == 2  # the exchange is saved once
+
+    def test_finished_reply_is_replayed(self, monkeypatch, chat_client):
+        create_mock = _mock_create(["Hello"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        first = chat_client.post("/chat/quiz1", json={"message": "hi"})
+        first_id = re.findall(r"^id: (\S+)$", first.text, re.M)[0]
+        again = chat_client.post("/chat/quiz1", json={"message": "hi"}, headers={"Last-Event-ID": first_id})
+
+        assert create_mock.call_count == 1
+        assert [e["type"] for e in _parse_sse(again.text)] == ["done"]
+
+    def test_unknown_last_event_id_starts_a_new_reply(self, monkeypatch, chat_client):
+        from app.services.stream_replay import stream_replay
+
+        create_mock = _mock_create(["Hello"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        resp = chat_client.post("/chat/quiz1", json={"message": "hi"}, headers={"Last-Event-ID": "gone:3"})
+
+        assert create_mock.call_count == 1
+        assert _parse_sse(resp.text)[-1]["type"] == "done"
+        assert stream_replay.stats()["resume_misses"] == 1
+
+    def test_disabled_sends_plain_events(self, monkeypatch, chat_client):
+        from app.services.stream_replay import stream_replay
+
+        monkeypatch.setattr(stream_replay, "max_streams", 0)
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", _mock_create(["Hello"]))
+
+        resp = chat_client.post("/chat/quiz1", json={"message": "hi"})
+
+        assert "id: " not in resp.text
+        assert _parse_sse(resp.text)[-1]["type"] == "done"
+
+
+class TestIdempotencyKeys:
+    def test_repeat_after_completion_replays_stored_reply(self, monkeypatch, chat_client, chat_col):
+        create_mock = _mock_create(["Hello"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+        headers = {"Idempotency-Key": "msg-1"}
+
+        first = chat_client.post("/chat/quiz1", json={"message": "hi", "conversation_id": "c1"}, headers=headers)
+        again = chat_client.post("/chat/quiz1", json={"message": "hi", "conversation_id": "c1"}, headers=headers)
+
+        assert again.status_code == 200
+        assert _parse_sse(again.text) == _parse_sse(first.text)
+        assert create_mock.call_count == 1
+        assert chat_col.insert_one.call_count == 2  # one exchange
+
+    def test_reconnect_past_replay_buffer_skips_seen_frames(self, monkeypatch, chat_client):
+        from app.services.stream_replay import stream_replay
+
+        create_mock = _mock_create(["Hello"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+        headers = {"Idempotency-Key": "msg-1"}
+
+        first = chat_client.post("/chat/quiz1", json={"message": "hi"}, headers=headers)
+        first_id, done_id = re.findall(r"^id: (\S+)$", first.text, re.M)
+        stream_replay.clear()  # e.g. the reconnect landed on another worker
+        again = chat_client.post("/chat/quiz1", json={"message": "hi"}, headers={**headers, "Last-Event-ID": first_id})
+
+        assert create_mock.call_count == 1
+        assert re.findall(r"^id: (\S+)$", again.text, re.M) == [done_id]
+        assert [e["type"] for e in _parse_sse(again.text)] == ["done"]
+
+    def test_duplicate_attaches_to_reply_in_flight(self, monkeypatch, chat_app, chat_col):
+        calls = []
+
+        async def create(**kwargs):
+            calls.append(kwargs)
+
+            async def chunks():
+                yield _FakeChunk("Hello")
+                await finish.wait()
+                yield _FakeChunk(" world")
+            return chunks()
+
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create)
+        body = {"message": "hi", "conversation_id": "c1", "client_message_id": "msg-1"}
+
+        async def run():
+            nonlocal finish
+            finish = asyncio.Event()
+            first = asyncio.create_task(_post_until_disconnect(chat_app, "/chat/quiz1", body, marker=b"never"))
+            while not calls:
+                await asyncio.sleep(0.01)
+            second = asyncio.create_task(_post_until_disconnect(chat_app, "/chat/quiz1", body, marker=b"never"))
+            await asyncio.sleep(0.05)
+            finish.set()
+            return await first, await second
+
+        finish = None
+        first, second = asyncio.run(run())
+        assert b"".join(second) == b"".join(first)
+        assert _parse_sse(b"".join(second).decode())[-1]["type"] == "done"
+        assert len(calls) == 1
+        assert chat_col.insert_one.call_count == 2
+
+    def test_failed_reply_releases_key(self, monkeypatch, chat_client):
+        create_mock = AsyncMock(side_effect=[RuntimeError("boom"), _FakeStream(["Hello"])])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+        headers = {"Idempotency-Key": "msg-1"}
+
+        failed = chat_client.post("/chat/quiz1", json={"message": "hi"}, headers=headers)
+        retried = chat_client.post("/chat/quiz1", json={"message": "hi"}, headers=headers)
+
+        assert _parse_sse(failed.text)[-1]["type"] == "error"
+        assert _parse_sse(retried.text)[-1]["type"] == "done"
+        assert create_mock.call_count == 2
+
+    def test_in_flight_on_another_worker_is_409(self, monkeypatch, chat_client, regular_user):
+        from app.services.idempotency import idempotency
+
+        create_mock = _mock_create(["Hello"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+        monkeypatch.setattr(chat_module, "_request_fingerprint", lambda request, req: "fp")
+        idempotency.claim(None, regular_user.id, "msg-1", "elsewhere", "fp")
+
+        resp = chat_client.post("/chat/quiz1", json={"message": "hi"}, headers={"Idempotency-Key": "msg-1"})
+
+        assert resp.status_code == 409
+        assert resp.headers["retry-after"]
+        create_mock.assert_not_called()
+
+    def test_key_reused_for_another_message_is_422(self, monkeypatch, chat_client):
+        create_mock = _mock_create(["Hello"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+        headers = {"Idempotency-Key": "msg-1"}
+
+        chat_client.post("/chat/quiz1", json={"message": "hi", "conversation_id": "c1"}, headers=headers)
+        other_message = chat_client.post("/chat/quiz1", json={"message": "bye", "conversation_id": "c1"}, headers=headers)
+        other_conv = chat_client.post("/chat/quiz1", json={"message": "hi", "conversation_id": "c2"}, headers=headers)
+
+        assert other_message.status_code == other_conv.status_code == 422
+        assert create_mock.call_count == 1
+
+    def test_overlong_key_rejected(self, chat_client):
+        resp = chat_client.post("/chat/quiz1", json={"message": "hi"}, headers={"Idempotency-Key": "k" * 201})
+        assert resp.status_code == 400
+
+
+class TestSingleFlight:
+    @pytest.fixture(autouse=True)
+    def single_flight_enabled(self, monkeypatch):
+        from app.services.single_flight import single_flight
+
+        monkeypatch.setattr(single_flight, "enabled", True)
+
+    @staticmethod
+    def _gated_create(calls, finish):
+        async def create(**kwargs):
+            calls.append(kwargs)
+
+            async def chunks():
+                yield _FakeChunk("Hello")
+                await finish.wait()
+                yield _FakeChunk(" world")
+            return chunks()
+        return create
+
+    def _run_pair(self, monkeypatch, chat_app):
+        calls = []
+
+        async def run():
+            finish = asyncio.Event()
+            monkeypatch.setattr(chat_module._client.chat.completions, "create", self._gated_create(calls, finish))
+            body = {"message": "hi", "conversation_id": "c1"}
+            first = asyncio.create_task(_post_until_disconnect(chat_app, "/chat/quiz1", body, marker=b"never"))
+            while not calls:
+                await asyncio.sleep(0.01)
+            second = asyncio.create_task(_post_until_disconnect(chat_app, "/chat/quiz1", body, marker=b"never"))
+            await asyncio.sleep(0.05)
+            finish.set()
+            return await first, await second
+
+        first, second = asyncio.run(run())
+        return calls, _parse_sse(b"".join(first).decode()), _parse_sse(b"".join(second).decode())
+
+    def test_identical_prompts_share_one_upstream_call(self, monkeypatch, chat_app, chat_col):
+        calls, first, second = self._run_pair(monkeypatch, chat_app)
+
+        assert len(calls) == 1
+        for events in (first, second):
+            assert "".join(e["content"] for e in events if e["type"] == "token") == "Hello world"
+            assert events[-1]["type"] == "done"
+        # Each request saves its own exchange; the follower's is tagged.
+        saved = [c.args[0] for c in chat_col.insert_one.call_args_list]
+        sources = [d["metadata"]["reply_source"] for d in saved if d["role"] == "assistant"]
+        assert len(saved) == 4
+        assert sorted(sources) == ["single_flight", "upstream"]
+
+    def test_joiner_is_admitted_while_the_gate_is_full(self, monkeypatch, chat_app):
+        from app.services.llm_gate import LLMGate
+
+        monkeypatch.setattr(chat_module, "llm_gate", LLMGate(max_concurrent=1, max_per_user=0, max_queue=0))
+        calls, first, second = self._run_pair(monkeypatch, chat_app)
+
+        assert len(calls) == 1
+        assert "".join(e["content"] for e in second if e["type"] == "token") == "Hello world"
+
+    def test_identical_request_waits_for_the_queued_leader(self, monkeypatch, chat_app):
+        from app.services.llm_gate import LLMGate
+
+        gate = LLMGate(max_concurrent=1, max_per_user=0, max_queue=1)
+        monkeypatch.setattr(chat_module, "llm_gate", gate)
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", _mock_create(["Hello"]))
+
+        async def run():
+            holder = gate.enqueue("someone")
+            body = {"message": "hi", "conversation_id": "c1"}
+            first = asyncio.create_task(_post_until_disconnect(chat_app, "/chat/quiz1", body, marker=b"never"))
+            while not gate.waiting:
+                await asyncio.sleep(0.01)
+            second = asyncio.create_task(_post_until_disconnect(chat_app, "/chat/quiz1", body, marker=b"never"))
+            await asyncio.sleep(0.05)
+            waiting = gate.waiting
+            holder.release()
+            return waiting, await first, await second
+
+        waiting, first, second = asyncio.run(run())
+        assert waiting == 1
+        for chunks in (first, second):
+            events = _parse_sse(b"".join(chunks).decode())
+            assert "".join(e["content"] for e in events if e["type"] == "token") == "Hello"
+
+    def test_opted_out_variant_calls_upstream_per_request(self, monkeypatch, chat_app):
+        from app.services.single_flight import single_flight
+
+        monkeypatch.setattr(single_flight, "disabled_variants", {"default"})
+        calls, first, second = self._run_pair(monkeypatch, chat_app)
+
+        assert len(calls) == 2
+        assert second[-1]["type"] == "done"
+
+
 class TestDoubleChatEndpoint:
     def test_missing_api_key_returns_500(self, monkeypatch, chat_client):
         monkeypatch.setattr(chat_module, "_UF_API_KEY", "")
@@ -748,9 +1866,31 @@ class TestDoubleChatEndpoint:
         assert chat_col.insert_one.call_count == 2
         assistant_doc = chat_col.insert_one.call_args_list[1].args[0]
         assert set(assistant_doc["content"]) == {"[AGENT A] hello-a", "[AGENT B] hello-b"}
-        assert assistant_doc["metadata"] == {"answer_incorrectly": False}
+        metadata = assistant_doc["metadata"]
+        assert metadata["answer_incorrectly"] is False
+        assert metadata["reply_source"] == "upstream"
+        assert set(metadata["agent_metrics"]) == {"A", "B"}
+        assert assistant_doc["agents"] == ["A", "B"]
         bson.encode(assistant_doc)
 
+    def test_agents_routed_separately(self, monkeypatch, chat_client, chat_col):
+        from app.services.model_routes import model_router
+
+        monkeypatch.setenv("UF_OPENAI_API_MODEL", "main")
+        monkeypatch.setattr(model_router, "overrides", {"double_b": {"model": "formal", "temperature": 0.0}})
+        create_mock = _agent_aware_create(["hello-a"], ["hello-b"])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        chat_client.post("/chat/double", json={"message": "hi", "agents": []})
+
+        sent = sorted((c.kwargs["model"], c.kwargs["temperature"]) for c in create_mock.call_args_list)
+        assert sent == [("formal", 0.0), ("main", 0.1)]
+        metadata = chat_col.insert_one.call_args_list[1].args[0]["metadata"]
+        assert metadata["agent_metrics"]["A"]["model_route"] == "double_a"
+        assert metadata["agent_metrics"]["B"]["model_route"] == "double_b"
+        assert metadata["agent_metrics"]["B"]["model_version"] == "formal"
+        assert "model_route" not in metadata
+
     def test_both_agents_stated_choice_detected_per_agent(self, monkeypatch, chat_client, chat_col):
         monkeypatch.setattr(
             chat_module._client.chat.completions, "create",
@@ -836,6 +1976,23 @@ class TestFollowupChatEndpoint:
         assert user_doc["trigger"] == "manual"
         assert assistant_doc["question_id"] == "q5"
 
+    def test_suggestions_use_their_own_route(self, monkeypatch, chat_client, chat_col):
+        from app.services.model_routes import model_router
+
+        monkeypatch.setenv("UF_OPENAI_API_MODEL", "main")
+        monkeypatch.setattr(model_router, "overrides", {"followup_suggestions": {"model": "small", "max_tokens": 150}})
+        create_mock = _mock_create_sequence([["main answer"], ["1. Q1"]])
+        monkeypatch.setattr(chat_module._client.chat.completions, "create", create_mock)
+
+        chat_client.post("/chat/followup", json={"message": "explain"})
+
+        answer, suggestions = (c.kwargs for c in create_mock.call_args_list)
+        assert (answer["model"], answer["temperature"], answer["max_tokens"]) == ("main", 0.5, 1000)
+        assert (suggestions["model"], suggestions["max_tokens"]) == ("small", 150)
+        metadata = chat_col.insert_one.call_args_list[-1].args[0]["metadata"]
+        assert (metadata["model_route"], metadata["model_version"]) == ("answer", "main")
+        assert model_router.stats()["followup_suggestions"]["calls"] == {"small": 1}
+
 
 # ── POST /chat/links ──────────────────────────────────────────────────────────
 
@@ -73,6 +73,16 @@ class TestSaveMyDemographics:
         query = call_args[0][0]
         assert query == {"_id": ObjectId(demo_user.id)}
 
+    def test_invalidates_cached_user(self, demo_client, mock_col, demo_user):
+        from app.services.user_cache import user_cache
+
+        user_cache.put({"_id": ObjectId(demo_user.id), "email": demo_user.email})
+        mock_col.update_one.return_value = MagicMock(matched_count=1)
+
+        demo_client.post("/demographics/me", json=VALID_PAYLOAD)
+
+        assert user_cache.get(demo_user.email) is None
+
     def test_user_not_found_returns_404(self, demo_client, mock_col):
         mock_col.update_one.return_value = MagicMock(matched_count=0)
 
@@ -0,0 +1,101 @@
+# backend/tests/test_enrollment_api.py
+"""FastAPI TestClient integration tests for app.api.enrollment (roster upload)."""
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.auth import get_current_user
+from app.api.enrollment import router as enrollment_router
+from app.core import security
+from app.services.users import signup_sequence
+
+
+@pytest.fixture
+def enroll_col():
+    col = MagicMock()
+    col.find.return_value = [{"email": "taken@test.edu"}]
+    col.database["counters"].find_one_and_update.return_value = {
+        "seq": signup_sequence.block_size
+    }
+
+    def insert_many(docs, ordered):
+        for doc in docs:
+            doc["_id"] = ObjectId()
+
+    col.insert_many.side_effect = insert_many
+    return col
+
+
+def _client(col, user):
+    app = FastAPI()
+    app.include_router(enrollment_router)
+    db = MagicMock()
+    db.__getitem__ = MagicMock(return_value=col)
+    app.state.db = db
+    app.dependency_overrides[get_current_user] = lambda: user
+    return TestClient(app)
+
+
+@pytest.fixture
+def enroll_client(enroll_col, admin_user, monkeypatch):
+    async def fake_hash_many(passwords):
+        return [f"hash:{p}" for p in passwords]
+
+    monkeypatch.setattr("app.api.enrollment.hash_passwords_async", fake_hash_many)
+    return _client(enroll_col, admin_user)
+
+
+def _lines(resp):
+    return [json.loads(line) for line in resp.text.splitlines()]
+
+
+class TestEnrollRoster:
+    def test_json_roster_streams_per_row_results(self, enroll_client, enroll_col):
+        resp = enroll_client.post("/enrollment/roster", json={"rows": [
+            {"first_name": "A", "last_name": "B", "email": "new@test.edu", "password": "pw123456"},
+            {"first_name": "C", "last_name": "D", "email": "taken@test.edu", "password": "pw123456"},
+            {"first_name": "E", "last_name": "F", "email": "bad", "password": "pw123456"},
+        ]})
+
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("application/x-ndjson")
+        lines = _lines(resp)
+        by_row = {line["row"]: line for line in lines if "row" in line}
+        assert by_row[1]["status"] == "created"
+        assert by_row[2]["status"] == "exists"
+        assert by_row[3]["status"] == "invalid"
+        assert lines[-1]["summary"] == {"total": 3, "created": 1, "exists": 1, "invalid": 1}
+
+        docs = enroll_col.insert_many.call_args[0][0]
+        assert [d["password_hash"] for d in docs] == ["hash:pw123456"]
+
+    def test_csv_roster(self, enroll_client):
+        csv_body = "first_name,last_name,email,password\nA,B,new@test.edu,pw123456\n"
+        resp = enroll_client.post(
+            "/enrollment/roster", content=csv_body, headers={"content-type": "text/csv"}
+        )
+        assert resp.status_code == 200
+        assert _lines(resp)[0]["status"] == "created"
+
+    def test_malformed_body_returns_400(self, enroll_client):
+        resp = enroll_client.post(
+            "/enrollment/roster", content="nope", headers={"content-type": "application/json"}
+        )
+        assert resp.status_code == 400
+
+    def test_empty_roster_returns_400(self, enroll_client):
+        resp = enroll_client.post("/enrollment/roster", json={"rows": []})
+        assert resp.status_code == 400
+
+    def test_oversized_roster_returns_413(self, enroll_client, monkeypatch):
+        monkeypatch.setattr("app.api.enrollment.MAX_ROSTER_ROWS", 1)
+        resp = enroll_client.post("/enrollment/roster", json={"rows": [{}, {}]})
+        assert resp.status_code == 413
+
+    def test_non_admin_forbidden(self, enroll_col, regular_user):
+        resp = _client(enroll_col, regular_user).post("/enrollment/roster", json={"rows": [{}]})
+        assert resp.status_code == 403
@@ -0,0 +1,128 @@
+# backend/tests/test_enrollment_service.py
+"""Unit tests for app.services.enrollment: roster parsing, validation and bulk insert."""
+from unittest.mock import MagicMock
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from app.schemas.user import AssignedVar
+from app.services.enrollment import (
+    parse_roster_csv,
+    validate_roster,
+    find_existing_emails,
+    insert_roster,
+)
+from app.services.users import signup_sequence
+
+
+def _row(email, password="password1", first="Ada", last="Lovelace"):
+    return {"first_name": first, "last_name": last, "email": email, "password": password}
+
+
+@pytest.fixture
+def roster_col(mock_col):
+    mock_col.database["counters"].find_one_and_update.return_value = {
+        "seq": signup_sequence.block_size
+    }
+
+    def fake_insert_many(docs, ordered):
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+
+    mock_col.insert_many.side_effect = fake_insert_many
+    return mock_col
+
+
+# ── parse_roster_csv ──────────────────────────────────────────────────────────
+
+class TestParseRosterCsv:
+    def test_reads_header_case_insensitively_and_strips(self):
+        text = "\ufeffFirst_Name, Last_Name ,Email,Password\n Ada ,Lovelace,ada@test.edu,pw123456\n"
+        assert parse_roster_csv(text) == [_row("ada@test.edu", "pw123456")]
+
+    def test_skips_blank_lines(self):
+        text = "first_name,last_name,email,password\n\n,,,\nA,B,a@test.edu,pw123456\n"
+        assert len(parse_roster_csv(text)) == 1
+
+
+# ── validate_roster ───────────────────────────────────────────────────────────
+
+class TestValidateRoster:
+    def test_splits_valid_invalid_and_duplicates(self):
+        valid, rejected = validate_roster([
+            _row("a@test.edu"),
+            _row("not-an-email"),
+            _row("A@test.edu"),
+            _row("b@test.edu", password="short"),
+        ])
+
+        assert [n for n, _ in valid] == [1]
+        assert [(r["row"], r["status"]) for r in rejected] == [
+            (2, "invalid"),
+            (3, "duplicate_in_roster"),
+            (4, "invalid"),
+        ]
+
+
+# ── find_existing_emails ──────────────────────────────────────────────────────
+
+class TestFindExistingEmails:
+    def test_single_in_query(self, mock_col):
+        mock_col.find.return_value = [{"email": "a@test.edu"}]
+        assert find_existing_emails(mock_col, ["A@test.edu", "b@test.edu"]) == {"a@test.edu"}
+        mock_col.find.assert_called_once_with(
+            {"email": {"$in": ["a@test.edu", "b@test.edu"]}}, {"email": 1}
+        )
+
+    def test_empty_skips_query(self, mock_col):
+        assert find_existing_emails(mock_col, []) == set()
+        mock_col.find.assert_not_called()
+
+
+# ── insert_roster ─────────────────────────────────────────────────────────────
+
+class TestInsertRoster:
+    def _valid(self, n):
+        valid, _ = validate_roster([_row(f"s{i}@test.edu") for i in range(n)])
+        return valid
+
+    def test_one_reservation_and_one_insert(self, roster_col):
+        rows = self._valid(6)
+        results = insert_roster(roster_col, rows, ["h"] * 6, "admin@test.edu")
+
+        assert roster_col.database["counters"].find_one_and_update.call_count == 1
+        roster_col.insert_many.assert_called_once()
+        docs = roster_col.insert_many.call_args[0][0]
+        assert roster_col.insert_many.call_args[1] == {"ordered": True}
+        assert [d["assigned_var"] for d in docs[:3]] == [v.value for v in AssignedVar]
+        assert all(d["consent"] is False and d["enrolled_by"] == "admin@test.edu" for d in docs)
+        assert [r["status"] for r in results] == ["created"] * 6
+        roster_col.insert_one.assert_not_called()
+        roster_col.update_one.assert_not_called()
+
+    def test_raced_duplicate_is_reported_and_rest_inserted(self, roster_col):
+        rows = self._valid(3)
+        calls = []
+
+        def insert_many(docs, ordered):
+            calls.append([d["email"] for d in docs])
+            for d in docs:
+                d.setdefault("_id", ObjectId())
+            if len(calls) == 1:
+                raise BulkWriteError({
+                    "nInserted": 1,
+                    "writeErrors": [{"index": 1, "code": 11000, "errmsg": "E11000"}],
+                })
+
+        roster_col.insert_many.side_effect = insert_many
+        results = insert_roster(roster_col, rows, ["h"] * 3, "admin@test.edu")
+
+        assert calls == [["s0@test.edu", "s1@test.edu", "s2@test.edu"], ["s2@test.edu"]]
+        assert [(r["row"], r["status"]) for r in results] == [
+            (1, "created"), (2, "exists"), (3, "created"),
+        ]
+
+    def test_empty_does_nothing(self, roster_col):
+        assert insert_roster(roster_col, [], [], "admin@test.edu") == []
+        roster_col.insert_many.assert_not_called()
@@ -0,0 +1,87 @@
+# backend/tests/test_heartbeats.py
+"""Unit tests for app.services.heartbeats: the coalescing last_active_at buffer."""
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect
+
+from app.services.heartbeats import HeartbeatBuffer
+
+
+class TestRecord:
+    def test_keeps_newest_timestamp_per_user(self):
+        buf = HeartbeatBuffer()
+        oid = ObjectId()
+        now = datetime.now(timezone.utc)
+
+        buf.record(oid, now)
+        buf.record(oid, now - timedelta(minutes=1))
+
+        assert buf.pending_for(oid) == now
+        assert buf.stats()["recorded"] == 2
+
+
+class TestFlush:
+    def test_single_unordered_bulk_write(self):
+        buf = HeartbeatBuffer()
+        users = MagicMock()
+        a, b = ObjectId(), ObjectId()
+        now = datetime.now(timezone.utc)
+        buf.record(a, now)
+        buf.record(a, now)
+        buf.record(b, now)
+
+        assert buf.flush(users) == 2
+
+        users.bulk_write.assert_called_once()
+        ops, = users.bulk_write.call_args[0]
+        assert users.bulk_write.call_args[1] == {"ordered": False}
+        assert UpdateOne({"_id": a}, {"$max": {"last_active_at": now}}) in ops
+        assert buf.pending_for(a) is None
+        assert buf.last_recorded(a) == now
+
+    def test_empty_buffer_does_not_write(self):
+        users = MagicMock()
+        assert HeartbeatBuffer().flush(users) == 0
+        users.bulk_write.assert_not_called()
+
+    def test_failed_flush_requeues_batch(self):
+        buf = HeartbeatBuffer()
+        users = MagicMock()
+        users.bulk_write.side_effect = AutoReconnect("down")
+        oid = ObjectId()
+        now = datetime.now(timezone.utc)
+        buf.record(oid, now)
+
+        assert buf.flush(users) == 0
+
+        assert buf.pending_for(oid) == now
+        assert buf.stats()["failed_flushes"] == 1
+
+    def test_stats_report_writes_saved(self):
+        buf = HeartbeatBuffer()
+        oid = ObjectId()
+        now = datetime.now(timezone.utc)
+        for _ in range(5):
+            buf.record(oid, now)
+
+        buf.flush(MagicMock())
+
+        stats = buf.stats()
+        assert stats["writes"] == 1
+        assert stats["writes_saved"] == 4
+        assert stats["flushes"] == 1
+
+    def test_last_recorded_is_bounded(self):
+        buf = HeartbeatBuffer(max_remembered=2)
+        a, b, c = ObjectId(), ObjectId(), ObjectId()
+        now = datetime.now(timezone.utc)
+        for oid in (a, b, c):
+            buf.record(oid, now)
+
+        buf.flush(MagicMock())
+
+        assert buf.last_recorded(a) is None
+        assert buf.last_recorded(c) == now
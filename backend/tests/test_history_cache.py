@@ -0,0 +1,119 @@
+# backend/tests/test_history_cache.py
+"""Unit tests for app.services.history_cache: the per-conversation prompt history window."""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services.chat import get_last_exchange
+from app.services.history_cache import HistoryWindowCache
+
+
+class _FakeMessages:
+    """Just enough of the messages collection for get_last_exchange."""
+
+    def __init__(self):
+        self.docs = []
+        self._t = datetime(2025, 1, 1)
+
+    def save(self, conv_id, user_message, reply):
+        turn = sum(1 for d in self.docs if d["role"] == "user")
+        for role, content in (("user", user_message), ("assistant", reply)):
+            self._t += timedelta(seconds=1)
+            self.docs.append({"_id": len(self.docs), "conversation_id": conv_id, "role": role,
+                              "content": content, "created_at": self._t, "turn": turn})
+
+    def find(self, query, projection, sort):
+        return sorted(
+            (d for d in self.docs
+             if d["conversation_id"] == query["conversation_id"] and d["role"] in query["role"]["$in"]),
+            key=lambda d: d["created_at"],
+        )
+
+
+@pytest.fixture
+def cache():
+    return HistoryWindowCache(max_bytes=1_000_000, ttl_seconds=60)
+
+
+def _read(cache, col, conv_id, prefix=None):
+    cached, version = cache.lookup(conv_id, prefix)
+    if cached is not None:
+        return cached
+    history = get_last_exchange(col, conv_id, prefix)
+    cache.fill(conv_id, prefix, history, version)
+    return history
+
+
+class TestHistoryWindowCache:
+    @pytest.mark.parametrize("prefix", [None, "[AGENT A]", "[AGENT B]"])
+    def test_matches_mongo_turn_after_turn(self, cache, prefix):
+        col = _FakeMessages()
+        for turn in range(7):
+            expected = get_last_exchange(col, "c1", prefix)
+            assert _read(cache, col, "c1", prefix) == expected
+            # Some turns are @mentions of a single agent.
+            reply = [f"[AGENT A] a{turn}"] if turn % 3 == 2 else [f"[AGENT A] a{turn}", f"[AGENT B] b{turn}"]
+            col.save("c1", f"q{turn}", reply)
+            cache.record("c1", f"q{turn}", reply)
+        assert cache.stats()["misses"] == 1
+        assert cache.stats()["hits"] == 6
+
+    def test_agent_views_are_separate(self, cache):
+        col = _FakeMessages()
+        for prefix in ("[AGENT A]", "[AGENT B]"):
+            _read(cache, col, "c1", prefix)
+        cache.record("c1", "q", ["[AGENT A] from a", "[AGENT B] from b"])
+
+        assert cache.lookup("c1", "[AGENT A]")[0][1]["content"] == "from a"
+        assert cache.lookup("c1", "[AGENT B]")[0][1]["content"] == "from b"
+        assert cache.lookup("c1")[0] is None  # plain view was never loaded
+
+    def test_unloaded_conversation_is_not_built_from_writes(self, cache):
+        cache.record("c1", "q", ["a"])
+        assert cache.lookup("c1")[0] is None
+
+    def test_fill_racing_a_write_is_dropped(self, cache):
+        _, version = cache.lookup("c1")
+        cache.record("c1", "q", ["a"])  # lands while the Mongo read is in flight
+        cache.fill("c1", None, [], version)
+        assert cache.lookup("c1")[0] is None
+
+    def test_newer_turn_in_mongo_drops_the_window(self, cache):
+        t0 = datetime(2025, 1, 1)
+        cache.fill("c1", None, [], 0, latest=None)
+        cache.record("c1", "q", ["a"], created_at=t0)
+
+        assert cache.lookup("c1", latest=t0)[0] is not None
+        assert cache.lookup("c1")[0] is not None  # nothing to compare with
+        # Another worker saved a turn after ours.
+        assert cache.lookup("c1", latest=t0 + timedelta(seconds=1))[0] is None
+        assert cache.stats()["stale"] == 1
+
+    def test_bounded_by_bytes(self):
+        cache = HistoryWindowCache(max_bytes=1000, ttl_seconds=60)
+        for i in range(10):
+            cache.fill(f"c{i}", None, [{"role": "user", "content": "x" * 200},
+                                       {"role": "assistant", "content": "y" * 200}], 0)
+        stats = cache.stats()
+        assert stats["bytes"] <= 1000
+        assert stats["evictions"] > 0
+        assert cache.lookup("c9")[0] is not None
+        assert cache.lookup("c0")[0] is None
+
+    def test_expired_entries_miss(self):
+        cache = HistoryWindowCache(max_bytes=1_000_000, ttl_seconds=0.0001)
+        cache.fill("c1", None, [], 0)
+        time.sleep(0.001)
+        assert cache.lookup("c1")[0] is None
+
+    def test_invalidate(self, cache):
+        cache.fill("c1", None, [], 0)
+        cache.invalidate("c1")
+        assert cache.lookup("c1")[0] is None
+        assert cache.stats()["bytes"] == 0
+
+    def test_disabled(self):
+        cache = HistoryWindowCache(max_bytes=0, ttl_seconds=60)
+        cache.fill("c1", None, [], 0)
+        assert cache.lookup("c1")[0] is None
@@ -0,0 +1,93 @@
+# backend/tests/test_idempotency.py
+"""Unit tests for app.services.idempotency: chat POST deduplication."""
+from unittest.mock import MagicMock
+
+import pytest
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from app.services.idempotency import IdempotencyKeyReusedError, IdempotencyStore
+
+
+@pytest.fixture
+def store():
+    return IdempotencyStore(enabled=True, ttl_seconds=600, pending_seconds=120, max_entries=10)
+
+
+class TestMemory:
+    def test_second_claim_gets_the_first(self, store):
+        assert store.claim(None, "u1", "k", "s1", "fp") is None
+        assert store.claim(None, "u1", "k", "s2", "fp") == {"stream_id": "s1", "frames": None, "fingerprint": "fp"}
+        assert store.claim(None, "u2", "k", "s3", "fp") is None
+        assert store.stats()["duplicates"] == 1
+
+    def test_complete_stores_frames(self, store):
+        store.claim(None, "u1", "k", "s1", "fp")
+        store.complete(None, "u1", "k", "s1", "fp", ["data: 1\n\n"])
+        assert store.claim(None, "u1", "k", "s2", "fp") == {"stream_id": "s1", "frames": ["data: 1\n\n"], "fingerprint": "fp"}
+
+    def test_release_frees_key(self, store):
+        store.claim(None, "u1", "k", "s1", "fp")
+        store.release(None, "u1", "k", "s1")
+        assert store.claim(None, "u1", "k", "s2", "fp") is None
+
+    def test_reuse_for_another_request_raises(self, store):
+        store.claim(None, "u1", "k", "s1", "fp")
+        with pytest.raises(IdempotencyKeyReusedError):
+            store.claim(None, "u1", "k", "s2", "other")
+        assert store.stats()["reused"] == 1
+        assert store.claim(None, "u1", "k", "s3", "fp")["stream_id"] == "s1"
+
+    def test_pending_claim_expires(self):
+        store = IdempotencyStore(enabled=True, ttl_seconds=600, pending_seconds=0, max_entries=10)
+        store.claim(None, "u1", "k", "s1", "fp")
+        assert store.claim(None, "u1", "k", "s2", "fp") is None
+
+
+class TestStore:
+    def test_claim_inserts_in_flight_record(self, store):
+        col = MagicMock()
+        assert store.claim(col, "u1", "k", "s1", "fp") is None
+        doc = col.insert_one.call_args.args[0]
+        assert doc["_id"] == "u1:k"
+        assert doc["frames"] is None
+
+    def test_key_claimed_by_another_worker(self, store):
+        col = MagicMock()
+        col.insert_one.side_effect = DuplicateKeyError("dup")
+        col.find_one.return_value = {"_id": "u1:k", "stream_id": "s0", "frames": ["data: x\n\n"], "fingerprint": "fp"}
+
+        assert store.claim(col, "u1", "k", "s1", "fp") == {
+            "stream_id": "s0", "frames": ["data: x\n\n"], "fingerprint": "fp",
+        }
+        assert store.stats()["size"] == 0
+
+    def test_record_without_fingerprint_does_not_match(self, store):
+        col = MagicMock()
+        col.insert_one.side_effect = DuplicateKeyError("dup")
+        col.find_one.return_value = {"_id": "u1:k", "stream_id": "s0", "frames": ["data: x\n\n"]}
+
+        with pytest.raises(IdempotencyKeyReusedError):
+            store.claim(col, "u1", "k", "s1", "fp")
+
+    def test_expired_record_taken_over(self, store):
+        col = MagicMock()
+        col.insert_one.side_effect = DuplicateKeyError("dup")
+        col.find_one.return_value = None
+
+        assert store.claim(col, "u1", "k", "s1", "fp") is None
+        col.replace_one.assert_called_once()
+
+    def test_store_errors_fall_back_to_memory(self, store):
+        col = MagicMock()
+        col.insert_one.side_effect = PyMongoError("down")
+
+        assert store.claim(col, "u1", "k", "s1", "fp") is None
+        assert store.claim(col, "u1", "k", "s2", "fp") == {"stream_id": "s1", "frames": None, "fingerprint": "fp"}
+
+    def test_complete_and_release_only_touch_own_claim(self, store):
+        col = MagicMock()
+        store.complete(col, "u1", "k", "s1", "fp", ["f"])
+        store.release(col, "u1", "k", "s2")
+        assert col.update_one.call_args.args[0] == {"_id": "u1:k", "stream_id": "s1"}
+        assert col.delete_one.call_args.args[0] == {"_id": "u1:k", "stream_id": "s2", "frames": None}
+        assert store.claim(None, "u1", "k", "s3", "fp") == {"stream_id": "s1", "frames": ["f"], "fingerprint": "fp"}
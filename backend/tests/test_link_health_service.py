@@ -431,6 +431,15 @@ class TestLlmJudgesRelevant:
         client = self._make_client("NO")
         assert llm_judges_relevant("Basic Probability", "Advanced Calculus", "Integrals and derivatives", client) is False
 
+    def test_uses_relevance_judge_route(self, monkeypatch):
+        from app.services.model_routes import model_router
+
+        monkeypatch.setattr(model_router, "overrides", {"relevance_judge": {"model": "small"}})
+        client = self._make_client("YES")
+        llm_judges_relevant("Basic Probability", "Intro to Probability", "Covers basic probability", client)
+        kwargs = client.chat.completions.create.call_args.kwargs
+        assert (kwargs["model"], kwargs["temperature"], kwargs["max_tokens"]) == ("small", 0.0, 5)
+
     def test_case_insensitive(self):
         client = self._make_client("yes, it is relevant")
         assert llm_judges_relevant("Basic Probability", "Probability Basics", "Covers coin flips", client) is True
@@ -0,0 +1,108 @@
+# backend/tests/test_llm_cache.py
+"""Unit tests for app.services.llm_cache: key normalisation and the memory/Mongo cache."""
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+import pytest
+from pymongo.errors import PyMongoError
+
+from app.services.llm_cache import LLMResponseCache, cache_key, ensure_indexes
+
+
+def _msgs(user="What is 2+2?", system="sys"):
+    return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+
+
+@pytest.fixture
+def cache():
+    return LLMResponseCache(enabled=True, max_entries=10, ttl_seconds=60, disabled_variants=set())
+
+
+class TestCacheKey:
+    def test_whitespace_is_normalised(self):
+        assert cache_key(_msgs("What is\n 2+2? "), 0.5, False, "m") == cache_key(_msgs(), 0.5, False, "m")
+
+    def test_every_input_changes_the_key(self):
+        base = cache_key(_msgs(), 0.5, False, "m")
+        assert cache_key(_msgs(system="other"), 0.5, False, "m") != base
+        assert cache_key(_msgs(), 0.1, False, "m") != base
+        assert cache_key(_msgs(), 0.5, True, "m") != base
+        assert cache_key(_msgs(), 0.5, False, "other-model") != base
+
+
+class TestLLMResponseCache:
+    def test_put_then_get_from_memory(self, cache):
+        col = MagicMock()
+        cache.put(col, "k", "a reply", "m")
+
+        assert cache.get(col, "k") == "a reply"
+        col.find_one.assert_not_called()
+        stats = cache.stats()
+        assert stats["memory_hits"] == 1
+        assert stats["saved_tokens"] > 0
+
+    def test_put_upserts_without_overwriting(self, cache):
+        col = MagicMock()
+        cache.put(col, "k", "a reply", "m")
+        args, kwargs = col.update_one.call_args
+        assert args[0] == {"_id": "k"}
+        assert args[1]["$setOnInsert"]["reply"] == "a reply"
+        assert kwargs["upsert"] is True
+
+    def test_reported_tokens_are_stored_and_counted(self, cache):
+        col = MagicMock()
+        cache.put(col, "k", "a reply", "m", output_tokens=9)
+
+        assert col.update_one.call_args.args[1]["$setOnInsert"]["output_tokens"] == 9
+        cache.get(col, "k")
+        assert cache.stats()["saved_tokens"] == 9
+
+    def test_store_hit_warms_memory(self, cache):
+        col = MagicMock()
+        col.find_one.return_value = {"_id": "k", "reply": "stored", "output_tokens": 7}
+
+        assert cache.get(col, "k") == "stored"
+        assert cache.get(col, "k") == "stored"
+
+        col.find_one.assert_called_once()
+        assert cache.stats()["store_hits"] == 1
+        assert cache.stats()["saved_tokens"] == 14
+
+    def test_miss(self, cache):
+        col = MagicMock()
+        col.find_one.return_value = None
+        assert cache.get(col, "k") is None
+        assert cache.stats()["misses"] == 1
+
+    def test_memory_only_without_collection(self, cache):
+        assert cache.get(None, "k") is None
+        cache.put(None, "k", "r", "m")
+        assert cache.get(None, "k") == "r"
+
+    def test_mongo_errors_degrade_to_miss(self, cache):
+        col = MagicMock()
+        col.find_one.side_effect = PyMongoError("down")
+        col.update_one.side_effect = PyMongoError("down")
+        assert cache.get(col, "k") is None
+        cache.put(col, "k", "r", "m")  # must not raise
+
+    def test_lru_bound(self):
+        cache = LLMResponseCache(enabled=True, max_entries=1, ttl_seconds=60, disabled_variants=set())
+        cache.put(None, "a", "1", "m")
+        cache.put(None, "b", "2", "m")
+        assert cache.get(None, "a") is None
+        assert cache.get(None, "b") == "2"
+
+    def test_enabled_for_respects_opt_out(self):
+        cache = LLMResponseCache(enabled=True, max_entries=10, ttl_seconds=60, disabled_variants={"links"})
+        assert cache.enabled_for("default")
+        assert not cache.enabled_for("links")
+        off = LLMResponseCache(enabled=False, max_entries=10, ttl_seconds=60, disabled_variants=set())
+        assert not off.enabled_for("default")
+
+
+class TestEnsureIndexes:
+    def test_ttl_index_on_expires_at(self):
+        col = MagicMock()
+        ensure_indexes(col)
+        col.create_index.assert_called_once_with("expires_at", expireAfterSeconds=0)
@@ -0,0 +1,137 @@
+# backend/tests/test_llm_gate.py
+"""Unit tests for app.services.llm_gate: upstream admission control."""
+import asyncio
+
+import pytest
+
+from app.services.llm_gate import LLMGate, LLMQueueFullError
+
+
+@pytest.fixture
+def gate():
+    return LLMGate(max_concurrent=2, max_per_user=2, max_queue=10)
+
+
+class TestAdmission:
+    def test_grants_until_cap_then_queues(self, gate):
+        a, b, c = gate.enqueue("u1"), gate.enqueue("u2"), gate.enqueue("u3")
+        assert a.granted and b.granted and not c.granted
+        assert gate.active == 2 and gate.waiting == 1
+
+        a.release()
+        assert c.granted
+        assert gate.active == 2 and gate.waiting == 0
+
+    def test_per_user_cap_lets_others_through(self):
+        gate = LLMGate(max_concurrent=4, max_per_user=2, max_queue=10)
+        held = [gate.enqueue("u1"), gate.enqueue("u1")]
+        third = gate.enqueue("u1")
+        other = gate.enqueue("u2")
+        assert not third.granted
+        assert other.granted
+
+        held[0].release()
+        assert third.granted
+
+    def test_waiting_users_served_round_robin(self):
+        gate = LLMGate(max_concurrent=1, max_per_user=0, max_queue=10)
+        holder = gate.enqueue("x")
+        burst = [gate.enqueue("u1") for _ in range(3)]
+        late = gate.enqueue("u2")
+        assert gate.position(late) == 2
+        assert [gate.position(t) for t in burst] == [1, 3, 4]
+
+        order = []
+        current = holder
+        for _ in range(4):
+            current.release()
+            current = next(t for t in [*burst, late] if t.granted and not t.released)
+            order.append("u2" if current is late else f"u1#{burst.index(current)}")
+        assert order == ["u1#0", "u2", "u1#1", "u1#2"]
+
+    def test_full_queue_rejects(self):
+        gate = LLMGate(max_concurrent=1, max_per_user=2, max_queue=1)
+        gate.enqueue("u1")
+        gate.enqueue("u2")
+        with pytest.raises(LLMQueueFullError):
+            gate.enqueue("u3")
+        assert gate.stats()["rejected"] == 1
+
+    def test_check_counts_streams_beyond_free_slots(self):
+        gate = LLMGate(max_concurrent=2, max_per_user=2, max_queue=1)
+        gate.enqueue("u1")
+        gate.check(2)  # one slot free, one would wait
+        with pytest.raises(LLMQueueFullError):
+            gate.check(3)
+
+    def test_abandoned_waiter_leaves_queue(self):
+        gate = LLMGate(max_concurrent=1, max_per_user=2, max_queue=10)
+        holder = gate.enqueue("u1")
+        waiter = gate.enqueue("u2")
+        waiter.release()
+        waiter.release()
+        assert gate.waiting == 0
+        assert gate.stats()["abandoned"] == 1
+
+        holder.release()
+        assert gate.active == 0
+
+    def test_release_is_idempotent(self, gate):
+        ticket = gate.enqueue("u1")
+        ticket.release()
+        ticket.release()
+        assert gate.active == 0
+
+    def test_disabled_gate_grants_everything(self):
+        gate = LLMGate(max_concurrent=0, max_per_user=2, max_queue=0)
+        tickets = [gate.enqueue("u1") for _ in range(5)]
+        assert all(t.granted for t in tickets)
+        gate.check(100)
+
+
+class TestTryAcquire:
+    def test_only_when_nobody_waits(self):
+        gate = LLMGate(max_concurrent=2, max_per_user=1, max_queue=10)
+        gate.enqueue("u1")
+        gate.enqueue("u1")  # waits on the per-user cap, one slot still free
+        assert not gate.idle("u2")
+        assert gate.try_acquire("u2") is None
+
+    def test_takes_free_slot(self, gate):
+        ticket = gate.try_acquire("u1")
+        assert ticket.granted and gate.active == 1
+
+
+class TestWait:
+    def test_yields_positions_until_granted(self):
+        async def run():
+            gate = LLMGate(max_concurrent=1, max_per_user=0, max_queue=10)
+            holder = gate.enqueue("x")
+            first = gate.enqueue("u1")
+            second = gate.enqueue("u2")
+            positions = []
+
+            async def waiter():
+                async for position in second.wait():
+                    positions.append(position)
+
+            task = asyncio.create_task(waiter())
+            await asyncio.sleep(0)
+            holder.release()
+            await asyncio.sleep(0)
+            first.release()
+            await asyncio.wait_for(task, 1)
+            return gate, positions, second
+
+        gate, positions, second = asyncio.run(run())
+        assert positions == [2, 1]
+        assert second.granted
+        stats = gate.stats()
+        assert stats["queued"] == 2 and stats["avg_wait_ms"] is not None
+
+    def test_granted_ticket_yields_nothing(self, gate):
+        async def run():
+            ticket = gate.enqueue("u1")
+            return [p async for p in ticket.wait()]
+
+        assert asyncio.run(run()) == []
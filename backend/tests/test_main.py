@@ -138,6 +138,23 @@ class TestShutdown:
         mock_stop_scheduler.assert_called_once()
         mongo_client.close.assert_called_once()
 
+    def test_shutdown_flushes_pending_heartbeats(self):
+        from datetime import datetime, timezone
+        from app.main import _shutdown
+        from app.services.heartbeats import heartbeats
+
+        users = MagicMock()
+        db = MagicMock()
+        db.__getitem__ = MagicMock(return_value=users)
+        app.state.db = db
+        app.state.mongo_client = MagicMock()
+        heartbeats.record("u1", datetime.now(timezone.utc))
+
+        with patch("app.scheduler.stop_scheduler"):
+            _shutdown()
+
+        users.bulk_write.assert_called_once()
+
     def test_shutdown_handles_missing_mongo_client(self):
         from app.main import _shutdown
 
@@ -0,0 +1,190 @@
+# backend/tests/test_message_writer.py
+"""Unit tests for app.services.message_writer: batched write-behind with a disk spool."""
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pytest
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError, ServerSelectionTimeoutError
+
+from app.services.message_writer import MessageWriteBehind
+
+
+def _pair(conv_id="c1", text="q"):
+    t = datetime(2025, 1, 1, 12, 0, 0)
+    return (
+        {"conversation_id": conv_id, "role": "user", "content": text, "created_at": t},
+        {"conversation_id": conv_id, "role": "assistant", "content": [f"re: {text}"], "created_at": t},
+    )
+
+
+@pytest.fixture
+def writer(tmp_path):
+    w = MessageWriteBehind(spool_path=str(tmp_path / "spool.jsonl"), max_batch=100)
+    yield w
+    w.stop()
+
+
+@pytest.fixture
+def col():
+    col = MagicMock()
+    col.aggregate.return_value = [{"_id": "c1", "n": 4}]
+    return col
+
+
+class TestFlush:
+    def test_one_ordered_insert_many_per_batch(self, writer, col):
+        writer._col = col
+        writer.enqueue(*_pair("c1", "a"))
+        writer.enqueue(*_pair("c2", "b"))
+
+        assert writer.flush() == 4
+
+        col.insert_many.assert_called_once()
+        docs = col.insert_many.call_args.args[0]
+        assert [(d["conversation_id"], d["role"]) for d in docs] == [
+            ("c1", "user"), ("c1", "assistant"), ("c2", "user"), ("c2", "assistant"),
+        ]
+        assert col.insert_many.call_args.kwargs["ordered"] is True
+        assert all(isinstance(d["_id"], ObjectId) for d in docs)
+
+    def test_turns_continue_from_stored_count(self, writer, col):
+        writer._col = col
+        first, second, other = _pair("c1"), _pair("c1"), _pair("c2")
+        for pair in (first, second, other):
+            writer.enqueue(*pair)
+
+        writer.flush()
+
+        col.aggregate.assert_called_once()
+        assert first[0]["turn"] == first[1]["turn"] == 4
+        assert second[0]["turn"] == second[1]["turn"] == 5
+        assert other[0]["turn"] == 0
+
+    def test_duplicates_from_a_retried_batch_are_skipped(self, writer, col):
+        writer._col = col
+        col.insert_many.side_effect = [
+            BulkWriteError({"nInserted": 1, "writeErrors": [{"index": 1, "code": 11000, "errmsg": "dup"}]}),
+            None,
+        ]
+        writer.enqueue(*_pair())
+        writer.enqueue(*_pair())
+
+        assert writer.flush() == 3
+        assert len(col.insert_many.call_args_list[1].args[0]) == 2
+        assert not os.path.exists(writer.spool_path)
+
+
+class TestSpool:
+    def test_unreachable_mongo_spools_the_batch(self, writer, col):
+        writer._col = col
+        col.insert_many.side_effect = ServerSelectionTimeoutError("down")
+        writer.enqueue(*_pair())
+
+        assert writer.flush() == 0
+
+        with open(writer.spool_path) as f:
+            assert len(f.readlines()) == 2
+        assert writer.stats()["spooled"] == 2
+        assert writer.stats()["failed_batches"] == 1
+
+    def test_replay_restores_documents_and_removes_the_spool(self, writer, col):
+        writer._col = col
+        col.insert_many.side_effect = ServerSelectionTimeoutError("down")
+        user_doc, asst_doc = _pair()
+        writer.enqueue(user_doc, asst_doc)
+        writer.flush()
+
+        replay_col = MagicMock()
+        assert writer.replay_spool(replay_col) == 2
+
+        replayed = replay_col.insert_many.call_args.args[0]
+        assert replayed[0]["_id"] == user_doc["_id"]
+        assert replayed[0]["created_at"] == user_doc["created_at"]
+        assert replayed[1]["content"] == ["re: q"]
+        assert replay_col.insert_many.call_args.kwargs["ordered"] is False
+        assert not os.path.exists(writer.spool_path)
+        assert not os.path.exists(writer.spool_path + ".replay")
+
+    def test_failed_replay_keeps_documents_for_next_time(self, writer, col):
+        writer._col = col
+        col.insert_many.side_effect = ServerSelectionTimeoutError("down")
+        writer.enqueue(*_pair())
+        writer.flush()
+
+        down = MagicMock()
+        down.insert_many.side_effect = ServerSelectionTimeoutError("still down")
+        assert writer.replay_spool(down) == 0
+
+        up = MagicMock()
+        assert writer.replay_spool(up) == 2
+
+    def test_turns_stay_unique_and_ordered_across_a_spooled_batch(self, writer):
+        stored = []
+
+        class _Messages:
+            down = True
+
+            def insert_many(self, docs, ordered):
+                if self.down:
+                    raise ServerSelectionTimeoutError("down")
+                stored.extend(docs)
+
+            def aggregate(self, pipeline):
+                conv_ids = pipeline[0]["$match"]["conversation_id"]["$in"]
+                counts = Counter(d["conversation_id"] for d in stored if d["role"] == "user")
+                return [{"_id": c, "n": counts[c]} for c in conv_ids if counts[c]]
+
+            def find(self, query, projection):
+                ids = set(query["_id"]["$in"])
+                return [d for d in stored if d["_id"] in ids]
+
+        writer._col = messages = _Messages()
+        writer.enqueue(*_pair("c1", "first"))
+        writer.flush()
+        with open(writer.spool_path) as f:
+            assert all("turn" not in json_util.loads(line) for line in f)
+
+        messages.down = False
+        writer.enqueue(*_pair("c1", "second"))
+        writer.enqueue(*_pair("c2", "other"))
+        writer.flush()
+        writer.replay_spool(messages)
+
+        c1 = [(d["content"], d["turn"]) for d in stored if d["conversation_id"] == "c1" and d["role"] == "user"]
+        assert sorted(c1, key=lambda row: row[1]) == [("first", 0), ("second", 1)]
+        assert all(d["turn"] == 0 for d in stored if d["conversation_id"] == "c2")
+        assert not os.path.exists(writer.spool_path)
+
+        writer.enqueue(*_pair("c1", "third"))
+        writer.flush()
+        assert stored[-1]["turn"] == 2
+
+    def test_replay_without_spool_is_a_no_op(self, writer):
+        assert writer.replay_spool(MagicMock()) == 0
+
+
+class TestBackgroundThread:
+    def test_wait_written_returns_once_the_exchange_is_stored(self, writer, col):
+        gate = threading.Event()
+        col.insert_many.side_effect = lambda *a, **k: gate.wait(5)
+        writer.start(col)
+        writer.enqueue(*_pair("c1"))
+
+        assert writer.wait_written("c1", timeout=0.05) is False
+        assert writer.wait_written("other", timeout=0.05) is True
+        gate.set()
+        assert writer.wait_written("c1", timeout=5) is True
+
+    def test_stop_drains_the_queue(self, writer, col):
+        col.insert_many.side_effect = lambda *a, **k: None
+        writer.start(col)
+        for _ in range(5):
+            writer.enqueue(*_pair())
+        writer.stop()
+
+        assert not writer.running
+        assert sum(len(c.args[0]) for c in col.insert_many.call_args_list) == 10
@@ -0,0 +1,37 @@
+# backend/tests/test_metrics_api.py
+"""FastAPI TestClient integration tests for app.api.metrics."""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.metrics import router as metrics_router
+from app.api.auth import get_current_user
+
+
+@pytest.fixture
+def metrics_client(admin_user):
+    app = FastAPI()
+    app.include_router(metrics_router)
+    app.dependency_overrides[get_current_user] = lambda: admin_user
+    return TestClient(app)
+
+
+@pytest.fixture
+def non_admin_metrics_client(regular_user):
+    app = FastAPI()
+    app.include_router(metrics_router)
+    app.dependency_overrides[get_current_user] = lambda: regular_user
+    return TestClient(app)
+
+
+class TestGetMetrics:
+    def test_admin_gets_user_cache_stats(self, metrics_client):
+        resp = metrics_client.get("/metrics")
+        assert resp.status_code == 200
+        body = resp.json()
+        assert {"hits", "misses", "size"} <= set(body["user_cache"])
+        assert {"hits", "misses", "size"} <= set(body["token_memo"])
+
+    def test_non_admin_forbidden(self, non_admin_metrics_client):
+        resp = non_admin_metrics_client.get("/metrics")
+        assert resp.status_code == 403
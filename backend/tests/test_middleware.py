@@ -0,0 +1,143 @@
+# backend/tests/test_middleware.py
+"""Tests for app.core.middleware: sliding session renewal via SessionRenewalMiddleware."""
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import pytest
+from bson import ObjectId
+from fastapi import Depends, FastAPI, Response
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from app.api.auth import router as auth_router, get_current_user, get_session_user
+from app.core.config import get_settings
+from app.core.middleware import SessionRenewalMiddleware
+from app.core.security import decode_token
+from app.schemas.user import AssignedVar, SurveyStage
+
+
+def _token(age_minutes: int, **claims) -> str:
+    settings = get_settings()
+    now = datetime.now(tz=timezone.utc)
+    iat = now - timedelta(minutes=age_minutes)
+    payload = {
+        **claims,
+        "sub": "student@test.edu",
+        "iat": int(iat.timestamp()),
+        "exp": int((iat + timedelta(minutes=settings.JWT_EXPIRES_MIN)).timestamp()),
+    }
+    return jwt.encode(payload, settings.JWT_SECRET, algorithm=settings.JWT_ALG)
+
+
+@pytest.fixture
+def user_doc():
+    return {
+        "_id": ObjectId(),
+        "email": "student@test.edu",
+        "password_hash": "x",
+        "assigned_var": AssignedVar.links.value,
+        "is_admin": False,
+        "survey_stage": SurveyStage.pre_base.value,
+        "session_version": 0,
+        "last_active_at": datetime.now(timezone.utc),
+    }
+
+
+@pytest.fixture
+def renewal_client(user_doc):
+    col = MagicMock()
+    col.find_one.return_value = user_doc
+    db = MagicMock()
+    db.__getitem__ = MagicMock(return_value=col)
+
+    app = FastAPI()
+    app.add_middleware(SessionRenewalMiddleware)
+    app.include_router(auth_router)
+    app.state.db = db
+
+    @app.get("/stream")
+    def stream(user=Depends(get_current_user)):
+        return StreamingResponse(iter(["a", "b"]), media_type="text/plain")
+
+    @app.get("/hot")
+    def hot(user=Depends(get_session_user)):
+        return {"id": user.id}
+
+    return TestClient(app)
+
+
+class TestSessionRenewal:
+    def test_fresh_token_is_not_renewed(self, renewal_client):
+        renewal_client.cookies.set(get_settings().COOKIE_NAME, _token(1))
+        resp = renewal_client.get("/auth/me")
+        assert resp.status_code == 200
+        assert "set-cookie" not in resp.headers
+
+    def test_aged_token_is_renewed(self, renewal_client):
+        settings = get_settings()
+        old = _token(settings.JWT_EXPIRES_MIN * 3 // 4)
+        renewal_client.cookies.set(settings.COOKIE_NAME, old)
+
+        resp = renewal_client.get("/auth/me")
+
+        new = resp.cookies[settings.COOKIE_NAME]
+        assert new != old
+        assert decode_token(new)["exp"] > decode_token(old)["exp"]
+
+    def test_streaming_response_is_renewed(self, renewal_client):
+        settings = get_settings()
+        renewal_client.cookies.set(settings.COOKIE_NAME, _token(settings.JWT_EXPIRES_MIN - 1))
+
+        resp = renewal_client.get("/stream")
+
+        assert resp.text == "ab"
+        assert settings.COOKIE_NAME in resp.cookies
+
+    def test_claims_token_is_renewed_with_claims(self, renewal_client, user_doc, monkeypatch):
+        settings = get_settings()
+        monkeypatch.setattr(settings, "SESSION_CLAIMS_ENABLED", True)
+        uid = str(user_doc["_id"])
+        renewal_client.cookies.set(
+            settings.COOKIE_NAME,
+            _token(settings.JWT_EXPIRES_MIN - 1, uid=uid, adm=False, var="links", sv=0),
+        )
+
+        resp = renewal_client.get("/hot")
+
+        assert resp.status_code == 200
+        payload = decode_token(resp.cookies[settings.COOKIE_NAME])
+        assert payload["uid"] == uid
+        assert payload["var"] == "links"
+
+    def test_claims_renewal_picks_up_changed_user(self, renewal_client, user_doc, monkeypatch):
+        settings = get_settings()
+        monkeypatch.setattr(settings, "SESSION_CLAIMS_ENABLED", True)
+        user_doc.update(is_admin=True, assigned_var=AssignedVar.followup.value)  # edited in Mongo
+        renewal_client.cookies.set(
+            settings.COOKIE_NAME,
+            _token(settings.JWT_EXPIRES_MIN - 1, uid=str(user_doc["_id"]), adm=False, var="links", sv=0),
+        )
+
+        resp = renewal_client.get("/hot")
+
+        payload = decode_token(resp.cookies[settings.COOKIE_NAME])
+        assert payload["adm"] is True
+        assert payload["var"] == "followup"
+
+    def test_endpoint_cookie_wins(self, renewal_client):
+        settings = get_settings()
+        renewal_client.cookies.set(settings.COOKIE_NAME, _token(settings.JWT_EXPIRES_MIN - 1))
+
+        resp = renewal_client.post("/auth/logout")
+
+        assert len(resp.headers.get_list("set-cookie")) == 1
+
+    def test_disabled_by_zero_fraction(self, renewal_client, monkeypatch):
+        settings = get_settings()
+        monkeypatch.setattr(settings, "SESSION_RENEW_AFTER_FRACTION", 0.0)
+        renewal_client.cookies.set(settings.COOKIE_NAME, _token(settings.JWT_EXPIRES_MIN - 1))
+
+        resp = renewal_client.get("/auth/me")
+
+        assert "set-cookie" not in resp.headers
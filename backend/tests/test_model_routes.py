@@ -0,0 +1,54 @@
+# backend/tests/test_model_routes.py
+"""Unit tests for app.services.model_routes: the per call site routing table."""
+from app.services.model_routes import DEFAULT_ROUTES, ModelRouter, parse_routes
+
+
+class TestParseRoutes:
+    def test_overrides_any_subset_of_fields(self):
+        raw = '{"followup_suggestions": {"model": "small", "max_tokens": "150"}, "answer": {"temperature": 0.2}}'
+        assert parse_routes(raw) == {
+            "followup_suggestions": {"model": "small", "max_tokens": 150},
+            "answer": {"temperature": 0.2},
+        }
+
+    def test_empty_means_defaults(self):
+        assert parse_routes("") == {}
+        assert parse_routes("  ") == {}
+
+    def test_bad_input_is_ignored(self):
+        assert parse_routes("{not json") == {}
+        assert parse_routes('["answer"]') == {}
+        assert parse_routes(
+            '{"summarizer": {"model": "x"}, "answer": {"temperature": "hot", "top_p": 1, "model": "big"}}'
+        ) == {"answer": {"model": "big"}}
+
+
+class TestModelRouter:
+    def test_defaults_follow_the_global_model(self, monkeypatch):
+        monkeypatch.setenv("UF_OPENAI_API_MODEL", "main")
+        route = ModelRouter({}).route("double_a")
+        assert (route.name, route.model, route.temperature, route.max_tokens) == ("double_a", "main", 0.1, 1000)
+
+    def test_override_wins_per_route(self, monkeypatch):
+        monkeypatch.setenv("UF_OPENAI_API_MODEL", "main")
+        router = ModelRouter({"followup_suggestions": {"model": "small", "max_tokens": 100}})
+        suggestions = router.route("followup_suggestions")
+        assert (suggestions.model, suggestions.temperature, suggestions.max_tokens) == ("small", 0.5, 100)
+        assert router.route("answer").model == "main"
+
+    def test_stats_list_every_route_with_call_counts(self, monkeypatch):
+        monkeypatch.setenv("UF_OPENAI_API_MODEL", "main")
+        router = ModelRouter({"relevance_judge": {"model": "small"}})
+        router.record(router.route("relevance_judge"))
+        router.record(router.route("relevance_judge"))
+        router.record(router.route("answer"))
+
+        stats = router.stats()
+        assert set(stats) == set(DEFAULT_ROUTES)
+        assert stats["relevance_judge"]["model"] == "small"
+        assert stats["relevance_judge"]["calls"] == {"small": 2}
+        assert stats["answer"]["calls"] == {"main": 1}
+        assert stats["page_summary"]["calls"] == {}
+
+        router.clear()
+        assert router.stats()["answer"]["calls"] == {}
@@ -0,0 +1,120 @@
+# backend/tests/test_pregen_service.py
+"""Unit tests for app.services.pregen: first-turn pre-generation planning and storage."""
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from bson import ObjectId
+
+from app.api.chat import FIRST_TURN_MODES, first_turn_messages
+from app.services.pregen import (
+    question_prompt,
+    plan_jobs,
+    pending_jobs,
+    store_pregenerated,
+    prune_stale,
+    run_pregeneration,
+)
+
+
+def _question(**overrides):
+    q = {
+        "_id": ObjectId(),
+        "stem": "What is 2+2?",
+        "subtitle": None,
+        "choices": [{"id": "a", "label": "3"}, {"id": "b", "label": "4"}],
+    }
+    q.update(overrides)
+    return q
+
+
+def _build(mode, message, answer_incorrectly, has_choices):
+    return first_turn_messages(mode, message, answer_incorrectly, has_choices, [])
+
+
+class TestQuestionPrompt:
+    def test_matches_quiz_page_format(self):
+        assert question_prompt(_question()) == "What is 2+2?\n\nAnswer choices:\nA. 3\nB. 4"
+
+    def test_includes_subtitle(self):
+        prompt = question_prompt(_question(subtitle="Use integers."))
+        assert prompt.startswith("What is 2+2?\n\nUse integers.\n\nAnswer choices:")
+
+
+class TestPlanJobs:
+    def test_one_job_per_distinct_first_turn(self):
+        jobs = plan_jobs([_question(), _question(stem="What is 3+3?")], list(FIRST_TURN_MODES), _build)
+        # default and followup send the same first turn and share one entry
+        assert len(jobs) == 2 * (len(FIRST_TURN_MODES) - 1) * 2
+        assert len({j["key"] for j in jobs}) == len(jobs)
+
+    def test_key_is_stable_and_tracks_question_text(self):
+        q = _question()
+        first = plan_jobs([q], ["default"], _build)
+        again = plan_jobs([q], ["default"], _build)
+        edited = plan_jobs([{**q, "stem": "What is 3+3?"}], ["default"], _build)
+        assert [j["key"] for j in first] == [j["key"] for j in again]
+        assert first[0]["key"] != edited[0]["key"]
+
+    def test_key_tracks_routed_model(self, monkeypatch):
+        from app.services.model_routes import model_router
+
+        q = _question()
+        before = plan_jobs([q], ["double_a"], _build)
+        monkeypatch.setattr(model_router, "overrides", {"double_a": {"model": "other"}})
+        after = plan_jobs([q], ["double_a"], _build)
+        assert after[0]["route"].model == "other"
+        assert before[0]["key"] != after[0]["key"]
+
+
+class TestPendingAndPrune:
+    def test_pending_skips_pregenerated_keys(self, mock_col):
+        jobs = plan_jobs([_question()], ["default"], _build)
+        mock_col.find.return_value = [{"_id": jobs[0]["key"]}]
+
+        assert pending_jobs(mock_col, jobs) == jobs[1:]
+        query = mock_col.find.call_args[0][0]
+        assert query["pregenerated"] is True
+
+    def test_prune_removes_entries_not_in_plan(self, mock_col):
+        jobs = plan_jobs([_question()], ["default"], _build)
+        mock_col.delete_many.return_value = MagicMock(deleted_count=3)
+
+        assert prune_stale(mock_col, jobs) == 3
+        mock_col.delete_many.assert_called_once_with(
+            {"pregenerated": True, "_id": {"$nin": [j["key"] for j in jobs]}}
+        )
+
+
+class TestStorePregenerated:
+    def test_stores_reply_with_stated_choice_and_no_expiry(self, mock_col):
+        job = plan_jobs([_question()], ["default"], _build)[0]
+
+        store_pregenerated(mock_col, job, "The answer is 4.")
+
+        (query, update), kwargs = mock_col.update_one.call_args
+        assert query == {"_id": job["key"]}
+        assert update["$set"]["stated_choice_id"] == "b"
+        assert update["$set"]["pregenerated"] is True
+        assert update["$set"]["model"] == job["route"].model
+        assert update["$unset"] == {"expires_at": ""}
+        assert kwargs["upsert"] is True
+
+
+class TestRunPregeneration:
+    def test_generates_and_reports_failures(self, mock_col):
+        jobs = plan_jobs([_question()], ["default"], _build)
+
+        async def stream(messages, route, meter):
+            if "incorrect" in messages[0]["content"]:
+                raise RuntimeError("upstream down")
+            yield "The answer "
+            yield "is 4."
+            meter.usage(SimpleNamespace(prompt_tokens=20, completion_tokens=5))
+
+        counts = asyncio.run(run_pregeneration(mock_col, jobs, stream, concurrency=2, per_minute=0))
+
+        assert counts == {"generated": 1, "failed": 1}
+        stored = mock_col.update_one.call_args[0][1]["$set"]
+        assert stored["reply"] == "The answer is 4."
+        assert stored["output_tokens"] == 5
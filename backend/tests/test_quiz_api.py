@@ -1,14 +1,14 @@
 # backend/tests/test_quiz_api.py
 """FastAPI TestClient integration tests for app/api/quiz.py."""
 from datetime import datetime
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from bson import ObjectId
 import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
 from app.api.quiz import router as quiz_router
-from app.api.auth import get_current_user
+from app.api.auth import get_current_user, get_session_user
 from app.schemas.user import UserPublic
 
 
@@ -30,6 +30,7 @@ def quiz_app(admin_user, mock_db):
     app.include_router(quiz_router)
     app.state.db = mock_db
     app.dependency_overrides[get_current_user] = lambda: admin_user
+    app.dependency_overrides[get_session_user] = lambda: admin_user
     return app
 
 
@@ -44,6 +45,7 @@ def quiz_app_oid(admin_user_oid, mock_db):
     app.include_router(quiz_router)
     app.state.db = mock_db
     app.dependency_overrides[get_current_user] = lambda: admin_user_oid
+    app.dependency_overrides[get_session_user] = lambda: admin_user_oid
     return app
 
 
@@ -60,6 +62,7 @@ def regular_quiz_app(regular_user, mock_db):
     app.include_router(quiz_router)
     app.state.db = mock_db
     app.dependency_overrides[get_current_user] = lambda: regular_user
+    app.dependency_overrides[get_session_user] = lambda: regular_user
     return app
 
 
@@ -218,6 +221,50 @@ class TestGetQuizState:
         assert data["current_question"]["id"] == str(qid1)
 
 
+class TestQuizStateSpeculation:
+    def _in_progress(self, mock_col, incorrect=()):
+        qid = ObjectId()
+        attempt = {
+            "_id": ObjectId(), "user_id": "userid1", "user_email": "student@test.edu",
+            "quiz_id": "followup", "conversation_id": "conv-1", "status": "in_progress",
+            "question_order": [str(qid)], "incorrect_question_ids": [str(qid) for _ in incorrect],
+            "answers": [{"question_id": str(qid), "shown_at": datetime.utcnow(), "answered_at": None, "choice_id": None}],
+        }
+        question_doc = {"_id": qid, "stem": "Q1", "subtitle": None, "choices": [{"id": "a", "label": "A"}]}
+        mock_col.find_one.side_effect = [attempt, question_doc, question_doc]
+        mock_col.find.return_value = [{"_id": qid}]
+        return str(qid)
+
+    def test_shown_question_is_speculated_for_the_quiz_variant(self, monkeypatch, regular_quiz_client, mock_col):
+        from app.api import quiz as quiz_module
+        from app.services.speculation import speculation
+
+        monkeypatch.setattr(speculation, "enabled", True)
+        speculate = AsyncMock()
+        monkeypatch.setattr(quiz_module, "speculate_first_turn", speculate)
+        qid = self._in_progress(mock_col, incorrect=[1])
+
+        resp = regular_quiz_client.get("/quiz/followup/state")
+
+        assert resp.status_code == 200
+        args = speculate.await_args.args
+        assert args[1:3] == ("userid1", "followup")
+        assert args[3]["id"] == qid
+        assert args[4] is True   # answer_incorrectly: question was missed before
+        assert args[5] is True   # no answered questions yet
+
+    def test_disabled_by_default(self, monkeypatch, regular_quiz_client, mock_col):
+        from app.api import quiz as quiz_module
+
+        speculate = AsyncMock()
+        monkeypatch.setattr(quiz_module, "speculate_first_turn", speculate)
+        self._in_progress(mock_col)
+
+        regular_quiz_client.get("/quiz/followup/state")
+
+        speculate.assert_not_called()
+
+
 # ── POST /quiz/{quiz_id}/answer ──────────────────────────────────────────────
 
 class TestSubmitQuizAnswer:
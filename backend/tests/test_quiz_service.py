@@ -22,6 +22,7 @@ from app.services.quiz import (
     MAX_QUIZ_QUESTIONS,
 )
 from app.schemas.user import SurveyStage
+from app.services.user_cache import user_cache
 
 
 # ── get_users_collection / get_quiz_attempts_collection ─────────────────────
@@ -225,6 +226,16 @@ class TestMarkQuizCompleted:
         second_call = mock_col.update_one.call_args_list[1]
         assert second_call[0][1]["$set"]["quiz_base_completed"] is True
 
+    def test_invalidates_cached_user(self, mock_db, mock_col):
+        user_oid = ObjectId()
+        user_cache.put({"_id": user_oid, "email": "student@test.edu"})
+        doc = {"_id": ObjectId(), "quiz_id": "base", "user_id": str(user_oid)}
+        mock_col.update_one.return_value = MagicMock(matched_count=1)
+
+        _mark_quiz_completed(mock_db, doc)
+
+        assert user_cache.get("student@test.edu") is None
+
     def test_user_not_found_raises_404(self, mock_db, mock_col):
         doc = {"_id": ObjectId(), "quiz_id": "base", "user_id": str(ObjectId())}
         mock_col.update_one.return_value = MagicMock(matched_count=0)
@@ -257,6 +268,14 @@ class TestResetQuizAttempt:
         assert update_call[0][1]["$set"]["quiz_variant_completed"] is False
         assert update_call[0][1]["$set"]["survey_stage"] == SurveyStage.post_base.value
 
+    def test_reset_invalidates_cached_user(self, mock_db, mock_col):
+        user_oid = ObjectId()
+        user_cache.put({"_id": user_oid, "email": "student@test.edu"})
+
+        reset_quiz_attempt(mock_db, str(user_oid), "base")
+
+        assert user_cache.get("student@test.edu") is None
+
     def test_reset_unknown_quiz_id_only_deletes(self, mock_db, mock_col):
         user_id = str(ObjectId())
         reset_quiz_attempt(mock_db, user_id, "unknown-quiz")
@@ -0,0 +1,89 @@
+# backend/tests/test_reply_metrics.py
+"""Unit tests for app.services.reply_metrics: per-reply timing and aggregates."""
+from types import SimpleNamespace
+
+from app.services.reply_metrics import ReplyLatencyStats, ReplyMeter, combined_metadata
+
+
+def _meter(started=0.0, first=None, finished=None, chars=0, **fields):
+    meter = ReplyMeter()
+    meter.started_at, meter.first_token_at, meter.finished_at = started, first, finished
+    meter.output_chars = chars
+    for name, value in fields.items():
+        setattr(meter, name, value)
+    return meter
+
+
+class TestReplyMeter:
+    def test_timing_from_first_token_and_finish(self):
+        meter = _meter(started=10.0, first=10.25, finished=11.25, output_tokens=50)
+        assert meter.ttft_ms == 250
+        assert meter.total_ms == 1250
+        assert meter.tokens_per_second == 50.0
+
+    def test_throughput_estimated_from_chars_without_usage(self):
+        meter = _meter(first=0.0, finished=2.0, chars=400)
+        assert meter.tokens_per_second == 50.0
+
+    def test_token_marks_first_token_once(self):
+        meter = ReplyMeter()
+        meter.token("ab")
+        first = meter.first_token_at
+        meter.token("cd")
+        assert meter.first_token_at == first
+        assert meter.output_chars == 4
+
+    def test_usage_block(self):
+        meter = ReplyMeter()
+        meter.usage(SimpleNamespace(prompt_tokens=30, completion_tokens=5), "gpt-x")
+        assert meter.metadata()["tokens_used"] == 35
+        assert meter.metadata()["model_version"] == "gpt-x"
+
+    def test_unfinished_reply_has_no_timing(self):
+        metadata = ReplyMeter().metadata()
+        assert metadata == {"reply_source": "upstream"}
+
+
+class TestCombinedMetadata:
+    def test_first_token_of_either_agent_and_last_finish(self):
+        meters = {
+            "A": _meter(started=0.0, first=0.5, finished=2.0, input_tokens=10, output_tokens=4, model="m"),
+            "B": _meter(started=0.1, first=0.3, finished=3.0, input_tokens=12, output_tokens=6, model="m"),
+        }
+        fields = combined_metadata(meters)
+        assert fields["ttft_ms"] == 300
+        assert fields["processing_time_ms"] == 3000
+        assert fields["tokens_used"] == 32
+        assert fields["model_version"] == "m"
+        assert fields["agent_metrics"]["B"]["output_tokens"] == 6
+
+    def test_mixed_sources(self):
+        meters = {"A": _meter(source="cache"), "B": _meter()}
+        fields = combined_metadata(meters)
+        assert fields["reply_source"] == "mixed"
+        assert "tokens_used" not in fields
+
+
+class TestReplyLatencyStats:
+    def test_aggregates_per_endpoint_and_variant(self):
+        stats = ReplyLatencyStats()
+        for ttft in (100, 200, 300, 400):
+            stats.record("default", "followup", {"ttft_ms": ttft, "processing_time_ms": ttft * 2, "output_tokens": 5})
+        stats.record("default", "followup", {"reply_source": "cache", "ttft_ms": 10})
+        stats.record("double", "double", {"ttft_ms": 50})
+
+        body = stats.stats()
+        series = body["default/followup"]
+        assert series["replies"] == 5
+        assert series["by_source"] == {"upstream": 4, "cache": 1}
+        assert series["output_tokens"] == 20
+        assert series["ttft_ms_p50"] == 200
+        assert series["ttft_ms_p95"] == 400
+        assert series["total_ms_p50"] == 600
+        assert body["double/double"]["replies"] == 1
+
+    def test_clear(self):
+        stats = ReplyLatencyStats()
+        stats.record("links", None, {})
+        stats.clear()
+        assert stats.stats() == {}
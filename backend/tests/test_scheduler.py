@@ -19,7 +19,10 @@ def _ensure_scheduler_stopped():
 def _make_app(interval_hours=12):
     return types.SimpleNamespace(
         state=types.SimpleNamespace(
-            settings=types.SimpleNamespace(LINK_CHECK_INTERVAL_HOURS=interval_hours)
+            settings=types.SimpleNamespace(
+                LINK_CHECK_INTERVAL_HOURS=interval_hours,
+                HEARTBEAT_FLUSH_SECONDS=15,
+            )
         )
     )
 
@@ -69,6 +72,35 @@ class TestStartStopScheduler:
         assert scheduler._scheduler is None
 
 
+    def test_start_scheduler_registers_heartbeat_flush_job(self):
+        app = _make_app(interval_hours=12)
+        try:
+            scheduler.start_scheduler(app)
+            job_ids = {job.id for job in scheduler._scheduler.get_jobs()}
+            assert {"link_health_and_discovery", "flush_heartbeats"} <= job_ids
+        finally:
+            scheduler.stop_scheduler()
+
+
+# ── flush_heartbeats ─────────────────────────────────────────────────────────
+
+class TestFlushHeartbeats:
+    def test_flushes_buffer_into_users_collection(self):
+        from datetime import datetime, timezone
+        from app.services.heartbeats import heartbeats
+
+        users = MagicMock()
+        db = MagicMock()
+        db.__getitem__ = MagicMock(return_value=users)
+        app = types.SimpleNamespace(state=types.SimpleNamespace(db=db))
+        heartbeats.record("u1", datetime.now(timezone.utc))
+
+        scheduler.flush_heartbeats(app)
+
+        db.__getitem__.assert_called_with("users")
+        users.bulk_write.assert_called_once()
+
+
 # ── run_jobs_now ─────────────────────────────────────────────────────────────
 
 class TestRunJobsNow:
@@ -2,13 +2,21 @@
 """Unit tests for app.core.security: password hashing and JWT helpers."""
 from datetime import datetime, timedelta, timezone
 
+import asyncio
+import threading
+
 import pytest
 from jose import jwt, JWTError
 
 from app.core.config import get_settings
+from app.core import security
 from app.core.security import (
+    HashingBusyError,
     hash_password,
+    hash_password_async,
+    password_needs_rehash,
     verify_password,
+    verify_password_async,
     create_access_token,
     decode_token,
 )
@@ -46,6 +54,65 @@ class TestHashPassword:
         assert verify_password(42, hashed)
 
 
+class TestArgon2Costs:
+    def test_options_only_include_configured_costs(self):
+        from types import SimpleNamespace
+
+        opts = security._argon2_options(
+            SimpleNamespace(ARGON2_TIME_COST=2, ARGON2_MEMORY_COST=0, ARGON2_PARALLELISM=1)
+        )
+        assert opts == {"argon2__time_cost": 2, "argon2__parallelism": 1}
+
+    def test_current_hash_does_not_need_rehash(self):
+        assert not password_needs_rehash(hash_password("pw"))
+
+    def test_hash_with_other_costs_needs_rehash(self):
+        from argon2 import PasswordHasher
+
+        old = PasswordHasher(time_cost=1, memory_cost=8 * 1024, parallelism=1).hash("pw")
+        assert password_needs_rehash(old)
+        assert verify_password("pw", old)
+
+
+# ── hash_password_async / verify_password_async ─────────────────────────────
+
+class TestHashingPool:
+    def test_async_round_trip(self):
+        hashed = asyncio.run(hash_password_async("correct horse"))
+        assert asyncio.run(verify_password_async("correct horse", hashed))
+        assert not asyncio.run(verify_password_async("wrong", hashed))
+
+    def test_runs_on_dedicated_pool(self):
+        seen = []
+
+        def _record_thread(_password):
+            seen.append(threading.current_thread().name)
+            return "hash"
+
+        asyncio.run(security._run_hashing(_record_thread, "pw"))
+        assert seen[0].startswith("argon2")
+
+    def test_full_queue_raises_busy(self, monkeypatch):
+        monkeypatch.setattr(security, "_hash_slots", threading.BoundedSemaphore(1))
+        security._hash_slots.acquire()
+
+        with pytest.raises(HashingBusyError):
+            asyncio.run(hash_password_async("pw"))
+
+    def test_batch_waits_for_slots_instead_of_failing(self, monkeypatch):
+        monkeypatch.setattr(security, "_hash_slots", threading.BoundedSemaphore(1))
+
+        hashes = asyncio.run(security.hash_passwords_async(["a", "b", "c"]))
+
+        assert [verify_password(p, h) for p, h in zip("abc", hashes)] == [True] * 3
+
+    def test_slot_released_after_completion(self, monkeypatch):
+        monkeypatch.setattr(security, "_hash_slots", threading.BoundedSemaphore(1))
+
+        asyncio.run(hash_password_async("pw"))
+        asyncio.run(hash_password_async("pw"))  # would raise if the slot leaked
+
+
 # ── create_access_token / decode_token ───────────────────────────────────────
 
 class TestCreateAccessToken:
@@ -70,6 +137,19 @@ class TestCreateAccessToken:
         assert actual_delta == pytest.approx(expected_delta, abs=2)
 
 
+    def test_extra_claims_are_included(self):
+        token = create_access_token("user@example.com", claims={"uid": "abc", "sv": 2})
+        payload = decode_token(token)
+        assert payload["uid"] == "abc"
+        assert payload["sv"] == 2
+
+    def test_extra_claims_cannot_override_registered_claims(self):
+        token = create_access_token("user@example.com", claims={"sub": "evil@example.com", "exp": 1})
+        payload = decode_token(token)
+        assert payload["sub"] == "user@example.com"
+        assert payload["exp"] > payload["iat"]
+
+
 class TestDecodeToken:
     def test_garbage_token_raises(self):
         with pytest.raises(JWTError):
@@ -102,3 +182,48 @@ class TestDecodeToken:
         )
         with pytest.raises(JWTError):
             decode_token(expired_token)
+
+
+class TestVerifiedTokenMemo:
+    def test_repeat_decode_is_served_from_memo(self, monkeypatch):
+        token = create_access_token("user@example.com")
+        decode_token(token)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("jwt.decode should not run on a memo hit")
+
+        monkeypatch.setattr(security.jwt, "decode", fail)
+        assert decode_token(token)["sub"] == "user@example.com"
+        assert security.token_memo.stats()["hits"] == 1
+
+    def test_returned_payload_is_a_copy(self):
+        token = create_access_token("user@example.com")
+        decode_token(token)["sub"] = "tampered"
+        assert decode_token(token)["sub"] == "user@example.com"
+
+    def test_entry_expires_with_token(self, monkeypatch):
+        token = create_access_token("user@example.com")
+        exp = decode_token(token)["exp"]
+
+        monkeypatch.setattr(security.time, "time", lambda: exp + 1)
+        key = security.hashlib.sha256(token.encode()).digest()
+        assert security.token_memo.get(key) is None
+        assert security.token_memo.stats()["size"] == 0
+
+    def test_invalid_tokens_are_not_memoised(self):
+        with pytest.raises(JWTError):
+            decode_token("not-a-valid-jwt")
+        assert security.token_memo.stats()["size"] == 0
+
+    def test_lru_bound(self, monkeypatch):
+        monkeypatch.setattr(security, "token_memo", security._VerifiedTokenMemo(2))
+        for i in range(3):
+            decode_token(create_access_token(f"user{i}@example.com"))
+        assert security.token_memo.stats()["size"] == 2
+
+    def test_zero_entries_disables(self, monkeypatch):
+        monkeypatch.setattr(security, "token_memo", security._VerifiedTokenMemo(0))
+        token = create_access_token("user@example.com")
+        decode_token(token)
+        decode_token(token)
+        assert security.token_memo.stats()["hits"] == 0
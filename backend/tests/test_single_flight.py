@@ -0,0 +1,148 @@
+# backend/tests/test_single_flight.py
+"""Unit tests for app.services.single_flight: sharing identical in-flight prompts."""
+import asyncio
+
+import pytest
+
+from app.services.single_flight import SingleFlight
+
+
+@pytest.fixture
+def registry():
+    return SingleFlight(enabled=True, disabled_variants=set())
+
+
+class _Upstream:
+    """Upstream delta generator that waits for release() before each delta
+    after the first, and records whether it was cut off."""
+
+    def __init__(self, deltas, fail=False):
+        self.deltas = deltas
+        self.fail = fail
+        self.gate = asyncio.Event()
+        self.calls = 0
+        self.cancelled = False
+
+    async def stream(self):
+        self.calls += 1
+        try:
+            for i, delta in enumerate(self.deltas):
+                if i:
+                    await self.gate.wait()
+                yield delta
+            if self.fail:
+                raise RuntimeError("boom")
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+async def _collect(sub):
+    return [d async for d in sub.deltas()]
+
+
+class TestSharing:
+    def test_late_joiner_gets_whole_reply_from_one_upstream(self, registry):
+        async def run():
+            upstream = _Upstream(["a", "b", "c"])
+            leader = registry.lead("k", upstream.stream())
+            first = asyncio.create_task(_collect(leader))
+            await asyncio.sleep(0)
+            follower = registry.join("k")
+            second = asyncio.create_task(_collect(follower))
+            upstream.gate.set()
+            return await first, await second, upstream.calls, registry.stats()
+
+        first, second, calls, stats = asyncio.run(run())
+        assert first == second == ["a", "b", "c"]
+        assert calls == 1
+        assert stats["led"] == 1 and stats["joined"] == 1 and stats["in_flight"] == 0
+
+    def test_nothing_to_join_once_finished(self, registry):
+        async def run():
+            upstream = _Upstream(["a"])
+            await _collect(registry.lead("k", upstream.stream()))
+            return registry.join("k")
+
+        assert asyncio.run(run()) is None
+
+    def test_errors_reach_every_subscriber(self, registry):
+        async def run():
+            leader = registry.lead("k", _Upstream(["a"], fail=True).stream())
+            follower = registry.join("k")
+            results = await asyncio.gather(_collect(leader), _collect(follower), return_exceptions=True)
+            return [type(r) for r in results]
+
+        assert asyncio.run(run()) == [RuntimeError, RuntimeError]
+
+    def test_variant_opt_out(self):
+        registry = SingleFlight(enabled=True, disabled_variants={"double"})
+        assert registry.enabled_for("default")
+        assert not registry.enabled_for("double")
+        assert not SingleFlight(enabled=False, disabled_variants=set()).enabled_for("default")
+
+
+class TestLeaving:
+    def test_leader_leaving_keeps_stream_for_follower(self, registry):
+        async def run():
+            upstream, released = _Upstream(["a", "b"]), []
+            leader = registry.lead("k", upstream.stream(), on_done=lambda: released.append(True))
+            follower = registry.join("k")
+            gen = leader.deltas()
+            await gen.__anext__()
+            await gen.aclose()
+            upstream.gate.set()
+            return await _collect(follower), upstream.cancelled, released
+
+        assert asyncio.run(run()) == (["a", "b"], False, [True])
+
+    def test_last_subscriber_leaving_cancels_upstream(self, registry):
+        async def run():
+            upstream, released = _Upstream(["a", "b"]), []
+            leader = registry.lead("k", upstream.stream(), on_done=lambda: released.append(True))
+            gen = leader.deltas()
+            await gen.__anext__()
+            await gen.aclose()
+            with pytest.raises(asyncio.CancelledError):
+                await leader.flight.task
+            return upstream.cancelled, released, registry.join("k")
+
+        assert asyncio.run(run()) == (True, [True], None)
+
+    def test_on_done_runs_when_cancelled_before_start(self, registry):
+        async def run():
+            released = []
+            leader = registry.lead("k", _Upstream(["a"]).stream(), on_done=lambda: released.append(True))
+            leader.leave()
+            await asyncio.sleep(0)
+            return released
+
+        assert asyncio.run(run()) == [True]
+
+
+class TestQueuedLead:
+    def test_waiter_joins_once_the_queued_request_leads(self, registry):
+        async def run():
+            assert registry.queue_lead("k")
+            assert not registry.queue_lead("k")
+            assert registry.busy("k")
+            waiter = asyncio.create_task(registry.join_queued("k"))
+            await asyncio.sleep(0)
+            upstream = _Upstream(["a", "b"])
+            leader = registry.lead("k", upstream.stream())
+            registry.unqueue("k")
+            follower = await waiter
+            upstream.gate.set()
+            return await _collect(leader), await _collect(follower), upstream.calls
+
+        assert asyncio.run(run()) == (["a", "b"], ["a", "b"], 1)
+
+    def test_waiter_gets_none_when_the_queued_request_gives_up(self, registry):
+        async def run():
+            registry.queue_lead("k")
+            waiter = asyncio.create_task(registry.join_queued("k"))
+            await asyncio.sleep(0)
+            registry.unqueue("k")
+            return await waiter, registry.busy("k")
+
+        assert asyncio.run(run()) == (None, False)
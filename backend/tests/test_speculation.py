@@ -0,0 +1,149 @@
+# backend/tests/test_speculation.py
+"""Unit tests for app.services.speculation: the per-user store of speculative replies."""
+import asyncio
+
+import pytest
+
+from app.services.speculation import SpeculationBusyError, SpeculationStore
+
+
+@pytest.fixture
+def store():
+    return SpeculationStore(enabled=True, max_in_flight=4, ttl_seconds=60)
+
+
+def _stream(*tokens, gate: asyncio.Event = None, fail: bool = False):
+    async def gen():
+        for t in tokens:
+            if gate is not None:
+                await gate.wait()
+            yield t
+        if fail:
+            raise RuntimeError("upstream boom")
+    return gen
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class TestSpeculationStore:
+    def test_claim_completed_reply(self, store):
+        async def run():
+            assert store.start("u1", "k", _stream("Hello", " world"))
+            await _settle()
+            reply = store.claim("u1", "k")
+            return store, reply
+
+        store, reply = asyncio.run(run())
+        assert reply.done and not reply.failed
+        assert reply.text == "Hello world"
+        stats = store.stats()
+        assert stats["started"] == stats["completed"] == stats["claimed_ready"] == 1
+        assert stats["payoff_rate"] == 1.0
+        assert stats["pending"] == 0
+
+    def test_claim_is_once_per_user_and_key(self, store):
+        async def run():
+            store.start("u1", "k", _stream("x"))
+            await _settle()
+            return store.claim("u2", "k"), store.claim("u1", "other"), store.claim("u1", "k"), store.claim("u1", "k")
+
+        other_user, other_key, first, second = asyncio.run(run())
+        assert other_user is None and other_key is None
+        assert first is not None
+        assert second is None
+
+    def test_follow_joins_in_flight_generation(self, store):
+        async def run():
+            gate = asyncio.Event()
+            store.start("u1", "k", _stream("a", "b", "c", gate=gate))
+            await _settle()
+            reply = store.claim("u1", "k")
+            assert not reply.done
+            gate.set()
+            return store, [d async for d in reply.follow()]
+
+        store, received = asyncio.run(run())
+        assert received == ["a", "b", "c"]
+        assert store.stats()["claimed_in_flight"] == 1
+
+    def test_cap_skips_instead_of_queueing(self):
+        async def run():
+            store = SpeculationStore(enabled=True, max_in_flight=1, ttl_seconds=60)
+            gate = asyncio.Event()
+            first = store.start("u1", "k1", _stream("a", gate=gate))
+            second = store.start("u2", "k2", _stream("b"))
+            gate.set()
+            await _settle()
+            third = store.start("u2", "k2", _stream("b"))
+            return store, first, second, third
+
+        store, first, second, third = asyncio.run(run())
+        assert (first, second, third) == (True, False, True)
+        assert store.stats()["skipped_busy"] == 1
+
+    def test_duplicate_start_is_skipped(self, store):
+        async def run():
+            store.start("u1", "k", _stream("a"))
+            return store, store.start("u1", "k", _stream("a"))
+
+        store, again = asyncio.run(run())
+        assert again is False
+        assert store.stats()["skipped_duplicate"] == 1
+
+    def test_retain_drops_previous_question_as_wasted(self, store):
+        async def run():
+            gate = asyncio.Event()
+            store.start("u1", "old", _stream("a", gate=gate))
+            await _settle()
+            store.retain("u1", ["new"])
+            await _settle()
+            return store
+
+        store = asyncio.run(run())
+        stats = store.stats()
+        assert stats["wasted"] == 1
+        assert stats["in_flight"] == 0
+        assert stats["pending"] == 0
+        assert stats["payoff_rate"] == 0.0
+
+    def test_expired_entries_are_wasted(self):
+        async def run():
+            store = SpeculationStore(enabled=True, max_in_flight=4, ttl_seconds=0)
+            store.start("u1", "k", _stream("a"))
+            await _settle()
+            return store, store.claim("u1", "k")
+
+        store, reply = asyncio.run(run())
+        assert reply is None
+        assert store.stats()["wasted"] == 1
+
+    def test_failed_generation_is_not_claimable(self, store):
+        async def run():
+            store.start("u1", "k", _stream("partial", fail=True))
+            await _settle()
+            return store, store.claim("u1", "k")
+
+        store, reply = asyncio.run(run())
+        assert reply is None
+        stats = store.stats()
+        assert stats["failed"] == 1
+        assert stats["wasted"] == 0
+
+    def test_no_free_slot_counts_as_skipped_not_failed(self, store):
+        async def busy():
+            raise SpeculationBusyError()
+            yield
+
+        async def run():
+            store.start("u1", "k", busy)
+            await _settle()
+            return store, store.claim("u1", "k")
+
+        store, reply = asyncio.run(run())
+        assert reply is None
+        stats = store.stats()
+        assert stats["failed"] == 0
+        assert stats["skipped_busy"] == 1
@@ -0,0 +1,130 @@
+# backend/tests/test_stream_replay.py
+"""Unit tests for app.services.stream_replay: resumable chat SSE streams."""
+import asyncio
+
+import pytest
+
+from app.core.config import get_settings
+from app.services.stream_replay import StreamReplayRegistry
+
+
+@pytest.fixture
+def registry():
+    return StreamReplayRegistry(max_streams=10, max_events=100, ttl_seconds=60)
+
+
+async def _frames(n, gate=None, closed=None):
+    try:
+        for i in range(n):
+            if gate is not None and i:
+                await gate.wait()
+            yield f"data: {i}\n\n"
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+class TestFollow:
+    def test_frames_get_sequential_ids(self, registry):
+        async def run():
+            stream = registry.start("u1", _frames(3))
+            return stream.id, [f async for f in stream.follow()]
+
+        stream_id, frames = asyncio.run(run())
+        assert frames == [f"id: {stream_id}:{i + 1}\ndata: {i}\n\n" for i in range(3)]
+
+    def test_resume_after_seq(self, registry):
+        async def run():
+            stream = registry.start("u1", _frames(3))
+            [f async for f in stream.follow()]
+            resumed, after = registry.resume(f"{stream.id}:1", "u1")
+            return [f async for f in resumed.follow(after)]
+
+        frames = asyncio.run(run())
+        assert [f.split("\n")[1] for f in frames] == ["data: 1", "data: 2"]
+
+    def test_reader_behind_dropped_frames_stops(self):
+        async def run():
+            stream = StreamReplayRegistry(max_streams=10, max_events=2, ttl_seconds=60).start("u1", _frames(5))
+            await stream.task
+            return stream.has(0), [f async for f in stream.follow(0)]
+
+        has, frames = asyncio.run(run())
+        assert not has
+        assert frames == []
+
+
+class TestResume:
+    def test_other_users_and_bad_ids_miss(self, registry):
+        async def run():
+            stream = registry.start("u1", _frames(1))
+            await stream.task
+            results = [
+                registry.resume(f"{stream.id}:1", "u2"),
+                registry.resume(f"{stream.id}:9", "u1"),
+                registry.resume(f"{stream.id}:x", "u1"),
+                registry.resume("nope:1", "u1"),
+            ]
+            return results, registry.stats()
+
+        results, stats = asyncio.run(run())
+        assert results == [None] * 4
+        assert stats["resume_misses"] == 4
+
+    def test_finished_streams_expire(self):
+        async def run():
+            registry = StreamReplayRegistry(max_streams=10, max_events=100, ttl_seconds=0)
+            old = registry.start("u1", _frames(1))
+            await old.task
+            old.finished_at -= 1
+            registry.start("u1", _frames(1))
+            return registry.resume(f"{old.id}:0", "u1")
+
+        assert asyncio.run(run()) is None
+
+    def test_oldest_finished_evicted_past_max_streams(self):
+        async def run():
+            registry = StreamReplayRegistry(max_streams=1, max_events=100, ttl_seconds=60)
+            first = registry.start("u1", _frames(1))
+            await first.task
+            second = registry.start("u1", _frames(1))
+            await second.task
+            return registry.resume(f"{first.id}:0", "u1"), registry.stats()["streams"]
+
+        resumed, streams = asyncio.run(run())
+        assert resumed is None
+        assert streams == 1
+
+
+class TestAbandon:
+    def test_no_reader_cancels_after_grace(self, registry, monkeypatch):
+        monkeypatch.setattr(get_settings(), "STREAM_RESUME_GRACE_SECONDS", 0)
+
+        async def run():
+            gate, closed = asyncio.Event(), []
+            stream = registry.start("u1", _frames(2, gate, closed))
+            reader = stream.follow()
+            await reader.__anext__()
+            await reader.aclose()
+            with pytest.raises(asyncio.CancelledError):
+                await stream.task
+            return closed, stream.done, registry.stats()["abandoned"]
+
+        assert asyncio.run(run()) == ([True], True, 1)
+
+    def test_reattach_within_grace_keeps_producing(self, registry, monkeypatch):
+        monkeypatch.setattr(get_settings(), "STREAM_RESUME_GRACE_SECONDS", 5)
+
+        async def run():
+            gate = asyncio.Event()
+            stream = registry.start("u1", _frames(2, gate))
+            reader = stream.follow()
+            await reader.__anext__()
+            await reader.aclose()
+            resumed, after = registry.resume(f"{stream.id}:1", "u1")
+            gate.set()
+            return [f async for f in resumed.follow(after)], stream.task.cancelled()
+
+        frames, cancelled = asyncio.run(run())
+        assert [f.split("\n")[1] for f in frames] == ["data: 1"]
+        assert not cancelled
@@ -713,6 +713,32 @@ class TestSubmitSurvey:
         assert set_doc["pre_quiz_survey"] == {str(item1): 5}
         assert "pre_quiz_survey_completed_at" in set_doc
 
+    def test_full_completion_invalidates_cached_user(self, mock_db, mock_col):
+        from app.services.user_cache import user_cache
+
+        item1 = ObjectId()
+        user_oid = ObjectId()
+        user_cache.put({"_id": user_oid, "email": "user@test.edu"})
+        doc = self._response_doc(user_id=str(user_oid), answers=[])
+        updated_doc = dict(doc)
+        updated_doc["answers"] = [
+            {"item_id": str(item1), "value": 5, "shown_at": None, "answered_at": datetime.now(timezone.utc)},
+        ]
+        mock_col.find_one.side_effect = [doc, updated_doc, updated_doc]
+        mock_col.update_one.side_effect = [
+            MagicMock(matched_count=1),
+            MagicMock(),
+            MagicMock(matched_count=1),
+        ]
+        final_find_result = MagicMock()
+        final_find_result.sort.return_value = []
+        mock_col.find.side_effect = [[{"_id": item1}], [{"_id": item1}], final_find_result]
+
+        req = SurveySubmitRequest(answers=[SurveyAnswerIn(item_id=str(item1), value=5)])
+        submit_survey(mock_db, str(user_oid), "user@test.edu", "pre_quiz", req)
+
+        assert user_cache.get("user@test.edu") is None
+
     def test_full_completion_post_base_sets_flags_and_payload(self, mock_db, mock_col):
         item1 = ObjectId()
         user_id = str(ObjectId())
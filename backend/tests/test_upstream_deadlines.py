@@ -0,0 +1,66 @@
+# backend/tests/test_upstream_deadlines.py
+"""Unit tests for app.services.upstream_deadlines: hedge delay and tail stats."""
+import pytest
+
+from app.services.upstream_deadlines import UpstreamDeadlines
+
+
+@pytest.fixture
+def deadlines():
+    return UpstreamDeadlines(ttft_seconds=20, idle_seconds=15, hedge_enabled=True, hedge_min_ms=100)
+
+
+def _seeded(deadlines, samples):
+    for ms in samples:
+        deadlines.record_first_token(ms)
+    return deadlines
+
+
+class TestHedgeDelay:
+    def test_none_until_enough_samples(self, deadlines):
+        _seeded(deadlines, [500] * 19)
+        assert deadlines.hedge_delay() is None
+        deadlines.record_first_token(500)
+        assert deadlines.hedge_delay() == 0.5
+
+    def test_p95_of_unhedged_ttft(self, deadlines):
+        _seeded(deadlines, [200] * 95 + [3000] * 5)
+        assert deadlines.hedge_delay() == 3.0
+
+    def test_floor_and_off_switch(self):
+        floored = UpstreamDeadlines(ttft_seconds=20, idle_seconds=15, hedge_enabled=True, hedge_min_ms=1000)
+        assert _seeded(floored, [200] * 20).hedge_delay() == 1.0
+        off = UpstreamDeadlines(ttft_seconds=20, idle_seconds=15, hedge_enabled=False, hedge_min_ms=100)
+        assert _seeded(off, [200] * 20).hedge_delay() is None
+
+    def test_hedge_wins_do_not_lower_the_delay(self, deadlines):
+        _seeded(deadlines, [800] * 20)
+        for _ in range(50):
+            deadlines.record_first_token(150, hedge_won=True)
+        assert deadlines.hedge_delay() == 0.8
+
+
+class TestStats:
+    def test_tail_improvement_from_overtaken_requests(self, deadlines):
+        _seeded(deadlines, [200] * 18)
+        deadlines.started, deadlines.hedged = 20, 2
+        for _ in range(2):
+            deadlines.record_first_token(1200, hedge_won=True)
+            deadlines.record_overtaken(5000, 1200)
+
+        stats = deadlines.stats()
+        assert stats["hedge_rate"] == 0.1
+        assert stats["hedge_wins"] == 2
+        assert stats["ttft_ms_p95"] == 1200
+        assert stats["unhedged_ttft_ms_p95"] == 5000
+        assert stats["p95_improvement_ms"] == 3800
+        assert stats["hedge_saved_ms_avg"] == 3800
+
+    def test_clear(self, deadlines):
+        _seeded(deadlines, [200] * 20)
+        deadlines.ttft_timeouts = 3
+        deadlines.clear()
+        stats = deadlines.stats()
+        assert stats["ttft_timeouts"] == 0
+        assert stats["ttft_ms_p95"] is None
+        assert stats["hedge_rate"] is None
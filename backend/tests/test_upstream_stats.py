@@ -0,0 +1,40 @@
+# backend/tests/test_upstream_stats.py
+"""Unit tests for app.services.upstream_stats."""
+from app.services.upstream_stats import UpstreamStreamStats
+
+
+class TestUpstreamStreamStats:
+    def test_saved_tokens_use_average_completed_reply(self):
+        stats = UpstreamStreamStats()
+        stats.record_completed(400)  # 100 tokens
+        stats.record_completed(800)  # 200 tokens
+        stats.record_cancelled(200)  # 50 generated of an expected 150
+
+        body = stats.stats()
+        assert body["avg_reply_tokens"] == 150
+        assert body["tokens_before_cancel"] == 50
+        assert body["estimated_saved_tokens"] == 100
+
+    def test_reported_usage_replaces_the_estimate(self):
+        stats = UpstreamStreamStats()
+        stats.record_completed(400, tokens=130)
+        stats.record_completed(400)  # no usage block: 100 estimated
+        assert stats.stats()["avg_reply_tokens"] == 115
+
+    def test_expected_reply_capped_at_max_tokens(self):
+        stats = UpstreamStreamStats()
+        stats.record_completed(4000)
+        stats.record_cancelled(0, max_tokens=300)
+        assert stats.stats()["estimated_saved_tokens"] == 300
+
+    def test_nothing_saved_without_completed_replies(self):
+        stats = UpstreamStreamStats()
+        stats.record_cancelled(100)
+        assert stats.stats()["cancelled"] == 1
+        assert stats.stats()["estimated_saved_tokens"] == 0
+
+    def test_cancelled_past_the_average_saves_nothing(self):
+        stats = UpstreamStreamStats()
+        stats.record_completed(40)
+        stats.record_cancelled(400)
+        assert stats.stats()["estimated_saved_tokens"] == 0
@@ -0,0 +1,123 @@
+# backend/tests/test_user_cache.py
+"""Unit tests for app.services.user_cache: the per-process user document LRU/TTL cache."""
+from unittest.mock import patch
+
+from bson import ObjectId
+
+from app.services.user_cache import UserDocCache
+
+
+def make_doc(email="student@test.edu", **overrides):
+    doc = {"_id": ObjectId(), "email": email, "is_admin": False}
+    doc.update(overrides)
+    return doc
+
+
+class TestGetPut:
+    def test_miss_then_hit(self):
+        cache = UserDocCache(max_entries=10, ttl_seconds=30)
+        doc = make_doc()
+
+        assert cache.get("student@test.edu") is None
+        cache.put(doc)
+        assert cache.get("student@test.edu") == doc
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    def test_lookup_is_case_insensitive(self):
+        cache = UserDocCache(max_entries=10, ttl_seconds=30)
+        cache.put(make_doc(email="student@test.edu"))
+        assert cache.get("Student@Test.EDU") is not None
+
+    def test_returns_a_copy(self):
+        cache = UserDocCache(max_entries=10, ttl_seconds=30)
+        cache.put(make_doc())
+
+        cache.get("student@test.edu")["is_admin"] = True
+
+        assert cache.get("student@test.edu")["is_admin"] is False
+
+    def test_expired_entry_is_a_miss(self):
+        cache = UserDocCache(max_entries=10, ttl_seconds=30)
+        with patch("app.services.user_cache.time.monotonic", return_value=1000.0):
+            cache.put(make_doc())
+        with patch("app.services.user_cache.time.monotonic", return_value=1031.0):
+            assert cache.get("student@test.edu") is None
+        assert cache.stats()["size"] == 0
+
+    def test_lru_eviction_when_full(self):
+        cache = UserDocCache(max_entries=2, ttl_seconds=30)
+        cache.put(make_doc(email="a@test.edu"))
+        cache.put(make_doc(email="b@test.edu"))
+        cache.get("a@test.edu")  # a becomes most recently used
+        cache.put(make_doc(email="c@test.edu"))
+
+        assert cache.get("b@test.edu") is None
+        assert cache.get("a@test.edu") is not None
+        assert cache.evictions == 1
+
+    def test_disabled_when_ttl_is_zero(self):
+        cache = UserDocCache(max_entries=10, ttl_seconds=0)
+        cache.put(make_doc())
+        assert cache.get("student@test.edu") is None
+        assert cache.stats()["enabled"] is False
+
+
+class TestInvalidation:
+    def test_invalidate_by_email(self):
+        cache = UserDocCache(max_entries=10, ttl_seconds=30)
+        cache.put(make_doc())
+
+        cache.invalidate("STUDENT@test.edu")
+
+        assert cache.get("student@test.edu") is None
+        assert cache.invalidations == 1
+
+    def test_invalidate_by_id(self):
+        cache = UserDocCache(max_entries=10, ttl_seconds=30)
+        doc = make_doc()
+        cache.put(doc)
+
+        cache.invalidate_id(str(doc["_id"]))
+
+        assert cache.get("student@test.edu") is None
+
+    def test_invalidate_unknown_is_noop(self):
+        cache = UserDocCache(max_entries=10, ttl_seconds=30)
+        cache.invalidate("nobody@test.edu")
+        cache.invalidate_id(str(ObjectId()))
+        assert cache.invalidations == 0
+
+    def test_update_fields_patches_in_place(self):
+        cache = UserDocCache(max_entries=10, ttl_seconds=30)
+        doc = make_doc()
+        cache.put(doc)
+
+        cache.update_fields(str(doc["_id"]), {"last_active_at": "now"})
+
+        assert cache.get("student@test.edu")["last_active_at"] == "now"
+
+
+class TestStats:
+    def test_hit_rate(self):
+        cache = UserDocCache(max_entries=10, ttl_seconds=30)
+        cache.put(make_doc())
+        cache.get("student@test.edu")
+        cache.get("student@test.edu")
+        cache.get("nobody@test.edu")
+
+        stats = cache.stats()
+        assert stats["hits"] == 2
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 2 / 3
+
+    def test_hit_rate_none_before_any_lookup(self):
+        assert UserDocCache(max_entries=10, ttl_seconds=30).stats()["hit_rate"] is None
+
+    def test_clear_resets_counters(self):
+        cache = UserDocCache(max_entries=10, ttl_seconds=30)
+        cache.put(make_doc())
+        cache.get("student@test.edu")
+        cache.clear()
+        assert cache.stats()["size"] == 0
+        assert cache.hits == 0
@@ -5,18 +5,27 @@ from unittest.mock import MagicMock
 
 import pytest
 from bson import ObjectId
+from pymongo import ReturnDocument
 from pymongo.errors import DuplicateKeyError
 
 from app.core.security import hash_password
 from app.schemas.user import AssignedVar, SurveyStage
+from app.services.user_cache import user_cache, session_versions
+from app.services.heartbeats import heartbeats
 from app.services.users import (
     get_users_collection,
     ensure_indexes,
     create_user,
     find_user_by_email,
+    find_user_by_email_cached,
+    get_session_version,
+    bump_session_version,
+    update_password_hash,
     check_user_password,
     maybe_touch_last_active,
     _next_assigned_var,
+    _SignupSequence,
+    signup_sequence,
     _normalize_stage,
     _to_public,
 )
@@ -116,35 +125,69 @@ class TestToPublic:
 # ── _next_assigned_var ────────────────────────────────────────────────────────
 
 class TestNextAssignedVar:
-    def _set_seq(self, mock_col, seq):
+    def _set_block_end(self, mock_col, seq):
         counters = mock_col.database["counters"]
         counters.find_one_and_update.return_value = {"_id": "user_signup_round_robin", "seq": seq}
         return counters
 
-    def test_seq_1_returns_followup(self, mock_col):
-        self._set_seq(mock_col, 1)
-        assert _next_assigned_var(mock_col) == AssignedVar.followup.value
-
-    def test_seq_2_returns_double(self, mock_col):
-        self._set_seq(mock_col, 2)
-        assert _next_assigned_var(mock_col) == AssignedVar.double.value
-
-    def test_seq_3_returns_links(self, mock_col):
-        self._set_seq(mock_col, 3)
-        assert _next_assigned_var(mock_col) == AssignedVar.links.value
+    def test_round_robin_order(self, mock_col):
+        self._set_block_end(mock_col, signup_sequence.block_size)
+        got = [_next_assigned_var(mock_col) for _ in range(4)]
+        assert got == [
+            AssignedVar.followup.value,
+            AssignedVar.double.value,
+            AssignedVar.links.value,
+            AssignedVar.followup.value,
+        ]
+
+    def test_one_counter_update_per_block(self, mock_col):
+        block = signup_sequence.block_size
+        counters = self._set_block_end(mock_col, block)
+        for _ in range(block):
+            _next_assigned_var(mock_col)
+        assert counters.find_one_and_update.call_count == 1
+
+        counters.find_one_and_update.return_value = {"seq": 2 * block}
+        _next_assigned_var(mock_col)
+        assert counters.find_one_and_update.call_count == 2
 
-    def test_seq_4_wraps_to_followup(self, mock_col):
-        self._set_seq(mock_col, 4)
-        assert _next_assigned_var(mock_col) == AssignedVar.followup.value
+    def test_each_block_is_balanced(self, mock_col):
+        # Counter left at 7 by the old one-at-a-time scheme.
+        block = signup_sequence.block_size
+        self._set_block_end(mock_col, 7 + block)
+        got = [_next_assigned_var(mock_col) for _ in range(block)]
+        assert {got.count(v.value) for v in AssignedVar} == {block // 3}
 
-    def test_uses_upsert_and_increment(self, mock_col):
-        counters = self._set_seq(mock_col, 1)
+    def test_reserves_block_with_upsert(self, mock_col):
+        counters = self._set_block_end(mock_col, signup_sequence.block_size)
         _next_assigned_var(mock_col)
         args, kwargs = counters.find_one_and_update.call_args
         assert args[0] == {"_id": "user_signup_round_robin"}
-        assert args[1] == {"$inc": {"seq": 1}}
+        assert args[1] == {"$inc": {"seq": signup_sequence.block_size}}
         assert kwargs["upsert"] is True
 
+    def test_block_size_rounds_up_to_multiple_of_variants(self):
+        assert _SignupSequence(50).block_size == 51
+        assert _SignupSequence(0).block_size == 3
+
+    def test_take_many_uses_current_block_then_one_reservation(self, mock_col):
+        block = signup_sequence.block_size
+        counters = self._set_block_end(mock_col, block)
+        signup_sequence.take(mock_col)
+
+        counters.find_one_and_update.return_value = {"seq": 2 * block}
+        seqs = signup_sequence.take_many(mock_col, block + 5)
+
+        assert seqs == list(range(2, block + 7))
+        assert counters.find_one_and_update.call_args[0][1] == {"$inc": {"seq": block}}
+        assert signup_sequence.take(mock_col) == block + 7
+
+    def test_given_back_number_is_reused(self, mock_col):
+        self._set_block_end(mock_col, signup_sequence.block_size)
+        seq = signup_sequence.take(mock_col)
+        signup_sequence.give_back(seq)
+        assert signup_sequence.take(mock_col) == seq
+
 
 # ── create_user ───────────────────────────────────────────────────────────────
 
@@ -153,7 +196,7 @@ class TestCreateUser:
         oid = ObjectId()
         mock_col.insert_one.return_value = MagicMock(inserted_id=oid)
         counters = mock_col.database["counters"]
-        counters.find_one_and_update.return_value = {"_id": "user_signup_round_robin", "seq": 1}
+        counters.find_one_and_update.return_value = {"_id": "user_signup_round_robin", "seq": signup_sequence.block_size}
 
         result = create_user(
             mock_col,
@@ -182,16 +225,15 @@ class TestCreateUser:
         assert inserted_doc["is_admin"] is False
         assert inserted_doc["survey_stage"] == SurveyStage.pre_base.value
 
-        # assigned_var update_one called with the round-robin result
-        mock_col.update_one.assert_called_once_with(
-            {"_id": oid}, {"$set": {"assigned_var": AssignedVar.followup.value}}
-        )
+        # assigned_var is written with the insert, no follow-up update
+        assert inserted_doc["assigned_var"] == AssignedVar.followup.value
+        mock_col.update_one.assert_not_called()
 
     def test_password_is_hashed(self, mock_col):
         oid = ObjectId()
         mock_col.insert_one.return_value = MagicMock(inserted_id=oid)
         counters = mock_col.database["counters"]
-        counters.find_one_and_update.return_value = {"_id": "user_signup_round_robin", "seq": 1}
+        counters.find_one_and_update.return_value = {"_id": "user_signup_round_robin", "seq": signup_sequence.block_size}
 
         create_user(
             mock_col,
@@ -230,6 +272,21 @@ class TestCreateUser:
                 consent=True,
             )
 
+    def test_duplicate_email_does_not_skip_a_variant(self, mock_col):
+        counters = mock_col.database["counters"]
+        counters.find_one_and_update.return_value = {"seq": signup_sequence.block_size}
+        mock_col.insert_one.side_effect = [
+            DuplicateKeyError("E11000 duplicate key error"),
+            MagicMock(inserted_id=ObjectId()),
+        ]
+        kwargs = dict(password="pw", first_name="A", last_name="B", consent=True)
+
+        with pytest.raises(DuplicateKeyError):
+            create_user(mock_col, email="dup@example.com", **kwargs)
+        result = create_user(mock_col, email="new@example.com", **kwargs)
+
+        assert result.assigned_var == AssignedVar.followup
+
 
 # ── find_user_by_email ────────────────────────────────────────────────────────
 
@@ -254,6 +311,117 @@ class TestFindUserByEmail:
         assert result is None
 
 
+# ── find_user_by_email_cached ─────────────────────────────────────────────────
+
+class TestFindUserByEmailCached:
+    def test_miss_reads_mongo_and_populates_cache(self, mock_col):
+        doc = {"_id": ObjectId(), "email": "user@example.com"}
+        mock_col.find_one.return_value = doc
+
+        assert find_user_by_email_cached(mock_col, "user@example.com") == doc
+        assert find_user_by_email_cached(mock_col, "USER@example.com") == doc
+
+        mock_col.find_one.assert_called_once()
+
+    def test_not_found_is_not_cached(self, mock_col):
+        mock_col.find_one.return_value = None
+
+        find_user_by_email_cached(mock_col, "nobody@example.com")
+        find_user_by_email_cached(mock_col, "nobody@example.com")
+
+        assert mock_col.find_one.call_count == 2
+
+
+# ── get_session_version / bump_session_version ────────────────────────────────
+
+class TestSessionVersion:
+    def test_reads_projected_version(self, mock_col):
+        oid = ObjectId()
+        mock_col.find_one.return_value = {"_id": oid, "session_version": 5}
+
+        assert get_session_version(mock_col, str(oid)) == 5
+        mock_col.find_one.assert_called_once_with({"_id": oid}, {"session_version": 1})
+
+    def test_missing_field_counts_as_zero(self, mock_col):
+        oid = ObjectId()
+        mock_col.find_one.return_value = {"_id": oid}
+        assert get_session_version(mock_col, str(oid)) == 0
+
+    def test_second_check_served_from_cache(self, mock_col):
+        oid = ObjectId()
+        mock_col.find_one.return_value = {"_id": oid, "session_version": 1}
+
+        get_session_version(mock_col, str(oid))
+        get_session_version(mock_col, str(oid))
+
+        mock_col.find_one.assert_called_once()
+
+    def test_unknown_user_returns_none(self, mock_col):
+        mock_col.find_one.return_value = None
+        assert get_session_version(mock_col, str(ObjectId())) is None
+
+    def test_invalid_id_returns_none_without_query(self, mock_col):
+        assert get_session_version(mock_col, "not-an-object-id") is None
+        mock_col.find_one.assert_not_called()
+
+    def test_bump_increments_in_mongo_and_updates_cache(self, mock_col):
+        oid = ObjectId()
+        # A stale cached copy: another worker has already bumped to 3.
+        doc = {"_id": oid, "email": "user@example.com", "session_version": 1}
+        mock_col.find_one_and_update.return_value = {"_id": oid, "session_version": 4}
+
+        assert bump_session_version(mock_col, doc, extra_set={"is_admin": True}) == 4
+
+        mock_col.find_one_and_update.assert_called_once_with(
+            {"_id": oid},
+            {"$inc": {"session_version": 1}, "$set": {"is_admin": True}},
+            projection={"session_version": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        assert get_session_version(mock_col, str(oid)) == 4
+        mock_col.find_one.assert_not_called()
+
+    def test_bump_without_extra_set_only_increments(self, mock_col):
+        oid = ObjectId()
+        mock_col.find_one_and_update.return_value = {"_id": oid, "session_version": 1}
+
+        bump_session_version(mock_col, {"_id": oid, "email": "user@example.com"})
+
+        assert mock_col.find_one_and_update.call_args[0][1] == {"$inc": {"session_version": 1}}
+
+    def test_bump_with_unmet_match_returns_none(self, mock_col):
+        oid = ObjectId()
+        doc = {"_id": oid, "email": "user@example.com", "session_version": 1}
+        mock_col.find_one_and_update.return_value = None
+
+        assert bump_session_version(mock_col, doc, match={"password_hash": "old"}) is None
+
+        assert mock_col.find_one_and_update.call_args[0][0] == {"password_hash": "old", "_id": oid}
+        assert session_versions.get(str(oid)) is None
+
+
+# ── update_password_hash ──────────────────────────────────────────────────────
+
+class TestUpdatePasswordHash:
+    def test_matches_old_hash_and_evicts_cache(self, mock_col):
+        oid = ObjectId()
+        doc = {"_id": oid, "email": "user@example.com", "password_hash": "old"}
+        user_cache.put(doc)
+        mock_col.update_one.return_value = MagicMock(modified_count=1)
+
+        assert update_password_hash(mock_col, doc, "new") is True
+
+        mock_col.update_one.assert_called_once_with(
+            {"_id": oid, "password_hash": "old"}, {"$set": {"password_hash": "new"}}
+        )
+        assert user_cache.get("user@example.com") is None
+
+    def test_concurrent_password_change_wins(self, mock_col):
+        doc = {"_id": ObjectId(), "email": "user@example.com", "password_hash": "old"}
+        mock_col.update_one.return_value = MagicMock(modified_count=0)
+        assert update_password_hash(mock_col, doc, "new") is False
+
+
 # ── check_user_password ───────────────────────────────────────────────────────
 
 class TestCheckUserPassword:
@@ -269,32 +437,40 @@ class TestCheckUserPassword:
 # ── maybe_touch_last_active ──────────────────────────────────────────────────
 
 class TestMaybeTouchLastActive:
-    def test_missing_last_active_at_updates(self, mock_col):
+    def test_missing_last_active_at_records_heartbeat(self, mock_col):
         oid = ObjectId()
         doc = {"_id": oid}
 
         maybe_touch_last_active(mock_col, doc)
 
-        mock_col.update_one.assert_called_once()
-        args = mock_col.update_one.call_args[0]
-        assert args[0] == {"_id": oid}
-        assert "last_active_at" in args[1]["$set"]
+        assert heartbeats.pending_for(oid) is not None
+        # Buffered, not written inline.
+        mock_col.update_one.assert_not_called()
 
-    def test_recent_value_does_not_update(self, mock_col):
+    def test_recent_value_does_not_record(self, mock_col):
         oid = ObjectId()
         doc = {"_id": oid, "last_active_at": datetime.now(timezone.utc) - timedelta(seconds=5)}
 
         maybe_touch_last_active(mock_col, doc)
 
-        mock_col.update_one.assert_not_called()
+        assert heartbeats.pending_for(oid) is None
 
-    def test_stale_value_updates(self, mock_col):
+    def test_stale_value_records(self, mock_col):
         oid = ObjectId()
         doc = {"_id": oid, "last_active_at": datetime.now(timezone.utc) - timedelta(minutes=10)}
 
         maybe_touch_last_active(mock_col, doc)
 
-        mock_col.update_one.assert_called_once()
+        assert heartbeats.pending_for(oid) is not None
+
+    def test_pending_heartbeat_counts_toward_debounce(self, mock_col):
+        oid = ObjectId()
+        doc = {"_id": oid, "last_active_at": datetime.now(timezone.utc) - timedelta(minutes=10)}
+
+        maybe_touch_last_active(mock_col, doc)
+        maybe_touch_last_active(mock_col, doc)
+
+        assert heartbeats.stats()["recorded"] == 1
 
     def test_naive_datetime_from_mongo_round_trip_does_not_raise(self, mock_col):
         """pymongo returns stored datetimes as naive UTC by default. A recent
@@ -306,13 +482,21 @@ class TestMaybeTouchLastActive:
 
         maybe_touch_last_active(mock_col, doc)  # must not raise
 
-        mock_col.update_one.assert_not_called()
+        assert heartbeats.pending_for(oid) is None
+
+    def test_touch_patches_cached_last_active_at(self, mock_col):
+        doc = {"_id": ObjectId(), "email": "user@example.com"}
+        user_cache.put(doc)
+
+        maybe_touch_last_active(mock_col, doc)
+
+        assert user_cache.get("user@example.com")["last_active_at"] is not None
 
-    def test_naive_stale_datetime_updates(self, mock_col):
+    def test_naive_stale_datetime_records(self, mock_col):
         oid = ObjectId()
         naive_stale = datetime.utcnow() - timedelta(minutes=10)
         doc = {"_id": oid, "last_active_at": naive_stale}
 
         maybe_touch_last_active(mock_col, doc)
 
-        mock_col.update_one.assert_called_once()
+        assert heartbeats.pending_for(oid) is not None
@@ -87,6 +87,33 @@ describe("ChatBox", () => {
     expect(await screen.findByRole("button", { name: "Send" })).toBeInTheDocument();
   });
 
+  it("reuses the idempotency key for a resend of a message still awaiting its reply", async () => {
+    mockSendChat.mockImplementationOnce(() => new Promise<ChatResponse>(() => {}));
+    mockSendChat.mockImplementation(async () => (
+      { replies: ["Hi"], conversationId: "conv-1", followupQuestions: undefined } as ChatResponse
+    ));
+
+    render(<ChatBox quizId="base" />);
+    const textarea = screen.getByPlaceholderText(PLACEHOLDER);
+    const send = async () => {
+      fireEvent.change(textarea, { target: { value: "Hello" } });
+      fireEvent.click(await screen.findByRole("button", { name: "Send" }));
+    };
+
+    await send();
+    fireEvent.click(await screen.findByRole("button", { name: "Cancel" }));
+    await send();
+    await screen.findByText("Hi");
+    await send();
+    await waitFor(() => expect(mockSendChat).toHaveBeenCalledTimes(3));
+
+    const keys = mockSendChat.mock.calls.map((c) => (c[4] as SendChatOptions).idempotencyKey);
+    expect(keys[0]).toBeTruthy();
+    expect(keys[1]).toBe(keys[0]);
+    // The second send got its reply, so asking again is a new message.
+    expect(keys[2]).not.toBe(keys[0]);
+  });
+
   it("shows a Cancel button while pending and resets state when clicked", async () => {
     mockSendChat.mockImplementation(() => new Promise<ChatResponse>(() => {}));
 
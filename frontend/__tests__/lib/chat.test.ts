@@ -134,6 +134,82 @@ describe("sendChat", () => {
     expect(totalDelta).toBe("Hello");
   });
 
+  it("reports queued positions before the reply streams", async () => {
+    const chunks = [
+      sseChunk([{ type: "queued", position: 2 }, { type: "queued", position: 1 }]),
+      sseChunk([{ type: "token", content: "Hi" }]),
+      sseChunk([{ type: "done", conversation_id: "conv-1" }]),
+    ];
+    (global.fetch as jest.Mock).mockResolvedValue(makeStreamingResponse(chunks));
+
+    const onQueued = jest.fn();
+    const result = await sendChat("base", null, "hi", [], { onQueued });
+
+    expect(onQueued.mock.calls).toEqual([[2, undefined], [1, undefined]]);
+    expect(result.replies).toEqual(["Hi"]);
+  });
+
+  it("resumes a dropped stream with Last-Event-ID instead of re-sending the message", async () => {
+    // Drops right after the id line of event 2, before its data arrives.
+    const reader = {
+      read: jest.fn()
+        .mockResolvedValueOnce({
+          done: false,
+          value: new TextEncoder().encode('id: s1:1\ndata: {"type": "token", "content": "Hel"}\n\nid: s1:2\n'),
+        })
+        .mockRejectedValueOnce(new TypeError("network error")),
+      releaseLock: jest.fn(),
+    };
+    const dropped = { ok: true, status: 200, statusText: "OK", body: { getReader: () => reader } };
+    const resumed = makeStreamingResponse([
+      'id: s1:2\ndata: {"type": "token", "content": "lo"}\n\n',
+      'id: s1:3\ndata: {"type": "done", "conversation_id": "conv-1"}\n\n',
+    ]);
+    (global.fetch as jest.Mock).mockResolvedValueOnce(dropped).mockResolvedValueOnce(resumed);
+
+    const result = await sendChat("base", null, "hi");
+
+    expect(result.replies).toEqual(["Hello"]);
+    const [firstInit, retryInit] = (global.fetch as jest.Mock).mock.calls.map((c) => c[1]);
+    expect(retryInit.headers["Last-Event-ID"]).toBe("s1:1");
+    expect(retryInit.headers["Idempotency-Key"]).toBe(firstInit.headers["Idempotency-Key"]);
+  });
+
+  it("starts over when a reconnect gets the reply from the start", async () => {
+    const reader = {
+      read: jest.fn()
+        .mockResolvedValueOnce({
+          done: false,
+          value: new TextEncoder().encode('id: s1:1\ndata: {"type": "token", "content": "Hel"}\n\n'),
+        })
+        .mockRejectedValueOnce(new TypeError("network error")),
+      releaseLock: jest.fn(),
+    };
+    const dropped = { ok: true, status: 200, statusText: "OK", body: { getReader: () => reader } };
+    const restarted = makeStreamingResponse([
+      'id: s2:1\ndata: {"type": "token", "content": "Hello"}\n\n',
+      'id: s2:2\ndata: {"type": "done", "conversation_id": "conv-1"}\n\n',
+    ]);
+    (global.fetch as jest.Mock).mockResolvedValueOnce(dropped).mockResolvedValueOnce(restarted);
+    const onRestart = jest.fn();
+
+    const result = await sendChat("base", null, "hi", [], { onRestart });
+
+    expect(result.replies).toEqual(["Hello"]);
+    expect(onRestart).toHaveBeenCalledTimes(1);
+  });
+
+  it("sends the caller's idempotency key", async () => {
+    (global.fetch as jest.Mock).mockResolvedValue(
+      makeStreamingResponse([sseChunk([{ type: "done", conversation_id: "c1" }])]),
+    );
+
+    await sendChat("base", null, "hi", [], { idempotencyKey: "msg-42" });
+
+    const init = (global.fetch as jest.Mock).mock.calls[0][1];
+    expect(init.headers["Idempotency-Key"]).toBe("msg-42");
+  });
+
   it("builds replies from accumulated tokens when no backend reply is provided", async () => {
     const chunks = [
       sseChunk([{ type: "token", content: "Hi" }]),
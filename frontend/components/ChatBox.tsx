@@ -116,6 +116,7 @@ export default function ChatBox({
   const [streamingMap, setStreamingMap] = useState<Record<string, string>>({});
   const [followupQuestions, setFollowupQuestions] = useState<string[] | undefined>(undefined);
   const [followupStreamText, setFollowupStreamText] = useState("");
+  const [queuePosition, setQueuePosition] = useState<number | null>(null);
   const [error, setError] = useState<string | null>(null);
   const [activeConvId, setActiveConvId] = useState<string | null>(
     conversationId,
@@ -151,6 +152,10 @@ export default function ChatBox({
   const followupStreamTextRef = useRef("");
   // Tracks how many \n-terminated lines have already been turned into chips.
   const processedNewlinesRef = useRef(0);
+  // Idempotency key of the message awaiting its reply. A double submit or a
+  // retry of the same message reuses it so the server answers it only once;
+  // cleared when the reply arrives, so asking the same thing again is new.
+  const outgoingRef = useRef<{ content: string; trigger: ChatTrigger; key: string } | null>(null);
 
   useEffect(() => {
     if (!activeConvId || historyFetched.current) return;
@@ -288,6 +293,12 @@ export default function ChatBox({
     };
     setMessages((m) => [...m, userMsg]);
 
+    const outgoing = outgoingRef.current;
+    const idempotencyKey = outgoing?.content === trimmed && outgoing.trigger === trigger
+      ? outgoing.key
+      : crypto.randomUUID();
+    outgoingRef.current = { content: trimmed, trigger, key: idempotencyKey };
+
     const controller = new AbortController();
     abortControllerRef.current = controller;
 
@@ -334,8 +345,10 @@ export default function ChatBox({
           answerChoices,
           questionId,
           trigger,
+          idempotencyKey,
           // onToken — streams main text at 60fps
           onToken: (delta, agent) => {
+            setQueuePosition(null);
             const key = agent ?? "default";
             setStreamingMap((prev: Record<string, string>) => ({ ...prev, [key]: (prev[key] ?? "") + delta }));
           },
@@ -352,6 +365,16 @@ export default function ChatBox({
             setFollowupActive(true);
             setStreamingMap({});
           },
+          // onQueued — the server is waiting for a free upstream slot
+          onQueued: (position) => setQueuePosition(position),
+          // onRestart — a reconnect is streaming the reply again from the start
+          onRestart: () => {
+            setStreamingMap({});
+            setFollowupQuestions(undefined);
+            setFollowupStreamText("");
+            followupStreamTextRef.current = "";
+            processedNewlinesRef.current = 0;
+          },
           // onFollowupToken — streams follow-up question tokens at 60fps
           onFollowupToken: (delta) => {
             followupStreamTextRef.current += delta;
@@ -360,6 +383,7 @@ export default function ChatBox({
         },
       );
 
+      if (outgoingRef.current?.key === idempotencyKey) outgoingRef.current = null;
       if (returnedConvId && !activeConvId) setActiveConvId(returnedConvId);
 
       if (!textDoneCommitted.current) {
@@ -393,6 +417,7 @@ export default function ChatBox({
       setFollowupActive(false);
       setPending(false);
       setStreamingMap({});
+      setQueuePosition(null);
     }
   }
 
@@ -663,7 +688,11 @@ export default function ChatBox({
         )}
 
         {pending && !followupActive && Object.keys(streamingMap).length === 0 && (
-          <div className="text-base text-gray-500">Assistant is typing…</div>
+          <div className="text-base text-gray-500">
+            {queuePosition
+              ? `Lots of students are asking right now — you're #${queuePosition} in line…`
+              : "Assistant is typing…"}
+          </div>
         )}
 
         {renderStreaming()}
@@ -32,6 +32,11 @@ export interface AIMessageMetadata {
   tokens_used?: number;
   input_tokens?: number;
   output_tokens?: number;
+  ttft_ms?: number;
+  tokens_per_second?: number;
+  reply_source?: "upstream" | "cache" | "speculation" | "single_flight" | "mixed";
+  model_route?: string;
+  agent_metrics?: Record<string, Omit<AIMessageMetadata, "agent_metrics">>;
   custom_metadata?: Record<string, unknown>;
 }
 
@@ -56,10 +61,38 @@ export interface SendChatOptions {
   onToken?: (delta: string, agent?: string) => void;
   onDone?: (replies: string[], convId: string) => void;
   onFollowupToken?: (delta: string) => void;
+  // Position in the server's upstream queue while the reply waits for a slot.
+  onQueued?: (position: number, agent?: string) => void;
+  // A reconnect got the reply from the start instead of the rest of it:
+  // drop whatever was streamed so far.
+  onRestart?: () => void;
   answerIncorrectly?: boolean;
   answerChoices?: { id: string; label: string }[];
   questionId?: string;
   trigger?: ChatTrigger;
+  // Same key = same reply: the server never starts a second generation for it.
+  // Pass one key per user message (reused for retries of that message) so a
+  // double submit is answered once. Without one the key only covers this
+  // call's own reconnects.
+  idempotencyKey?: string;
+}
+
+function newIdempotencyKey(): string {
+  if (typeof crypto !== "undefined" && typeof crypto.randomUUID === "function") {
+    return crypto.randomUUID();
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+// Reconnect attempts per reply when the stream drops before "done".
+const MAX_RESUMES = 3;
+
+function streamOf(eventId: string | undefined): string | undefined {
+  return eventId?.split(":")[0];
+}
+
+function retryAfterMs(resp: Response): number {
+  return (Number(resp.headers?.get("Retry-After")) || 1) * 1000;
 }
 
 export async function sendChat(
@@ -69,22 +102,31 @@ export async function sendChat(
   agents: string[] = [],
   options: SendChatOptions = {},
 ): Promise<ChatResponse> {
-  const { signal, onToken, onDone, onFollowupToken, answerIncorrectly, answerChoices, questionId, trigger } = options;
-  const resp = await fetch(`/api/chat/${quizId}`, {
+  const { signal, onToken, onDone, onFollowupToken, onQueued, onRestart, answerIncorrectly, answerChoices, questionId, trigger } = options;
+  const idempotencyKey = options.idempotencyKey ?? newIdempotencyKey();
+  const body = JSON.stringify({
+    message,
+    conversation_id: conversationId,
+    agents,
+    answer_incorrectly: answerIncorrectly ?? false,
+    answer_choices: (answerChoices ?? []).map((c) => ({ id: c.id, label: c.label })),
+    question_id: questionId ?? null,
+    trigger: trigger ?? null,
+  });
+  // With lastEventId the server resumes the reply it is still generating
+  // (or has just finished) instead of starting a new one.
+  const post = (lastEventId?: string) => fetch(`/api/chat/${quizId}`, {
     method: "POST",
-    headers: { "Content-Type": "application/json" },
+    headers: {
+      "Content-Type": "application/json",
+      "Idempotency-Key": idempotencyKey,
+      ...(lastEventId ? { "Last-Event-ID": lastEventId } : {}),
+    },
     credentials: "include",
     signal,
-    body: JSON.stringify({
-      message,
-      conversation_id: conversationId,
-      agents,
-      answer_incorrectly: answerIncorrectly ?? false,
-      answer_choices: (answerChoices ?? []).map((c) => ({ id: c.id, label: c.label })),
-      question_id: questionId ?? null,
-      trigger: trigger ?? null,
-    }),
+    body,
   });
+  const resp = await post();
 
   if (!resp.ok) {
     let detail = `${resp.status} ${resp.statusText}`;
@@ -96,9 +138,13 @@ export async function sendChat(
   }
 
   // All chat endpoints now return SSE (text/event-stream).
-  const reader = resp.body!.getReader();
+  let reader = resp.body!.getReader();
   const decoder = new TextDecoder();
   let sseBuffer = "";
+  let pendingEventId: string | undefined;
+  let lastEventId: string | undefined;
+  let resumes = 0;
+  let reconnected = false;
   const replyMap: Record<string, string> = {};
   let returnedConvId = conversationId ?? "";
   let followupQuestions: string[] | undefined;
@@ -126,13 +172,54 @@ export async function sendChat(
 
   try {
     while (true) {
-      const { done, value } = await reader.read();
+      let chunk: ReadableStreamReadResult<Uint8Array>;
+      try {
+        chunk = await reader.read();
+      } catch (err) {
+        // Connection dropped mid-reply: reattach from the last event we saw.
+        if (signal?.aborted || !lastEventId) throw err;
+        let retry: Response | undefined;
+        while (resumes < MAX_RESUMES) {
+          resumes += 1;
+          retry = await post(lastEventId);
+          // 409: still being generated by a server that can't stream it to
+          // us yet; ask again once it may have finished.
+          if (retry.status !== 409) break;
+          await new Promise((resolve) => setTimeout(resolve, retryAfterMs(retry!)));
+        }
+        if (!retry?.ok || !retry.body) throw err;
+        reader = retry.body.getReader();
+        sseBuffer = "";
+        pendingEventId = undefined;
+        reconnected = true;
+        continue;
+      }
+      const { done, value } = chunk;
       if (done) break;
       sseBuffer += decoder.decode(value, { stream: true });
       const lines = sseBuffer.split("\n");
       sseBuffer = lines.pop() ?? "";
       for (const line of lines) {
+        if (line.startsWith("id: ")) {
+          pendingEventId = line.slice(4);
+          continue;
+        }
         if (!line.startsWith("data: ")) continue;
+        if (reconnected) {
+          reconnected = false;
+          // Events from another stream (or without ids) are the message
+          // answered again from the start, not the rest of the reply we had.
+          if (streamOf(pendingEventId) !== streamOf(lastEventId)) {
+            for (const key of Object.keys(replyMap)) delete replyMap[key];
+            for (const key of Object.keys(tokenBuffer)) delete tokenBuffer[key];
+            citations = [];
+            followupQuestions = undefined;
+            onRestart?.();
+          }
+        }
+        // Only count an event as seen once its data line has arrived.
+        lastEventId = pendingEventId ?? lastEventId;
+        pendingEventId = undefined;
         let event: Record<string, unknown>;
         try {
           event = JSON.parse(line.slice(6));
@@ -153,6 +240,9 @@ export async function sendChat(
             // Batch questions (backwards compat for endpoints that send the full array).
             followupQuestions = [...(followupQuestions ?? []), ...(event.questions as string[])];
           }
+        } else if (event.type === "queued") {
+          const agent = event.agent != null ? (event.agent as string) : undefined;
+          onQueued?.((event.position as number) ?? 0, agent);
         } else if (event.type === "citations") {
           citations = (event.citations as Citation[]) ?? [];
         } else if (event.type === "done") {